@@ -14,11 +14,14 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides the AbstractRecipe class"""
 
+import collections
 import multiprocessing
 import os
+import time
 
 import abkhazia.utils as utils
-from abkhazia.kaldi import kaldi_path, Abkhazia2Kaldi
+from abkhazia.kaldi import kaldi_path, Abkhazia2Kaldi, planner
+from abkhazia.kaldi.split_data import split_data, read_utt2dur
 
 
 class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
@@ -50,12 +53,35 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
     delete_recipe (bool): delete the recipe directory after execution
       (default is True)
 
+    balance_jobs (bool): split the data among jobs by balancing their
+      total duration instead of their number of utterances (default
+      is False)
+
+    rusage_history (path): a JSON file where the peak memory of the
+      recipe steps is recorded, and read back by plan() (default is
+      None, do not record)
+
+    memory_budget (int): if specified, the Kaldi commands run locally
+      are throttled so that the memory used by concurrent jobs stays
+      within `memory_budget` MB (see utils.jobs.MemoryLimiter, default
+      is None, no limit)
+
+    max_kaldi_warnings, max_kaldi_errors (int): if specified, abort
+      a step as soon as it produced more Kaldi WARNING (respectively
+      ERROR) messages (default is None, no limit)
+
+    kaldi_messages (dict): the number of Kaldi messages per level
+      (a collections.Counter) for each step, as counted by
+      utils.logger.KaldiLogClassifier from the commands output and
+      the jobs log files
+
 
     Methods:
     --------
 
     Each concrete recipe must implmements/specializes the following
-    methods: check_parameters, create, run and export.
+    methods: check_parameters, create, run and export. The recipes
+    made of several steps must specialize the steps method.
 
     """
     name = NotImplemented
@@ -79,6 +105,21 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
         # if True, delete the recipe_dir on instance destruction
         self.delete_recipe = True
 
+        # if True, split data/<name> in jobs of balanced durations
+        self.balance_jobs = False
+
+        # where to record the peak memory of the steps, the step of
+        # the running commands and their peak memory (MB)
+        self.rusage_history = None
+        self.memory_budget = None
+        self.max_kaldi_warnings = None
+        self.max_kaldi_errors = None
+        self.kaldi_messages = {}
+        self._step = None
+        self._peaks = {}
+        # the bytes of the jobs log files already classified
+        self._log_offsets = {}
+
         # init the abkhazia2kaldi converter
         self.a2k = Abkhazia2Kaldi(
             self.corpus, self.recipe_dir, name=self.name, log=self.log)
@@ -90,16 +131,58 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
         except AttributeError:  # if raised from __init__
             pass
 
-    def _run_command(self, command, verbose=True):
-        """Run the command as a subprocess in a Kaldi environment"""
+    def _run_command(self, command, verbose=True, max_memory=None):
+        """Run the command as a subprocess in a Kaldi environment
+
+        If `max_memory` is specified, the command is killed when its
+        resident memory exceeds that number of MB (see utils.jobs).
+
+        """
         if verbose is True:
             self.log.info('running %s', command)
 
-        utils.jobs.run(
-            command,
-            stdout=self.log.debug,
-            env=kaldi_path(),
-            cwd=self.recipe_dir)
+        step = self._step or self.steps()[0]
+        classifier = utils.logger.KaldiLogClassifier(
+            self.log,
+            max_warnings=self.max_kaldi_warnings,
+            max_errors=self.max_kaldi_errors,
+            counts=self.kaldi_messages.setdefault(
+                step, collections.Counter()),
+            offsets=self._log_offsets)
+
+        start = time.time()
+        try:
+            with utils.trace.span(
+                    command.split()[0], category='kaldi',
+                    step=step, command=command):
+                rusage = utils.jobs.run(
+                    command,
+                    stdout=classifier,
+                    env=kaldi_path(),
+                    cwd=self.recipe_dir,
+                    limiter=self._limiter(step),
+                    key=step,
+                    njobs=self.njobs,
+                    max_memory=max_memory)
+        finally:
+            # the jobs messages are in their log files, read them
+            # even on failure to report the errors
+            classifier.read_logs(self.recipe_dir, since=start)
+        classifier.check()
+
+        # ru_maxrss is in kB on Linux
+        self._peaks[step] = max(
+            self._peaks.get(step, 0), rusage.ru_maxrss // 1024)
+
+    def _limiter(self, step):
+        """Return a MemoryLimiter for `step`, None if no memory budget"""
+        if not self.memory_budget:
+            return None
+
+        profile = planner.PROFILES.get(step)
+        return utils.jobs.MemoryLimiter(
+            self.memory_budget,
+            default=profile.memory if profile else 500)
 
     def _check_njobs(self, local=False):
         """Garanties a valid njobs parameter
@@ -133,6 +216,77 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
             self.log.warning(
                 'asking %s cores but reduced to %s', old_njobs, self.njobs)
 
+    def _balance_jobs(self):
+        """Split data/<name> in jobs of balanced durations
+
+        Do nothing if self.balance_jobs is False. The split
+        directories are then reused by the Kaldi scripts instead of
+        calling utils/split_data.sh (see kaldi.split_data).
+
+        """
+        if not self.balance_jobs:
+            return
+
+        data_dir = os.path.join(self.recipe_dir, 'data', self.name)
+        split_data(data_dir, self.njobs,
+                   utt2dur=read_utt2dur(data_dir, corpus=self.a2k.corpus),
+                   log=self.log)
+
+    def steps(self):
+        """Return the names of the recipe steps, as in planner.PROFILES"""
+        return (self.name,)
+
+    def plan(self, machine=None):
+        """Return the list of planner.StepPlan of the recipe steps
+
+        The steps are planned for `machine` (the local machine by
+        default), from the peak memory recorded in
+        self.rusage_history if any. Log a warning if a step needs
+        more memory than available.
+
+        """
+        if machine is None:
+            machine = planner.local_machine()
+
+        history = (planner.History(self.rusage_history)
+                   if self.rusage_history else None)
+
+        plans = planner.plan(
+            self.steps(), machine=machine,
+            nspeakers=len(self.corpus.spks()), history=history)
+
+        for p in plans:
+            if p.memory > machine.memory:
+                self.log.warning(
+                    'step %s needs %s MB but only %s MB are available',
+                    p.step, p.memory, machine.memory)
+        return plans
+
+    def apply_plan(self, plans):
+        """Setup the recipe parameters from a list of planner.StepPlan"""
+        for p in plans:
+            self.log.debug('applying plan %s', p)
+            self._apply_step_plan(p)
+
+    def _apply_step_plan(self, plan):
+        """Setup the recipe parameters from a planner.StepPlan
+
+        This method only sets self.njobs, it must be specialized in
+        recipes having threads or several steps.
+
+        """
+        self.njobs = plan.njobs
+
+    def _save_rusage(self):
+        """Record the peak memory of the steps in self.rusage_history"""
+        if not self.rusage_history or not self._peaks:
+            return
+
+        history = planner.History(self.rusage_history)
+        for step, peak in self._peaks.items():
+            history.record(step, peak)
+        history.save()
+
     def check_parameters(self):
         """Perform sanity checks on recipe parameters, raise on error
 
@@ -160,7 +314,10 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
         # setup other files and folders
         self.a2k.setup_wav_folder()
         self.a2k.setup_kaldi_folders()
-        self.a2k.setup_machine_specific_scripts()
+        step = self.steps()[0]
+        limiter = self._limiter(step)
+        self.a2k.setup_machine_specific_scripts(
+            max_jobs=limiter.max_jobs(step, self.njobs) if limiter else None)
 
     def run(self):
         """Run the recipe by calling Kaldi scripts
@@ -178,9 +335,18 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
 
         """
         self.meta.save(os.path.join(self.output_dir, 'meta.txt'))
+        self._save_rusage()
+
+        for step, counts in sorted(self.kaldi_messages.items()):
+            if counts['WARNING'] or counts['ERROR']:
+                self.log.info(
+                    'step %s: %s Kaldi warnings and %s errors',
+                    step, counts['WARNING'], counts['ERROR'])
 
     def compute(self):
         """Create, run and export the recipe"""
-        self.create()
-        self.run()
-        self.export()
+        for phase in (self.create, self.run, self.export):
+            with utils.trace.span(
+                    '{} {}'.format(self.name, phase.__name__),
+                    category='recipe'):
+                phase()
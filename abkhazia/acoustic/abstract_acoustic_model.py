@@ -140,8 +140,11 @@ class AbstractAcousticModel(AbstractRecipe):
             silence_probability=lang['silence_probability'],
             position_dependent_phones=lang['position_dependent_phones'],
             keep_tmp_dirs=lang['keep_tmp_dirs'],
+            use_cache=lang.get('use_cache', True),
             log=self.log)
 
+        self._balance_jobs()
+
     def export(self):
         """Copy model files to output_dir"""
         result_directory = os.path.join(
@@ -23,6 +23,7 @@ from abkhazia.acoustic.abstract_acoustic_model import (
     AbstractAcousticModel)
 from abkhazia.align.align import convert_alignment_to_kaldi_format
 import abkhazia.kaldi as kaldi
+from abkhazia.kaldi.split_data import is_split
 
 
 class Monophone(AbstractAcousticModel):
@@ -148,9 +149,13 @@ class MonophoneFromAlignment(Monophone):
 
         # split the data for njobs processing, this normally done in
         # the run() step but we need here to split the alignment
-        # before calling the train_mono.sh script
-        self._run_command(
-            './utils/split_data.sh data/acoustic {}'.format(self.njobs))
+        # before calling the train_mono.sh script. Keep the balanced
+        # split if any.
+        if not is_split(
+                os.path.join(self.recipe_dir, 'data', 'acoustic'),
+                self.njobs):
+            self._run_command(
+                './utils/split_data.sh data/acoustic {}'.format(self.njobs))
 
         # build a dict utt -> split to split the alignement following
         # the data split distribution
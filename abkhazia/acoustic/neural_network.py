@@ -163,6 +163,16 @@ class NeuralNetwork(AbstractAcousticModel):
             'Must be pnorm-input-dim % pnorm-output-dim == 0, but it is '
             'pnorm-input-dim={} and pnorm-output-dim={}'.format(idim, odim))
 
+    def steps(self):
+        return ('nnet',)
+
+    def _apply_step_plan(self, plan):
+        # self.njobs is the number of threads of each nnet job
+        self.njobs = plan.num_threads
+        self.set_option('num-jobs-nnet', plan.njobs)
+        self.set_option('combine-num-threads', plan.num_threads)
+        self.set_option('minibatch-size', plan.minibatch_size)
+
     def run(self):
         self._train_pnorm_fast()
 
@@ -182,6 +192,9 @@ class NeuralNetwork(AbstractAcousticModel):
         io_opt = '--io-opts "{}"'.format(
             '' if _maxiojobs <= 0 else '-tc {}'.format(_maxiojobs))
 
+        # the number of nnet jobs, each one on self.njobs threads
+        jobs_opt = '--num-jobs-nnet {}'.format(
+            self.options['num-jobs-nnet'].value)
         num_threads_opt = (
             '--num-threads {0} --parallel-opts "--num-threads {0}"'
             .format(self.njobs))
@@ -207,7 +220,8 @@ class NeuralNetwork(AbstractAcousticModel):
         command = (
             ' '.join((
                 'steps/nnet2/train_pnorm_fast.sh --cmd "{}"'.format(job_cmd),
-                nnet_opts, io_opt, egs_opts, num_threads_opt, combine_opt,
+                nnet_opts, io_opt, egs_opts, jobs_opt, num_threads_opt,
+                combine_opt,
                 '{data} {lang} {origin} {target}'.format(
                     data=self.data_dir,
                     lang=self.lang_dir,
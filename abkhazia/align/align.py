@@ -89,6 +89,8 @@ class Align(abstract_recipe.AbstractRecipe):
             self.feat_dir,
             os.path.join(self.recipe_dir, 'data', self.name))
 
+        self._balance_jobs()
+
     def run(self):
         # build alignment lattice
         self._align_fmllr()
@@ -73,6 +73,11 @@ class _AmBase(AbstractKaldiCommand):
             "default is '%(default)s'",
             metavar='<phone|word>', choices=['phone', 'word'])
 
+        lex.add_argument(
+            '--no-cache', action='store_true',
+            help='do not reuse a lang directory prepared in a previous run '
+            'from the same lexicon and parameters')
+
         dir_group.add_argument(
             '-f', '--features', metavar='<feats-dir>', default=None,
             help='')
@@ -111,7 +116,8 @@ class _AmBase(AbstractKaldiCommand):
             'level': args.lang_level,
             'silence_probability': args.silence_probability,
             'position_dependent_phones': args.word_position_dependent,
-            'keep_tmp_dirs': True if args.recipe else False}
+            'keep_tmp_dirs': True if args.recipe else False,
+            'use_cache': not args.no_cache}
 
         # instanciate and setup the kaldi recipe with standard args
         if cls.am_class is not acoustic.Monophone:
@@ -135,6 +141,7 @@ class _AmBase(AbstractKaldiCommand):
                     corpus, feats, output_dir, lang_args, log=log)
 
         recipe.njobs = args.njobs
+        recipe.balance_jobs = args.balance_jobs
         if args.recipe:
             recipe.delete_recipe = False
 
@@ -148,6 +155,8 @@ class _AmBase(AbstractKaldiCommand):
                 pass
 
         # finally train the acoustic model
+        if not cls._setup_recipe(recipe, args):
+            return
         recipe.compute()
 
 
@@ -125,6 +125,7 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         recipe = (align.AlignNoLattice if args.no_lattice
                   else align.Align)(corpus, output_dir, log=log)
         recipe.njobs = args.njobs
+        recipe.balance_jobs = args.balance_jobs
         recipe.level = level
         recipe.with_posteriors = args.post
         recipe.acoustic_scale = args.acoustic_scale
@@ -134,6 +135,8 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         recipe.delete_recipe = False if args.recipe else True
 
         # finally compute the alignments
+        if not cls._setup_recipe(recipe, args):
+            return
         recipe.create()
         recipe.run()
         recipe.export()
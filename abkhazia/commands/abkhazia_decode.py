@@ -71,6 +71,10 @@ class _DecodeBase(AbstractKaldiCommand):
 
         graph_group = parser.add_argument_group('graph making parameters')
         kaldi.options.add_options(graph_group, decode._mkgraph.options())
+        graph_group.add_argument(
+            '--no-cache', action='store_true',
+            help='do not reuse the decoding graph and best paths computed '
+            'in a previous run on the same models')
 
         decode_group = parser.add_argument_group('decoding parameters')
         kaldi.options.add_options(
@@ -100,7 +104,9 @@ class _DecodeBase(AbstractKaldiCommand):
             corpus, lang, feat, acou, output_dir, fmllr_dir=fmllr,
             decode_type=cls.name, log=log)
         recipe.njobs = args.njobs
+        recipe.balance_jobs = args.balance_jobs
         recipe.delete_recipe = False if args.recipe else True
+        recipe.use_cache = not args.no_cache
 
         # setup the model options parsed from command line
         for k, v in vars(args).items():
@@ -110,6 +116,8 @@ class _DecodeBase(AbstractKaldiCommand):
                 pass
 
         # finally decode the corpus
+        if not cls._setup_recipe(recipe, args):
+            return
         recipe.compute()
 
 
@@ -50,6 +50,24 @@ class _FeatBase(AbstractKaldiCommand):
             help="""if set write features in a h5features file
             named '<output_dir>/feats.h5f'""")
 
+        dir_parser.add_argument(
+            '--h5f-chunk-size', metavar='<float>', default='auto',
+            type=lambda v: v if v == 'auto' else float(v),
+            help="""with --h5f, size of the HDF5 chunks in MB, or 'auto'
+            to let h5features choose it, default is %(default)s""")
+
+        dir_parser.add_argument(
+            '--h5f-compression', metavar='<str>', default=None,
+            type=lambda v: int(v) if v.isdigit() else v,
+            help="""with --h5f, 'lzf' for fast compression, 'gzip' or
+            a gzip level in [0, 9] for higher compression ratios,
+            default is no compression""")
+
+        dir_parser.add_argument(
+            '--h5f-by-speaker', action='store_true',
+            help="""with --h5f, write the utterances of each speaker
+            in a distinct group""")
+
         # from http://kaldi-asr.org/doc/structkaldi_1_1ProcessPitchOptions.html
         parser.add_argument(
             '--pitch', action='store_true',
@@ -64,12 +82,31 @@ class _FeatBase(AbstractKaldiCommand):
             help="""if specified, compute CMVN statistics,
             default is %(default)s""")
 
+        parser.add_argument(
+            '--online-cmvn', action='store_true',
+            help="""if specified with --cmvn, compute CMVN statistics
+            in process, during the deltas pass if --delta-backend is
+            numpy, instead of calling compute-cmvn-stats""")
+
         parser.add_argument(
             '--delta-order', metavar='<int>', type=int, default=0,
             help="""compute deltas on raw features, up to the specified order. If
             delta-order is set to 0, deltas are not computed. Default
             is %(default)s.""")
 
+        parser.add_argument(
+            '--delta-backend', choices=['kaldi', 'numpy'], default='kaldi',
+            help="""compute deltas with the Kaldi add-deltas program or
+            in process with numpy, default is %(default)s""")
+
+        parser.add_argument(
+            '--deep-check', metavar='<int>', type=int, nargs='?',
+            const=0, default=None,
+            help="""if specified, read back the exported features
+            matrices and fail if any is corrupted, has an inconsistent
+            dimension or contains NaN or infinite values. If <int> is
+            given, only check a random sample of <int> matrices""")
+
         cls.add_kaldi_options(
             parser.add_argument_group(
                 '{} features options'.format(cls.feat_name)))
@@ -110,10 +147,15 @@ class _FeatBase(AbstractKaldiCommand):
         recipe.type = cls.feat_name
         recipe.use_pitch = utils.str2bool(args.pitch)  # 'true' to True
         recipe.use_cmvn = utils.str2bool(args.cmvn)
+        recipe.online_cmvn = args.online_cmvn
         recipe.delta_order = args.delta_order
+        recipe.delta_backend = args.delta_backend
+        recipe.deep_check = args.deep_check
         recipe.features_options = cls.parsed_options
         recipe.njobs = args.njobs
         recipe.delete_recipe = False if args.recipe else True
+        if not cls._setup_recipe(recipe, args):
+            return
         recipe.compute()
 
         # export to h5features if asked for
@@ -121,7 +163,11 @@ class _FeatBase(AbstractKaldiCommand):
             recipe.log.info('exporting Kaldi ark features to h5features...')
             kaldi.scp_to_h5f(
                 os.path.join(recipe.output_dir, 'feats.scp'),
-                os.path.join(recipe.output_dir, 'feats.h5f'))
+                os.path.join(recipe.output_dir, 'feats.h5f'),
+                chunk_size=args.h5f_chunk_size,
+                compression=args.h5f_compression,
+                utt2spk=corpus.utt2spk if args.h5f_by_speaker else None,
+                log=recipe.log)
 
 
 class _FeatMfcc(_FeatBase):
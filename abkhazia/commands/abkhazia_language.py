@@ -59,6 +59,18 @@ class AbkhaziaLanguage(AbstractKaldiCommand):
             "model, default is '%(default)s'",
             metavar='<phone|word>', choices=['phone', 'word'])
 
+        group.add_argument(
+            '--ngram-backend', default='irstlm',
+            metavar='<irstlm|python>', choices=['irstlm', 'python'],
+            help="estimate the n-grams with IRSTLM or count them in "
+            "process with python (for orders up to 3), "
+            "default is '%(default)s'")
+
+        group.add_argument(
+            '--no-cache', action='store_true',
+            help='do not reuse the lang directory and G.fst prepared in a '
+            'previous run from the same lexicon and ARPA model')
+
     @classmethod
     def run(cls, args):
         corpus_dir, output_dir = cls._parse_io_dirs(args)
@@ -85,7 +97,11 @@ class AbkhaziaLanguage(AbstractKaldiCommand):
                 order=args.model_order,
                 level=args.model_level,
                 position_dependent_phones=args.word_position_dependent,
-                silence_probability=args.silence_probability)
+                silence_probability=args.silence_probability,
+                ngram_backend=args.ngram_backend)
 
+        recipe.use_cache = not args.no_cache
         recipe.delete_recipe = False if args.recipe else True
+        if not cls._setup_recipe(recipe, args):
+            return
         recipe.compute()
@@ -71,8 +71,11 @@ class Abkhazia(object):
     def load_config(self):
         """Load the config file optionally given by --config argument
 
+        Also parse the --trace argument to self.trace_file, enabling
+        tracing if specified.
+
         Return the string read from sys.argv, with '--config
-        <config-file>' removed
+        <config-file>' and '--trace <trace-file>' removed
 
         """
         parser = argparse.ArgumentParser(add_help=False)
@@ -90,7 +93,14 @@ class Abkhazia(object):
         parser.add_argument(
             '-c', '--config', metavar='<config-file>', action=_ConfigAction)
 
-        return parser.parse_known_args()[1]
+        # add a trace argument
+        parser.add_argument('--trace', metavar='<trace-file>', default=None)
+
+        args, argv = parser.parse_known_args()
+        self.trace_file = args.trace
+        if self.trace_file:
+            utils.trace.enable()
+        return argv
 
     def init_parser(self):
         """Return an argument parser initialized form abkhazia subcommands"""
@@ -109,6 +119,13 @@ class Abkhazia(object):
             'defined in <config-file>, default configuration is read from\n{}'
             .format(utils.AbkhaziaConfig.default_config_file()))
 
+        # same as --config, --trace has been parsed in self.load_config()
+        parser.add_argument(
+            '--trace', metavar='<trace-file>', default=None,
+            help='record the time and resources spent by the processing\n'
+            'steps, append them to <trace-file> in Chrome trace format\n'
+            '(see chrome://tracing) and print a summary at exit')
+
         # add a version description argument
         parser.add_argument(
             '--version', action='version',
@@ -145,7 +162,14 @@ class Abkhazia(object):
         args = parser.parse_args(argv)
 
         # call the run() method of the parsed subcommand
-        args.command(args)
+        try:
+            args.command(args)
+        finally:
+            if self.trace_file:
+                utils.trace.export_chrome(
+                    self.trace_file,
+                    process_name=' '.join(['abkhazia'] + argv))
+                print(utils.trace.summary())
 
 
 class CatchExceptions(object):
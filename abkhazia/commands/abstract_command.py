@@ -33,6 +33,7 @@ import shutil
 import textwrap
 
 import abkhazia.utils as utils
+from abkhazia.kaldi import planner
 
 
 class AbstractCommand(object):
@@ -230,4 +231,81 @@ class AbstractKaldiCommand(AbstractCoreCommand):
             min(<njobs>, corpus.nspeakers). Default is to launch
             %(default)s jobs.""")
 
+        parser.add_argument(
+            '--balance-jobs', action='store_true', help="""
+            split the data among jobs by balancing their total
+            duration, instead of their number of utterances as done by
+            Kaldi (used by acoustic, align and decode)""")
+
+        plan_group = parser.add_argument_group('parallelism planning')
+        plan_group.add_argument(
+            '--plan', action='store_true', help="""
+            choose the number of jobs, of threads per job and the nnet
+            minibatch size of each step from the cores and memory of
+            the local machine, overloads --njobs and the related
+            training and decoding parameters""")
+
+        plan_group.add_argument(
+            '--dry-run', action='store_true', help="""
+            print the plan computed by --plan and exit without running
+            the recipe""")
+
+        plan_group.add_argument(
+            '--rusage-history', metavar='<file>', default=None, help="""
+            JSON file where the peak memory of each step is recorded,
+            and read back by --plan to estimate the memory of a job,
+            by default nothing is recorded and --plan uses default
+            estimates""")
+
+        plan_group.add_argument(
+            '--memory-budget', metavar='<MB>', type=int, default=None,
+            help="""
+            throttle the Kaldi jobs run locally so that the memory of
+            the concurrent jobs, estimated from their peak memory on
+            previous runs, stays within <MB>. The memory reserved by
+            the other abkhazia processes run with --memory-budget on
+            the machine is taken into account. By default there is no
+            limit""")
+
+        kaldi_group = parser.add_argument_group('Kaldi messages')
+        kaldi_group.add_argument(
+            '--max-kaldi-warnings', metavar='<int>', type=int, default=None,
+            help="""
+            abort a step as soon as Kaldi reported more than <int>
+            warnings, by default there is no limit""")
+
+        kaldi_group.add_argument(
+            '--max-kaldi-errors', metavar='<int>', type=int, default=None,
+            help="""
+            abort a step as soon as Kaldi reported more than <int>
+            errors, by default there is no limit""")
+
         return parser, dir_group
+
+    @staticmethod
+    def _setup_recipe(recipe, args):
+        """Setup the recipe from the arguments common to Kaldi commands
+
+        Return False on --dry-run, after printing the plan and
+        removing the output directory, else True
+
+        """
+        recipe.rusage_history = args.rusage_history
+        recipe.memory_budget = args.memory_budget
+        recipe.max_kaldi_warnings = args.max_kaldi_warnings
+        recipe.max_kaldi_errors = args.max_kaldi_errors
+        if not args.plan and not args.dry_run:
+            return True
+
+        machine = planner.local_machine()
+        plans = recipe.plan(machine)
+        if args.dry_run:
+            print(planner.format_plan(plans, machine))
+            # _parse_output_dir ensures output_dir is a new directory
+            utils.remove(recipe.output_dir, safe=True)
+            return False
+
+        recipe.log.info(
+            'parallelism plan:\n%s', planner.format_plan(plans, machine))
+        recipe.apply_plan(plans)
+        return True
@@ -99,6 +99,7 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
     """
 
     @classmethod
+    @utils.trace.traced(category='corpus')
     def load(cls, corpus_dir, validate=False, log=utils.logger.null_logger()):
         """Return a corpus initialized from `corpus_dir`
 
@@ -125,6 +126,7 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         self.silences = []
         self.variants = []
 
+    @utils.trace.traced(category='corpus')
     def save(self, path, no_wavs=False, copy_wavs=True, force=False):
         """Save the corpus to the directory `path`
 
@@ -151,6 +153,7 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
 
         CorpusSaver.save(self, path, no_wavs=no_wavs, copy_wavs=copy_wavs)
 
+    @utils.trace.traced(category='corpus')
     def validate(self, njobs=utils.default_njobs()):
         """Validate speech corpus data
 
@@ -542,8 +545,9 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         return(CorpusFilter(self).create_filter(
             out_path, function, nb_speaker, new_speakers, THCHS30))
 
-    def trim(self, corpus_dir, output_dir, function, not_kept_utts):
+    def trim(self, corpus_dir, output_dir, function, not_kept_utts,
+             njobs=utils.default_njobs(local=True)):
         """ Remove utterances from the corpus
-            (using sox to trim the wav files)"""
-        CorpusTrimmer(self).trim(
+            (trimming the wav files in parallel)"""
+        CorpusTrimmer(self, njobs=njobs, log=self.log).trim(
                 corpus_dir, output_dir, function, not_kept_utts)
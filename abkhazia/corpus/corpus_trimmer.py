@@ -16,58 +16,76 @@
 
 import os
 import shutil
-import subprocess
-import shlex
-import sys
-import wave
-import contextlib
-
-from itertools import *
-from operator import itemgetter, attrgetter, methodcaller
 from collections import defaultdict
-from abkhazia.utils import open_utf8, logger
+
+import joblib
+
+from abkhazia.utils import append_ext, default_njobs, logger, wav
 
 
 class CorpusTrimmer(object):
     """Removes utterances from a corpus"""
 
-    def __init__(self, corpus, log=logger.null_logger()):
+    def __init__(self, corpus, njobs=default_njobs(local=True),
+                 log=logger.null_logger()):
         """Removes utterances in 'not_kept_utts' from the
         wavs in the corpus
 
         'corpus' is an instance of Corpus'
 
+        'njobs' is the number of wav files trimmed in parallel
+
         'not_kept_utts' is a dictionnary of the form :
         not_kept_utts=(speaker :[(utt1,wav_id,start_time,stop_time),
         (utt1,wav_id,start_time,stop_time)...])
         """
         self.log = log
         self.corpus = corpus
+        self.njobs = njobs
+
+    def _removed_intervals(self, not_kept_utts):
+        """Return a dict wav -> [(start, stop), ...] of times to remove
 
-        utt_ids, utt_speakers = zip(*self.corpus.utt2spk.items())
-        self.utts = zip(utt_ids, utt_speakers)
-        self.speakers = set(utt_speakers)
+        Only the wavs in the corpus are considered: the wavs that won't
+        be kept at all are not trimmed.
+
+        """
+        removed = defaultdict(list)
+        for utts in not_kept_utts.values():
+            for _, (wav_id, start, stop) in utts:
+                wav_id = append_ext(wav_id, '.wav')
+                if wav_id in self.corpus.wavs:
+                    removed[wav_id].append((start, stop))
+        return removed
+
+    def _trim_one(self, wav_input_path, wav_output_path, intervals):
+        """Trim a single wav, remove the output if empty"""
+        # if the wav doesn't have utt to remove, copy file
+        if not intervals:
+            shutil.copyfile(wav_input_path, wav_output_path)
+            return
+
+        self.log.debug(
+            'for wav %s, %s seconds should have been trimmed',
+            os.path.basename(wav_input_path),
+            sum(stop - start for start, stop in intervals))
+
+        # if the output file is empty, remove it
+        if wav.remove_intervals(
+                wav_input_path, wav_output_path, intervals) == 0:
+            self.log.debug('removing empty file : %s', wav_output_path)
+            os.remove(wav_output_path)
 
     def trim(self, corpus_dir, output_dir, function, not_kept_utts):
         """Given a corpus and a list of utterances, this
         method removes the utterances in the list from the wavs,
         from segments, from the text and from utt2spk
         """
-        # return error if sox is not installed
-        try:
-            subprocess.check_output(shlex.split('which sox'))
-        except:
-            raise OSError('sox is not installed on your system')
-
-        spk2utts = defaultdict(list)
-        for utt, spkr in self.utts:
-            spk2utts[spkr].append(utt)
-
         # get input and output wav paths
         corpus_dir = os.path.abspath(corpus_dir)
         wav_dir = self.corpus.wav_folder
         if not os.path.isdir(wav_dir):
-            raise IOError('invalid corpus: not found{}'.format(path))
+            raise IOError('invalid corpus: not found {}'.format(wav_dir))
 
         output_dir = os.path.abspath(output_dir)
         output_dir = os.path.join(output_dir, function)
@@ -75,81 +93,14 @@ class CorpusTrimmer(object):
         if not os.path.isdir(output_wav_dir):
             os.makedirs(output_wav_dir)
 
-        # remove utterances from the wavs using sox
-        for speaker in self.speakers:
-            print(speaker)
-            utt_to_remove = not_kept_utts[speaker]
-
-            # if speaker doesn't have utt to remove, copy file
-            if utt_to_remove == []:
-                wavs_to_copy = set([self.corpus.segments[utt][0] for
-                                    utt in spk2utts[speaker]])
-                for wav in wavs_to_copy:
-                    wav_name = '.'.join([wav, 'wav'])
-                    wav_input_path = '/'.join([wav_dir, wav_name])
-                    wav_output_path = '/'.join([output_wav_dir, wav_name])
-
-                    shutil.copyfile(wav_input_path, wav_output_path)
-
-            # don't trim utterances for wave file that won't be kept at all
-            wav_ids = [os.path.splitext(w)[0] for w in self.corpus.wavs]
-            wavs_output = [(wav_id, start, stop)
-                           for utt_id, (wav_id, start, stop)
-                           in utt_to_remove if wav_id in wav_ids]
-
-            wavs_start_dict = defaultdict(list)
-            wavs_stop_dict = defaultdict(list)
-            wavs_duration_dict = defaultdict(list)
-            for wav_id, start, stop in wavs_output:
-                wavs_start_dict[wav_id].append(start)
-                wavs_stop_dict[wav_id].append(stop)
-                wavs_duration_dict[wav_id].append(stop - start)
-
-            for wav in wavs_start_dict:
-                # start removing utterances at the end
-                # and finish at the begining : removing an utterance at the
-                # end doesn't affect the other utterances timestamps !
-                wavs_starts_temp = sorted(wavs_start_dict[wav], reverse=True)
-                wavs_stop_temp = sorted(wavs_stop_dict[wav], reverse=True)
-
-                wav_name = '.'.join([wav, 'wav'])
-                wav_input_path = '/'.join([wav_dir, wav_name])
-                wav_output_path = '/'.join([output_wav_dir, wav_name])
-
-                # Create string of timestamps to remove to pass as
-                # arguments to sox
-                timestamps = ''
-                for start, stop in zip(wavs_starts_temp, wavs_stop_temp):
-                    times = '=' + str(start) + ' ' + '=' + str(stop)
-                    timestamps = ' '.join([times, timestamps])
-
-                # call sox to trim part of the signal
-                list_command = ['sox', wav_input_path,
-                                wav_output_path, 'trim 0', timestamps]
-
-                command = ' '.join(list_command)
-                process = subprocess.Popen(
-                        shlex.split(command), stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE)
-                stdout, stderr = process.communicate()
-                if stdout:
-                    self.log.debug(stdout)
-                if stderr:
-                    self.log.debug(stderr)
-
-                self.log.debug(
-                        '''for wav {wav_id}, {duration} seconds'''
-                        '''should have been trimmed'''.format(
-                            wav_id=wav, duration=sum(wavs_duration_dict[wav])))
-
-                # if the output file is empty, remove it
-                with contextlib.closing(
-                        wave.open(wav_output_path, 'r')) as wav_file:
-                    frames = wav_file.getnframes()
-
-                self.log.debug('checking length of output trimmed file')
-                if frames == 0:
-                    self.log.debug(
-                            'removing empty file : {wav_id}'.format(
-                                wav_id=wav_output_path))
-                    os.remove(wav_output_path)
+        removed = self._removed_intervals(not_kept_utts)
+        self.log.info(
+            'trimming %s utterances from %s wavs',
+            sum(len(v) for v in removed.values()), len(removed))
+
+        # remove utterances from the wavs, one wav per job
+        joblib.Parallel(n_jobs=self.njobs, backend='threading')(
+            joblib.delayed(self._trim_one)(
+                os.path.join(wav_dir, w),
+                os.path.join(output_wav_dir, w),
+                removed[w]) for w in sorted(self.corpus.wavs))
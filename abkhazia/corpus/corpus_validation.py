@@ -135,6 +135,12 @@ class CorpusValidation(object):
             raise IOError('Cannot retrieve metadata for the following '
                           'wavs: {}'.format(resume_list(missing_meta)))
 
+        invalid_files = [w for w in self.corpus.wavs
+                         if meta[w].comptype == 'INVALID']
+        if invalid_files:
+            raise IOError("The following files have an invalid header: {}"
+                          .format(resume_list(invalid_files)))
+
         empty_files = [w for w in self.corpus.wavs if meta[w].nframes == 0]
         if empty_files:
             raise IOError("The following files are empty: {}"
@@ -147,20 +147,36 @@ class AbstractPreparator(object):
         return False
 
     def _prepare_wavs_dir(self, wavs_dir, inputs, outputs):
-        """Detect outputs already present and delete any undesired file"""
+        """Detect outputs already present and delete any undesired file
+
+        The files already present are considered converted, except
+        those having a saved fingerprint: they are checked against
+        their input by utils.wav.convert.
+
+        """
         self.log.debug('scanning %s', wavs_dir)
 
+        fingerprints = utils.wav.load_fingerprints(
+            os.path.join(wavs_dir, self.fingerprints))
+
         target = dict((o, i) for i, o in zip(inputs, outputs))
         found = 0
         deleted = 0
         for wav in os.listdir(wavs_dir):
+            if wav == self.fingerprints:
+                continue
+
             # the complete path to the wav file
             path = os.path.realpath(os.path.join(wavs_dir, wav))
 
             # the target file is found in the directory, delete it if
             # it is empty, delete it it's a link and we force copying
             if wav in target and not self._broken_wav(path):
-                del target[wav]
+                # fingerprints are keyed by absolute path (see
+                # utils.wav.convert)
+                if os.path.abspath(
+                        os.path.join(wavs_dir, wav)) not in fingerprints:
+                    del target[wav]
                 found += 1
             else:
                 utils.remove(path)
@@ -230,7 +246,9 @@ class AbstractPreparator(object):
                            len(inputs), self.audio_format)
             utils.wav.convert(
                 inputs, outputs, self.audio_format,
-                self.njobs, verbose=5, copy=self.copy_wavs)
+                self.njobs, verbose=5, copy=self.copy_wavs,
+                fingerprints=os.path.join(wavs_dir, self.fingerprints),
+                log=self.log)
             self.log.debug('finished converting wavs')
 
         # finally return the wav folder path
@@ -257,6 +275,14 @@ class AbstractPreparator(object):
 
     """
 
+    fingerprints = '.fingerprints'
+    """The file in wavs_dir where to save the fingerprints of the wavs
+
+    Used by make_wavs() to convert again the wavs whose audio file
+    changed since the last preparation.
+
+    """
+
     copy_wavs = False
     """A boolean used only for corpora with original audio files in wav
 
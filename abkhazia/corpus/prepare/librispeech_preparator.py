@@ -117,8 +117,10 @@ class LibriSpeechPreparator(AbstractPreparatorWithCMU):
             self.input_dir = os.path.join(input_dir, selection)
 
     def list_audio_files(self):
+        # the walk is cached to be reused by make_transcription
         flacs = utils.list_files_with_extension(
-            self.input_dir, '.flac', abspath=True)
+            self.input_dir, '.flac', abspath=True,
+            njobs=self.njobs, cache=True)
 
         wavs = []
         for flac in flacs:
@@ -153,7 +155,7 @@ class LibriSpeechPreparator(AbstractPreparatorWithCMU):
 
         corrupted_wavs = []
         for trs in utils.list_files_with_extension(
-                self.input_dir, '.trans.txt'):
+                self.input_dir, '.trans.txt', njobs=self.njobs, cache=True):
             for line in open(trs, 'r'):
                 matched = re.match(r'([0-9\-]+)\s([A-Z].*)', line)
                 if matched:
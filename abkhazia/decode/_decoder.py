@@ -42,7 +42,7 @@ def options():
 
 
 def decode(decoder, graph_dir):
-    decoder.log.info('decoding and computing WER')
+    decoder.log.info('decoding')
 
     # generate option string for decoding
     decode_opts = ' '.join(
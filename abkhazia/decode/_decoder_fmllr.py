@@ -50,7 +50,7 @@ def options():
 
 
 def decode(decoder, graph_dir):
-    decoder.log.info('fmllr decoding and computing WER')
+    decoder.log.info('fmllr decoding')
 
     # generate option string for decoding
     decode_opts = ' '.join(
@@ -52,7 +52,7 @@ def options():
 
 
 def decode(decoder, graph_dir):
-    decoder.log.info('nnet decoding and computing WER')
+    decoder.log.info('nnet decoding')
 
     # generate option string for decoding
     decode_opts = ' '.join('--{} {}'.format(n, str(o))
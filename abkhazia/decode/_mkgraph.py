@@ -17,11 +17,28 @@
 Instantiate a full decoding graph (HCLG), 'quinphone' option is
 not forwarded from kaldi to abkhazia for now.
 
+Building HCLG is the most memory and time consuming step of the
+decoding. The graphs are cached in the abkhazia tmp-directory (see
+abkhazia.utils.cache), keyed by the tree and the transition model of
+the acoustic model, the lang files and the mkgraph parameters, so
+decoding again on the same models reuses the graph. The graph
+building is killed if it exceeds the max-memory option, unlimited by
+default.
+
 """
 
+import hashlib
 import os
+
 import abkhazia.utils as utils
 import abkhazia.kaldi as kaldi
+from abkhazia.kaldi import planner
+
+
+LANG_FILES = ('L.fst', 'L_disambig.fst', 'G.fst', 'words.txt',
+              'phones.txt', os.path.join('phones', 'disambig.int'),
+              os.path.join('phones', 'silence.csl'))
+"""The files of the lang directory read by mkgraph.sh"""
 
 
 def options():
@@ -34,18 +51,84 @@ def options():
         opt('self-loop-scale', default=0.1, type=float,
             help='Scale of self-loop versus non-self-loop log probs'),
         opt('reverse', default=False, type=bool,
-            help='Build a time-reversed H transducer'))}
+            help='Build a time-reversed H transducer'),
+        opt('max-memory', default=0, type=int,
+            help='Kill the graph building when it exceeds that memory '
+            '(in MB), default is 0 (no limit)'))}
 
 
-def mkgraph(decoder, verbose=True):
-    decoder.log.info('computing full decoding graph')
+def transition_model_hash(model):
+    """Return the SHA1 hex digest of the transition model in `model`
+
+    A Kaldi model (final.mdl) starts with its transition model
+    (topology and transition probabilities), followed by the
+    acoustic model parameters. Only the first part is used to build
+    the graph. If the transition model is not found, the whole
+    `model` is hashed.
+
+    """
+    end = b'</TransitionModel>'
+    sha1 = hashlib.sha1()
+    with open(model, 'rb') as fin:
+        tail = b''
+        for chunk in iter(lambda: fin.read(2**20), b''):
+            index = (tail + chunk).find(end)
+            if index != -1:
+                sha1.update(chunk[:index - len(tail) + len(end)])
+                break
+            sha1.update(chunk)
+            tail = chunk[-len(end):]
+    return sha1.hexdigest()
+
+
+def graph_key(decoder):
+    """Return the cache key of the graph built by `decoder`"""
+    opts = decoder.mkgraph_opts
+    lang_files = [os.path.join(decoder.lm_dir, f) for f in LANG_FILES]
+    return utils.cache.hash_files(
+        os.path.join(decoder.recipe_dir, 'utils', 'mkgraph.sh'),
+        os.path.join(decoder.am_dir, 'tree'),
+        *(f for f in lang_files if os.path.isfile(f)),
+        extra=[transition_model_hash(
+                   os.path.join(decoder.am_dir, 'final.mdl')),
+               decoder.am_type == 'mono', opts['reverse'].value,
+               opts['transition-scale'].value,
+               opts['self-loop-scale'].value])
+
+
+def _max_memory(decoder):
+    """Return the memory (MB) the graph building can use, None if unlimited
+
+    Log a warning if a previous build (recorded in the rusage history
+    of the decoder) used more.
+
+    """
+    max_memory = decoder.mkgraph_opts['max-memory'].value or None
 
+    if max_memory and decoder.rusage_history:
+        peak = planner.History(decoder.rusage_history).peak('mkgraph')
+        if peak and peak > max_memory:
+            decoder.log.warning(
+                'mkgraph used up to %s MB on previous runs but is limited '
+                'to %s MB, it may be killed', peak, max_memory)
+    return max_memory
+
+
+def mkgraph(decoder, verbose=True):
     opts = decoder.mkgraph_opts
 
     target = os.path.join(decoder.recipe_dir, 'graph')
     if not os.path.isdir(target):
         os.makedirs(target)
 
+    cache, key = None, None
+    if decoder.use_cache:
+        cache, key = utils.cache.FileCache('graph'), graph_key(decoder)
+        if cache.get(key, target):
+            decoder.log.info('decoding graph found in cache')
+            return target
+
+    decoder.log.info('computing full decoding graph')
     command = (
         '{cmd} {log} utils/mkgraph.sh {mono} {reverse} '
         '--transition-scale {tscale} --self-loop-scale {slscale} '
@@ -61,6 +144,9 @@ def mkgraph(decoder, verbose=True):
             model=decoder.am_dir,
             graph=target))
 
-    decoder._run_command(command, verbose=verbose)
+    decoder._run_command(
+        command, verbose=verbose, max_memory=_max_memory(decoder))
 
+    if cache:
+        cache.put(key, target)
     return target
@@ -12,14 +12,50 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
-"""Options to feed egs/wsj/s5/utils/score.sh
+"""Scoring of the decoded lattices over LM weights and penalties
+
+This replaces the Kaldi egs/wsj/s5/local/score.sh script, which reads
+all the lattices again for each LM weight. Here the lattices are
+converted to text once, then each lattice file is read once and its
+best paths are computed for all the LM weights and word insertion
+penalties, the lattice files being processed in parallel. With
+decode-mbr the best paths are computed by lattice-mbr-decode from the
+text lattices. The best paths are cached by weight (see
+abkhazia.utils.cache) and the hypotheses are scored in parallel, in
+process by default (see _wer.py).
+
+The outputs in the decode directory follow Kaldi: wer_LMWT_WIP and
+scoring/LMWT.WIP.tra, as well as scoring/best_wer (copied to
+scoring_kaldi/best_wer as written by steps/score_kaldi.sh). The errors
+by utterance and by speaker of the best weights are detailed in
+scoring/wer_details.
 
 Following score options are ignored: iter, stage, stats. The reverse
-option is linked to the mkgraph.reverse option
+option is linked to the mkgraph.reverse option: the lattices decoded
+with a time-reversed graph are reversed back with lattice-reverse
+before scoring.
 
 """
 
+import collections
+import glob
+import os
+import re
+import time
+
+import joblib
+
+import abkhazia.utils as utils
 import abkhazia.kaldi as kaldi
+from abkhazia.kaldi import kaldi_path
+from abkhazia.decode import _wer
+
+
+REF_FILTER = ('<NOISE>', '<SPOKEN_NOISE>')
+"""Words removed from the reference text before scoring"""
+
+HYP_FILTER = ('<UNK>',)
+"""Words removed from the hypotheses before scoring"""
 
 
 def options():
@@ -34,9 +70,11 @@ def options():
         # conflicts with deocde.beam option
         opt('pruning-beam', default=6, type=float,
             help='Pruning beam (applied after acoustic scaling)'),
-        # TODO cause bugs when parsing
-        # opt('word-ins-penalty', default=[0.0, 0.5, 1.0], type=list,
-        #     help='Word insertion penalities to decode with'),
+        # a list option cause bugs when parsing, the penalties are
+        # given as a comma separated string
+        opt('word-ins-penalty', default='0.0,0.5,1.0', type=str,
+            help='Word insertion penalities to decode with, '
+            'comma separated'),
         opt('min-lmwt', default=9, type=int,
             help='minumum LM-weight for lattice rescoring'),
         opt('max-lmwt', default=20, type=int,
@@ -57,4 +95,396 @@ def format(score_opts, mkgraph_opts):
 
 
 def skip_scoring(score_opts):
-    return '--skip-scoring true' if score_opts['skip-scoring'] is True else ''
+    """Scoring is done by score() after decoding, never by Kaldi"""
+    return '--skip-scoring true'
+
+
+def read_lattices(filename):
+    """Yield (utt, lattice) from the text lattices in `filename`
+
+    The file is an archive of lattices in text format, as written by
+    'lattice-copy ark:- ark,t:-', either CompactLattice (arcs 'src
+    dst word graph,acoustic,trans') or Lattice (arcs 'src dst ilabel
+    word graph,acoustic'). A lattice is a tuple (start, arcs, finals)
+    with `arcs` a list of (src, dst, word, graph, acoustic) sorted
+    topologically and `finals` a dict state -> (graph, acoustic).
+
+    """
+    def _weight(weight):
+        weight = weight.split(',')
+        return float(weight[0]), float(weight[1])
+
+    def _lattice(lines):
+        arcs, finals = [], {}
+        for line in lines:
+            line = line.split()
+            if len(line) <= 2:
+                finals[int(line[0])] = (
+                    _weight(line[1]) if len(line) == 2 else (0.0, 0.0))
+                continue
+
+            if len(line) == 3 or ',' in line[3]:  # CompactLattice
+                word = int(line[2])
+                weight = _weight(line[3]) if len(line) == 4 else (0.0, 0.0)
+            else:  # Lattice
+                word = int(line[3])
+                weight = _weight(line[4]) if len(line) == 5 else (0.0, 0.0)
+            arcs.append((int(line[0]), int(line[1]), word) + weight)
+
+        start = int(lines[0].split()[0])
+        return start, _topological(start, arcs), finals
+
+    utt, lines = None, []
+    with utils.open_utf8(filename, 'r') as fin:
+        for line in fin:
+            if utt is None:
+                if line.strip():
+                    utt = line.split()[0]
+            elif line.strip():
+                lines.append(line)
+            else:
+                if lines:
+                    yield utt, _lattice(lines)
+                utt, lines = None, []
+    if utt is not None and lines:
+        yield utt, _lattice(lines)
+
+
+def _topological(start, arcs):
+    """Return `arcs` sorted in topological order of their source"""
+    if all(src < dst for src, dst, *_ in arcs):
+        return sorted(arcs, key=lambda arc: arc[0])
+
+    successors = collections.defaultdict(list)
+    indegree = collections.Counter()
+    for src, dst, *_ in arcs:
+        successors[src].append(dst)
+        indegree[dst] += 1
+
+    rank, queue = {}, [start]
+    while queue:
+        state = queue.pop()
+        rank[state] = len(rank)
+        for dst in successors[state]:
+            indegree[dst] -= 1
+            if indegree[dst] == 0:
+                queue.append(dst)
+    return sorted((a for a in arcs if a[0] in rank), key=lambda a: rank[a[0]])
+
+
+def best_path(lattice, lmwt, wip=0.0):
+    """Return (words, cost) of the best path in `lattice`
+
+    This is 'lattice-scale --inv-acoustic-scale=`lmwt` |
+    lattice-add-penalty --word-ins-penalty=`wip` | lattice-best-path':
+    the cost of an arc is its graph cost, plus its acoustic cost
+    divided by `lmwt`, plus `wip` if it has a word. Return (None,
+    None) if the lattice has no successful path.
+
+    """
+    start, arcs, finals = lattice
+    inv = 1.0 / lmwt
+    best, back = {start: 0.0}, {}
+    for index, (src, dst, word, graph, acoustic) in enumerate(arcs):
+        cost = best.get(src)
+        if cost is None:
+            continue
+        cost += graph + acoustic * inv + (wip if word else 0.0)
+        if cost < best.get(dst, float('inf')):
+            best[dst] = cost
+            back[dst] = index
+
+    final, cost = None, float('inf')
+    for state, (graph, acoustic) in finals.items():
+        if state in best and best[state] + graph + acoustic * inv < cost:
+            final, cost = state, best[state] + graph + acoustic * inv
+    if final is None:
+        return None, None
+
+    words, state = [], final
+    while state != start:
+        src, _, word, _, _ = arcs[back[state]]
+        if word:
+            words.append(word)
+        state = src
+    return words[::-1], cost
+
+
+def _best_paths(lattices, weights):
+    """Best paths of the text lattices in `lattices` for all `weights`
+
+    Return (paths, times) with paths[weight] a list of (utt, words)
+    and times[weight] the time spent on that weight.
+
+    """
+    paths = {w: [] for w in weights}
+    times = {w: 0.0 for w in weights}
+    for utt, lattice in read_lattices(lattices):
+        for weight in weights:
+            t0 = time.time()
+            words, _ = best_path(lattice, float(weight[0]), float(weight[1]))
+            times[weight] += time.time() - t0
+            if words is not None:
+                paths[weight].append((utt, words))
+    return paths, times
+
+
+def _mbr_paths(lattices, weight, symtab, beam):
+    """Best paths of `lattices` for `weight` with lattice-mbr-decode"""
+    t0 = time.time()
+    output = []
+    utils.jobs.run(
+        'bash -c "lattice-scale --inv-acoustic-scale={} '
+        '\'ark:cat {}|\' ark:- | '
+        'lattice-add-penalty --word-ins-penalty={} ark:- ark:- | '
+        'lattice-prune --beam={} ark:- ark:- | '
+        'lattice-mbr-decode --word-symbol-table={} ark:- ark,t:- '
+        '2> /dev/null"'.format(
+            weight[0], ' '.join(lattices), weight[1], beam, symtab),
+        stdout=output.append, env=kaldi_path())
+
+    paths = []
+    for line in ''.join(output).split('\n'):
+        line = line.split()
+        if line:
+            paths.append((line[0], [int(w) for w in line[1:]]))
+    return paths, time.time() - t0
+
+
+def kaldi_scorer(ref_txt, hyp_txt):
+    """Return the output of the Kaldi compute-wer on `hyp_txt`"""
+    output = []
+    utils.jobs.run(
+        'compute-wer --text --mode=present ark:{} ark,p:{}'.format(
+            ref_txt, hyp_txt),
+        stdout=output.append, env=kaldi_path())
+    return ''.join(
+        line for line in output if not line.startswith(('LOG', 'WARNING')))
+
+
+def _read_symbols(symtab):
+    symbols = {}
+    for line in utils.open_utf8(symtab, 'r'):
+        word, index = line.split()
+        symbols[int(index)] = word
+    return symbols
+
+
+def _write_filtered(filename, text, removed):
+    with utils.open_utf8(filename, 'w') as fout:
+        for utt, words in text:
+            fout.write(u'{} {}\n'.format(
+                utt, ' '.join(w for w in words if w not in removed)))
+
+
+def score_lattices(lattices, symtab, ref_text, output_dir,
+                   lmwts, wips=('0.0',), decode_mbr=False, beam=6,
+                   scorer=None, njobs=1, use_cache=True,
+                   log=utils.logger.null_logger()):
+    """Score the text lattices for all LM weights and penalties
+
+    Parameters:
+    -----------
+
+    lattices (list): the text lattice files, each one is read once
+
+    symtab (path): the words.txt symbol table of the graph
+
+    ref_text (path): the reference text, as the data/text file
+
+    output_dir (path): the decode directory where to write the
+      scoring/LMWT.WIP.tra best paths and the wer_LMWT_WIP scores
+
+    lmwts, wips (lists): the LM weights and word insertion penalties
+      to score (as strings, used in the output file names)
+
+    decode_mbr (bool): when True, compute the best paths with the
+      Kaldi lattice-mbr-decode, after a pruning with `beam`
+
+    scorer (function): scorer(ref_txt, hyp_txt) returns the WER
+      report of the hypotheses, as written by the Kaldi compute-wer
+      (see kaldi_scorer). Default is an in-process _wer.WerScorer,
+      the errors of its best weights are detailed in
+      scoring/wer_details.
+
+    njobs (int): number of parallel jobs
+
+    use_cache (bool): when True reuse the best paths computed on the
+      same lattices in a previous run, and the errors of the default
+      scorer computed on the same reference
+
+    Return:
+    -------
+
+    A dict (lmwt, wip) -> (WER, best path time, scoring time), WER is
+    None if not found in the scorer output.
+
+    """
+    scoring_dir = os.path.join(output_dir, 'scoring')
+    if not os.path.isdir(scoring_dir):
+        os.makedirs(scoring_dir)
+    weights = [(str(lmwt), str(wip)) for lmwt in lmwts for wip in wips]
+    if scorer is None:
+        scorer = _wer.WerScorer(use_cache=use_cache)
+
+    def _tra(weight):
+        return os.path.join(scoring_dir, '{}.{}.tra'.format(*weight))
+
+    # get back the cached best paths
+    cache, cached = None, set()
+    if use_cache:
+        cache = utils.cache.FileCache('scoring')
+        base = utils.cache.hash_files(
+            *lattices, extra=[decode_mbr, beam if decode_mbr else None])
+        for weight in weights:
+            if cache.get('{}-{}-{}'.format(base, *weight), _tra(weight)):
+                cached.add(weight)
+
+    # compute the missing ones, in parallel over the lattice files or
+    # the weights with decode-mbr
+    missing = [w for w in weights if w not in cached]
+    times = {w: 0.0 for w in weights}
+    if missing:
+        log.info('computing best paths for %s weights on %s lattice files',
+                 len(missing), len(lattices))
+        if decode_mbr:
+            results = joblib.Parallel(n_jobs=njobs, backend='threading')(
+                joblib.delayed(_mbr_paths)(lattices, w, symtab, beam)
+                for w in missing)
+            paths = {w: p for w, (p, _) in zip(missing, results)}
+            times.update({w: t for w, (_, t) in zip(missing, results)})
+        else:
+            paths = {w: [] for w in missing}
+            for p, t in joblib.Parallel(n_jobs=njobs)(
+                    joblib.delayed(_best_paths)(lat, missing)
+                    for lat in lattices):
+                for w in missing:
+                    paths[w] += p[w]
+                    times[w] += t[w]
+
+        for weight in missing:
+            with utils.open_utf8(_tra(weight), 'w') as fout:
+                for utt, words in sorted(paths[weight]):
+                    fout.write(u' '.join([utt] + [str(w) for w in words])
+                               + u'\n')
+            if cache:
+                cache.put('{}-{}-{}'.format(base, *weight), _tra(weight))
+
+    # filter the reference text
+    ref_txt = os.path.join(scoring_dir, 'test_filt.txt')
+    _write_filtered(
+        ref_txt,
+        ((line.split()[0], line.split()[1:])
+         for line in utils.open_utf8(ref_text, 'r') if line.strip()),
+        REF_FILTER)
+
+    # score the hypotheses of all the weights in parallel
+    symbols = _read_symbols(symtab)
+
+    def _score(weight):
+        t0 = time.time()
+        hyp_txt = os.path.join(scoring_dir, '{}.{}.txt'.format(*weight))
+        _write_filtered(
+            hyp_txt,
+            ((line.split()[0], [symbols[int(w)] for w in line.split()[1:]])
+             for line in utils.open_utf8(_tra(weight), 'r')),
+            HYP_FILTER)
+
+        report = scorer(ref_txt, hyp_txt)
+        with utils.open_utf8(os.path.join(
+                output_dir, 'wer_{}_{}'.format(*weight)), 'w') as fout:
+            fout.write(report)
+
+        wer = re.search(r'%WER\s+([0-9.]+)', report)
+        return float(wer.group(1)) if wer else None, time.time() - t0
+
+    scores = joblib.Parallel(n_jobs=njobs, backend='threading')(
+        joblib.delayed(_score)(w) for w in weights)
+    results = {w: (wer, times[w], t) for w, (wer, t) in zip(weights, scores)}
+
+    # the timing report
+    log.info('%6s %6s %10s %10s %8s', 'lmwt', 'wip', 'path (s)',
+             'score (s)', '%WER')
+    for weight in weights:
+        wer, path_time, score_time = results[weight]
+        log.info('%6s %6s %10s %10.3f %8s', weight[0], weight[1],
+                 'cached' if weight in cached else '{:.3f}'.format(
+                     path_time), score_time, wer)
+
+    # the best WER, as written by Kaldi utils/best_wer.sh
+    scored = [w for w in weights if results[w][0] is not None]
+    if scored:
+        best = min(scored, key=lambda w: results[w][0])
+        wer_file = os.path.join(output_dir, 'wer_{}_{}'.format(*best))
+        with utils.open_utf8(wer_file, 'r') as fin:
+            wer_line = fin.readline().strip()
+        for directory in (scoring_dir,
+                          os.path.join(output_dir, 'scoring_kaldi')):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with utils.open_utf8(
+                    os.path.join(directory, 'best_wer'), 'w') as fout:
+                fout.write(u'{} {}\n'.format(wer_line, wer_file))
+        log.info('best WER is %s (lmwt %s, wip %s)',
+                 results[best][0], *best)
+
+        if isinstance(scorer, _wer.WerScorer):
+            scorer.write_details(
+                os.path.join(scoring_dir, '{}.{}.txt'.format(*best)),
+                os.path.join(scoring_dir, 'wer_details'))
+
+    if isinstance(scorer, _wer.WerScorer):
+        scorer.save()
+    return results
+
+
+def score(decoder, graph_dir, decode_dir):
+    """Score the lattices decoded in `decode_dir`"""
+    opts = decoder.score_opts
+    if opts['skip-scoring'].value:
+        return
+
+    # convert the lattices to text, once
+    scoring_dir = os.path.join(decode_dir, 'scoring')
+    if not os.path.isdir(scoring_dir):
+        os.makedirs(scoring_dir)
+
+    lattices = {
+        lat: os.path.join(scoring_dir, os.path.basename(lat)[:-3] + '.txt')
+        for lat in glob.glob(os.path.join(decode_dir, 'lat.*.gz'))}
+    if not lattices:
+        raise IOError('no lattices found in {}'.format(decode_dir))
+
+    # the lattices of a time-reversed graph have their words in
+    # reverse order, reverse them back to score them
+    rspecifier = "'ark:gunzip -c {}|'"
+    if decoder.mkgraph_opts['reverse'].value:
+        rspecifier = "'ark:gunzip -c {}| lattice-reverse ark:- ark:- |'"
+
+    decoder.log.info('converting %s lattices to text', len(lattices))
+    joblib.Parallel(n_jobs=decoder.njobs, backend='threading')(
+        joblib.delayed(decoder._run_command)(
+            'lattice-copy --write-compact=true {} ark,t:{}'.format(
+                rspecifier.format(lat), txt), verbose=False)
+        for lat, txt in lattices.items())
+    lattices = sorted(lattices.values(), key=utils.natural_sort_keys)
+
+    try:
+        score_lattices(
+            lattices,
+            os.path.join(graph_dir, 'words.txt'),
+            os.path.join(decoder.recipe_dir, 'data', decoder.name, 'text'),
+            decode_dir,
+            range(opts['min-lmwt'].value, opts['max-lmwt'].value + 1),
+            wips=opts['word-ins-penalty'].value.split(','),
+            decode_mbr=opts['decode-mbr'].value,
+            beam=opts['pruning-beam'].value,
+            scorer=_wer.WerScorer(
+                utt2spk=decoder.corpus.utt2spk,
+                use_cache=decoder.use_cache),
+            njobs=decoder.njobs,
+            use_cache=decoder.use_cache,
+            log=decoder.log)
+    finally:
+        for lat in lattices:
+            utils.remove(lat, safe=True)
@@ -0,0 +1,299 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Word error rate computed in process
+
+The WerScorer replaces the Kaldi compute-wer in the scoring of the
+decoded lattices (see _score.py). The reference text is read once for
+all the hypotheses, the edit distances are computed row by row with
+numpy and the errors of each (reference, hypothesis) pair are kept:
+as most of the hypotheses do not change from an LM weight to the
+next, or from a decoding to the next, only the changed ones are
+rescored. The errors are cached in the abkhazia tmp-directory (see
+abkhazia.utils.cache), keyed by the reference text.
+
+Besides the aggregated WER, in the format of compute-wer, the scorer
+reports the errors by utterance and by speaker.
+
+"""
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import abkhazia.utils as utils
+
+
+Errors = collections.namedtuple(
+    'Errors', 'nwords insertions deletions substitutions')
+"""The errors of a hypothesis against its reference
+
+nwords (int): the number of words in the reference
+
+insertions, deletions, substitutions (int): the number of edits
+  transforming the reference into the hypothesis
+
+"""
+
+
+def sum_errors(errors):
+    """Return the Errors summing the `errors`"""
+    return Errors(*(sum(e) for e in zip(*errors))) if errors \
+        else Errors(0, 0, 0, 0)
+
+
+def nerrors(errors):
+    """Return the total number of edits in `errors`"""
+    return errors.insertions + errors.deletions + errors.substitutions
+
+
+def wer(errors):
+    """Return the word error rate in `errors` (in %)
+
+    As in compute-wer, an empty reference gives a rate of 0 if the
+    hypothesis is empty, else of 100.
+
+    """
+    if not errors.nwords:
+        return 100.0 if nerrors(errors) else 0.0
+    return 100.0 * nerrors(errors) / errors.nwords
+
+
+def edit_distance(ref, hyp):
+    """Return the Errors of the hypothesis `hyp` against `ref`
+
+    `ref` and `hyp` are lists of words. The Levenshtein distance
+    matrix is computed row by row: the substitutions and deletions
+    of a row are vectorized from the previous row, and the
+    insertions by a cumulative minimum along the row. The edits are
+    then counted by backtracking, preferring substitutions then
+    deletions.
+
+    """
+    nref, nhyp = len(ref), len(hyp)
+    if not nref or not nhyp:
+        return Errors(nref, nhyp, nref, 0)
+
+    ref = np.asarray(ref)
+    hyp = np.asarray(hyp)
+    steps = np.arange(nhyp + 1)
+
+    cost = np.empty((nref + 1, nhyp + 1), dtype=np.int64)
+    cost[0] = steps
+    for i in range(1, nref + 1):
+        row = np.empty(nhyp + 1, dtype=np.int64)
+        row[0] = i
+        row[1:] = np.minimum(
+            cost[i - 1, :-1] + (hyp != ref[i - 1]), cost[i - 1, 1:] + 1)
+        # row[j] = min(row[j], row[j-1] + 1) for all j
+        cost[i] = np.minimum.accumulate(row - steps) + steps
+
+    i, j, edits = nref, nhyp, [0, 0, 0]
+    while i or j:
+        if i and j and cost[i, j] == (
+                cost[i - 1, j - 1] + (ref[i - 1] != hyp[j - 1])):
+            edits[2] += int(ref[i - 1] != hyp[j - 1])
+            i, j = i - 1, j - 1
+        elif i and cost[i, j] == cost[i - 1, j] + 1:
+            edits[1] += 1
+            i -= 1
+        else:
+            edits[0] += 1
+            j -= 1
+    return Errors(nref, *edits)
+
+
+def read_text(filename):
+    """Return an ordered dict utt -> list of words from `filename`"""
+    text = collections.OrderedDict()
+    with utils.open_utf8(filename, 'r') as fin:
+        for line in fin:
+            line = line.split()
+            if line:
+                text[line[0]] = line[1:]
+    return text
+
+
+def _pair(ref, hyp):
+    """Return the key of a (reference, hypothesis) pair"""
+    return hashlib.sha1(u'{}\t{}'.format(
+        ' '.join(ref), ' '.join(hyp)).encode('utf8')).hexdigest()
+
+
+class WerScorer(object):
+    """Score hypotheses with the word error rate
+
+    A WerScorer is called as scorer(ref_txt, hyp_txt) and returns the
+    report of compute-wer --mode=present on the text files (the
+    utterances of the reference not in the hypotheses are ignored).
+    The errors by utterance and by speaker of each scored hypotheses
+    file are then available from details() and write_details().
+
+    Parameters:
+    -----------
+
+    utt2spk (dict): utterance -> speaker, if None the errors by
+      speaker are not computed
+
+    use_cache (bool): when True, the errors computed on previous runs
+      with the same reference text are reused, call save() to update
+      the cache
+
+    """
+    def __init__(self, utt2spk=None, use_cache=False):
+        self.utt2spk = utt2spk
+        self.cache = utils.cache.FileCache('wer') if use_cache else None
+
+        # ref_txt -> (text, cache key, errors by pair)
+        self._refs = {}
+        # hyp_txt -> errors by utterance
+        self._details = {}
+        self._lock = threading.Lock()
+
+    def _reference(self, ref_txt):
+        with self._lock:
+            if ref_txt not in self._refs:
+                key = utils.cache.hash_files(ref_txt) + '.json'
+                errors = {}
+                if self.cache:
+                    tmp = tempfile.mkdtemp(dir=self.cache.directory,
+                                           prefix='.tmp')
+                    try:
+                        filename = os.path.join(tmp, key)
+                        if self.cache.get(key, filename):
+                            with open(filename, 'r') as fin:
+                                errors = json.load(fin)
+                    finally:
+                        utils.remove(tmp, safe=True)
+                self._refs[ref_txt] = (read_text(ref_txt), key, errors)
+            return self._refs[ref_txt]
+
+    def score(self, ref_txt, hyp_txt):
+        """Return the Errors of the hypotheses by utterance
+
+        Raise IOError if a hypothesis has no reference.
+
+        """
+        ref, _, cached = self._reference(ref_txt)
+
+        errors = collections.OrderedDict()
+        for utt, hyp in read_text(hyp_txt).items():
+            try:
+                words = ref[utt]
+            except KeyError:
+                raise IOError('{}: no reference for utterance {}'.format(
+                    hyp_txt, utt))
+
+            pair = _pair(words, hyp)
+            if pair in cached:
+                errors[utt] = Errors(len(words), *cached[pair])
+            else:
+                errors[utt] = edit_distance(words, hyp)
+                cached[pair] = errors[utt][1:]
+
+        self._details[hyp_txt] = errors
+        return errors
+
+    def __call__(self, ref_txt, hyp_txt):
+        errors = self.score(ref_txt, hyp_txt)
+        nref = len(self._reference(ref_txt)[0])
+        return report(errors, nref - len(errors))
+
+    def details(self, hyp_txt):
+        """Return the errors of `hyp_txt` by utterance and speaker
+
+        Return two dicts utt -> Errors and spk -> (nutts, Errors),
+        the second is empty if the speakers are unknown.
+
+        """
+        errors = self._details[hyp_txt]
+
+        speakers = collections.defaultdict(list)
+        if self.utt2spk:
+            for utt, err in errors.items():
+                speakers[self.utt2spk[utt]].append(err)
+        return errors, {
+            spk: (len(err), sum_errors(err))
+            for spk, err in sorted(speakers.items())}
+
+    def write_details(self, hyp_txt, directory):
+        """Write the per_utt and per_spk errors of `hyp_txt`
+
+        The files are tables in `directory`, per_spk is written only
+        if the speakers are known.
+
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        utterances, speakers = self.details(hyp_txt)
+
+        with utils.open_utf8(os.path.join(directory, 'per_utt'), 'w') as fout:
+            fout.write(u'{:<30} {:>6} {:>5} {:>5} {:>5} {:>7}\n'.format(
+                'utterance', '#words', 'ins', 'del', 'sub', '%WER'))
+            for utt, err in utterances.items():
+                fout.write(u'{:<30} {:>6} {:>5} {:>5} {:>5} {:>7.2f}\n'
+                           .format(utt, *(err + (wer(err),))))
+
+        if not speakers:
+            return
+
+        with utils.open_utf8(os.path.join(directory, 'per_spk'), 'w') as fout:
+            fout.write(
+                u'{:<20} {:>6} {:>7} {:>5} {:>5} {:>5} {:>7}\n'.format(
+                    'speaker', '#utts', '#words', 'ins', 'del', 'sub',
+                    '%WER'))
+            for spk, (nutts, err) in speakers.items():
+                fout.write(
+                    u'{:<20} {:>6} {:>7} {:>5} {:>5} {:>5} {:>7.2f}\n'
+                    .format(spk, nutts, *(err + (wer(err),))))
+
+    def save(self):
+        """Update the cache with the errors computed so far"""
+        if not self.cache:
+            return
+
+        for _, key, errors in self._refs.values():
+            tmp = tempfile.mkdtemp(dir=self.cache.directory, prefix='.tmp')
+            try:
+                filename = os.path.join(tmp, key)
+                with open(filename, 'w') as fout:
+                    json.dump(errors, fout)
+                self.cache.put(key, filename)
+            finally:
+                utils.remove(tmp, safe=True)
+
+
+def report(errors, missing=0):
+    """Return the compute-wer report of the `errors` by utterance
+
+    `missing` is the number of utterances of the reference without
+    hypothesis.
+
+    """
+    total = sum_errors(list(errors.values()))
+    nwrong = sum(1 for err in errors.values() if nerrors(err))
+    nutts = len(errors)
+    return (
+        u'%WER {:.2f} [ {} / {}, {} ins, {} del, {} sub ]\n'
+        u'%SER {:.2f} [ {} / {} ]\n'
+        u'Scored {} sentences, {} not present in hyp.\n'.format(
+            wer(total), nerrors(total), total.nwords, total.insertions,
+            total.deletions, total.substitutions,
+            100.0 * nwrong / nutts if nutts else 0.0, nwrong, nutts,
+            nutts, missing))
@@ -67,6 +67,10 @@ class Decode(abstract_recipe.AbstractRecipe):
         self.decode_opts = self._decoder.options()
         self.score_opts = _score.options()
 
+        # if True, reuse the decoding graph and best paths computed in
+        # a previous run on the same models (see abkhazia.utils.cache)
+        self.use_cache = True
+
     def check_parameters(self):
         """Raise if the decoding parameters are not correct"""
         super(Decode, self).check_parameters()
@@ -96,6 +100,19 @@ class Decode(abstract_recipe.AbstractRecipe):
         else:
             raise KeyError('Option {} not valid'.format(name))
 
+    def steps(self):
+        return ('mkgraph',
+                'decode-nnet' if self._decoder_type == 'nnet' else 'decode')
+
+    def _apply_step_plan(self, plan):
+        # mkgraph is a single job run with highmem-cmd
+        if plan.step == 'mkgraph':
+            return
+
+        self.njobs = plan.njobs
+        if 'num-threads' in self.decode_opts:
+            self.set_option('num-threads', plan.num_threads)
+
     def create(self):
         super(Decode, self).create()
 
@@ -110,15 +127,22 @@ class Decode(abstract_recipe.AbstractRecipe):
     def run(self):
         """Run the created recipe and decode speech data"""
         # build the full decoding graph
+        self._step = 'mkgraph'
         graph_dir = _mkgraph.mkgraph(self)
+        self._step = self.steps()[1]
 
         # fixing data dir (exclude utterances with no features, usually the
         # utterances shorter than 100ms)
         self._fix_data_dir()
+        self._balance_jobs()
 
         # decode the corpus according to input am type
         self._decoder.decode(self, graph_dir)
 
+        # score the lattices for all the LM weights in a single read
+        _score.score(
+            self, graph_dir, os.path.join(self.recipe_dir, 'decode'))
+
     def export(self):
         """Copy the whole <recipe-dir>/decode to <output-dir>, copy
         <recipe-dir>/graph to <output-dir>/graph
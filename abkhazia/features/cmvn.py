@@ -0,0 +1,79 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""NumPy implementation of the Kaldi compute-cmvn-stats program
+
+The CMVN statistics of a speaker are stored in a 2 x (dim + 1) double
+matrix: the first row is the sum of the features followed by the
+number of frames, the second row is the sum of the squared features
+followed by a zero. The statistics can be accumulated frame by frame
+while the features are streamed, so they do not need a dedicated pass
+over the arks.
+
+"""
+
+import numpy as np
+
+import abkhazia.kaldi.ark as ark
+
+
+class CmvnStats(object):
+    """Accumulates per-speaker CMVN statistics
+
+    Parameters:
+    -----------
+
+    utt2spk (dict): maps utterances to their speaker, if None the
+        statistics are accumulated per utterance, as done by
+        compute-cmvn-stats without the --spk2utt option
+
+    """
+    def __init__(self, utt2spk=None):
+        self.utt2spk = utt2spk
+        self.stats = {}
+
+    def accumulate(self, utt, features):
+        """Add the features of the utterance `utt` to the statistics"""
+        features = np.asarray(features, dtype=np.float64)
+        key = utt if self.utt2spk is None else self.utt2spk[utt]
+
+        if key not in self.stats:
+            self.stats[key] = np.zeros((2, features.shape[1] + 1))
+        stats = self.stats[key]
+        stats[0, :-1] += features.sum(axis=0)
+        stats[1, :-1] += (features ** 2).sum(axis=0)
+        stats[0, -1] += features.shape[0]
+
+    def update(self, other):
+        """Add the statistics accumulated by an `other` CmvnStats"""
+        for key, stats in other.stats.items():
+            if key in self.stats:
+                self.stats[key] += stats
+            else:
+                self.stats[key] = stats.copy()
+
+    def accumulate_scp(self, scp):
+        """Accumulate the statistics of all the features in `scp`"""
+        for utt, features in ark.read_scp(scp):
+            self.accumulate(utt, features)
+
+    def write(self, arkfile, scpfile):
+        """Write the statistics as Kaldi double matrices in an ark/scp
+
+        The entries are sorted by speaker, as required by Kaldi for
+        the scp files.
+
+        """
+        return ark.write_ark(
+            arkfile, sorted(self.stats.items()), scpfile=scpfile, double=True)
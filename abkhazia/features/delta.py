@@ -0,0 +1,99 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""NumPy implementation of the Kaldi add-deltas program
+
+This replicates kaldi/src/feat/feature-functions.cc: the delta
+features of order i are obtained by convolving the features of order
+i-1 with a linear regression filter of half width `window`, the
+first and last frames being replicated at the edges.
+
+"""
+
+import numpy as np
+
+import abkhazia.kaldi.ark as ark
+
+
+def delta_scales(order, window=2):
+    """Return the list of the `order` + 1 delta filters
+
+    The filter of order i is a numpy array of length 2 * i * window
+    + 1, the filter of order 0 is [1.0]
+
+    """
+    scales = [np.ones(1)]
+    normalizer = 2.0 * sum(j * j for j in range(1, window + 1))
+    kernel = np.arange(-window, window + 1) / normalizer
+    for _ in range(order):
+        scales.append(np.convolve(scales[-1], kernel))
+    return scales
+
+
+def compute_deltas(features, order=2, window=2):
+    """Return the features with appended deltas up to `order`
+
+    Parameters:
+    -----------
+
+    features (2D numpy array): input features, one frame per row
+
+    order (int): the maximal order of the deltas
+
+    window (int): the half width of the regression filter, as the
+        --delta-window option of add-deltas
+
+    Return:
+    -------
+
+    A float32 numpy array of shape (nframes, (order + 1) * ndims)
+
+    """
+    features = np.asarray(features, dtype=np.float32)
+    nframes = features.shape[0]
+
+    output = [features]
+    for scale in delta_scales(order, window)[1:]:
+        offset = scale.shape[0] // 2
+        padded = np.pad(features, ((offset, offset), (0, 0)), mode='edge')
+
+        delta = np.zeros(features.shape, dtype=np.float32)
+        for j, s in enumerate(scale.astype(np.float32)):
+            if s != 0:
+                delta += s * padded[j:j + nframes]
+        output.append(delta)
+
+    return np.concatenate(output, axis=1)
+
+
+def scp_add_deltas(scp_in, ark_out, scp_out, order=2, window=2,
+                   cmvn=None):
+    """Compute deltas on the features in `scp_in` in a single pass
+
+    Equivalent to `add-deltas scp:scp_in ark,scp:ark_out,scp_out`,
+    each matrix being read, extended and written once. Return the
+    number of processed utterances.
+
+    If `cmvn` is a features.cmvn.CmvnStats instance, the CMVN
+    statistics of the input features are accumulated in it during
+    the same pass.
+
+    """
+    def _features():
+        for utt, feats in ark.read_scp(scp_in):
+            if cmvn is not None:
+                cmvn.accumulate(utt, feats)
+            yield utt, compute_deltas(feats, order=order, window=window)
+
+    return ark.write_ark(ark_out, _features(), scpfile=scp_out)
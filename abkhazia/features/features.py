@@ -14,12 +14,18 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides the Features class wrapping Kaldi speech feature processors"""
 
+import contextlib
+import heapq
+import itertools
 import os
 import shutil
 import joblib
 
 import abkhazia.utils as utils
 import abkhazia.abstract_recipe as abstract_recipe
+import abkhazia.kaldi.ark as kaldi_ark
+from abkhazia.features.cmvn import CmvnStats
+from abkhazia.features.delta import scp_add_deltas
 
 
 class Features(abstract_recipe.AbstractRecipe):
@@ -27,8 +33,18 @@ class Features(abstract_recipe.AbstractRecipe):
     name = 'features'
 
     @staticmethod
-    def check_features(directory, cmvn=False):
-        """Raise IOError if feats.scp and wavs.scp are not in `directory`"""
+    def check_features(directory, cmvn=False,
+                       deep=False, sample=None, njobs=1):
+        """Raise IOError if feats.scp and wavs.scp are not in `directory`
+
+        If `deep` is True, also read back the features matrices
+        referenced in feats.scp (and cmvn.scp) and raise IOError if
+        any of them is corrupted, have inconsistent dimensions or
+        contains NaN or infinite values. With `sample` specified,
+        only a random sample of `sample` matrices is read, on `njobs`
+        parallel jobs (see kaldi.ark.check_scp).
+
+        """
         scp = ['feats.scp', 'wav.scp']
         if cmvn is True:
             scp.append('cmvn.scp')
@@ -38,6 +54,26 @@ class Features(abstract_recipe.AbstractRecipe):
                     'Invalid features directory, "{}" not found: {}'.format(
                         f, directory))
 
+        if not deep:
+            return
+
+        for f in (s for s in scp if s != 'wav.scp'):
+            check = kaldi_ark.check_scp(
+                os.path.join(directory, f), sample=sample, njobs=njobs)
+            if check.errors:
+                raise IOError(
+                    'Invalid features in {}, {} corrupted entries, '
+                    'first is {}: {}'.format(
+                        f, len(check.errors), *check.errors[0]))
+            if len(check.dims) > 1:
+                raise IOError(
+                    'Invalid features in {}, inconsistent dimensions: {}'
+                    .format(f, ', '.join(str(d) for d in sorted(check.dims))))
+            if check.nnan or check.ninf:
+                raise IOError(
+                    'Invalid features in {}, found {} NaN and {} inf values'
+                    .format(f, check.nnan, check.ninf))
+
     @staticmethod
     def export_features(srcdir, destdir):
         """Copy scp files from `srcdir` to `destdir`
@@ -58,6 +94,7 @@ class Features(abstract_recipe.AbstractRecipe):
 
     def __init__(self, corpus, output_dir,
                  type='mfcc', use_pitch=False, use_cmvn=False, delta_order=0,
+                 delta_backend='kaldi', online_cmvn=False,
                  log=utils.logger.null_logger()):
         super(Features, self).__init__(corpus, output_dir, log=log)
 
@@ -65,6 +102,13 @@ class Features(abstract_recipe.AbstractRecipe):
         self.use_pitch = use_pitch
         self.use_cmvn = use_cmvn
         self.delta_order = delta_order
+        self.delta_backend = delta_backend
+        self.online_cmvn = online_cmvn
+
+        # if not None, read back the exported features and check them
+        # (see check_features), on a random sample of `deep_check`
+        # matrices if not 0
+        self.deep_check = None
 
         # overload a kaldi default parameter
         self.features_options = [('use-energy', 'false')]
@@ -72,6 +116,10 @@ class Features(abstract_recipe.AbstractRecipe):
         if self.type not in ['mfcc', 'plp', 'fbank']:
             raise IOError('unknown feature type "{}"'.format(self.type))
 
+        if self.delta_backend not in ['kaldi', 'numpy']:
+            raise IOError(
+                'unknown delta backend "{}"'.format(self.delta_backend))
+
     def _setup_conf_dir(self):
         """Setup the configurtion files for feature extraction
 
@@ -131,23 +179,65 @@ class Features(abstract_recipe.AbstractRecipe):
         The order of the computed deltas is given by the attribute
         self.delta_order. Raise IOError if self.delta_order == 0
 
+        If self.delta_backend is 'numpy', the deltas are computed in
+        process instead of calling add-deltas (see features.delta).
+
         """
         if self.delta_order <= 0:
             raise IOError(
                 'Cannot compute deltas because order is lower than 1')
-        self.log.info('computing deltas (order %s)', self.delta_order)
+        self.log.info('computing deltas (order %s, %s)',
+                      self.delta_order, self.delta_backend)
 
         inputs = [f for f in utils.list_files_with_extension(
             self.output_dir, '.scp', abspath=True, recursive=False)
                   if 'raw_' in f]
 
         # compute deltas in parallel, one job per scp file
-        joblib.Parallel(n_jobs=self.njobs, verbose=1, backend='threading')(
-            joblib.delayed(_delta_joblib_fnc)(scp, self) for scp in inputs)
+        stats = joblib.Parallel(
+            n_jobs=self.njobs, verbose=1, backend='threading')(
+                joblib.delayed(_delta_joblib_fnc)(scp, self)
+                for scp in inputs)
+
+        if self._fused_cmvn():
+            self._write_cmvn_stats(stats)
+
+    def _fused_cmvn(self):
+        """True if CMVN stats are accumulated while computing deltas"""
+        return (self.use_cmvn and self.online_cmvn and
+                self.delta_order != 0 and self.delta_backend == 'numpy')
+
+    def _write_cmvn_stats(self, stats):
+        """Merge the per-job CmvnStats `stats` and write cmvn.scp"""
+        cmvn = CmvnStats()
+        for s in stats:
+            cmvn.update(s)
+        cmvn.write(os.path.join(self.output_dir, 'cmvn_features.ark'),
+                   os.path.join(self.output_dir, 'cmvn.scp'))
 
     def _compute_cmvn_stats(self):
-        """Wrapper on steps/compute_cmvn_stats.sh"""
+        """Wrapper on steps/compute_cmvn_stats.sh
+
+        If self.online_cmvn is True, the statistics are computed in
+        process instead (see features.cmvn).
+
+        """
         self.log.info('computing CMVN statistics')
+        if self.online_cmvn:
+            inputs = [f for f in utils.list_files_with_extension(
+                self.output_dir, '.scp', abspath=True, recursive=False)
+                      if 'raw_' in f]
+
+            def _accumulate(scp):
+                cmvn = CmvnStats(self.corpus.utt2spk)
+                cmvn.accumulate_scp(scp)
+                return cmvn
+
+            self._write_cmvn_stats(
+                joblib.Parallel(n_jobs=self.njobs, backend='threading')(
+                    joblib.delayed(_accumulate)(scp) for scp in inputs))
+            return
+
         self._run_command(
             'steps/compute_cmvn_stats.sh {0} {1} {2}'.format(
                 os.path.join('data', self.name),
@@ -166,7 +256,9 @@ class Features(abstract_recipe.AbstractRecipe):
     def run(self):
         self._compute_features()
 
-        if self.use_cmvn:
+        # with online CMVN and numpy deltas, the CMVN statistics are
+        # accumulated in the deltas pass
+        if self.use_cmvn and not self._fused_cmvn():
             self._compute_cmvn_stats()
 
         if self.delta_order != 0:
@@ -179,15 +271,22 @@ class Features(abstract_recipe.AbstractRecipe):
         # 'feats.scp', and delete them, sort them in natural order to
         # preserve Kaldi ordering
         inputs = [f for f in utils.list_files_with_extension(
-            self.output_dir, '.scp', abspath=True, recursive=False)
-                  if 'raw_' in f]
-        inputs.sort(key=utils.natural_sort_keys)
-
-        output_scp = os.path.join(self.output_dir, 'feats.scp')
-        with open(output_scp, 'w') as outfile:
-            for infile in inputs:
-                outfile.write(open(infile, 'r').read())
-                utils.remove(infile)
+            self.output_dir, '.scp', abspath=True, recursive=False,
+            natural_sort=True) if 'raw_' in f]
+
+        # the arks are written by Kaldi in output_dir, but make sure
+        # no feats.scp entry refers to an ark outside of it
+        arks = {}
+        for scp in inputs:
+            arks.update(_import_arks(scp, self.output_dir))
+        if arks:
+            self.log.debug('imported %s ark files in %s',
+                           len(arks), self.output_dir)
+
+        merge_scp(inputs, os.path.join(self.output_dir, 'feats.scp'),
+                  arks=arks)
+        for infile in inputs:
+            utils.remove(infile)
 
         # export wav.scp, correct paths to be relative to corpus
         # instead of recipe_dir. TODO Do we really need a reference to
@@ -203,6 +302,95 @@ class Features(abstract_recipe.AbstractRecipe):
                 wav = os.path.join(self.corpus.wav_folder, key)
                 scp.write('{} {}\n'.format(key, wav))
 
+        if self.deep_check is not None:
+            self.log.info('checking the exported features')
+            self.check_features(
+                self.output_dir, cmvn=self.use_cmvn, deep=True,
+                sample=self.deep_check or None, njobs=self.njobs)
+
+
+def _scp_key(line):
+    return line.split(' ', 1)[0]
+
+
+def _scp_bounds(scp):
+    """Return the keys of the first and last lines of `scp`"""
+    with open(scp, 'rb') as fscp:
+        first = fscp.readline()
+
+        # read backward until we got the last complete line
+        size = fscp.seek(0, os.SEEK_END)
+        chunk = 1024
+        while True:
+            fscp.seek(max(0, size - chunk))
+            lines = fscp.read().rstrip(b'\n').split(b'\n')
+            if len(lines) > 1 or chunk >= size:
+                break
+            chunk *= 2
+
+    return _scp_key(first.decode()), _scp_key(lines[-1].decode())
+
+
+def _relocate(lines, arks):
+    """Yield `lines` from a scp with ark paths replaced as in `arks`"""
+    for line in lines:
+        key, path = line.rstrip('\n').split(' ', 1)
+        ark, offset = path.rsplit(':', 1)
+        yield '{} {}:{}\n'.format(key, arks.get(ark, ark), offset)
+
+
+def merge_scp(inputs, output, arks=None):
+    """Merge the sorted scp files `inputs` into a sorted scp `output`
+
+    This is a streaming k-way merge, so the memory usage does not
+    depend on the size of the scp files. When the inputs do not
+    overlap, as for the per-job scp files written by Kaldi, they are
+    simply concatenated in the order of their keys.
+
+    `arks` is an optional dict mapping ark files to new paths, used to
+    rewrite the entries in `output`
+
+    """
+    inputs = [scp for scp in inputs if not utils.is_empty_file(scp)]
+    bounds = sorted((_scp_bounds(scp), scp) for scp in inputs)
+    ordered = all(bounds[i][0][1] < bounds[i+1][0][0]
+                  for i in range(len(bounds) - 1))
+
+    with open(output, 'w') as fout:
+        if ordered and not arks:
+            for _, scp in bounds:
+                with open(scp, 'r') as fin:
+                    shutil.copyfileobj(fin, fout)
+            return
+
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(open(scp, 'r')) for _, scp in bounds]
+            lines = (itertools.chain.from_iterable(files) if ordered
+                     else heapq.merge(*files, key=_scp_key))
+            fout.writelines(_relocate(lines, arks) if arks else lines)
+
+
+def _import_arks(scp, directory):
+    """Hardlink (or move) in `directory` the arks of `scp` outside of it
+
+    Return a dict mapping the original ark files to the imported
+    ones. The ark paths are kept absolute because Kaldi resolves
+    relative paths in scp files from its working directory.
+
+    """
+    arks = {}
+    for ark in kaldi_ark.scp_ark_files(scp):
+        if os.path.dirname(os.path.abspath(ark)) == directory:
+            continue
+
+        dest = os.path.join(directory, os.path.basename(ark))
+        try:
+            os.link(ark, dest)
+        except OSError:  # cross-device link
+            shutil.move(ark, dest)
+        arks[ark] = dest
+    return arks
+
 
 def _delta_joblib_fnc(scp, instance):
     """A tweak to compute deltas inplace and in parallel using joblib
@@ -212,23 +400,46 @@ def _delta_joblib_fnc(scp, instance):
 
     scp is a str or a 1-length tuple containing the scp to compute delta on
 
+    The deltas are written once, in a new ark file next to `scp`. On
+    success `scp` is replaced to index that new ark and the arks of
+    the raw features are removed.
+
+    Return the CmvnStats of the raw features if they are accumulated
+    during the deltas pass, None otherwise.
+
     """
     # filename of the input
     if isinstance(scp, tuple):
         scp = scp[0]
 
-    # temp file for pseudo-inplace operation
+    raw_arks = kaldi_ark.scp_ark_files(scp)
+    delta_ark = os.path.splitext(scp)[0] + '_delta.ark'
+
+    # temp scp for pseudo-inplace operation
     tmp = scp + '_tmp'
 
+    cmvn = (CmvnStats(instance.corpus.utt2spk)
+            if instance._fused_cmvn() else None)
+
     try:
-        # compute deltas to tmp
-        instance._run_command(
-            'add-deltas --delta-order={0} scp:{1} ark:{2}'.format(
-                instance.delta_order, scp, tmp), verbose=False)
-
-        # move tmp to scp
-        instance._run_command(
-            'copy-feats ark:{} ark,scp:{},{}'.format(
-                tmp, scp.replace('.scp', '.ark'), scp), verbose=False)
+        if instance.delta_backend == 'numpy':
+            scp_add_deltas(
+                scp, delta_ark, tmp, order=instance.delta_order, cmvn=cmvn)
+        else:
+            instance._run_command(
+                'add-deltas --delta-order={0} scp:{1} ark,scp:{2},{3}'
+                .format(instance.delta_order, scp, delta_ark, tmp),
+                verbose=False)
+
+        os.replace(tmp, scp)
+    except Exception:
+        utils.remove(delta_ark, safe=True)
+        raise
     finally:
         utils.remove(tmp, safe=True)
+
+    for raw in raw_arks:
+        if raw != delta_ark:
+            utils.remove(raw, safe=True)
+
+    return cmvn
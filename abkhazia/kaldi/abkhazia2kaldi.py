@@ -18,7 +18,7 @@ import os
 import pkg_resources
 import shutil
 
-from abkhazia.utils import config, logger, open_utf8
+from abkhazia.utils import config, jobs, logger, open_utf8
 from abkhazia.corpus.corpus_saver import CorpusSaver
 
 
@@ -190,12 +190,13 @@ class Abkhazia2Kaldi(object):
             os.symlink(origin, target)
 
     @staticmethod
-    def _write_cmd_script(script):
+    def _write_cmd_script(script, max_jobs=None):
         with open(script, 'w') as stream:
             for cmd in ('train', 'decode', 'highmem'):
-                key = '{}-cmd'.format(cmd)
-                value = config.get('kaldi', key)
-                stream.write('export {}={}\n'.format(key, value))
+                value = config.get('kaldi', '{}-cmd'.format(cmd))
+                if max_jobs:
+                    value = jobs.throttle_cmd(value, max_jobs)
+                stream.write('export {}_cmd="{}"\n'.format(cmd, value))
 
     @staticmethod
     def _write_path_script(script):
@@ -204,9 +205,15 @@ class Abkhazia2Kaldi(object):
             'abkhazia/share/path.sh')
         shutil.copy(source, script)
 
-    def setup_machine_specific_scripts(self):
-        """Setup cmd.sh and path.sh in self.recipe_dir"""
-        self._write_cmd_script(os.path.join(self.recipe_dir, 'cmd.sh'))
+    def setup_machine_specific_scripts(self, max_jobs=None):
+        """Setup cmd.sh and path.sh in self.recipe_dir
+
+        If `max_jobs` is specified, the run.pl commands in cmd.sh run
+        at most `max_jobs` jobs at once.
+
+        """
+        self._write_cmd_script(
+            os.path.join(self.recipe_dir, 'cmd.sh'), max_jobs=max_jobs)
         self._write_path_script(os.path.join(self.recipe_dir, 'path.sh'))
 
     def setup_score(self):
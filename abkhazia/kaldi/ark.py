@@ -23,13 +23,20 @@ respectively.
 Provides the dict_to_ark function to write ark files from numpy
 arrays.
 
+Provides the read_scp and write_ark functions to stream features
+matrices from and to binary ark/scp files without calling Kaldi, and
+the check_scp function to detect corrupted features.
+
 """
 
+import collections
 import os
+import random
 import re
 import struct
 import tempfile
 
+import joblib
 import numpy as np
 import h5features as h5f
 import h5py
@@ -65,6 +72,7 @@ def ark_to_dict(arkfile):
 
 def ark_to_h5f(ark_files, h5_file, h5_group='features',
                sample_frequency=100, tstart=0.0125,
+               chunk_size='auto', compression=None, utt2spk=None,
                log=utils.logger.null_logger()):
     """Convert a sequence of kaldi ark files into a single h5features file
 
@@ -87,6 +95,19 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    chunk_size (float): size of the HDF5 chunks in MB, or 'auto' to
+        let h5features choose it. Small chunks make the reading of
+        random utterances faster, large ones the reading of the whole
+        file.
+
+    compression (str or int): None for no compression, 'lzf' for
+        fast compression, 'gzip' or a gzip level in [0, 9] for higher
+        compression ratios
+
+    utt2spk (dict): if specified, write the utterances of each
+        speaker in a distinct group `h5_group`/<speaker>, so the
+        features of a speaker can be loaded at once
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -94,6 +115,8 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
 
     AssertionError if the `h5_group` already exists in the `h5_file`
 
+    IOError if an utterance is not in `utt2spk`
+
     """
     ark_files = list(ark_files)
 
@@ -106,16 +129,36 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
               's' if len(ark_files) else '',
               h5_file, h5_group)
 
-    with h5f.Writer(h5_file) as fout:
+    with h5f.Writer(h5_file, chunk_size=chunk_size,
+                    compression=compression) as fout:
         for ark in ark_files:
             log.debug('converting {}...'.format(os.path.basename(ark)))
-            fout.write(_ark_to_data(
-                ark, sample_frequency=sample_frequency, tstart=tstart),
-                       h5_group, append=True)
+            data = ark_to_dict(ark)
+
+            if utt2spk is None:
+                fout.write(_dict_to_data(
+                    data, sample_frequency=sample_frequency, tstart=tstart),
+                           h5_group, append=True)
+                continue
+
+            speakers = {}
+            for utt, feats in data.items():
+                try:
+                    speakers.setdefault(utt2spk[utt], {})[utt] = feats
+                except KeyError:
+                    raise IOError(
+                        'utterance {} has no speaker'.format(utt))
+
+            for spk, spk_data in sorted(speakers.items()):
+                fout.write(_dict_to_data(
+                    spk_data, sample_frequency=sample_frequency,
+                    tstart=tstart),
+                           h5_group + '/' + spk, append=True)
 
 
 def scp_to_h5f(scp_file, h5_file, h5_group='features',
                sample_frequency=100, tstart=0.0125,
+               chunk_size='auto', compression=None, utt2spk=None,
                log=utils.logger.null_logger()):
     """Convert ark files referenced in `scp_file` into a h5features file
 
@@ -138,6 +181,8 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    chunk_size, compression, utt2spk: see ark_to_h5f
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -148,19 +193,7 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
     IOError if the scp file is badly formatted
 
     """
-    # extract the ark files referenced in the scp
-    ark_files = set()
-    for n, line in enumerate(open(scp_file, 'r').readlines(), 1):
-        matched = re.match('^.* (.*):[0-9]*$', line)
-        if not matched:
-            raise IOError('Bad scp file line {}: {}'.format(n, scp_file))
-        ark_files.add(matched.group(1))
-
-    # sort them in natural order to have f.10.ark > f.9.ark. This is
-    # important to concatenate features in order because some Kaldi
-    # scripts assumes ordered features (with the rspecifier ark,s,cs).
-    ark_files = list(ark_files)
-    ark_files.sort(key=utils.natural_sort_keys)
+    ark_files = scp_ark_files(scp_file)
 
     log.info('writing {} ark files to {} in group {}'.format(
         len(ark_files), os.path.basename(h5_file), h5_group))
@@ -168,7 +201,168 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
     # Then deleguate to ark_to_h5f
     ark_to_h5f(ark_files, h5_file, h5_group,
                sample_frequency=sample_frequency, tstart=tstart,
-               log=log)
+               chunk_size=chunk_size, compression=compression,
+               utt2spk=utt2spk, log=log)
+
+
+def scp_ark_files(scp_file):
+    """Return the ark files referenced in `scp_file`
+
+    The ark files are sorted in natural order to have f.10.ark >
+    f.9.ark. This is important to concatenate features in order
+    because some Kaldi scripts assumes ordered features (with the
+    rspecifier ark,s,cs).
+
+    Raise IOError if the scp file is badly formatted
+
+    """
+    ark_files = set(ark for _, ark, _ in _parse_scp(scp_file))
+    return sorted(ark_files, key=utils.natural_sort_keys)
+
+
+def read_scp(scp_file):
+    """Yield (utt_id, features) pairs from the entries of `scp_file`
+
+    The features are read directly from the binary ark files
+    referenced in the scp, in the order of the scp. Full precision
+    (float and double) and compressed matrices are supported. Each
+    ark file is opened once as long as consecutive entries refer to
+    it.
+
+    Raise IOError if the scp file is badly formatted or if a matrix
+    is not in a supported binary format
+
+    """
+    arkfile, fark = None, None
+    try:
+        for utt, ark, offset in _parse_scp(scp_file):
+            if ark != arkfile:
+                if fark:
+                    fark.close()
+                arkfile, fark = ark, open(ark, 'rb')
+
+            fark.seek(offset)
+            try:
+                yield utt, _read_matrix(fark)
+            except AssertionError as err:
+                raise IOError('{}:{}: {}'.format(ark, offset, err))
+    finally:
+        if fark:
+            fark.close()
+
+
+def write_ark(arkfile, items, scpfile=None, double=False):
+    """Write (utt_id, features) pairs to a binary Kaldi ark file
+
+    This is a streaming writer: `items` can be any iterable (a
+    generator from read_scp for instance) and is consumed only
+    once. The features are written as float matrices, or as double
+    matrices if `double` is True.
+
+    Parameters:
+    -----------
+
+    arkfile (str): path to the ark file to write
+
+    items (iterable): (utt_id, features) pairs, utt_id is a str and
+        features a 2D numpy array
+
+    scpfile (str): if specified, write a scp file indexing the ark,
+        as done by the Kaldi wspecifier 'ark,scp:arkfile,scpfile'
+
+    Return:
+    -------
+
+    The number of matrices written
+
+    """
+    dtype, token = ('<f8', b'DM') if double else ('<f4', b'FM')
+
+    nitems = 0
+    with open(arkfile, 'wb') as fark, \
+            open(scpfile if scpfile else os.devnull, 'w') as fscp:
+        for utt, data in items:
+            data = np.asarray(data, dtype=dtype)
+            fark.write(utt.encode() + b' ')
+            fscp.write('{} {}:{}\n'.format(utt, arkfile, fark.tell()))
+            fark.write(b'\0B' + token + b' \x04' +
+                       struct.pack('<i', data.shape[0]) +
+                       b'\x04' + struct.pack('<i', data.shape[1]))
+            fark.write(data.tobytes())
+            nitems += 1
+    return nitems
+
+
+ScpCheck = collections.namedtuple(
+    'ScpCheck', 'nutts nchecked dims nnan ninf errors')
+"""The result of check_scp
+
+nutts (int): number of entries in the scp file
+
+nchecked (int): number of entries checked
+
+dims (set): the distinct dimensions of the checked features
+
+nnan, ninf (int): total number of NaN and infinite values
+
+errors (list): (utt_id, message) pairs for unreadable entries
+
+"""
+
+
+def check_scp(scp_file, sample=None, njobs=1, seed=None):
+    """Check the features referenced in `scp_file` can be read back
+
+    For each checked entry, verify the ark file exists, a valid binary
+    matrix lies at the offset and ends before the next entry of the
+    same ark, and count the NaN and infinite values in it. The arks
+    are read in parallel, each one sequentially.
+
+    Parameters:
+    -----------
+
+    scp_file (str): the scp file to check
+
+    sample (int): if specified, check only a random sample of
+        `sample` entries instead of the whole scp. The time taken does
+        not depend on the size of the arks anymore.
+
+    njobs (int): number of arks read in parallel
+
+    seed (int): the random seed used for sampling
+
+    Return:
+    -------
+
+    A ScpCheck namedtuple
+
+    Raise:
+    ------
+
+    IOError if the scp file is badly formatted
+
+    """
+    entries = list(_parse_scp(scp_file))
+    nutts = len(entries)
+    if sample is not None and sample < nutts:
+        entries = random.Random(seed).sample(entries, sample)
+
+    arks = collections.defaultdict(list)
+    for utt, ark, offset in entries:
+        arks[ark].append((offset, utt))
+
+    results = joblib.Parallel(n_jobs=njobs, backend='threading')(
+        joblib.delayed(_check_ark)(ark, sorted(utts))
+        for ark, utts in sorted(arks.items()))
+
+    dims, nnan, ninf, errors = set(), 0, 0, []
+    for _dims, _nnan, _ninf, _errors in results:
+        dims.update(_dims)
+        nnan += _nnan
+        ninf += _ninf
+        errors += _errors
+
+    return ScpCheck(nutts, len(entries), dims, nnan, ninf, errors)
 
 
 def dict_to_ark(arkfile, data, format='text'):
@@ -214,10 +408,8 @@ def dict_to_ark(arkfile, data, format='text'):
 #
 
 
-def _ark_to_data(arkfile, sample_frequency=100, tstart=0.0125):
-    """ark to h5features.Data"""
-    d = ark_to_dict(arkfile)
-
+def _dict_to_data(d, sample_frequency=100, tstart=0.0125):
+    """dict of features to h5features.Data"""
     times = [np.arange(val.shape[0], dtype=float) / sample_frequency + tstart
              for val in d.values()]
 
@@ -236,37 +428,138 @@ def _ark_to_dict_binary(arkfile):
     res = {}
     with open(arkfile, 'rb') as fin:
         while True:
-            # TODO break if empty buffer here
             fname = b''
             c = fin.read(1)
             if c == b'':  # EOF (EOFError not raised by read(empty))
                 break
             while c != b' ':
+                assert c != b'', 'unexpected end of file'
                 fname += c
                 c = fin.read(1)
 
-            # end of fname
-            fin.read(1)
+            res[fname.decode()] = _read_matrix(fin)
+    return res
 
-            # data type
-            assert fin.read(4) == 'BFM ', 'type not supported'
 
-            # nrows type
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            nrows = struct.unpack('i', fin.read(4))[0]
+def _parse_scp(scp_file):
+    """Yield (utt_id, ark_file, offset) from the lines of `scp_file`"""
+    with open(scp_file, 'r') as fscp:
+        for n, line in enumerate(fscp, 1):
+            matched = re.match('^(.*) (.*):([0-9]*)$', line.strip())
+            if not matched:
+                raise IOError(
+                    'Bad scp file line {}: {}'.format(n, scp_file))
+            yield (matched.group(1), matched.group(2),
+                   int(matched.group(3) or 0))
 
-            # ncols type:
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            ncols = struct.unpack('i', fin.read(4))[0]
 
-            # data
-            size = nrows * ncols * 4
-            data = np.frombuffer(
-                fin.read(size), dtype=np.float32).reshape((nrows, ncols))
-            res[fname.decode()] = data
-    return res
+def _check_ark(arkfile, entries):
+    """Check the (offset, utt_id) `entries` sorted by offset in `arkfile`
+
+    Return the tuple (dims, nnan, ninf, errors) as aggregated by
+    check_scp
+
+    """
+    dims, nnan, ninf, errors = set(), 0, 0, []
+    if not os.path.isfile(arkfile):
+        return dims, nnan, ninf, [
+            (utt, 'ark file not found: {}'.format(arkfile))
+            for _, utt in entries]
+
+    size = os.path.getsize(arkfile)
+    with open(arkfile, 'rb') as fark:
+        for n, (offset, utt) in enumerate(entries):
+            if offset >= size:
+                errors.append((utt, 'offset {} beyond the end of {}'
+                               .format(offset, arkfile)))
+                continue
+
+            fark.seek(offset)
+            try:
+                data = _read_matrix(fark)
+            except (AssertionError, ValueError, struct.error) as err:
+                errors.append((utt, 'bad matrix at {}:{}: {}'.format(
+                    arkfile, offset, err or 'truncated')))
+                continue
+
+            # the matrix must end before the next entry begins
+            if n + 1 < len(entries) and fark.tell() > entries[n+1][0]:
+                errors.append((utt, 'matrix at {}:{} overlaps the next one'
+                               .format(arkfile, offset)))
+
+            dims.add(data.shape[1] if data.ndim == 2 else 0)
+            nnan += np.count_nonzero(np.isnan(data))
+            ninf += np.count_nonzero(np.isinf(data))
+
+    return dims, nnan, ninf, errors
+
+
+def _read_token(fin):
+    """Read a space terminated token from the binary stream `fin`"""
+    token = b''
+    c = fin.read(1)
+    while c not in (b' ', b''):
+        token += c
+        c = fin.read(1)
+    return token.decode()
+
+
+def _read_int32(fin):
+    assert fin.read(1) == b'\x04', 'type not supported'
+    return struct.unpack('<i', fin.read(4))[0]
+
+
+def _read_matrix(fin):
+    """Read a binary Kaldi matrix starting at the current position of `fin`
+
+    Support float (FM), double (DM) and compressed (CM, CM2, CM3)
+    matrices, return a 2D numpy array of float32 (or float64 for DM)
+
+    Raise AssertionError if the matrix type is not supported
+
+    """
+    assert fin.read(2) == b'\0B', 'binary mode expected'
+    token = _read_token(fin)
+
+    if token in ('FM', 'DM'):
+        nrows = _read_int32(fin)
+        ncols = _read_int32(fin)
+        dtype = np.dtype('<f4' if token == 'FM' else '<f8')
+        size = nrows * ncols * dtype.itemsize
+        return np.frombuffer(
+            fin.read(size), dtype=dtype).reshape((nrows, ncols))
+
+    assert token in ('CM', 'CM2', 'CM3'), 'type not supported'
+    vmin, vrange, nrows, ncols = struct.unpack('<ffii', fin.read(16))
+
+    # see kaldi/src/matrix/compressed-matrix.cc for details on the
+    # format, computations are made in float32 as in Kaldi
+    vmin, vrange = np.float32(vmin), np.float32(vrange)
+    if token == 'CM2':
+        data = np.frombuffer(fin.read(2 * nrows * ncols), dtype='<u2')
+        return (vmin + vrange * np.float32(1 / 65535.) *
+                data.astype(np.float32)).reshape((nrows, ncols))
+
+    if token == 'CM3':
+        data = np.frombuffer(fin.read(nrows * ncols), dtype=np.uint8)
+        return (vmin + vrange * np.float32(1 / 255.) *
+                data.astype(np.float32)).reshape((nrows, ncols))
+
+    # CM: per column quantiles followed by columns of bytes
+    quantiles = vmin + vrange * np.float32(1 / 65535.) * np.frombuffer(
+        fin.read(8 * ncols), dtype='<u2').astype(np.float32).reshape(
+            (ncols, 4, 1))
+    p0, p25, p75, p100 = (quantiles[:, i] for i in range(4))
+    data = np.frombuffer(fin.read(nrows * ncols), dtype=np.uint8).reshape(
+        (ncols, nrows)).astype(np.float32)
+
+    return np.where(
+        data <= 64,
+        p0 + (p25 - p0) * data * np.float32(1 / 64.),
+        np.where(
+            data <= 192,
+            p25 + (p75 - p25) * (data - 64) * np.float32(1 / 128.),
+            p75 + (p100 - p75) * (data - 192) * np.float32(1 / 63.))).T
 
 
 def _ark_to_dict_binary_bytext(arkfile):
@@ -0,0 +1,230 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Plan the parallelism of Kaldi recipes steps on the local machine
+
+The recipes steps have very different profiles: features extraction
+or GMM training run many small single threaded jobs, nnet2 training
+runs a few heavy multithreaded jobs and mkgraph is a single process
+needing a lot of memory. The plan function chooses, for each step,
+the number of jobs, the number of threads per job and the nnet
+minibatch size from the number of cores and the available memory of
+the machine.
+
+The memory needed by a job is read from a rusage history file when
+the step has already been run (see the History class), else a
+default estimate from PROFILES is used.
+
+"""
+
+import collections
+import json
+import multiprocessing
+import os
+
+
+Machine = collections.namedtuple('Machine', 'ncores memory')
+"""A machine description: number of cores and available memory (MB)"""
+
+
+StepProfile = collections.namedtuple(
+    'StepProfile', 'memory max_jobs max_threads')
+"""The resources profile of a recipe step
+
+memory (int): default estimate of the memory used by a job (MB)
+
+max_jobs (int): maximal number of jobs, None for no limit
+
+max_threads (int): maximal number of threads per job
+
+"""
+
+
+StepPlan = collections.namedtuple(
+    'StepPlan', 'step njobs num_threads minibatch_size memory source')
+"""The planned execution of a recipe step
+
+step (str): the name of the step
+
+njobs (int): the number of parallel jobs
+
+num_threads (int): the number of threads per job
+
+minibatch_size (int): the nnet minibatch size, None if irrelevant
+
+memory (int): the memory used by a job (MB)
+
+source (str): where `memory` comes from, 'history' or 'default'
+
+"""
+
+
+PROFILES = {
+    'features': StepProfile(memory=200, max_jobs=None, max_threads=1),
+    'language': StepProfile(memory=2000, max_jobs=1, max_threads=1),
+    'acoustic': StepProfile(memory=500, max_jobs=None, max_threads=1),
+    'align': StepProfile(memory=500, max_jobs=None, max_threads=1),
+    'mkgraph': StepProfile(memory=4000, max_jobs=1, max_threads=1),
+    'decode': StepProfile(memory=1000, max_jobs=None, max_threads=1),
+    'decode-nnet': StepProfile(memory=1000, max_jobs=None, max_threads=4),
+    # nnet2 jobs are averaged after each iteration, so prefer a few
+    # multithreaded jobs over many single threaded ones
+    'nnet': StepProfile(memory=2000, max_jobs=4, max_threads=16)}
+"""Default profiles of the recipes steps"""
+
+
+# margin applied on the memory peaks read from history
+_MEMORY_MARGIN = 1.2
+
+
+def local_machine():
+    """Return the Machine description of the local host
+
+    The number of cores is the one available to the current process
+    and the memory is MemAvailable from /proc/meminfo, or the total
+    physical memory if /proc/meminfo is not readable.
+
+    """
+    try:
+        ncores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        ncores = multiprocessing.cpu_count()
+
+    try:
+        with open('/proc/meminfo', 'r') as fin:
+            meminfo = dict(line.split(':', 1) for line in fin)
+        memory = int(meminfo['MemAvailable'].split()[0]) // 1024
+    except (IOError, KeyError):
+        memory = (os.sysconf('SC_PAGE_SIZE')
+                  * os.sysconf('SC_PHYS_PAGES') // 1024**2)
+
+    return Machine(ncores=ncores, memory=memory)
+
+
+class History(object):
+    """Peak memory of the recipes steps, saved as a JSON file
+
+    Each step is mapped to the peak resident memory (MB) of its last
+    `size` runs. The file is created by save() if it does not exist.
+
+    """
+    def __init__(self, filename, size=5):
+        self.filename = os.path.abspath(filename)
+        self.size = size
+
+        self.peaks = {}
+        if os.path.isfile(self.filename):
+            with open(self.filename, 'r') as fin:
+                self.peaks = json.load(fin)
+
+    def peak(self, step):
+        """Return the peak memory of `step` (MB), None if unknown"""
+        peaks = self.peaks.get(step)
+        return max(peaks) if peaks else None
+
+    def record(self, step, memory):
+        """Append the peak `memory` (MB) of a run of `step`"""
+        self.peaks[step] = (
+            self.peaks.get(step, []) + [int(memory)])[-self.size:]
+
+    def save(self):
+        """Write the history to its file"""
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(self.filename, 'w') as fout:
+            json.dump(self.peaks, fout, indent=2, sort_keys=True)
+
+
+def plan_step(step, machine, nspeakers=None, history=None):
+    """Return the StepPlan of `step` on `machine`
+
+    Parameters:
+    -----------
+
+    step (str): the name of the step, must be a key of PROFILES
+
+    machine (Machine): the machine on which to run the step
+
+    nspeakers (int): the number of speakers in the corpus, as Kaldi
+        does not support more jobs than speakers
+
+    history (History): peak memory of previous runs, if None or if
+        `step` is not in history, use the PROFILES default
+
+    Raise:
+    ------
+
+    IOError if `step` is unknown
+
+    """
+    try:
+        profile = PROFILES[step]
+    except KeyError:
+        raise IOError('unknown step "{}", choose in {}'.format(
+            step, ', '.join(sorted(PROFILES))))
+
+    peak = history.peak(step) if history else None
+    if peak is None:
+        memory, source = profile.memory, 'default'
+    else:
+        memory, source = int(peak * _MEMORY_MARGIN), 'history'
+
+    # first saturate the cores with jobs, as far as the memory allows
+    njobs = min(machine.ncores, max(1, machine.memory // max(1, memory)))
+    for limit in (profile.max_jobs, nspeakers):
+        if limit:
+            njobs = min(njobs, limit)
+
+    # then give the remaining cores to the jobs as threads
+    num_threads = max(1, min(profile.max_threads, machine.ncores // njobs))
+
+    # hogwild training is unstable with large minibatches, Kaldi
+    # recommends 128 with several threads and 512 otherwise
+    minibatch_size = None
+    if step == 'nnet':
+        minibatch_size = 128 if num_threads > 1 else 512
+
+    return StepPlan(step, njobs, num_threads, minibatch_size, memory, source)
+
+
+def plan(steps, machine=None, nspeakers=None, history=None):
+    """Return the list of StepPlan of `steps` on `machine`
+
+    If `machine` is None, plan for the local_machine(). See
+    plan_step for the other parameters.
+
+    """
+    if machine is None:
+        machine = local_machine()
+    return [plan_step(s, machine, nspeakers=nspeakers, history=history)
+            for s in steps]
+
+
+def format_plan(plans, machine=None):
+    """Return a human readable table of the StepPlan in `plans`"""
+    lines = []
+    if machine is not None:
+        lines.append('machine: {} cores, {} MB available'.format(
+            machine.ncores, machine.memory))
+
+    lines.append('{:<12} {:>5} {:>8} {:>10} {:>12}'.format(
+        'step', 'njobs', 'threads', 'minibatch', 'memory/job'))
+    for p in plans:
+        lines.append('{:<12} {:>5} {:>8} {:>10} {:>9} MB ({})'.format(
+            p.step, p.njobs, p.num_threads,
+            '-' if p.minibatch_size is None else p.minibatch_size,
+            p.memory, p.source))
+    return '\n'.join(lines)
@@ -0,0 +1,230 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Split a Kaldi data directory in jobs of balanced durations
+
+The Kaldi script utils/split_data.sh assigns contiguous speakers to
+jobs so that each job has about the same number of utterances. On
+corpora with very unequal speaker durations, some jobs last much
+longer than the others. The split_data function here assigns the
+speakers to jobs by balancing their total duration instead, and
+writes the data/<name>/split<njobs> directories in the Kaldi format.
+
+The Kaldi steps split their data only if it is not already split
+more recently than the features, as in steps/train_mono.sh:
+
+    [[ -d $sdata && $data/feats.scp -ot $sdata ]] || \
+        split_data.sh $data $nj
+
+so split_data marks the split directory as newer than feats.scp and
+the steps use the balanced split. Calling utils/split_data.sh
+directly may split again, depending on the Kaldi version, check
+is_split() before.
+
+"""
+
+import heapq
+import os
+
+import abkhazia.utils as utils
+
+
+# data files indexed by utterance, speaker and recording (or utterance
+# if there is no segments file), as in utils/split_data.sh
+_UTT_FILES = ('utt2spk', 'feats.scp', 'text', 'segments', 'utt2dur',
+              'utt2lang', 'utt2num_frames', 'vad.scp')
+
+_SPK_FILES = ('spk2utt', 'cmvn.scp', 'spk2gender', 'spk2warp')
+
+_RECO_FILES = ('wav.scp', 'reco2file_and_channel')
+
+
+def _read_index(filename, column=1):
+    """Return a dict first field -> `column` field of `filename`"""
+    with utils.open_utf8(filename, 'r') as fin:
+        return {line.split()[0]: line.split()[column]
+                for line in fin if line.strip()}
+
+
+def read_utt2dur(data_dir, corpus=None):
+    """Return a dict of utterances mapped to their duration in seconds
+
+    The durations are read from the utt2dur file in `data_dir` if it
+    exists, else from the segments file. If there is no segments file,
+    they are read from `corpus` and cached in `data_dir`/utt2dur.
+
+    Raise IOError if no durations are available
+
+    """
+    utt2dur = os.path.join(data_dir, 'utt2dur')
+    if os.path.isfile(utt2dur):
+        return {k: float(v) for k, v in _read_index(utt2dur).items()}
+
+    segments = os.path.join(data_dir, 'segments')
+    if os.path.isfile(segments):
+        with utils.open_utf8(segments, 'r') as fin:
+            return {line.split()[0]:
+                    float(line.split()[3]) - float(line.split()[2])
+                    for line in fin if line.strip()}
+
+    if corpus is None:
+        raise IOError(
+            'no utt2dur nor segments files in {}'.format(data_dir))
+
+    durations = corpus.utt2duration()
+    with utils.open_utf8(utt2dur, 'w') as fout:
+        for utt, dur in sorted(durations.items()):
+            fout.write(u'{} {}\n'.format(utt, dur))
+    return durations
+
+
+def partition(durations, njobs):
+    """Assign the keys of `durations` to `njobs` of balanced durations
+
+    Greedy longest processing time first: the keys are considered by
+    decreasing duration and each one is assigned to the least loaded
+    job. The total duration of the longest job is at most 4/3 of the
+    optimal one.
+
+    Return a list of `njobs` sorted lists of keys
+
+    """
+    jobs = [[] for _ in range(njobs)]
+    loads = [(0.0, n) for n in range(njobs)]
+    for key, dur in sorted(durations.items(), key=lambda x: (-x[1], x[0])):
+        load, n = heapq.heappop(loads)
+        jobs[n].append(key)
+        heapq.heappush(loads, (load + dur, n))
+    return [sorted(job) for job in jobs]
+
+
+def kaldi_partition(counts, njobs):
+    """Assign the keys of `counts` to `njobs` as Kaldi does
+
+    This approximates utils/split_scp.pl --utt2spk: the sorted keys
+    are assigned to contiguous jobs of about the same total count.
+
+    Return a list of `njobs` sorted lists of keys
+
+    """
+    total = float(sum(counts.values()))
+    jobs = [[] for _ in range(njobs)]
+    cumul = 0
+    for key in sorted(counts):
+        n = min(njobs - 1, int(njobs * (cumul + counts[key] / 2.) / total))
+        jobs[n].append(key)
+        cumul += counts[key]
+    return jobs
+
+
+def imbalance(durations, jobs):
+    """Return the ratio between the longest and the mean job durations"""
+    loads = [sum(durations[k] for k in job) for job in jobs]
+    mean = sum(loads) / len(loads)
+    return max(loads) / mean if mean else 1.0
+
+
+def is_split(data_dir, njobs):
+    """Return True if the Kaldi steps reuse `data_dir`/split`njobs`
+
+    This is the test of the steps: the split directory exists and
+    feats.scp is older than it.
+
+    """
+    split_dir = os.path.join(data_dir, 'split{}'.format(njobs))
+    feats = os.path.join(data_dir, 'feats.scp')
+    return os.path.isdir(split_dir) and os.path.isfile(feats) and (
+        os.stat(feats).st_mtime_ns < os.stat(split_dir).st_mtime_ns)
+
+
+def split_data(data_dir, njobs, utt2dur=None,
+               log=utils.logger.null_logger()):
+    """Write `data_dir`/split`njobs` with jobs of balanced durations
+
+    Parameters:
+    -----------
+
+    data_dir (str): the Kaldi data directory to split, must contain
+        at least the utt2spk and spk2utt files
+
+    njobs (int): the number of jobs, must not be greater than the
+        number of speakers
+
+    utt2dur (dict): utterances durations, read with read_utt2dur if
+        not specified
+
+    log (logging.Logger): where to send the imbalance ratios
+
+    Return:
+    -------
+
+    The imbalance ratios (see the imbalance function) of the Kaldi
+    split and of the balanced one
+
+    Raise:
+    ------
+
+    IOError if `njobs` is greater than the number of speakers
+
+    """
+    if utt2dur is None:
+        utt2dur = read_utt2dur(data_dir)
+
+    utt2spk = _read_index(os.path.join(data_dir, 'utt2spk'))
+    spk2dur, spk2count = {}, {}
+    for utt, spk in utt2spk.items():
+        spk2dur[spk] = spk2dur.get(spk, 0) + utt2dur.get(utt, 0)
+        spk2count[spk] = spk2count.get(spk, 0) + 1
+
+    if njobs > len(spk2dur):
+        raise IOError('cannot split {} speakers in {} jobs'.format(
+            len(spk2dur), njobs))
+
+    jobs = partition(spk2dur, njobs)
+    ratios = (imbalance(spk2dur, kaldi_partition(spk2count, njobs)),
+              imbalance(spk2dur, jobs))
+    log.info('job durations imbalance (max/mean): %.2f for Kaldi split, '
+             '%.2f for balanced split', *ratios)
+
+    segments = os.path.join(data_dir, 'segments')
+    utt2reco = (_read_index(segments) if os.path.isfile(segments)
+                else {utt: utt for utt in utt2spk})
+
+    for n, job in enumerate(jobs, 1):
+        spks = set(job)
+        utts = set(u for u, s in utt2spk.items() if s in spks)
+        keys = dict(
+            [(f, utts) for f in _UTT_FILES] +
+            [(f, spks) for f in _SPK_FILES] +
+            [(f, set(utt2reco[u] for u in utts)) for f in _RECO_FILES])
+
+        job_dir = os.path.join(data_dir, 'split{}'.format(njobs), str(n))
+        if not os.path.isdir(job_dir):
+            os.makedirs(job_dir)
+
+        for name, selected in keys.items():
+            source = os.path.join(data_dir, name)
+            if not os.path.isfile(source):
+                continue
+
+            with utils.open_utf8(source, 'r') as fin, \
+                    utils.open_utf8(os.path.join(job_dir, name), 'w') as fout:
+                for line in fin:
+                    if line.split(None, 1)[0] in selected:
+                        fout.write(line)
+
+    # the split directory of a previous run is older than the data
+    # files, mark it as newer so that the steps do not split again
+    os.utime(os.path.join(data_dir, 'split{}'.format(njobs)))
+    return ratios
@@ -26,11 +26,16 @@ https://github.com/sfischer13/python-arpa.
 import gzip
 import os
 import re
-import shutil
-import tempfile
+
+import joblib
+
 import abkhazia.utils as utils
 
 
+CHUNK_SIZE = 2**22
+"""Size of the text chunks compressed in parallel by ARPALanguageModel.save"""
+
+
 class ARPALanguageModel(object):
     def __init__(self, ngrams):
         """Build a LM from raw data
@@ -46,75 +51,135 @@ class ARPALanguageModel(object):
 
     @classmethod
     def load(cls, path):
-        """Load an ARPA language model from the file `path`"""
+        """Load an ARPA language model from the file `path`
+
+        The file is decompressed on the fly if `path` ends with '.gz'
+
+        """
         assert os.path.isfile(path)
 
         data = {}
         order = None
-        for line in (l.strip() for l in utils.open_utf8(path, 'r') if l):
-            if line.startswith('\\data\\'):
-                order = 0
-            elif line.startswith('\\end\\'):
-                break
-            elif line.startswith('\\') and line.endswith(':'):
-                order = int(re.search('[0-9]+', line).group(0))
-                if order not in data:
-                    data[order] = {}
-            elif line:
-                if order == 0:  # still in \data\ section
-                    pass
-                elif order > 0:
-                    line = line.split('\t')
-                    prob = float(line[0])
-                    ngram = tuple(line[1].split())
-                    backoff = None if len(line) <= 2 else float(line[2])
-                    data[order][ngram] = (prob, backoff)
-                else:
-                    raise IOError(
-                        'unable to parse ARPA file line: {}'.format(line))
+        with (gzip.open(path, 'rt', encoding='utf8')
+              if path.endswith('.gz') else utils.open_utf8(path, 'r')) as fin:
+            for line in (l.strip() for l in fin if l):
+                if line.startswith('\\data\\'):
+                    order = 0
+                elif line.startswith('\\end\\'):
+                    break
+                elif line.startswith('\\') and line.endswith(':'):
+                    order = int(re.search('[0-9]+', line).group(0))
+                    if order not in data:
+                        data[order] = {}
+                elif line:
+                    if order == 0:  # still in \data\ section
+                        pass
+                    elif order > 0:
+                        line = line.split('\t')
+                        prob = float(line[0])
+                        ngram = tuple(line[1].split())
+                        backoff = None if len(line) <= 2 else float(line[2])
+                        data[order][ngram] = (prob, backoff)
+                    else:
+                        raise IOError(
+                            'unable to parse ARPA file line: {}'.format(line))
         return cls(data)
 
-    def save(self, path, compress=False):
+    def save(self, path, compress=False, compresslevel=6, njobs=1):
         """Save a language model to `path` in the ARPA format
 
-        Do not write empty ngrams to the `path`. If `compress` is True, save to
-        a gzipped file.
+        Do not write empty ngrams to the `path`. If `compress` is True,
+        save to a gzipped file, compressed on the fly with the given
+        `compresslevel` (from 1, fast, to 9, best compression). If
+        `njobs` > 1, the text is compressed by chunks in parallel, each
+        chunk being a member of the gzip file (this is a valid gzip
+        file, read by gunzip and load as any other).
 
         """
         if not compress:
-            self._save_text(path)
+            with utils.open_utf8(path, 'w') as fp:
+                fp.writelines(self._lines())
+        elif njobs == 1:
+            with gzip.open(path, 'wt', encoding='utf8',
+                           compresslevel=compresslevel) as fp:
+                fp.writelines(self._lines())
         else:
-            with tempfile.NamedTemporaryFile() as tmp:
-                self._save_text(tmp.name)
-                with gzip.open(path, 'wb') as f_out:
-                    shutil.copyfileobj(tmp, f_out)
-
-    def _save_text(self, path):
-        with utils.open_utf8(path, 'w') as fp:
-            # write header
-            fp.write('\n\\data\\\n')
-            for order in range(1, self.order+1):
-                size = len(self.ngrams[order])
-                if size:
-                    fp.write('ngram {}={}\n'.format(order, size))
-            fp.write('\n')
-
-            # write ngrams
-            for order in range(1, self.order+1):
-                if len(self.ngrams[order]):
-                    fp.write('\\{}-grams:\n'.format(order))
-                    for k, v in sorted(self.ngrams[order].items()):
-                        ngram = ' '.join(k)
-                        if v[1] is None:  # no backoff
-                            fp.write(u'{}\t{}\n'.format(v[0], ngram))
-                        else:
-                            fp.write(u'{}\t{}\t{}\n'.format(v[0], ngram, v[1]))
-                    fp.write('\n')
-            fp.write('\\end\\\n')
-
-    def prune_vocabulary(self, words):
-        """Remove any ngram entry containing a word not in `words`"""
-        for ngram in self.ngrams.values():
+            with open(path, 'wb') as fp:
+                # compress a batch of chunks at once, keeping a bounded
+                # amount of text in memory (zlib releases the GIL)
+                with joblib.Parallel(
+                        n_jobs=njobs, backend='threading') as parallel:
+                    for batch in _batches(self._chunks(), 2 * njobs):
+                        fp.writelines(parallel(
+                            joblib.delayed(gzip.compress)(
+                                chunk.encode('utf8'), compresslevel)
+                            for chunk in batch))
+
+    def _lines(self):
+        """Yield the lines of the model in ARPA format"""
+        # write header
+        yield '\n\\data\\\n'
+        for order in range(1, self.order+1):
+            size = len(self.ngrams[order])
+            if size:
+                yield 'ngram {}={}\n'.format(order, size)
+        yield '\n'
+
+        # write ngrams
+        for order in range(1, self.order+1):
+            if len(self.ngrams[order]):
+                yield '\\{}-grams:\n'.format(order)
+                for k, v in sorted(self.ngrams[order].items()):
+                    ngram = ' '.join(k)
+                    if v[1] is None:  # no backoff
+                        yield u'{}\t{}\n'.format(v[0], ngram)
+                    else:
+                        yield u'{}\t{}\t{}\n'.format(v[0], ngram, v[1])
+                yield '\n'
+        yield '\\end\\\n'
+
+    def _chunks(self):
+        """Yield the model in ARPA format by chunks of CHUNK_SIZE chars"""
+        chunk, length = [], 0
+        for line in self._lines():
+            chunk.append(line)
+            length += len(line)
+            if length >= CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk, length = [], 0
+        if chunk:
+            yield ''.join(chunk)
+
+    def prune_vocabulary(self, words, misplaced_markers=False):
+        """Remove any ngram entry containing a word not in `words`
+
+        If `misplaced_markers` is True, remove as well the entries
+        where <s> is not the first word or </s> not the last one
+        (such as '<s> <s>' or '</s> <s>'). They cause determinization
+        failures of CLG (ends up being epsilon cycles). The entries are
+        removed in a single pass over the model.
+
+        """
+        for order, ngram in self.ngrams.items():
+            markers = misplaced_markers and order > 1
             for entry in list(ngram.keys()):
-                if not all(word in words for word in entry):
+                if not all(word in words for word in entry) or (
+                        markers and ('<s>' in entry[1:] or
+                                     '</s>' in entry[:-1])):
                     del ngram[entry]
+
+    def vocabulary(self):
+        """Return the set of words in the unigrams of the model"""
+        return set(entry[0] for entry in self.ngrams.get(1, {}))
+
+
+def _batches(iterable, size):
+    """Yield lists of `size` successive elements of `iterable`"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,401 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Compact ARPA language models stored in numpy arrays
+
+The CompactLanguageModel stores the n-grams of each order as arrays
+(the word, the row of the context in the previous order, the log10
+probability and backoff weight), sorted by context and word. This
+takes a fraction of the memory of the tuples used by
+abkhazia.language.arpa.ARPALanguageModel, and the backoff weights are
+computed with vectorized operations.
+
+It replaces the SRILM call 'ngram -renorm -prune-lowprobs' used to
+restrict the vocabulary of a language model:
+
+>>> lm = CompactLanguageModel.load('G.arpa.gz')
+>>> lm.restrict_vocabulary(words)
+>>> lm.prune_lowprobs()
+>>> lm.save('G.pruned.arpa')
+
+The backoff weights are computed as in SRILM (see Ngram::computeBOW in
+the SRILM sources), including its handling of degenerate contexts.
+
+"""
+
+import array
+import gzip
+
+import numpy as np
+
+import abkhazia.utils as utils
+
+
+BOS, EOS = '<s>', '</s>'
+
+PROB_EPSILON = 3e-6
+"""Rounding tolerance on probabilities, as Prob_Epsilon in SRILM"""
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf8')
+    return utils.open_utf8(path, mode)
+
+
+class CompactLanguageModel(object):
+    """An ARPA n-gram language model stored in numpy arrays
+
+    vocab (list): the words of the model, their index is their id
+
+    word, ctx, prob, bow (dict): map an order n to arrays of the
+        n-grams of that order: the id of their last word, the row of
+        their context (the n-1 first words) in the order n-1 (0 for
+        unigrams), their log10 probability and backoff weight. The
+        rows are sorted by (ctx, word).
+
+    """
+    def __init__(self, vocab, word, ctx, prob, bow):
+        self.vocab = vocab
+        self.word = word
+        self.ctx = ctx
+        self.prob = prob
+        self.bow = bow
+        self.order = len(word)
+        self._keys_cache = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load an ARPA language model, gzipped if `path` ends with .gz"""
+        vocab, index = [], {}
+        columns, probs, bows = {}, {}, {}
+        order = None
+        with _open(path, 'r') as fin:
+            for line in fin:
+                fields = line.split()
+                if not fields:
+                    continue
+                if fields[0][0] == '\\':
+                    if fields[0] == '\\end\\':
+                        break
+                    if fields[0].endswith('-grams:'):
+                        order = int(fields[0][1:fields[0].index('-')])
+                        columns[order] = array.array('l')
+                        probs[order] = array.array('d')
+                        bows[order] = array.array('d')
+                        cols, prob, bow = (
+                            columns[order], probs[order], bows[order])
+                    continue
+                if order is None:  # still in the \data\ section
+                    continue
+
+                nfields = len(fields)
+                if nfields != order + 1 and nfields != order + 2:
+                    raise IOError(
+                        'unable to parse ARPA file line: {}'.format(line))
+                if order == 1:
+                    index[fields[1]] = len(vocab)
+                    vocab.append(fields[1])
+                try:
+                    cols.extend(map(index.__getitem__, fields[1:order + 1]))
+                except KeyError as err:
+                    raise IOError(
+                        'word {} is not in unigrams: {}'.format(err, line))
+                prob.append(float(fields[0]))
+                bow.append(float(fields[-1]) if nfields == order + 2 else 0)
+
+        lm = cls(vocab, {}, {}, {}, {})
+        for n in sorted(columns):
+            cols = np.array(columns[n], dtype=np.int64).reshape(-1, n)
+            ctx = lm._lookup(cols[:, :-1]) if n > 1 else np.zeros(
+                len(cols), dtype=np.int64)
+            if (ctx < 0).any():
+                # the missing contexts are inserted, as in SRILM
+                lm._insert_contexts(np.unique(cols[ctx < 0, :-1], axis=0))
+                ctx = lm._lookup(cols[:, :-1])
+
+            rows = np.lexsort((cols[:, -1], ctx))
+            lm.word[n] = cols[rows, -1].astype(np.int32)
+            lm.ctx[n] = ctx[rows]
+            lm.prob[n] = np.frombuffer(probs[n])[rows]
+            lm.bow[n] = np.frombuffer(bows[n])[rows]
+            lm.order = n
+
+        # the inserted contexts get their backoff probability
+        for n in range(2, lm.order + 1):
+            missing = np.isnan(lm.prob[n])
+            if missing.any():
+                cols = lm.columns(n)[missing]
+                lm.prob[n][missing] = (
+                    lm.bow[n - 1][lm.ctx[n][missing]] +
+                    lm.logprob(cols[:, 1:-1], cols[:, -1]))
+        return lm
+
+    def _insert_contexts(self, cols):
+        """Insert the n-grams `cols` (as word ids) in the model
+
+        `cols` is an array of shape (m, n) of n-grams absent from the
+        model. They are inserted with a NaN probability and a null
+        backoff weight, as are their own missing contexts. This
+        mimics SRILM when an ARPA file misses the context of an
+        n-gram, the probabilities are then set by load().
+
+        """
+        n = cols.shape[1]
+        ctx = self._lookup(cols[:, :-1])
+        if (ctx < 0).any():
+            self._insert_contexts(np.unique(cols[ctx < 0, :-1], axis=0))
+            ctx = self._lookup(cols[:, :-1])
+
+        size = self.size(n)
+        word = np.concatenate((self.word[n], cols[:, -1].astype(np.int32)))
+        ctx = np.concatenate((self.ctx[n], ctx))
+        rows = np.lexsort((word, ctx))
+        self.word[n] = word[rows]
+        self.ctx[n] = ctx[rows]
+        self.prob[n] = np.concatenate(
+            (self.prob[n], np.full(len(cols), np.nan)))[rows]
+        self.bow[n] = np.concatenate(
+            (self.bow[n], np.zeros(len(cols))))[rows]
+        self._keys_cache = {}
+
+        # the former rows keep their order, the contexts of the next
+        # order are remapped and stay sorted
+        if n + 1 in self.ctx:
+            position = np.empty(len(rows), dtype=np.int64)
+            position[rows] = np.arange(len(rows))
+            self.ctx[n + 1] = position[:size][self.ctx[n + 1]]
+
+    def save(self, path):
+        """Write the model to `path` in ARPA format, gzipped if .gz"""
+        words = np.array(self.vocab, dtype=object)
+        with _open(path, 'w') as fout:
+            fout.write('\n\\data\\\n')
+            for n in range(1, self.order + 1):
+                fout.write('ngram {}={}\n'.format(n, self.size(n)))
+
+            for n in range(1, self.order + 1):
+                fout.write('\n\\{}-grams:\n'.format(n))
+                cols = self.columns(n)
+                text = words[cols[:, 0]]
+                for j in range(1, n):
+                    text = text + ' ' + words[cols[:, j]]
+                probs = _format(self.prob[n])
+                if n == self.order:
+                    fout.writelines(
+                        '{}\t{}\n'.format(p, t) for p, t in zip(probs, text))
+                else:
+                    fout.writelines(
+                        '{}\t{}\t{}\n'.format(p, t, b)
+                        for p, t, b in zip(probs, text, _format(self.bow[n])))
+            fout.write('\n\\end\\\n')
+
+    def size(self, n):
+        """Return the number of n-grams of order `n`"""
+        return len(self.word[n])
+
+    def vocabulary(self):
+        """Return the set of words in the unigrams of the model"""
+        return set(self.vocab[w] for w in self.word[1])
+
+    def columns(self, n):
+        """Return the word ids of the n-grams of order `n`, as (size, n)"""
+        cols = np.empty((self.size(n), n), dtype=np.int32)
+        cols[:, n - 1] = self.word[n]
+        rows = self.ctx[n]
+        for j in range(n - 1, 0, -1):
+            cols[:, j - 1] = self.word[j][rows]
+            rows = self.ctx[j][rows]
+        return cols
+
+    def _key(self, ctx, word):
+        return ctx.astype(np.int64) * len(self.vocab) + word
+
+    def _keys(self, n):
+        """The sorted keys of the n-grams of order `n`, cached"""
+        if n not in self._keys_cache:
+            self._keys_cache[n] = self._key(self.ctx[n], self.word[n])
+        return self._keys_cache[n]
+
+    def _lookup(self, cols):
+        """Return the rows of the n-grams `cols` (as word ids), -1 if absent
+
+        `cols` is an array of shape (m, n), return an array of shape (m,)
+
+        """
+        nrows, n = cols.shape
+        rows = np.zeros(nrows, dtype=np.int64)
+        found = np.ones(nrows, dtype=bool)
+        if n > self.order:
+            found[:] = False
+        for j in range(1, min(n, self.order) + 1):
+            keys = self._keys(j)
+            if not len(keys):
+                found[:] = False
+                break
+            key = self._key(rows, cols[:, j - 1])
+            idx = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            found &= keys[idx] == key
+            rows = np.where(found, idx, 0)
+        return np.where(found, rows, -1)
+
+    def logprob(self, context, word):
+        """Return the backoff log10 p(`word`|`context`)
+
+        `context` is an array of word ids of shape (m, k) and `word`
+        an array of shape (m,). Only the last order - 1 words of the
+        context are considered.
+
+        """
+        context = context[:, max(context.shape[1] - self.order + 1, 0):]
+        result = np.empty(len(word))
+        rows = self._lookup(np.column_stack((context, word)))
+        hit = rows >= 0
+        n = context.shape[1] + 1
+        if n <= self.order:
+            result[hit] = self.prob[n][rows[hit]]
+
+        miss = ~hit
+        if not miss.any():
+            return result
+        if n == 1:
+            result[miss] = -np.inf
+            return result
+
+        ctx = self._lookup(context[miss])
+        bow = np.where(ctx >= 0, self.bow[n - 1][np.maximum(ctx, 0)], 0)
+        result[miss] = bow + self.logprob(context[miss, 1:], word[miss])
+        return result
+
+    def _filter(self, n, keep):
+        """Keep the n-grams of order `n` in `keep`, and their extensions"""
+        self._keys_cache = {}
+        for attr in (self.word, self.ctx, self.prob, self.bow):
+            attr[n] = attr[n][keep]
+
+        if n < self.order:
+            # remap the contexts of the next order, the mapping is
+            # monotonic and the rows stay sorted
+            mapping = np.cumsum(keep) - 1
+            keep_next = keep[self.ctx[n + 1]]
+            self.ctx[n + 1] = mapping[self.ctx[n + 1]]
+            self._filter(n + 1, keep_next)
+
+    def restrict_vocabulary(self, words, misplaced_markers=True):
+        """Remove the n-grams containing a word not in `words`
+
+        If `misplaced_markers` is True, remove as well the n-grams
+        where <s> is not the first word or </s> not the last one.
+        The backoff weights are not updated, see renormalize().
+
+        """
+        in_vocab = np.array([w in words for w in self.vocab], dtype=bool)
+        bos = self.vocab.index(BOS) if BOS in self.vocab else -1
+        eos = self.vocab.index(EOS) if EOS in self.vocab else -1
+
+        # the masks are computed first, the filtering then removes
+        # the extensions of the removed n-grams
+        masks = {}
+        for n in range(1, self.order + 1):
+            cols = self.columns(n)
+            keep = in_vocab[cols].all(axis=1)
+            if misplaced_markers and n > 1:
+                keep &= ~(cols[:, 1:] == bos).any(axis=1)
+                keep &= ~(cols[:, :-1] == eos).any(axis=1)
+            masks[n] = keep
+
+        for n in range(self.order, 0, -1):
+            self._filter(n, masks[n])
+
+    def renormalize(self):
+        """Recompute the backoff weights of the model
+
+        As in SRILM, the backoff weight of a context c is
+
+            bow(c) = (1 - Sum p(w|c)) / (1 - Sum p_BO(w|c'))
+
+        where the sums are over the words w with an explicit
+        probability in context c, and p_BO(w|c') is the backoff
+        probability given the context c without its first word. The
+        empty context of the unigrams has no backoff distribution, so
+        the unigram probabilities are scaled to sum to 1.
+
+        """
+        for n in range(1, self.order + 1):
+            ctx = self.ctx[n]
+            size = self.size(n - 1) if n > 1 else 1
+
+            explicit = 10 ** self.prob[n]
+            numerator = 1 - np.bincount(ctx, explicit, minlength=size)
+            if n > 1:
+                cols = self.columns(n)
+                backoff = 10 ** self.logprob(cols[:, 1:-1], cols[:, -1])
+                denominator = 1 - np.bincount(ctx, backoff, minlength=size)
+            else:
+                denominator = np.zeros(size)
+            extended = np.bincount(ctx, minlength=size) > 0
+
+            # avoid some predictable anomalies due to rounding errors
+            numerator[(numerator < 0) & (numerator > -PROB_EPSILON)] = 0
+            denominator[
+                (denominator < 0) & (denominator > -PROB_EPSILON)] = 0
+
+            # the backoff distribution has no probability left, scale
+            # the explicit probabilities to sum to 1
+            scale = (denominator == 0) & (numerator > PROB_EPSILON)
+            if scale.any():
+                scaled = scale[ctx]
+                self.prob[n][scaled] -= np.log10(1 - numerator[ctx[scaled]])
+                numerator[scale] = 0
+            if n == 1:
+                continue
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bow = np.log10(numerator) - np.log10(denominator)
+            bow[(denominator <= 0) & (numerator > PROB_EPSILON)] = -np.inf
+            bow[(denominator <= 0) & (numerator <= PROB_EPSILON)] = 0
+            bow[numerator < 0] = -np.inf
+            bow[~extended] = 0
+            self.bow[n - 1] = bow
+
+    def prune_lowprobs(self, min_order=2):
+        """Remove the n-grams less probable than their backoff estimate
+
+        As in SRILM, the n-grams of order at least `min_order` that
+        are not a context of a higher order n-gram are removed if
+        p(w|c) < bow(c) p_BO(w|c'). The backoff weights are then
+        recomputed, until no more n-gram is removed.
+
+        """
+        while True:
+            self.renormalize()
+            pruned = False
+            for n in range(self.order, max(min_order, 2) - 1, -1):
+                cols = self.columns(n)
+                low = self.prob[n] < (
+                    self.bow[n - 1][self.ctx[n]] +
+                    self.logprob(cols[:, 1:-1], cols[:, -1]))
+                if n < self.order:
+                    low &= np.bincount(
+                        self.ctx[n + 1], minlength=self.size(n)) == 0
+                if low.any():
+                    self._filter(n, ~low)
+                    pruned = True
+            if not pruned:
+                break
+
+
+def _format(values):
+    """Format log10 values as in ARPA files, -99 for -inf"""
+    return ['-99' if v == -np.inf else '{:.7g}'.format(v) for v in values]
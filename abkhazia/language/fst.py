@@ -0,0 +1,180 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Read and write OpenFst binary FSTs without the Kaldi toolchain
+
+Some grammars are small and analytically known, such as the flat
+unigram of FlatLanguageModel. They are written here directly in the
+binary format of an OpenFst VectorFst over the tropical semiring (the
+'vector' FST type with 'standard' arcs read by Kaldi), instead of
+compiling an ARPA model with arpa2fst.
+
+An FST is represented as a list of states, each state being a pair
+(final, arcs) where `final` is the final weight (INF for a non final
+state) and `arcs` a list of (ilabel, olabel, weight, nextstate).
+
+"""
+
+import math
+import struct
+
+
+MAGIC = 2125659606
+"""The magic number of the OpenFst binary files"""
+
+VERSION = 2
+"""The version of the VectorFst binary format"""
+
+INF = float('inf')
+"""The zero of the tropical semiring, weight of the non final states"""
+
+# the OpenFst properties computed by write_vector_fst (see
+# fst/properties.h), the other ones are left unknown
+EXPANDED = 0x1
+MUTABLE = 0x2
+ACCEPTOR, NOT_ACCEPTOR = 0x10000, 0x20000
+I_DETERMINISTIC, NON_I_DETERMINISTIC = 0x40000, 0x80000
+O_DETERMINISTIC, NON_O_DETERMINISTIC = 0x100000, 0x200000
+EPSILONS, NO_EPSILONS = 0x400000, 0x800000
+I_EPSILONS, NO_I_EPSILONS = 0x1000000, 0x2000000
+O_EPSILONS, NO_O_EPSILONS = 0x4000000, 0x8000000
+I_LABEL_SORTED, NOT_I_LABEL_SORTED = 0x10000000, 0x20000000
+O_LABEL_SORTED, NOT_O_LABEL_SORTED = 0x40000000, 0x80000000
+WEIGHTED, UNWEIGHTED = 0x100000000, 0x200000000
+
+
+def _write_string(fout, string):
+    fout.write(struct.pack('<i', len(string)) + string.encode('ascii'))
+
+
+def _read_string(fin):
+    length, = struct.unpack('<i', fin.read(4))
+    return fin.read(length).decode('ascii')
+
+
+def _flag(condition, true, false):
+    return true if condition else false
+
+
+def properties(states):
+    """Return the OpenFst properties of the FST `states`"""
+    arcs = [arc for _, state_arcs in states for arc in state_arcs]
+
+    def _sorted(index):
+        return all(
+            all(a[index] <= b[index] for a, b in zip(s, s[1:]))
+            for _, s in states)
+
+    def _deterministic(index):
+        return all(len(set(a[index] for a in s)) == len(s)
+                   for _, s in states)
+
+    return (
+        EXPANDED | MUTABLE |
+        _flag(all(a[0] == a[1] for a in arcs), ACCEPTOR, NOT_ACCEPTOR) |
+        _flag(_deterministic(0), I_DETERMINISTIC, NON_I_DETERMINISTIC) |
+        _flag(_deterministic(1), O_DETERMINISTIC, NON_O_DETERMINISTIC) |
+        _flag(any(a[0] == 0 and a[1] == 0 for a in arcs),
+              EPSILONS, NO_EPSILONS) |
+        _flag(any(a[0] == 0 for a in arcs), I_EPSILONS, NO_I_EPSILONS) |
+        _flag(any(a[1] == 0 for a in arcs), O_EPSILONS, NO_O_EPSILONS) |
+        _flag(_sorted(0), I_LABEL_SORTED, NOT_I_LABEL_SORTED) |
+        _flag(_sorted(1), O_LABEL_SORTED, NOT_O_LABEL_SORTED) |
+        _flag(any(a[2] != 0 for a in arcs) or
+              any(f not in (0, INF) for f, _ in states),
+              WEIGHTED, UNWEIGHTED))
+
+
+def write_vector_fst(path, states, start=0):
+    """Write the FST `states` in OpenFst binary format to `path`
+
+    The arcs are written as given, sort them by ilabel to obtain the
+    equivalent of 'fstarcsort --sort_type=ilabel'.
+
+    """
+    narcs = sum(len(arcs) for _, arcs in states)
+    with open(path, 'wb') as fout:
+        fout.write(struct.pack('<i', MAGIC))
+        _write_string(fout, 'vector')
+        _write_string(fout, 'standard')
+        # version, flags (no symbol tables), properties, start,
+        # number of states and number of arcs
+        fout.write(struct.pack(
+            '<iiQqqq', VERSION, 0, properties(states),
+            start, len(states), narcs))
+
+        for final, arcs in states:
+            fout.write(struct.pack('<fq', final, len(arcs)))
+            fout.write(b''.join(
+                struct.pack('<iifi', *arc) for arc in arcs))
+
+
+def read_vector_fst(path):
+    """Return (start, states, properties) read from the FST `path`
+
+    Raise IOError if `path` is not a VectorFst over the tropical
+    semiring without symbol tables.
+
+    """
+    with open(path, 'rb') as fin:
+        magic, = struct.unpack('<i', fin.read(4))
+        if magic != MAGIC:
+            raise IOError('{} is not an OpenFst binary file'.format(path))
+
+        fst_type, arc_type = _read_string(fin), _read_string(fin)
+        version, flags, props, start, nstates, _ = struct.unpack(
+            '<iiQqqq', fin.read(40))
+        if (fst_type, arc_type, flags) != ('vector', 'standard', 0):
+            raise IOError(
+                '{}: unsupported FST {}/{} (flags {})'.format(
+                    path, fst_type, arc_type, flags))
+
+        states = []
+        for _ in range(nstates):
+            final, narcs = struct.unpack('<fq', fin.read(12))
+            arcs = [struct.unpack('<iifi', fin.read(16))
+                    for _ in range(narcs)]
+            states.append((final, arcs))
+    return start, states, props
+
+
+def write_unigram(path, lm, symbols):
+    """Compile the unigram ARPA model `lm` to the FST `path`
+
+    This is equivalent to 'arpa2fst --read-symbol-table=words.txt |
+    fstarcsort --sort_type=ilabel' on a model of order 1: a single
+    state, initial and final with the </s> weight, looping on the
+    other words with their weights (<s> is always free). `symbols`
+    is a dict word -> label (from words.txt), the words of `lm` not
+    in `symbols` are ignored and returned as a sorted list.
+
+    """
+    if lm.order != 1:
+        raise IOError(
+            'in-process FST compilation is limited to unigrams, '
+            'order is {}'.format(lm.order))
+
+    # arpa2fst weights are -ln(p), ARPA probabilities are log10(p)
+    final, arcs, oovs = INF, [], []
+    for (word,), (logprob, _) in lm.ngrams[1].items():
+        weight = -logprob * math.log(10)
+        if word not in symbols:
+            oovs.append(word)
+        elif word == '</s>':
+            final = weight
+        elif word != '<s>':
+            arcs.append((symbols[word], symbols[word], weight, 0))
+
+    write_vector_fst(path, [(final, sorted(arcs))])
+    return sorted(oovs)
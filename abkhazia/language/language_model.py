@@ -14,18 +14,19 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides the LanguageModel class"""
 
-import gzip
 import math
 import os
-import re
 import shutil
 import tempfile
 import pkg_resources
 
 import abkhazia.utils as utils
 import abkhazia.abstract_recipe as abstract_recipe
+import abkhazia.kaldi as kaldi
+from abkhazia.utils import prepare_lang
+from abkhazia.language import fst, ngram
 from abkhazia.language.arpa import ARPALanguageModel
-from abkhazia.kaldi import kaldi_path
+from abkhazia.language.compact import CompactLanguageModel
 
 
 def check_language_model(lm_dir):
@@ -69,10 +70,26 @@ def read_int2phone(lm_dir, word_position_dependent=True):
     return phonemap
 
 
+def arpa2fst_reads_symbols():
+    """Return True if arpa2fst compiles an ARPA LM with a symbol table
+
+    The --read-symbol-table and --disambig-symbol options exist only
+    in the arpa2fst of recent Kaldi versions. The former arpa2fst,
+    as in the Kaldi branch installed by abkhazia, writes an FST with
+    its own symbols, to be relabeled by fstprint | fstcompile.
+
+    """
+    try:
+        options = kaldi.options.get_options('arpa2fst')
+    except (RuntimeError, AttributeError):  # not found or unparsed
+        return False
+    return 'read-symbol-table' in options and 'disambig-symbol' in options
+
+
 class LanguageModel(abstract_recipe.AbstractRecipe):
     """Compute a language model from an abkhazia corpus
 
-    This class uses Kaldi, IRSTLM and SRILM to compute n-grams
+    This class uses Kaldi and IRSTLM to compute n-grams
     language models from any abkhazia speech corpus. The models can be
     either at word or phone level.
 
@@ -97,6 +114,14 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
         destined to be used with an acoustic model trained with or
         without word position dependent variants of the phones
 
+    ngram_backend (str): 'irstlm' to estimate the n-grams with IRSTLM,
+        or 'python' to count them in process (only for orders up to
+        abkhazia.language.ngram.MAX_ORDER)
+
+    use_cache (bool): when True, reuse the lang directory prepared
+        from the same lexicon and the G.fst compiled from the same
+        ARPA model and words.txt in a previous run
+
     Exemple:
     --------
 
@@ -115,8 +140,8 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
 
     def __init__(self, corpus, output_dir,
                  level='word', order=2, silence_probability=0.5,
-                 position_dependent_phones=True,
-                 log=utils.logger.null_logger()):
+                 position_dependent_phones=True, ngram_backend='irstlm',
+                 use_cache=True, log=utils.logger.null_logger()):
         super(LanguageModel, self).__init__(corpus, output_dir, log=log)
 
         # Here we could use a different silence_probability. Thomas
@@ -129,6 +154,8 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
         self.order = order
         self.silence_probability = silence_probability
         self.position_dependent_phones = position_dependent_phones
+        self.ngram_backend = ngram_backend
+        self.use_cache = use_cache
 
     def _check_level(self):
         level_choices = ['word', 'phone']
@@ -150,6 +177,16 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
                 'language model order must be an integer > 0, it is {}'
                 .format(self.order))
 
+    def _check_ngram_backend(self):
+        if self.ngram_backend not in ('irstlm', 'python'):
+            raise RuntimeError(
+                'unknown n-gram backend "{}"'.format(self.ngram_backend))
+
+        if self.ngram_backend == 'python' and self.order > ngram.MAX_ORDER:
+            raise RuntimeError(
+                'python n-gram backend is limited to order {}, it is {}'
+                .format(ngram.MAX_ORDER, self.order))
+
     def _check_silence_probability(self):
         if self.silence_probability >= 1 or self.silence_probability < 0:
             raise RuntimeError(
@@ -201,6 +238,15 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
                   utils.str2bool(self.position_dependent_phones) is True
                   else script_prepare_lm)
 
+        lang_cache = None
+        if self.use_cache:
+            lang_cache = prepare_lang.LangCache(
+                self.a2k._local_path(), script, self.level,
+                self.silence_probability, self.position_dependent_phones)
+            if lang_cache.get(self.output_dir):
+                self.log.info('preprocessing corpus (cached)')
+                return
+
         self._run_command(
             script + ' --position-dependent-phones {0}'
             ' --sil-prob {1} {2} "<unk>" {3} {4}'.format(
@@ -210,6 +256,9 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
                 os.path.join(self.output_dir, 'local'),
                 self.output_dir))
 
+        if lang_cache:
+            lang_cache.put(self.output_dir)
+
     def _compile_fst(self, G_txt, G_fst):
         """Compile and sort a text FST to kaldi binary FST
 
@@ -241,31 +290,33 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
     def _compute_lm(self, G_arpa):
         """Generate an ARPA n-gram from an abkhazia corpus
 
-        This method relies on the following Kaldi programs:
-        add-start-end.sh, build-lm.sh and compile-lm. It uses the
-        IRSTLM library.
+        With the 'irstlm' backend, this method relies on the IRSTLM
+        programs build-lm.sh and compile-lm. The training text is
+        streamed from lm_text.txt to a gzipped text with sentence
+        markers and the compiled LM is directly piped to gzip.
+
+        With the 'python' backend the n-grams are counted in process
+        (see abkhazia.language.ngram).
 
         """
         self.log.info(
-            'computing %s %s-gram in ARPA format', self.level, self.order)
+            'computing %s %s-gram in ARPA format (%s)',
+            self.level, self.order, self.ngram_backend)
 
-        # cut -d' ' -f2 lm_text > text_ready. Train need to
-        # remove utt-id on first column of text file
         lm_text = os.path.join(self.a2k._local_path(), 'lm_text.txt')
-        lm_lines = utils.open_utf8(lm_text, 'r').readlines()
 
-        text_ready = os.path.join(self.a2k._local_path(), 'text_ready.txt')
-        with utils.open_utf8(text_ready, 'w') as ready:
-            ready.write('\n'.join(
-                [' '.join(line.split()[1:]) for line in lm_lines]))
+        if self.ngram_backend == 'python':
+            counts = ngram.count_ngrams(ngram.sentences(lm_text), self.order)
+            ngram.kneser_ney(counts, self.order).save(
+                G_arpa, compress=True, njobs=self.njobs)
+            return
 
-        text_se = os.path.join(self.a2k._local_path(), 'text_se.txt')
-        utils.jobs.run(
-            'add-start-end.sh',
-            stdin=open(text_ready, 'r'),
-            stdout=open(text_se, 'w').write,
-            env=kaldi_path(), cwd=self.recipe_dir)
-        assert os.path.isfile(text_se), 'LM failed on add-start-end'
+        # remove the utt-ids from the text and add the sentence
+        # markers, build-lm.sh reads its input twice so we cannot
+        # pipe it
+        text_se = os.path.join(self.a2k._local_path(), 'text_se.gz')
+        nutts = ngram.write_sentences(lm_text, text_se)
+        self.log.debug('wrote %s utterances to %s', nutts, text_se)
 
         # k option is number of split, useful for huge text files
         # build-lm.sh in kaldi/tools/irstlm/bin
@@ -275,144 +326,148 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
             .format(text_se, self.order, text_lm))
         assert os.path.isfile(text_lm), 'LM failed on build-lm'
 
-        text_blm = os.path.join(self.a2k._local_path(), 'text_blm.gz')
         self._run_command(
-            # was with the -i option
-            'compile-lm {} --text=yes {}'.format(text_lm, text_blm))
+            'utils/run.pl {0} compile-lm {1} --text=yes /dev/stdout | '
+            'gzip -c > {2}'.format(
+                os.path.join(self.output_dir, 'compile_lm.log'),
+                text_lm, G_arpa))
 
-        # gzip the compiled lm (from
-        # https://docs.python.org/2/library/gzip.html#examples-of-usage)
-        with open(text_blm, 'rb') as fin, gzip.open(G_arpa, 'wb') as fout:
-            shutil.copyfileobj(fin, fout)
-
-    def _change_lm_vocab(self, lm_txt, words_txt):
+    def _change_lm_vocab(self, lm, words):
         """Create a LM from an existing one by changing its vocabulary
 
-        All n-grams in the new vocab are retained with their original
-        probabilities. Backoff weights are recomputed and backed-off
-        unigrams for all new words are added. -subset option performs
-        subsetting of the vocabulary without adding new words.
-
-        This is reimplementation of the change-lm-vocab script from
-        SRILM, modified in 3 ways:
-
-         - no more -tolower option
+        All n-grams of the CompactLanguageModel `lm` in the new vocab
+        `words` are retained with their original probabilities, the
+        n-grams with misplaced sentence markers are removed. Backoff
+        weights are recomputed and the n-grams whose probabilities
+        are lower than their backed-off estimates are removed. Return
+        the path to the written ARPA model.
 
-         - the pruning step now updates ngrams count in the header
-           (disable annoying warning)
-
-         - the call to ngram is done in 2 steps if the 1 step failed
-           (-renorm and prune-lowprobs options failed together on
-           -librispeech-test-clean, need 2 calls)
+        This is an in-process equivalent of the former call to SRILM
+        'ngram -renorm -prune-lowprobs' on the pruned model (see
+        abkhazia.language.compact).
 
         """
         out_lm = os.path.join(self.output_dir, 'out_lm.txt')
         self.log.debug('pruning vocabulary in %s', out_lm)
 
-        words = set(w.split()[0] for w in utils.open_utf8(words_txt, 'r'))
-        lm = ARPALanguageModel.load(lm_txt)
-        lm.prune_vocabulary(words)
-        lm_pruned = lm_txt + '.pruned'
-        lm.save(lm_pruned)
-
-        try:
-            self._run_command(
-                'ngram -lm {0} -vocab /dev/null -renorm -write-lm {1} '
-                '-prune-lowprobs -unk -order {2}'
-                .format(lm_pruned, out_lm, self.order))
-        except RuntimeError:
-            self._run_command(
-                'utils/run.pl {3} '
-                'ngram -lm {0} -vocab /dev/null -write-lm - '
-                '-prune-lowprobs -unk -order {2} | '
-                'ngram -lm - -vocab /dev/null -renorm -unk '
-                '-order {2} -write-lm {1}'
-                .format(lm_pruned, out_lm, self.order,
-                        os.path.join(self.output_dir, 'ngram.log')))
-
+        lm.restrict_vocabulary(words, misplaced_markers=True)
+        lm.prune_lowprobs()
+        lm.save(out_lm)
         return out_lm
 
     def _format_lm(self, arpa_lm, fst_lm):
         """Converts ARPA-format language models to FSTs
 
-        Change the LM vocabulary using SRILM. This is a Python
-        implementation of Kaldi egs/wsj/s5/utils/format_lm_sri.sh,
-        with margin modifications.
+        Change the LM vocabulary and compile it to FST with
+        arpa2fst. This is a Python implementation of Kaldi
+        egs/wsj/s5/utils/format_lm_sri.sh, with margin modifications
+        and without SRILM.
 
-        Note: if you want to just convert ARPA LMs to FSTs, there is a
-        simpler way to do this that doesn't require SRILM: see
-        examples in Kaldi egs/wsj/s5/local/wsj_format_local_lms.sh
+        The FST is cached in the abkhazia tmp-directory, keyed by the
+        hash of `arpa_lm`, words.txt and the LM order (see
+        abkhazia.utils.cache), unless self.use_cache is False.
 
         """
-        self.log.info('converting ARPA to FST')
-
         words_txt = os.path.join(self.output_dir, 'words.txt')
         for _file in (arpa_lm, words_txt):
             if not os.path.isfile(_file):
                 raise IOError('excpected input file {} to exist'.format(_file))
 
         lm_base = os.path.splitext(os.path.basename(arpa_lm))[0]
+        oovs = os.path.join(self.output_dir, 'oovs_{}.txt'.format(lm_base))
+
         tempdir = tempfile.mkdtemp()
         try:
-            # unzip the input LM. Removing all "illegal" combinations of
-            # <s> and </s>, which are supposed to occur only at being/end
-            # of utt. These can cause determinization failures of CLG
-            # [ends up being epsilon cycles].
-            lm_txt = os.path.join(tempdir, lm_base + '.txt')
-            # self.log.debug('unzip %s to %s', arpa_lm, lm_txt)
-            with utils.open_utf8(lm_txt, 'w') as fp:
-                for line in gzip.open(arpa_lm, 'rb'):
-                    line = line.decode()
-                    if not (re.search('<s> <s>', line) or
-                            re.search('</s> <s>', line) or
-                            re.search('</s> </s>', line)):
-                        fp.write(line)
-
-            # finds words in the arpa LM that are not symbols in the
-            # OpenFst-format symbol table words.txt
-            oovs = os.path.join(self.output_dir, 'oovs_{}.txt'.format(lm_base))
-            self.log.debug('write OOVs to %s', oovs)
-            utils.jobs.run(
-                'utils/find_arpa_oovs.pl {} {}'.format(words_txt, lm_txt),
-                stdout=utils.open_utf8(oovs, 'w').write,
-                env=kaldi_path(),
-                cwd=self.recipe_dir)
-
-            # Change the LM vocabulary to be the intersection of the
-            # current LM vocabulary and the set of words in the
-            # pronunciation lexicon. This also renormalizes the LM by
-            # recomputing the backoff weights, and remove those ngrams
-            # whose probabilities are lower than the backed-off
-            # estimates.
-            lm_pruned = self._change_lm_vocab(lm_txt, words_txt)
-
-            # convert from ARPA to FST
-            self._run_command(
-                'utils/run.pl {0} arpa2fst {1} | fstprint | '
-                'utils/eps2disambig.pl | utils/s2eps.pl | '
-                'fstcompile --isymbols={2} --osymbols={2} '
-                '--keep_isymbols=false --keep_osymbols=false | '
-                'fstrmepsilon | fstarcsort --sort_type=ilabel > {3}'.format(
-                    os.path.join(self.output_dir, 'format_lm.log'),
-                    lm_pruned, words_txt, fst_lm))
-
-            # The output is like: 9.14233e-05 -0.259833. We do expect
-            # the first of these 2 numbers to be close to zero (the
-            # second is nonzero because the backoff weights make the
-            # states sum to >1).
-            try:
-                self._run_command('fstisstochastic {}'.format(fst_lm))
-            except RuntimeError:
-                pass
-
+            # the cache entry is a directory with the FST and the OOVs
+            entry = os.path.join(tempdir, 'entry')
+            if self.use_cache:
+                cache = utils.cache.FileCache('G.fst')
+                key = utils.cache.hash_files(
+                    arpa_lm, words_txt, extra=[self.order])
+                if cache.get(key, entry):
+                    self.log.info('converting ARPA to FST (cached)')
+                    shutil.copy(os.path.join(entry, 'G.fst'), fst_lm)
+                    shutil.copy(os.path.join(entry, 'oovs.txt'), oovs)
+                    return
+
+            self.log.info('converting ARPA to FST')
+            os.makedirs(entry)
+            self._compile_lm(arpa_lm, words_txt, entry)
+            shutil.copy(os.path.join(entry, 'G.fst'), fst_lm)
+            shutil.copy(os.path.join(entry, 'oovs.txt'), oovs)
+
+            if self.use_cache:
+                cache.put(key, entry)
         finally:
             utils.remove(tempdir, safe=True)
 
+    def _compile_lm(self, arpa_lm, words_txt, output_dir):
+        """Compile `arpa_lm` to `output_dir`/G.fst
+
+        Write the words of the LM not in `words_txt` to
+        `output_dir`/oovs.txt
+
+        """
+        words = set(w.split()[0] for w in utils.open_utf8(words_txt, 'r'))
+
+        # the gzipped ARPA LM is loaded once and filtered in memory,
+        # removing all "illegal" combinations of <s> and </s>, which
+        # are supposed to occur only at being/end of utt. These can
+        # cause determinization failures of CLG [ends up being
+        # epsilon cycles].
+        lm = CompactLanguageModel.load(arpa_lm)
+
+        # finds words in the arpa LM that are not symbols in the
+        # OpenFst-format symbol table words.txt
+        oovs = os.path.join(output_dir, 'oovs.txt')
+        self.log.debug('write OOVs to %s', oovs)
+        with utils.open_utf8(oovs, 'w') as fout:
+            for word in sorted(lm.vocabulary() - words):
+                fout.write(u'{}\n'.format(word))
+
+        # Change the LM vocabulary to be the intersection of the
+        # current LM vocabulary and the set of words in the
+        # pronunciation lexicon. This also renormalizes the LM by
+        # recomputing the backoff weights, and remove those ngrams
+        # whose probabilities are lower than the backed-off
+        # estimates.
+        lm_pruned = self._change_lm_vocab(lm, words)
+        del lm
+
+        # convert from ARPA to FST, <s> and </s> are mapped to
+        # epsilons and the backoff arcs to #0
+        fst_lm = os.path.join(output_dir, 'G.fst')
+        if arpa2fst_reads_symbols():
+            command = (
+                'utils/run.pl {0} arpa2fst --disambig-symbol=#0 '
+                '--read-symbol-table={1} {2} - | '
+                'fstarcsort --sort_type=ilabel > {3}')
+        else:
+            command = (
+                'utils/run.pl {0} arpa2fst {2} | fstprint | '
+                'utils/eps2disambig.pl | utils/s2eps.pl | '
+                'fstcompile --isymbols={1} --osymbols={1} '
+                '--keep_isymbols=false --keep_osymbols=false | '
+                'fstrmepsilon | fstarcsort --sort_type=ilabel > {3}')
+        self._run_command(command.format(
+            os.path.join(self.output_dir, 'format_lm.log'),
+            words_txt, lm_pruned, fst_lm))
+
+        # The output is like: 9.14233e-05 -0.259833. We do expect
+        # the first of these 2 numbers to be close to zero (the
+        # second is nonzero because the backoff weights make the
+        # states sum to >1).
+        try:
+            self._run_command('fstisstochastic {}'.format(fst_lm))
+        except RuntimeError:
+            pass
+
     def check_parameters(self):
         """Raise if the language modeling parameters are not correct"""
         super(LanguageModel, self).check_parameters()
         self._check_level()
         self._check_order()
+        self._check_ngram_backend()
         self._check_silence_probability()
         self._check_position_dependent()
 
@@ -478,7 +533,12 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
 
 
 class FlatLanguageModel(LanguageModel):
-    """A flat LM is a unigram of equiprobable tokens"""
+    """A flat LM is a unigram of equiprobable tokens
+
+    Its G.fst is written in process (see abkhazia.language.fst), only
+    the lang directory is prepared with Kaldi.
+
+    """
     def __init__(self, corpus, output_dir,
                  level='word', silence_probability=0.5,
                  position_dependent_phones=True,
@@ -517,9 +577,23 @@ class FlatLanguageModel(LanguageModel):
         ngram = {1: {(t, ): (prob, None) for t in sorted(tokens)}}
 
         # save it as a compressed text ARPA format
+        lm = ARPALanguageModel(ngram)
         g_arpa = os.path.join(self.a2k._local_path(), 'G.arpa.gz')
-        ARPALanguageModel(ngram).save(g_arpa, compress=True)
+        lm.save(g_arpa, compress=True)
+
+        # compile it to binary FST format, in process as the FST of
+        # a unigram is known
+        self.log.info('converting ARPA to FST')
+        words_txt = os.path.join(self.output_dir, 'words.txt')
+        symbols = {}
+        for line in utils.open_utf8(words_txt, 'r'):
+            word, label = line.split()
+            symbols[word] = int(label)
 
-        # compile it to binary FST format
         g_fst = os.path.join(self.a2k._local_path(), 'G.fst')
-        self._format_lm(g_arpa, g_fst)
+        oovs = fst.write_unigram(g_fst, lm, symbols)
+
+        with utils.open_utf8(
+                os.path.join(self.output_dir, 'oovs_G.arpa.txt'), 'w') as fout:
+            for word in oovs:
+                fout.write(u'{}\n'.format(word))
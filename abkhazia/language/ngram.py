@@ -0,0 +1,175 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Streaming preparation of the LM training text and n-gram counting
+
+The training text of a language model (the lm_text.txt file written
+by LanguageModel.create) has one utterance per line, the utterance id
+followed by the words (or phones). The functions here read it line by
+line and never hold the whole text in memory:
+
+- sentences() yields the tokens of each utterance,
+
+- write_sentences() writes the utterances surrounded by the <s> and
+  </s> markers, as expected by the IRSTLM build-lm.sh script,
+
+- count_ngrams() and kneser_ney() estimate an interpolated
+  Kneser-Ney model in process, as an alternative to IRSTLM for small
+  orders (the counts are held in memory).
+
+"""
+
+import collections
+import gzip
+import math
+
+import abkhazia.utils as utils
+from abkhazia.language.arpa import ARPALanguageModel
+
+
+BOS, EOS = '<s>', '</s>'
+"""The begin and end of sentence markers"""
+
+MAX_ORDER = 3
+"""The maximal order of the in-process n-gram estimation"""
+
+
+def sentences(lm_text):
+    """Yield the list of tokens of each utterance in `lm_text`
+
+    The first column of the file (the utterance id) is dropped, as
+    well as the empty utterances.
+
+    """
+    with utils.open_utf8(lm_text, 'r') as fin:
+        for line in fin:
+            tokens = line.split()[1:]
+            if tokens:
+                yield tokens
+
+
+def write_sentences(lm_text, output):
+    """Write the utterances of `lm_text` with sentence markers in `output`
+
+    Each line of `output` is '<s> w1 ... wn </s>'. If `output` ends
+    with '.gz' it is gzip compressed (IRSTLM reads gzipped inputs
+    transparently). Return the number of utterances written.
+
+    """
+    if output.endswith('.gz'):
+        # fast compression, the file is read back just once
+        fout = gzip.open(output, 'wt', encoding='utf8', compresslevel=1)
+    else:
+        fout = utils.open_utf8(output, 'w')
+
+    nutts = 0
+    with fout, utils.open_utf8(lm_text, 'r') as fin:
+        for line in fin:
+            # IRSTLM splits words on any whitespace, no need to
+            # split the line here
+            text = line.strip().partition(' ')[2].strip()
+            if text:
+                nutts += 1
+                fout.write(u'{} {} {}\n'.format(BOS, text, EOS))
+    return nutts
+
+
+def count_ngrams(sentences, order):
+    """Return the counts of the n-grams in `sentences` up to `order`
+
+    `sentences` is an iterable of lists of tokens, as returned by
+    sentences(). The sentence markers are added. Return a dict
+    order -> collections.Counter mapping n-grams (as tuples) to their
+    number of occurrences.
+
+    """
+    counts = {n: collections.Counter() for n in range(1, order + 1)}
+    for tokens in sentences:
+        tokens = [BOS] + tokens + [EOS]
+        for n in range(1, order + 1):
+            counts[n].update(zip(*(tokens[i:] for i in range(n))))
+    return counts
+
+
+def _discount(counts):
+    """Absolute discount from the counts of counts (Ney et al. 1994)"""
+    n1 = sum(1 for c in counts.values() if c == 1)
+    n2 = sum(1 for c in counts.values() if c == 2)
+    if n1 == 0 or n2 == 0:
+        return 0.5
+    return n1 / (n1 + 2.0 * n2)
+
+
+def _log10(p):
+    """log10(p) rounded as in ARPA files, -99 for 0, None for None"""
+    if p is None:
+        return None
+    return -99 if p <= 0 else round(math.log10(p), 7)
+
+
+def kneser_ney(counts, order=None):
+    """Estimate an interpolated Kneser-Ney language model
+
+    `counts` are the n-gram counts as returned by
+    count_ngrams(). Except for the highest order and the n-grams
+    starting with <s>, the estimation relies on continuation counts
+    (the number of distinct words preceding an n-gram), each order
+    being discounted with a single absolute discount. The
+    interpolation weight of a context is its backoff weight in the
+    returned abkhazia.language.arpa.ARPALanguageModel.
+
+    """
+    order = order or max(counts)
+    if order > MAX_ORDER:
+        raise IOError(
+            'in-process n-gram estimation is limited to order {}, '
+            'it is {}'.format(MAX_ORDER, order))
+
+    # adjusted counts: raw counts for the highest order and the
+    # n-grams starting with <s>, continuation counts otherwise
+    adjusted = {order: counts[order]}
+    for n in range(order - 1, 0, -1):
+        adjusted[n] = collections.Counter(
+            ngram[1:] for ngram in counts[n + 1])
+        adjusted[n].update(
+            {ngram: count for ngram, count in counts[n].items()
+             if ngram[0] == BOS})
+
+    # unigrams, <s> is never predicted
+    total = float(sum(c for w, c in adjusted[1].items() if w[0] != BOS))
+    probs = {1: {w: (0 if w[0] == BOS else c / total)
+                 for w, c in adjusted[1].items()}}
+    weights = {order: {}}
+
+    for n in range(2, order + 1):
+        discount = _discount(adjusted[n])
+
+        # total count and number of distinct successors of each context
+        totals, types = collections.Counter(), collections.Counter()
+        for ngram, count in adjusted[n].items():
+            totals[ngram[:-1]] += count
+            types[ngram[:-1]] += 1
+
+        weights[n - 1] = {
+            h: discount * types[h] / totals[h] for h in totals}
+        lower, weight = probs[n - 1], weights[n - 1]
+        probs[n] = {
+            ngram: (max(count - discount, 0) / totals[ngram[:-1]] +
+                    weight[ngram[:-1]] * lower[ngram[1:]])
+            for ngram, count in adjusted[n].items()}
+
+    return ARPALanguageModel({
+        n: {ngram: (_log10(p), _log10(weights[n].get(ngram)))
+            for ngram, p in probs[n].items()}
+        for n in range(1, order + 1)})
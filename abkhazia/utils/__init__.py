@@ -23,4 +23,6 @@ from . import abkhazia_base
 from . import logger
 from . import wav
 from . import jobs
+from . import trace
+from . import cache
 from . import cha
@@ -0,0 +1,154 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Cache of files and directories keyed by the hash of their inputs
+
+Some abkhazia outputs are long to compute but depend only on a few
+input files and parameters, such as the G.fst grammar compiled from an
+ARPA language model and a words.txt symbol table. A FileCache stores
+such outputs under a key hashed from their inputs, to reuse them on
+later runs.
+
+>>> cache = FileCache('G.fst')
+>>> key = hash_files(arpa, words_txt, extra=[order])
+>>> if not cache.get(key, g_fst):
+...     compile_fst(arpa, words_txt, g_fst)
+...     cache.put(key, g_fst)
+
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from .config import config
+
+
+DEFAULT_MAX_SIZE = 5000
+"""Maximal size of a cache in MB when not configured in abkhazia.conf"""
+
+
+def hash_files(*files, extra=()):
+    """Return the SHA1 hex digest of the content of `files`
+
+    The strings in `extra` (usually parameters) are hashed as well.
+
+    """
+    sha1 = hashlib.sha1()
+    for f in files:
+        with open(f, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(2**20), b''):
+                sha1.update(chunk)
+        sha1.update(b'\0')
+    for e in extra:
+        sha1.update(str(e).encode('utf8') + b'\0')
+    return sha1.hexdigest()
+
+
+def _copy(source, target):
+    if os.path.isdir(source):
+        shutil.copytree(source, target, dirs_exist_ok=True)
+    else:
+        shutil.copy(source, target)
+
+
+class FileCache(object):
+    """A directory caching files or directories by key
+
+    Entries are written atomically so that concurrent abkhazia
+    processes can share a cache. When the cache exceeds `max_size`,
+    the least recently used entries are removed.
+
+    Parameters:
+    -----------
+
+    name (str): name of the cache, its entries are stored in
+        `directory`/`name`
+
+    directory (str): the root directory of the caches, default is
+        abkhazia-cache in the abkhazia tmp-directory
+
+    max_size (int): maximal size of the cache in MB, default is the
+        cache-max-size of abkhazia.conf (or DEFAULT_MAX_SIZE), unlimited
+        if 0
+
+    """
+    def __init__(self, name, directory=None, max_size=None):
+        self.directory = os.path.join(
+            directory or os.path.join(
+                config.get('abkhazia', 'tmp-directory'), 'abkhazia-cache'),
+            name)
+        self.max_size = (
+            int(config.get('abkhazia', 'cache-max-size',
+                           fallback=DEFAULT_MAX_SIZE))
+            if max_size is None else max_size)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        """Return the path of the cache entry `key`"""
+        return os.path.join(self.directory, key)
+
+    def get(self, key, target):
+        """Copy the entry `key` to `target`, return False if not cached
+
+        When the entry is a directory and `target` an existing one,
+        the content of the entry is merged into `target`.
+
+        """
+        cached = self.path(key)
+        if not os.path.exists(cached):
+            return False
+
+        _copy(cached, target)
+        os.utime(cached)  # mark the entry as recently used
+        return True
+
+    def put(self, key, source):
+        """Copy the file or directory `source` as the entry `key`"""
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp')
+        try:
+            _copy(source, os.path.join(tmp, key))
+            try:
+                os.rename(os.path.join(tmp, key), self.path(key))
+            except OSError:
+                # the entry already exists, put by a concurrent process
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        if self.max_size:
+            self._evict()
+
+    def _size(self, path):
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, files in os.walk(path) for f in files)
+
+    def _evict(self):
+        entries = sorted(
+            (os.path.getmtime(self.path(k)), self._size(self.path(k)), k)
+            for k in os.listdir(self.directory) if not k.startswith('.'))
+        size = sum(e[1] for e in entries)
+        for _, entry_size, key in entries[:-1]:
+            if size <= self.max_size * 2**20:
+                break
+            if os.path.isdir(self.path(key)):
+                shutil.rmtree(self.path(key), ignore_errors=True)
+            else:
+                os.remove(self.path(key))
+            size -= entry_size
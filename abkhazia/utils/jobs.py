@@ -12,17 +12,291 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with abkahzia. If not, see <http://www.gnu.org/licenses/>.
-"""Provide functions to launch command-line jobs"""
+"""Provide functions to launch command-line jobs
 
+The MemoryLimiter class implements an admission control of the jobs
+running on the local machine against a memory budget: before running,
+a command reserves the memory of its jobs, estimated from their peak
+memory observed on previous runs, and waits until the budget allows
+it. The reservations are shared by all the abkhazia processes of the
+machine.
+
+A command can also be guarded against a peak memory: when the
+resident memory of the command and its descendants exceeds
+`max_memory`, they are killed instead of having the machine swap.
+
+"""
+
+import contextlib
+import fcntl
+import json
 import os
+import re
 import shlex
+import signal
 import subprocess
 import sys
 import threading
+import time
+import uuid
+
+from .config import config
+
+
+MEMORY_POLL = 0.5
+"""Delay between two checks of the memory of a guarded command (s)"""
+
+
+def throttle_cmd(command, max_jobs):
+    """Return `command` with its run.pl calls limited to `max_jobs`
+
+    The Kaldi run.pl script runs the jobs of a JOB=1:N array in
+    parallel, the --max-jobs-run option limits the number of jobs
+    running at once. Other commands (such as queue.pl) and run.pl
+    calls already having that option are left unchanged.
+
+    """
+    if '--max-jobs-run' in command:
+        return command
+    return re.sub(r'(\S*\brun\.pl)\b',
+                  r'\1 --max-jobs-run {}'.format(max_jobs), command)
+
+
+class MemoryLimiter(object):
+    """Throttle concurrent jobs against a memory budget
+
+    The reservations and the observed peak memory of the commands are
+    stored in `directory`, shared by all the processes using it.
+    Reservations of dead processes are ignored.
+
+    Parameters:
+    -----------
+
+    budget (int): the memory budget in MB, default is the physical
+        memory of the machine
+
+    directory (str): where to store reservations and peaks, default
+        is abkhazia-jobs in the abkhazia tmp-directory
+
+    default (int): memory of a job (MB) if not observed yet
+
+    poll (float): delay between two admission attempts (s)
+
+    """
+    def __init__(self, budget=None, directory=None, default=500, poll=1.0):
+        self.budget = budget or (
+            os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+            // 1024**2)
+        self.directory = directory or os.path.join(
+            config.get('abkhazia', 'tmp-directory'), 'abkhazia-jobs')
+        self.default = default
+        self.poll = poll
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        with open(os.path.join(self.directory, 'lock'), 'a') as flock:
+            fcntl.flock(flock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(flock, fcntl.LOCK_UN)
+
+    def _peaks(self):
+        try:
+            with open(os.path.join(self.directory, 'peaks.json'), 'r') as fin:
+                return json.load(fin)
+        except (IOError, ValueError):
+            return {}
+
+    def reserved(self):
+        """Return the memory reserved by running jobs (MB)"""
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.res'):
+                continue
+
+            filename = os.path.join(self.directory, name)
+            try:
+                with open(filename, 'r') as fin:
+                    pid, memory = (int(v) for v in fin.read().split())
+                os.kill(pid, 0)
+            except ProcessLookupError:  # stale reservation
+                os.remove(filename)
+                continue
+            except PermissionError:  # alive, owned by another user
+                pass
+            except (IOError, ValueError):  # being written or removed
+                continue
+            total += memory
+        return total
+
+    def peak(self, key):
+        """Return the observed peak memory of a `key` job (MB) or None"""
+        peaks = self._peaks().get(key)
+        return max(peaks) if peaks else None
+
+    def record(self, key, memory, size=5):
+        """Record the peak `memory` (MB) of a `key` job
+
+        The peak of `key` is the maximum of its `size` last records
+
+        """
+        with self._lock():
+            peaks = self._peaks()
+            peaks[key] = (peaks.get(key, []) + [int(memory)])[-size:]
+
+            tmp = os.path.join(self.directory, 'peaks.json.tmp')
+            with open(tmp, 'w') as fout:
+                json.dump(peaks, fout)
+            os.replace(tmp, os.path.join(self.directory, 'peaks.json'))
+
+    def max_jobs(self, key, njobs, memory=None):
+        """Return how many of `njobs` `key` jobs fit in the free memory
+
+        Return at least 1. `memory` overloads the peak memory of a
+        `key` job.
+
+        """
+        memory = memory or self.peak(key) or self.default
+        free = self.budget - self.reserved()
+        return max(1, min(njobs, free // max(1, memory)))
+
+    @contextlib.contextmanager
+    def admit(self, key, njobs=1, memory=None):
+        """Wait for enough free memory to run `key` jobs
+
+        Block until at least one of the `njobs` jobs fits in the
+        budget, or until no other job is running (so that a job
+        exceeding the budget runs alone). Reserve the memory of the
+        admitted jobs until the context exits.
+
+        Yield the number of admitted jobs, to be run at once
+
+        """
+        memory = memory or self.peak(key) or self.default
+        reservation = os.path.join(
+            self.directory, '{}-{}.res'.format(os.getpid(), uuid.uuid4().hex))
+
+        while True:
+            with self._lock():
+                reserved = self.reserved()
+                free = self.budget - reserved
+                if free >= memory or reserved == 0:
+                    admitted = max(1, min(njobs, free // max(1, memory)))
+                    with open(reservation, 'w') as fout:
+                        fout.write('{} {}'.format(
+                            os.getpid(), admitted * memory))
+                    break
+            time.sleep(self.poll)
+
+        try:
+            yield admitted
+        finally:
+            os.remove(reservation)
 
 
 def run(command, stdin=None, stdout=sys.stdout.write,
-        cwd=None, env=os.environ, returncode=0):
+        cwd=None, env=os.environ, returncode=0,
+        limiter=None, key=None, njobs=1, max_memory=None):
+    """Run 'command' as a subprocess, optionally throttled
+
+    If `limiter` is a MemoryLimiter, wait to be admitted before
+    running the command and record its peak memory once done. `key`
+    identifies the command in the limiter (default to the basename
+    of its executable) and `njobs` is the number of parallel jobs it
+    runs, its run.pl calls are limited to the admitted ones (see
+    throttle_cmd). The other arguments are as in _run().
+
+    """
+    if limiter is None:
+        return _run(command, stdin=stdin, stdout=stdout,
+                    cwd=cwd, env=env, returncode=returncode,
+                    max_memory=max_memory)
+
+    if key is None:
+        key = os.path.basename(shlex.split(command)[0])
+
+    with limiter.admit(key, njobs=njobs) as admitted:
+        if njobs > 1:
+            command = throttle_cmd(command, admitted)
+
+        rusage = _run(command, stdin=stdin, stdout=stdout,
+                      cwd=cwd, env=env, returncode=returncode,
+                      max_memory=max_memory)
+
+    # ru_maxrss is in kB on Linux
+    limiter.record(key, rusage.ru_maxrss // 1024)
+    return rusage
+
+
+def _descendants(pid):
+    """Return the pids of the descendants of the process `pid`
+
+    Read from /proc, return an empty list if /proc is not available
+
+    """
+    children = {}
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', entry, 'stat'), 'r') as fin:
+                # the command name in parentheses may contain spaces
+                ppid = int(fin.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            pids.append(child)
+            stack.append(child)
+    return pids
+
+
+def _memory(pids):
+    """Return the resident memory of the processes `pids` (MB)
+
+    Read from /proc, the processes not found are ignored
+
+    """
+    pages = 0
+    for pid in pids:
+        try:
+            with open(os.path.join('/proc', str(pid), 'statm'), 'r') as fin:
+                pages += int(fin.read().split()[1])
+        except (IOError, IndexError, ValueError):
+            continue
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024**2
+
+
+def _kill(pid):
+    """Terminate the process `pid` and all its descendants"""
+    # stop the processes first so that they cannot fork anymore
+    stopped, pids = [], [pid]
+    while pids:
+        for p in pids:
+            try:
+                os.kill(p, signal.SIGSTOP)
+            except ProcessLookupError:
+                pass
+        stopped += pids
+        pids = [p for p in _descendants(pid) if p not in stopped]
+
+    for p in stopped:
+        for sig in (signal.SIGTERM, signal.SIGCONT):
+            try:
+                os.kill(p, sig)
+            except ProcessLookupError:
+                pass
+
+
+def _run(command, stdin=None, stdout=sys.stdout.write,
+         cwd=None, env=os.environ, returncode=0, max_memory=None):
     """Run 'command' as a subprocess
 
     command : string to be executed as a subprocess
@@ -31,7 +305,9 @@ def run(command, stdin=None, stdout=sys.stdout.write,
         redirect the output to stdout, but you can redirect to a
         logger with stdout=log.debug for exemple. Use
         stdout=open(os.devnull, 'w').write to ignore the command
-        output.
+        output. If it raises an exception, the command and its
+        subprocesses are terminated and the exception is raised
+        again (see logger.KaldiLogClassifier).
 
     stdin : standard input redirection, can be a file or any readable
         stream.
@@ -42,8 +318,13 @@ def run(command, stdin=None, stdout=sys.stdout.write,
 
     returncode : expected return code of the command
 
-    Returns silently if the command returned with `returncode`, else
-    raise a RuntimeError
+    max_memory : if specified, the command and its subprocesses are
+        terminated when their resident memory exceeds `max_memory`
+        MB, and a RuntimeError is raised
+
+    Returns the resource usage of the command (as returned by
+    os.wait4) if it returned with `returncode`, else raise a
+    RuntimeError
 
     """
     job = subprocess.Popen(
@@ -53,22 +334,81 @@ def run(command, stdin=None, stdout=sys.stdout.write,
         stderr=subprocess.STDOUT,
         cwd=cwd, env=env)
 
+    # the job is killed only until it is reaped, as its pid can then be
+    # reused by another process
+    done = threading.Event()
+    reaping = threading.Lock()
+
+    def kill():
+        with reaping:
+            if not done.is_set():
+                _kill(job.pid)
+
     # join the command output to log (from
     # https://stackoverflow.com/questions/35488927)
+    failure = []
+
     def consume_lines(pipe, consume):
         with pipe:
             # NOTE: workaround read-ahead bug
             for line in iter(pipe.readline, b''):
-                line = line.decode()
-                consume(line)
-            consume('\n')
+                if failure:  # drain the pipe until the job is killed
+                    continue
+                try:
+                    consume(line.decode())
+                except Exception as err:
+                    failure.append(err)
+                    kill()
+            if not failure:
+                consume('\n')
 
-    threading.Thread(
+    thread = threading.Thread(
         target=consume_lines,
-        args=[job.stdout, lambda line: stdout(line)]).start()
+        args=[job.stdout, lambda line: stdout(line)])
+    thread.start()
 
-    job.wait()
+    # kill the job if it exceeds max_memory
+    def guard_memory():
+        while not done.wait(MEMORY_POLL):
+            memory = _memory([job.pid] + _descendants(job.pid))
+            if memory > max_memory and not done.is_set():
+                failure.append(RuntimeError(
+                    'command "{}" killed, it uses {} MB and exceeds {} MB'
+                    .format(command, memory, max_memory)))
+                kill()
+                return
+
+    if max_memory:
+        guard = threading.Thread(target=guard_memory)
+        guard.daemon = True
+        guard.start()
+
+    # wait for the job to exit without reaping it, so that its pid is
+    # not reused while being killed, then reap it with wait4 to get
+    # back its resource usage, in particular the peak memory ru_maxrss
+    # of the command and its descendants. Without waitid (on macOS)
+    # the job is reaped at once and a guard checking the memory at
+    # that moment may still signal the reaped pid.
+    if hasattr(os, 'waitid'):
+        os.waitid(os.P_PID, job.pid, os.WEXITED | os.WNOWAIT)
+        with reaping:
+            done.set()
+        _, status, rusage = os.wait4(job.pid, 0)
+    else:
+        _, status, rusage = os.wait4(job.pid, 0)
+        with reaping:
+            done.set()
+    job.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                      else os.WEXITSTATUS(status))
+
+    # wait for the last lines to be consumed, with a timeout in case
+    # an orphan subprocess keeps the pipe open
+    thread.join(timeout=5)
+    if failure:
+        raise failure[0]
 
     if job.returncode != returncode:
         raise RuntimeError('command "{}" returned with {}'
                            .format(command, job.returncode))
+
+    return rusage
@@ -31,13 +31,27 @@ This module implements the following behavior:
 The log file is UTF-8 encoded.
 
 The logs are postprocessed to have a nice log formatting from Kaldi
-logs (stripping messages, deleting empty ones, etc.)
+logs (stripping messages, deleting empty ones, etc.). The Kaldi
+messages are classified by the KaldiLogClassifier, that logs them
+according to their Kaldi level.
 
 """
 
+import collections
 import logging
 import os
+import re
 import sys
+import threading
+
+
+# the level prefix of Kaldi messages, as in "WARNING (program[version]:
+# function():file.cc:42) message"
+_KALDI_LEVEL = re.compile(
+    r'^\s*(LOG|VLOG\[\d+\]|WARNING|ERROR|ASSERTION_FAILED) \(')
+
+# serializes the reading of Kaldi log files by concurrent commands
+_READ_LOGS_LOCK = threading.Lock()
 
 
 class LevelFilter(logging.Filter):
@@ -90,6 +104,134 @@ class NoLocalSubdirNotFound(logging.Filter):
         return "'local' subdirectory not found." not in record.getMessage()
 
 
+def kaldi_level(line):
+    """Return the level of a Kaldi message, None if not a Kaldi message
+
+    The level is one of LOG, VLOG, WARNING or ERROR (assertion
+    failures are errors). Only the prefix of the message is
+    considered, so that a warning reporting an error is a warning.
+
+    """
+    match = _KALDI_LEVEL.match(line)
+    if match is None:
+        return None
+
+    level = match.group(1)
+    if level.startswith('VLOG'):
+        return 'VLOG'
+    return 'ERROR' if level == 'ASSERTION_FAILED' else level
+
+
+class KaldiLogClassifier(object):
+    """Log Kaldi messages according to their level and count them
+
+    A classifier is called on each line output by a Kaldi command
+    (it can be given as the stdout argument of utils.jobs.run). The
+    WARNING and ERROR messages are sent to `log` as warnings and
+    errors, the other lines as debug messages.
+
+    Parameters:
+    -----------
+
+    log (logging.Logger): where to send the messages
+
+    max_warnings, max_errors (int): if specified, raise a
+        RuntimeError as soon as the number of warnings (respectively
+        errors) exceeds that threshold
+
+    counts (collections.Counter): the number of messages per level,
+        updated by the classifier. Share it between classifiers to
+        count messages (and apply thresholds) over several commands.
+
+    offsets (dict): log file -> number of bytes already read by
+        read_logs(), updated by the classifier. Share it between
+        classifiers so that a log file is read only once by
+        concurrent commands.
+
+    """
+    def __init__(self, log=None, max_warnings=None, max_errors=None,
+                 counts=None, offsets=None):
+        self.log = log or null_logger()
+        self.max_warnings = max_warnings
+        self.max_errors = max_errors
+        self.counts = collections.Counter() if counts is None else counts
+        self.offsets = {} if offsets is None else offsets
+
+    def __call__(self, line):
+        self.classify(line)
+        self.check()
+
+    def classify(self, line, prefix=''):
+        """Count and log the message `line`, return its level"""
+        level = kaldi_level(line)
+        if level:
+            self.counts[level] += 1
+
+        if level == 'ERROR':
+            self.log.error(prefix + line)
+        elif level == 'WARNING':
+            self.log.warning(prefix + line)
+        else:
+            self.log.debug(prefix + line)
+        return level
+
+    def check(self):
+        """Raise RuntimeError if a threshold is exceeded"""
+        for level, threshold in (('WARNING', self.max_warnings),
+                                 ('ERROR', self.max_errors)):
+            if threshold is not None and self.counts[level] > threshold:
+                raise RuntimeError(
+                    'too many Kaldi {} messages: {} (threshold is {})'
+                    .format(level, self.counts[level], threshold))
+
+    def read_logs(self, directory, since=None):
+        """Classify the warnings and errors in Kaldi log files
+
+        The log files are the `directory`/exp/**/log/*.log files
+        written by the Kaldi jobs (as in exp/<model>/log), the
+        symbolic links are not followed. Only the files modified
+        after the `since` timestamp are read, each from the offset
+        where it was last read (see `offsets`), so that a message is
+        classified only once. The messages are prefixed by the log
+        file name. The thresholds are not checked, call check() for
+        that.
+
+        """
+        with _READ_LOGS_LOCK:
+            for log_file in _log_files(os.path.join(directory, 'exp')):
+                if since is not None and os.path.getmtime(log_file) < since:
+                    continue
+
+                offset = self.offsets.get(log_file, 0)
+                if os.path.getsize(log_file) < offset:  # rewritten
+                    offset = 0
+
+                prefix = os.path.relpath(log_file, directory) + ': '
+                with open(log_file, 'rb') as fin:
+                    fin.seek(offset)
+                    for line in fin:
+                        # a partial line is read once completed
+                        if not line.endswith(b'\n'):
+                            break
+                        offset += len(line)
+
+                        line = line.decode('utf8', errors='replace')
+                        if kaldi_level(line) in ('WARNING', 'ERROR'):
+                            self.classify(line.rstrip('\n'), prefix=prefix)
+                self.offsets[log_file] = offset
+
+
+def _log_files(directory):
+    """Return the sorted */log/*.log files in `directory`"""
+    files = []
+    for root, dirs, names in os.walk(directory, followlinks=False):
+        dirs.sort()
+        if os.path.basename(root) == 'log':
+            files.extend(os.path.join(root, name) for name in names
+                         if name.endswith('.log'))
+    return sorted(files)
+
+
 def get_log(log_file=os.devnull, verbose=False, header_in_stdout=False):
     """Return a configured logger
 
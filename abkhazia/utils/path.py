@@ -14,10 +14,14 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides path/files related functions usefull to abkhazia"""
 
+import collections
 import os
-import re
 import shutil
 
+import joblib
+
+from .misc import natural_sort_keys
+
 
 def list_directory(directory, abspath=False):
     """Return os.listdir(directory) with .DS_Store filtered out"""
@@ -27,9 +31,87 @@ def list_directory(directory, abspath=False):
     return lsd
 
 
+# cache of directory walks, maps (directory, recursive) to a tuple
+# (mtimes, files, links) where mtimes is a dict directory ->
+# st_mtime_ns. Only the WALK_CACHE_SIZE most recently used walks are
+# kept.
+_WALK_CACHE = collections.OrderedDict()
+
+WALK_CACHE_SIZE = 4
+"""Maximal number of directory walks kept by list_files_with_extension"""
+
+
+def clear_walk_cache():
+    """Forget the directory walks cached by list_files_with_extension"""
+    _WALK_CACHE.clear()
+
+
+def _scan_directory(directory, with_dirs=False):
+    """Return the (files, links, subdirectories) in `directory`
+
+    Mimics os.walk: symbolic links to directories are neither listed
+    as files nor followed. `links` are the files being symbolic links.
+    If `with_dirs` is True, mimics os.listdir instead: the
+    directories and links to directories are listed as files as well.
+
+    """
+    files, links, subdirs = [], [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if not is_dir or with_dirs:
+                files.append(entry.path)
+                if entry.is_symlink():
+                    links.append(entry.path)
+            if is_dir and not entry.is_symlink():
+                subdirs.append(entry.path)
+    return files, links, subdirs
+
+
+def _walk(directory, recursive=True, njobs=1):
+    """Return (mtimes, files, links) for all the files under `directory`
+
+    The directories are scanned level by level, the ones of a same
+    level in parallel on `njobs` threads. `mtimes` maps each scanned
+    directory to its modification time. If not `recursive`, only
+    `directory` is scanned and its subdirectories are listed in
+    `files`, as with os.listdir.
+
+    """
+    mtimes, files, links = {}, [], set()
+    level = [directory]
+    with joblib.Parallel(n_jobs=njobs, backend='threading') as parallel:
+        while level:
+            mtimes.update((d, os.stat(d).st_mtime_ns) for d in level)
+            scanned = parallel(
+                joblib.delayed(_scan_directory)(d, not recursive)
+                for d in level)
+
+            level = []
+            for _files, _links, _subdirs in scanned:
+                files += _files
+                links.update(_links)
+                if recursive:
+                    level += _subdirs
+    return mtimes, files, links
+
+
+def _is_up_to_date(mtimes):
+    """Return True if none of the directories in `mtimes` changed"""
+    try:
+        return all(os.stat(d).st_mtime_ns == m for d, m in mtimes.items())
+    except OSError:
+        return False
+
+
 def list_files_with_extension(
         directory, extension,
-        abspath=False, realpath=True, recursive=True):
+        abspath=False, realpath=True, recursive=True,
+        njobs=1, cache=False, natural_sort=False):
     """Return all files of given extension in directory hierarchy
 
     The files are returned in a sorted list with a path relative to
@@ -42,24 +124,47 @@ def list_files_with_extension(
     If `recursive` is True, list files in the whole subdirectories
         structure, if False just list the top-level directory
 
+    `njobs` is the number of threads scanning the directories in
+        parallel, this mainly helps on network file systems
+
+    If `cache` is True, the directory walk is kept in memory and
+        reused by the next calls on the same `directory` (whatever
+        the `extension`) as long as no directory in the hierarchy has
+        been modified. Only the WALK_CACHE_SIZE last walks are kept,
+        see also clear_walk_cache()
+
+    If `natural_sort` is True, sort the files in human order (see
+        natural_sort_keys), else in lexicographic order
+
     """
-    # the regular expression to match in filenames
-    expr = r'(.*)' + extension + '$'
-
-    # build the list of matching files
-    matched = []
-    if recursive:
-        for path, _, files in os.walk(directory):
-            matched += [os.path.join(path, f)
-                        for f in files if re.match(expr, f)]
+    key = (directory, recursive)
+    if cache and key in _WALK_CACHE and _is_up_to_date(_WALK_CACHE[key][0]):
+        _, files, links = _WALK_CACHE[key]
+        _WALK_CACHE.move_to_end(key)
     else:
-        matched = [os.path.join(directory, f)
-                   for f in os.listdir(directory) if re.match(expr, f)]
+        mtimes, files, links = _walk(
+            directory, recursive=recursive, njobs=njobs)
+        if cache:
+            _WALK_CACHE[key] = (mtimes, files, links)
+            _WALK_CACHE.move_to_end(key)
+            while len(_WALK_CACHE) > WALK_CACHE_SIZE:
+                _WALK_CACHE.popitem(last=False)
+
+    matched = [f for f in files if f.endswith(extension)]
 
-    if abspath:
-        matched = [os.path.abspath(m) for m in matched]
     if realpath:
-        matched = [os.path.realpath(m) for m in matched]
+        # the walk does not follow links to directories, so only the
+        # root directory and the links to files need to be resolved
+        root = os.path.realpath(directory)
+        matched = [
+            os.path.realpath(m) if m in links
+            else os.path.join(root, m[len(directory):].lstrip(os.sep))
+            for m in matched]
+    elif abspath:
+        matched = [os.path.abspath(m) for m in matched]
+
+    if natural_sort:
+        return sorted(matched, key=natural_sort_keys)
     return sorted(matched)
 
 
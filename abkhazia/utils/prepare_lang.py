@@ -12,14 +12,83 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
-"""Wrapper on the Kaldi wsj/utils/prepare_lang.sh script"""
+"""Wrapper on the Kaldi wsj/utils/prepare_lang.sh script
+
+The lang directories are cached in the abkhazia tmp-directory (see
+abkhazia.utils.cache), keyed by the dictionary files given to
+prepare_lang.sh, the script itself and its parameters. The language,
+acoustic, align and decode steps on a same corpus then build L.fst
+only once.
+
+"""
 
 import os
+import shutil
+import tempfile
 
-from abkhazia.utils import logger, jobs, bool2str, remove
+from abkhazia.utils import logger, jobs, bool2str, str2bool, remove, cache
 from abkhazia.kaldi import kaldi_path, Abkhazia2Kaldi
 
 
+DICT_FILES = ('lexicon.txt', 'nonsilence_phones.txt', 'silence_phones.txt',
+              'optional_silence.txt', 'extra_questions.txt')
+"""The files read by prepare_lang.sh in the dict directory"""
+
+LANG_FILES = ('L.fst', 'L_disambig.fst', 'oov.int', 'oov.txt', 'phones',
+              'phones.txt', 'topo', 'words.txt')
+"""The files and directories written by prepare_lang.sh"""
+
+
+class LangCache(object):
+    """Cache of the lang directories written by prepare_lang.sh
+
+    Parameters:
+    -----------
+
+    dict_dir (path): the dict directory given to prepare_lang.sh,
+      with the files in DICT_FILES
+
+    script (path): the prepare_lang.sh script to run
+
+    level, silence_probability, position_dependent_phones: the
+      parameters of prepare_lang(), see there
+
+    """
+    def __init__(self, dict_dir, script, level, silence_probability,
+                 position_dependent_phones):
+        self.cache = cache.FileCache('lang')
+        self.key = cache.hash_files(
+            script,
+            *(os.path.join(dict_dir, f) for f in DICT_FILES
+              if os.path.isfile(os.path.join(dict_dir, f))),
+            extra=[level, float(silence_probability),
+                   bool2str(str2bool(position_dependent_phones))])
+
+    def get(self, output_dir):
+        """Copy a cached lang directory to `output_dir`
+
+        Return False if the lang directory is not cached.
+
+        """
+        return self.cache.get(self.key, output_dir)
+
+    def put(self, output_dir):
+        """Cache the lang directory prepared in `output_dir`"""
+        tmpdir = tempfile.mkdtemp(dir=self.cache.directory, prefix='.tmp')
+        try:
+            entry = os.path.join(tmpdir, 'lang')
+            os.makedirs(entry)
+            for name in LANG_FILES:
+                origin = os.path.join(output_dir, name)
+                if os.path.isdir(origin):
+                    shutil.copytree(origin, os.path.join(entry, name))
+                elif os.path.isfile(origin):
+                    shutil.copy(origin, entry)
+            self.cache.put(self.key, entry)
+        finally:
+            remove(tmpdir, safe=True)
+
+
 def prepare_lang(
         corpus,
         output_dir,
@@ -27,6 +96,7 @@ def prepare_lang(
         silence_probability=0.5,
         position_dependent_phones=False,
         keep_tmp_dirs=False,
+        use_cache=True,
         log=logger.null_logger()):
     """Wrapper on the Kaldi wsj/utils/prepare_lang.sh script
 
@@ -59,14 +129,19 @@ def prepare_lang(
       directories 'recipe' and 'local' in `output_dir`, if false
       remove them before returning.
 
+    use_cache (bool): default to True. If true, reuse the lang
+      directory prepared in a previous run with the same lexicon,
+      phones and parameters.
+
     log (logger.Logging): the logger instance where to send messages,
       default is too disable the log.
 
     Return:
     -------
 
-    The return code of the Kaldi prepare_lang script. 0 for success,
-    any other for error.
+    The resource usage of the Kaldi prepare_lang script (as returned by
+    abkhazia.utils.jobs.run, raising on error), None if the lang
+    directory has been found in cache.
 
     """
     output_dir = os.path.abspath(output_dir)
@@ -79,8 +154,6 @@ def prepare_lang(
     a2k.setup_phones()
     a2k.setup_silences()
     a2k.setup_variants()
-    a2k.setup_kaldi_folders()
-    a2k.setup_machine_specific_scripts()
 
     if level == 'word':
         a2k.setup_lexicon()
@@ -104,6 +177,20 @@ def prepare_lang(
               if level == 'phone' and position_dependent_phones
               else script_prepare_lm)
 
+    lang_cache = None
+    if use_cache:
+        lang_cache = LangCache(
+            a2k._local_path(), script, level,
+            silence_probability, position_dependent_phones)
+        if lang_cache.get(output_dir):
+            log.info('lexicon found in cache')
+            if not keep_tmp_dirs:
+                remove(a2k.recipe_dir)
+            return None
+
+    a2k.setup_kaldi_folders()
+    a2k.setup_machine_specific_scripts()
+
     # generate the bash command we will run
     command = (
         script + ' --position-dependent-phones {wpd}'
@@ -114,11 +201,15 @@ def prepare_lang(
             temp=os.path.join(output_dir, 'local'),
             output=output_dir))
 
-    # run the command in Kaldi and forward its return code
+    # run the command in Kaldi and forward its resource usage
     log.info('running "%s"', command)
     try:
-        return jobs.run(
+        result = jobs.run(
             command, cwd=a2k.recipe_dir, env=kaldi_path(), stdout=log.debug)
+        # jobs.run raises on error, the lang directory is complete
+        if lang_cache:
+            lang_cache.put(output_dir)
+        return result
     finally:
         if not keep_tmp_dirs:
             remove(a2k.recipe_dir)
@@ -0,0 +1,215 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Record timed spans of the abkhazia processing steps
+
+The span context manager (and the traced decorator) records the
+wall time and the resource usage of a block of code, such as a Kaldi
+command, a corpus loading or a wav conversion. Tracing is disabled by
+default, a span is then a no-op, enable it with enable().
+
+The recorded spans are exported in the Chrome trace format, to be
+viewed in chrome://tracing or https://ui.perfetto.dev, with
+export_chrome(). As the spans are timestamped with the wall clock,
+the traces of successive abkhazia commands appended to the same file
+make a trace of the whole pipeline. The summary() function returns a
+text summary of the spans.
+
+From the command line, use 'abkhazia --trace <file> <command> ...'.
+
+"""
+
+import collections
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+
+Span = collections.namedtuple(
+    'Span', 'name category start duration pid tid args utime stime maxrss')
+"""A recorded span
+
+name, category (str): the span name and category
+
+start, duration (float): wall clock start time and duration (s)
+
+pid, tid (int): the process and thread that recorded the span
+
+args (dict): arguments attached to the span
+
+utime, stime (float): user and system CPU time (s) of the process
+    and its terminated children during the span (including the other
+    threads of the process)
+
+maxrss (int): peak resident memory of the process or of its largest
+    child at the end of the span (MB)
+
+"""
+
+
+# the recorded spans, None when tracing is disabled
+_SPANS = None
+
+
+def enable():
+    """Enable tracing, keep the spans already recorded if any"""
+    global _SPANS
+    if _SPANS is None:
+        _SPANS = []
+
+
+def disable():
+    """Disable tracing and forget the recorded spans"""
+    global _SPANS
+    _SPANS = None
+
+
+def enabled():
+    """Return True if tracing is enabled"""
+    return _SPANS is not None
+
+
+def spans():
+    """Return the list of recorded spans"""
+    return list(_SPANS or [])
+
+
+def _rusage():
+    self = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self.ru_utime + children.ru_utime,
+            self.ru_stime + children.ru_stime,
+            max(self.ru_maxrss, children.ru_maxrss))
+
+
+class span(object):
+    """Record the block of code under `name` when tracing is enabled
+
+    Additional keyword arguments are attached to the span.
+
+    >>> with span('load corpus', category='corpus', path=corpus_dir):
+    ...     corpus = Corpus.load(corpus_dir)
+
+    """
+    __slots__ = ('name', 'category', 'args', '_start', '_rusage')
+
+    def __init__(self, name, category='abkhazia', **args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self._start = None
+
+    def __enter__(self):
+        if _SPANS is not None:
+            self._rusage = _rusage()
+            self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is None or _SPANS is None:
+            return False
+
+        duration = time.time() - self._start
+        utime, stime, maxrss = _rusage()
+        _SPANS.append(Span(
+            self.name, self.category, self._start, duration,
+            os.getpid(), threading.get_ident(), self.args,
+            utime - self._rusage[0], stime - self._rusage[1],
+            maxrss // 1024))  # ru_maxrss is in kB on Linux
+        self._start = None
+        return False
+
+
+def traced(name=None, category='abkhazia'):
+    """Decorator recording the calls of a function as spans
+
+    The span name defaults to the function qualified name
+
+    """
+    def decorator(function):
+        _name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _SPANS is None:
+                return function(*args, **kwargs)
+            with span(_name, category=category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_chrome(filename, process_name=None, append=True):
+    """Write the recorded spans to `filename` in Chrome trace format
+
+    If `append` is True and `filename` exists, the spans are appended
+    to the events it already contains. `process_name` labels the
+    current process in the trace viewer.
+
+    """
+    events = []
+    if append and os.path.isfile(filename):
+        with open(filename, 'r') as fin:
+            events = json.load(fin)['traceEvents']
+
+    if process_name:
+        events.append({
+            'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+            'args': {'name': process_name}})
+
+    for s in spans():
+        args = dict((k, str(v)) for k, v in s.args.items())
+        args.update(
+            utime='{:.3f}'.format(s.utime),
+            stime='{:.3f}'.format(s.stime),
+            maxrss='{} MB'.format(s.maxrss))
+        events.append({
+            'name': s.name, 'cat': s.category, 'ph': 'X',
+            'ts': int(s.start * 1e6), 'dur': int(s.duration * 1e6),
+            'pid': s.pid, 'tid': s.tid, 'args': args})
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as fout:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fout)
+    os.replace(tmp, filename)
+
+
+def summary():
+    """Return a text summary of the recorded spans
+
+    The spans are grouped by category and name and sorted by
+    decreasing total duration. Nested spans are counted in their
+    parent as well.
+
+    """
+    groups = collections.OrderedDict()
+    for s in spans():
+        groups.setdefault((s.category, s.name), []).append(s)
+
+    lines = ['{:<10} {:<40} {:>6} {:>10} {:>10} {:>10} {:>8}'.format(
+        'category', 'name', 'calls', 'wall (s)', 'user (s)', 'sys (s)',
+        'rss (MB)')]
+    for (category, name), group in sorted(
+            groups.items(), key=lambda g: -sum(s.duration for s in g[1])):
+        lines.append(
+            '{:<10} {:<40} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>8}'.format(
+                category, name[-40:], len(group),
+                sum(s.duration for s in group),
+                sum(s.utime for s in group),
+                sum(s.stime for s in group),
+                max(s.maxrss for s in group)))
+    return '\n'.join(lines)
@@ -21,30 +21,51 @@ that is 16 bits, 16 kHz mono wav files.
 
 import collections
 import contextlib
+import itertools
+import math
 import os
 import shlex
 import shutil
+import struct
 import subprocess
+import time
 import wave
 
 import joblib
-from . import config
+import numpy as np
 
+from . import config, logger, trace
+from .path import remove
 
-def wav2wav(wav_in, wav_out, copy=True):
+
+def wav2wav(wav_in, wav_out, copy=True, native=True):
     """Copy/link an input wav file
 
     If the input wav if not 16 bit, 16 kHz or mono it will be
     converted, else if `copy` is True, copy the file, else symlink it.
 
+    If `native` is True, PCM wavs are converted in process (see
+    pcm2wav), else or for other encodings, they are converted by sox.
+
     """
-    info = _scan_one(wav_in)
-    if info.rate != 16000 or info.nbc != 1 or info.width != 2:
+    try:
+        info = _scan_one(wav_in)
+        exotic = info.comptype != 'NONE'
+    except wave.Error:  # not a valid wav file
+        exotic = True
+
+    if exotic or info.rate != 16000 or info.nbc != 1 or info.width != 2:
+        if native and not exotic:
+            try:
+                return pcm2wav(wav_in, wav_out)
+            except wave.Error:  # PCM layout unsupported by wave
+                pass
+
         # convert the file to the desired audio format
         command = ('sox -c 1 -b 16 {} -t wav {} rate 16k'
                    .format(wav_in, wav_out))
 
-        subprocess.call(shlex.split(command))
+        subprocess.check_call(shlex.split(command))
 
     elif copy:
         shutil.copy(wav_in, wav_out)
@@ -52,6 +73,150 @@ def wav2wav(wav_in, wav_out, copy=True):
         os.symlink(wav_in, wav_out)
 
 
+PCM_CHUNK_SIZE = 2**16
+"""Number of frames read at once when converting PCM wavs in process"""
+
+
+def _decode_pcm(raw, width, nchannels):
+    """Return PCM frames `raw` as a float array (nframes, nchannels)
+
+    The values are scaled to the 16 bits range, whatever the sample
+    `width` of the input.
+
+    """
+    if width == 1:  # 8 bits wavs are unsigned
+        data = (np.frombuffer(raw, dtype=np.uint8) - 128.) * 256
+    elif width == 2:
+        data = np.frombuffer(raw, dtype='<i2').astype(np.float64)
+    elif width == 3:
+        # 24 bits little endian, extend the sign of the most significant
+        # byte on 32 bits
+        b = np.frombuffer(raw, dtype=np.uint8).reshape((-1, 3))
+        data = (b[:, 0].astype(np.int32) | b[:, 1].astype(np.int32) << 8
+                | b[:, 2].astype(np.int8).astype(np.int32) << 16) / 256.
+    elif width == 4:
+        data = np.frombuffer(raw, dtype='<i4') / 65536.
+    else:
+        raise wave.Error('unsupported sample width {}'.format(width))
+
+    return data.reshape((-1, nchannels))
+
+
+def _read_pcm(fin, chunk_size=PCM_CHUNK_SIZE):
+    """Yield the frames of the opened PCM wav `fin` by chunks
+
+    Each chunk is a float array of shape (nframes, nchannels), see
+    _decode_pcm.
+
+    """
+    width, nchannels = fin.getsampwidth(), fin.getnchannels()
+    while True:
+        raw = fin.readframes(chunk_size)
+        if not raw:
+            return
+        yield _decode_pcm(raw, width, nchannels)
+
+
+def resample_chunks(chunks, nin, rate_in, rate_out,
+                    half_width=16, beta=8.0, chunk_size=8192):
+    """Resample a 1D signal given by chunks from `rate_in` to `rate_out`
+
+    `chunks` is an iterable of 1D arrays, the signal being their
+    concatenation of `nin` samples. Yield the resampled signal by
+    chunks of at most `chunk_size` samples, so that the memory usage
+    is bounded by the size of the input and output chunks.
+
+    This is a polyphase band-limited interpolation with a sinc filter
+    of `half_width` zero-crossings on each side, tapered by a Kaiser
+    window of parameter `beta`. When downsampling, the filter cutoff
+    is lowered to the output Nyquist frequency to prevent aliasing.
+
+    """
+    if rate_in == rate_out:
+        for chunk in chunks:
+            yield chunk
+        return
+
+    # the output sample k is at the position k * down / up on the input
+    # timeline, so there is only `up` distinct filter phases
+    gcd = math.gcd(rate_in, rate_out)
+    up, down = rate_out // gcd, rate_in // gcd
+
+    # cutoff relatively to the input Nyquist frequency, with a little
+    # rolloff to attenuate aliasing around the output Nyquist
+    cutoff = 0.95 * min(1., rate_out / rate_in)
+    width = int(np.ceil(half_width / cutoff))
+    offsets = np.arange(-width + 1, width + 1)
+
+    # the filter coefficients for each phase
+    delta = np.arange(up)[:, None] / up - offsets[None, :]
+    window = np.i0(beta * np.sqrt(np.clip(
+        1 - (delta / width) ** 2, 0, 1))) / np.i0(beta)
+    table = cutoff * np.sinc(cutoff * delta) * window
+
+    # the input is padded with `width` zeros before and `width + 1`
+    # after, `buffer` holds its samples from the index `first`
+    nout = int(np.ceil(nin * up / down))
+    buffer, first, k = np.zeros(width), 0, 0
+    for chunk in itertools.chain(chunks, [np.zeros(width + 1)]):
+        buffer = np.concatenate((buffer, chunk))
+
+        # the output k needs the padded input up to k * down // up +
+        # 2 * width, compute all the outputs available in buffer
+        last = first + len(buffer) - 2 * width
+        kmax = min(nout, -(-last * up // down)) if last > 0 else 0
+        for start in range(k, kmax, chunk_size):
+            position = np.arange(start, min(start + chunk_size, kmax)) * down
+            base, phase = position // up, position % up
+            index = base[:, None] + offsets[None, :] + width - first
+            yield np.einsum('ij,ij->i', buffer[index], table[phase])
+        k = kmax
+
+        # forget the samples no more needed by the next outputs
+        drop = min(len(buffer), (k * down) // up + 1 - first)
+        buffer, first = buffer[drop:], first + drop
+
+
+def resample(data, rate_in, rate_out,
+             half_width=16, beta=8.0, chunk_size=8192):
+    """Resample a 1D signal from `rate_in` to `rate_out`
+
+    See resample_chunks for details.
+
+    """
+    if rate_in == rate_out:
+        return data
+
+    return np.concatenate(list(resample_chunks(
+        [data], len(data), rate_in, rate_out, half_width=half_width,
+        beta=beta, chunk_size=chunk_size)))
+
+
+def pcm2wav(wav_in, wav_out, chunk_size=PCM_CHUNK_SIZE):
+    """Convert a PCM wav file to 16 bits, 16 kHz mono in process
+
+    Channels are averaged, the signal is resampled to 16 kHz and
+    rounded to 16 bits. This is a numpy equivalent of 'sox -c 1 -b 16
+    wav_in -t wav wav_out rate 16k' for PCM inputs, without
+    dithering. The file is streamed by chunks of `chunk_size` frames.
+    Raise wave.Error if `wav_in` is not a PCM wav.
+
+    """
+    with contextlib.closing(wave.open(wav_in, 'r')) as fin:
+        rate, nin = fin.getframerate(), fin.getnframes()
+        if fin.getsampwidth() not in (1, 2, 3, 4):
+            raise wave.Error(
+                'unsupported sample width {}'.format(fin.getsampwidth()))
+
+        with contextlib.closing(wave.open(wav_out, 'w')) as fout:
+            fout.setparams((1, 2, 16000, 0, 'NONE', 'not compressed'))
+            for data in resample_chunks(
+                    (d.mean(axis=1) for d in _read_pcm(fin, chunk_size)),
+                    nin, rate, 16000):
+                fout.writeframes(np.clip(
+                    np.round(data), -2**15, 2**15 - 1).astype('<i2').tobytes())
+
+
 # a little trick to send wav2wav to joblib
 def _wav2wav_link(i, o):
     return wav2wav(i, o, copy=False)
@@ -76,7 +241,7 @@ def flac2wav(flac, wav):
     command = ('sox -c 1 -b 16 {} -t wav {} rate 16k'
                .format(flac, wav))
 
-    subprocess.call(shlex.split(command))
+    subprocess.check_call(shlex.split(command))
 
 
 def sph2wav(sph, wav):
@@ -97,7 +262,7 @@ def sph2wav(sph, wav):
         raise OSError('sph2pipe not found on your system')
 
     command = sph2pipe + ' -f wav {} {}'.format(sph, wav)
-    subprocess.call(shlex.split(command))
+    subprocess.check_call(shlex.split(command))
 
 
 def shn2wav(shn, wav):
@@ -128,10 +293,89 @@ def shn2wav(shn, wav):
 
     ps = subprocess.Popen(shlex.split(command1), stdout=subprocess.PIPE)
     subprocess.check_output(shlex.split(command2), stdin=ps.stdout)
-    ps.wait()
+    if ps.wait() != 0:
+        raise subprocess.CalledProcessError(ps.returncode, command1)
+
+
+def fingerprint(filename):
+    """Return a string identifying the current state of `filename`
+
+    The fingerprint is made of the file size and modification time, so
+    it changes each time the file is modified.
+
+    """
+    stat = os.stat(filename)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def load_fingerprints(filename):
+    """Return the fingerprints saved in `filename` as a dict
+
+    The returned dict maps each converted output file to a tuple
+    (input, input fingerprint, output fingerprint, fileformat). Return
+    an empty dict if `filename` does not exist.
+
+    """
+    if filename is None or not os.path.isfile(filename):
+        return {}
+
+    fingerprints = {}
+    for line in open(filename, 'r'):
+        entry = line.rstrip('\n').split('\t')
+        fingerprints[entry[0]] = tuple(entry[1:])
+    return fingerprints
+
+
+def save_fingerprints(filename, fingerprints):
+    """Write the `fingerprints` dict to `filename`, overwrite it if needed"""
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as fout:
+        for output, entry in sorted(fingerprints.items()):
+            fout.write('\t'.join((output,) + tuple(entry)) + '\n')
+    os.replace(tmp, filename)
+
+
+def _is_up_to_date(entry, i, o, fileformat):
+    """Return True if the output `o` has been converted from the current `i`"""
+    try:
+        return entry == (i, fingerprint(i), fingerprint(o), fileformat)
+    except OSError:  # output not found
+        return False
+
 
+def _convert_batch(fnc, batch, retries):
+    """Convert a batch of (input, output) files, retry on failure
 
-def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False):
+    Return a list of (output, latency) pairs, raise RuntimeError when
+    a conversion still fails after `retries` retries.
+
+    """
+    latencies = []
+    for i, o in batch:
+        for attempt in range(retries + 1):
+            tstart = time.time()
+            try:
+                # remove any partial output from a previous attempt
+                remove(o, safe=True)
+                fnc(i, o)
+                if not os.path.isfile(o) or os.path.getsize(o) == 0:
+                    raise IOError('empty output file {}'.format(o))
+                latencies.append((o, time.time() - tstart))
+                break
+            except (OSError, subprocess.CalledProcessError) as err:
+                if attempt == retries:
+                    remove(o, safe=True)
+                    raise RuntimeError(
+                        'failed to convert {} after {} attempts: {}'
+                        .format(i, retries + 1, err))
+                time.sleep(0.1 * 2 ** attempt)
+    return latencies
+
+
+@trace.traced(category='wav')
+def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False,
+            fingerprints=None, batch_size=None, retries=2,
+            log=logger.null_logger()):
     """Convert a range of audio files to the wav format
 
     inputs: list of input files to convert
@@ -141,14 +385,32 @@ def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False):
     fileformat: audio format of the input files, must be in
         {wav, flac, sph, shn}
 
-    njobs: the number of parallel conversions
+    njobs: the number of parallel conversions, each job being a
+        worker process
 
     copy: only for wavs input, see wav2wav
 
+    fingerprints: a file where to save the fingerprints of the
+        converted files. If specified, the outputs already converted
+        from the current version of their input are not converted
+        again.
+
+    batch_size: the number of files converted by a job at once. By
+        default many small batches are sent to each worker.
+
+    retries: number of times a failed conversion is retried before
+        raising a RuntimeError
+
+    log: where to send the conversion report, including latency
+        percentiles
+
     We must have len(inputs) == len(wavs), all files in inputs must
     exist. For details on the verbose level, please refeer to the
     joblib documentation.
 
+    Return a dict mapping the converted outputs to their conversion
+    latency in seconds (outputs up to date are not included).
+
     """
     # mapping from file format to conversion function
     try:
@@ -170,26 +432,176 @@ def convert(inputs, outputs, fileformat, njobs=1, verbose=0, copy=False):
         if not os.path.isfile(i):
             raise IOError('input file does not exist: {}'.format(i))
 
+    # skip the outputs already converted from their current input
+    fileformat_id = fileformat + ('-copy' if copy else '')
+    saved = load_fingerprints(fingerprints)
+    todo = [(i, os.path.abspath(o)) for i, o in zip(inputs, outputs)
+            if not _is_up_to_date(
+                saved.get(os.path.abspath(o)), i, o, fileformat_id)]
+    if len(todo) != len(inputs):
+        log.debug('skipping %s files already converted',
+                  len(inputs) - len(todo))
+    if not todo:
+        return {}
+
+    # split the files to convert in batches, by default 4 batches
+    # per job and at most 64 files per batch
+    if batch_size is None:
+        batch_size = max(1, min(64, len(todo) // (4 * njobs)))
+    batches = [todo[n:n+batch_size] for n in range(0, len(todo), batch_size)]
+
     # convert files in parallel
-    joblib.Parallel(
-        n_jobs=njobs, verbose=verbose, backend='threading')(
-            joblib.delayed(fnc)(i, o) for i, o in zip(inputs, outputs))
+    latencies = dict(itertools.chain.from_iterable(
+        joblib.Parallel(n_jobs=njobs, verbose=verbose)(
+            joblib.delayed(_convert_batch)(fnc, batch, retries)
+            for batch in batches)))
+
+    # save the fingerprints of the converted files
+    if fingerprints is not None:
+        for i, o in todo:
+            saved[o] = (i, fingerprint(i), fingerprint(o), fileformat_id)
+        save_fingerprints(fingerprints, saved)
+
+    percentiles = np.percentile(list(latencies.values()), [50, 90, 99, 100])
+    log.debug(
+        'converted %s files, latency per file: '
+        'p50=%.3fs p90=%.3fs p99=%.3fs max=%.3fs',
+        len(latencies), *percentiles)
+
+    return latencies
 
 
 _metawav = collections.namedtuple(
     '_metawav', 'nbc width rate nframes comptype compname duration')
 
 
+# wav format tags for PCM data
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_header(wav, header_size=4096):
+    """Return (nbc, width, rate, nframes, format) read from a wav header
+
+    Only the RIFF, fmt and data chunk headers are read and validated,
+    with a single read of `header_size` bytes (unless other chunks
+    fill that first block). `width` is in bytes and `format` is the
+    wav format tag (1 for PCM). When the data chunk size exceeds the
+    file size (truncated or streamed wav), `nframes` is computed from
+    the available data.
+
+    Raise wave.Error if the header is not valid.
+
+    """
+    fd = os.open(wav, os.O_RDONLY)
+    try:
+        filesize = os.fstat(fd).st_size
+        buf, base = os.pread(fd, header_size, 0), 0
+        if len(buf) < 12 or buf[:4] != b'RIFF' or buf[8:12] != b'WAVE':
+            raise wave.Error('{}: not a RIFF/WAVE file'.format(wav))
+
+        fmt = None
+        offset = 12
+        while offset + 8 <= filesize:
+            # make sure the chunk header and the fmt body are buffered
+            if offset + 48 > base + len(buf) and base + len(buf) < filesize:
+                buf, base = os.pread(fd, header_size, offset), offset
+            if offset + 8 > base + len(buf):
+                break
+
+            chunk_id = buf[offset - base:offset - base + 4]
+            chunk_size = struct.unpack_from('<I', buf, offset - base + 4)[0]
+
+            if chunk_id == b'fmt ':
+                if chunk_size < 16 or offset + 24 > base + len(buf):
+                    raise wave.Error('{}: bad fmt chunk'.format(wav))
+                tag, nbc, rate, _, align, bits = struct.unpack_from(
+                    '<HHIIHH', buf, offset - base + 8)
+                if (tag == _WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40
+                        and offset + 34 <= base + len(buf)):
+                    # the actual format is the subformat GUID prefix
+                    tag = struct.unpack_from('<H', buf, offset - base + 32)[0]
+                width = (bits + 7) // 8
+                if nbc == 0 or rate == 0 or align != nbc * width:
+                    raise wave.Error('{}: bad fmt chunk'.format(wav))
+                fmt = (nbc, width, rate, tag)
+
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise wave.Error('{}: data before fmt chunk'.format(wav))
+                size = min(chunk_size, filesize - offset - 8)
+                return fmt[:3] + (size // (fmt[0] * fmt[1]), fmt[3])
+
+            # chunks are word aligned
+            offset += 8 + chunk_size + (chunk_size & 1)
+    finally:
+        os.close(fd)
+
+    raise wave.Error('{}: data chunk not found'.format(wav))
+
+
+def _make_metawav(nbc, width, rate, nframes, tag):
+    """Return a metawav tuple from the fields returned by read_header"""
+    if tag == _WAVE_FORMAT_PCM:
+        comptype, compname = 'NONE', 'not compressed'
+    else:
+        comptype, compname = 'FORMAT_{:04X}'.format(tag), 'compressed'
+    return _metawav(
+        nbc, width, rate, nframes, comptype, compname,
+        nframes / float(rate))  # duration
+
+
 def _scan_one(wav):
     """scan a single wav file and return a metawav tuple"""
-    try:
-        param = wave.open(wav, 'r').getparams()
-        return _metawav(
-            param[0], param[1], param[2],
-            param[3], param[4], param[5],
-            param[3]/float(param[2]))  # duration
-    except EOFError:
-        return _metawav(nframes=0)
+    return _make_metawav(*read_header(wav))
+
+
+_headers_dtype = [
+    ('filename', object),
+    ('nbc', np.int16),
+    ('width', np.int16),
+    ('rate', np.int32),
+    ('nframes', np.int64),
+    ('duration', np.float64),
+    ('format', np.int32),
+    ('valid', np.bool_)]
+
+
+def _scan_headers_batch(wavs):
+    """Return a list of records for `scan_headers`"""
+    records = []
+    for wav in wavs:
+        try:
+            nbc, width, rate, nframes, tag = read_header(wav)
+            records.append(
+                (wav, nbc, width, rate, nframes, nframes / rate, tag, True))
+        except (OSError, wave.Error):
+            records.append((wav, 0, 0, 0, 0, 0., 0, False))
+    return records
+
+
+def scan_headers(wavs, njobs=1, batch_size=1024, verbose=0):
+    """Return the headers of `wavs` files as a numpy record array
+
+    Each file header is read with a single read (see read_header)
+    and the files are scanned in parallel by batches of `batch_size`,
+    `verbose` is the verbosity level of joblib.
+    The returned record array has the following fields:
+
+        filename nbc width rate nframes duration format valid
+
+    When a file has an invalid header or cannot be read, its `valid`
+    field is False and the other numeric fields are 0.
+
+    """
+    wavs = list(wavs)
+    batches = [wavs[n:n+batch_size] for n in range(0, len(wavs), batch_size)]
+    records = list(itertools.chain.from_iterable(
+        joblib.Parallel(n_jobs=njobs, backend='threading',
+                        verbose=verbose)(
+            joblib.delayed(_scan_headers_batch)(batch)
+            for batch in batches)))
+    return np.rec.array(records, dtype=_headers_dtype)
 
 
 def scan(wavs, njobs=1, verbose=0):
@@ -197,6 +609,7 @@ def scan(wavs, njobs=1, verbose=0):
 
     wavs : a list of absolute paths to wav files
     njobs : the number of parallel scans
+    verbose : the verbosity level of joblib
 
     The returned dict 'metainfo' have wavs for keys and the following
     named tuple as value:
@@ -208,17 +621,83 @@ def scan(wavs, njobs=1, verbose=0):
         metainfo = scan(wavs)
         d = metainfo[wavs[2]].duration
 
-    See the documentation of wave.getparams() for details.
+    comptype is 'NONE' for PCM wavs and 'INVALID' for files with an
+    invalid header. See the documentation of wave.getparams() for
+    details.
 
     """
-    res = joblib.Parallel(
-        n_jobs=njobs, verbose=verbose, backend="threading")(
-            joblib.delayed(_scan_one)(wav) for wav in wavs)
-
-    return dict(zip(wavs, res))
+    res = {}
+    for h in scan_headers(wavs, njobs=njobs, verbose=verbose):
+        res[h.filename] = (
+            _make_metawav(int(h.nbc), int(h.width), int(h.rate),
+                          int(h.nframes), int(h.format)) if h.valid
+            else _metawav(0, 0, 0, 0, 'INVALID', 'invalid header', 0.))
+    return res
 
 
 def duration(wav):
     """Return the duration of a wav file in seconds"""
-    with contextlib.closing(wave.open(wav, 'r')) as w:
-        return w.getnframes() / float(w.getframerate())
+    _, _, rate, nframes, _ = read_header(wav)
+    return nframes / float(rate)
+
+
+def kept_frames(nframes, rate, intervals):
+    """Return the frame ranges kept once `intervals` are removed
+
+    nframes : the number of frames in the wav file
+
+    rate : the sample rate of the wav file
+
+    intervals : a list of (start, stop) times in seconds to remove,
+        they can be unsorted, overlapping or out of the wav bounds.
+
+    Times are converted to frames as done by sox (rounded to the
+    nearest frame). Return a list of (start, stop) frames to keep,
+    sorted and non-overlapping, stop being excluded.
+
+    """
+    # convert to frames, clip to wav bounds and sort
+    removed = sorted(
+        (min(max(int(start * rate + 0.5), 0), nframes),
+         min(max(int(stop * rate + 0.5), 0), nframes))
+        for start, stop in intervals)
+
+    kept = []
+    position = 0
+    for start, stop in removed:
+        if start > position:
+            kept.append((position, start))
+        position = max(position, stop)
+    if position < nframes:
+        kept.append((position, nframes))
+    return kept
+
+
+def remove_intervals(wav_in, wav_out, intervals, chunk_size=2**16):
+    """Write `wav_in` to `wav_out` with the given time `intervals` removed
+
+    This is an in-process equivalent of 'sox wav_in wav_out trim 0 =s1
+    =e1 =s2 =e2 ...'. The kept frames are computed once and the output
+    file is written in a single streaming pass, reading at most
+    `chunk_size` frames at once.
+
+    Return the number of frames written to `wav_out`.
+
+    """
+    with contextlib.closing(wave.open(wav_in, 'r')) as fin:
+        params = fin.getparams()
+        kept = kept_frames(params.nframes, params.framerate, intervals)
+        nframes = sum(stop - start for start, stop in kept)
+
+        with contextlib.closing(wave.open(wav_out, 'w')) as fout:
+            # setting nframes in advance avoid to patch the header on
+            # each write
+            fout.setparams(params._replace(nframes=nframes))
+            for start, stop in kept:
+                fin.setpos(start)
+                while start < stop:
+                    size = min(chunk_size, stop - start)
+                    fout.writeframesraw(fin.readframes(size))
+                    start += size
+
+    return nframes
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Time and disk peak of ARPALanguageModel.save with compression
+
+Estimate a Kneser-Ney trigram on a synthetic text and save it gzipped
+with the former implementation (uncompressed temporary file then
+gzip level 9 in a second pass), with the streaming writer at several
+compression levels and with the parallel compression. The disk peak
+is the size of the files written at once.
+
+"""
+
+import argparse
+import gzip
+import os
+import shutil
+import tempfile
+import time
+
+import abkhazia.utils as utils
+from abkhazia.language import ngram
+from lm_text import synthetic_text
+
+
+def former(lm, path, tmpdir):
+    """The former save(compress=True), return the disk peak (bytes)"""
+    tmp = os.path.join(tmpdir, 'tmp.arpa')
+    lm.save(tmp)
+    with open(tmp, 'rb') as fin, gzip.open(path, 'wb') as fout:
+        shutil.copyfileobj(fin, fout)
+    peak = os.path.getsize(tmp) + os.path.getsize(path)
+    os.remove(tmp)
+    return peak
+
+
+def streaming(lm, path, compresslevel, njobs):
+    lm.save(path, compress=True, compresslevel=compresslevel, njobs=njobs)
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nwords', type=int, default=2000000,
+        help='number of words in the synthetic text, '
+        'default is %(default)s')
+    parser.add_argument(
+        '-j', '--njobs', type=int, default=4,
+        help='number of parallel compression jobs, '
+        'default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lm_text = os.path.join(tmpdir, 'lm_text.txt')
+        synthetic_text(lm_text, args.nwords)
+        lm = ngram.kneser_ney(ngram.count_ngrams(ngram.sentences(lm_text), 3))
+        print('trigram of {} n-grams'.format(
+            sum(len(v) for v in lm.ngrams.values())))
+
+        path = os.path.join(tmpdir, 'G.arpa.gz')
+        variants = [('former (level 9)', former, (lm, path, tmpdir))]
+        for level in (9, 6, 1):
+            variants.append(('streaming (level {})'.format(level),
+                             streaming, (lm, path, level, 1)))
+        for level in (6, 1):
+            variants.append(('{} jobs (level {})'.format(args.njobs, level),
+                             streaming, (lm, path, level, args.njobs)))
+
+        print('{:<22} {:>9} {:>14} {:>10}'.format(
+            'variant', 'time (s)', 'disk peak (MB)', 'size (MB)'))
+        for name, function, fargs in variants:
+            t0 = time.time()
+            peak = function(*fargs)
+            print('{:<22} {:>9.2f} {:>14.1f} {:>10.1f}'.format(
+                name, time.time() - t0, peak / 2**20,
+                os.path.getsize(path) / 2**20))
+            os.remove(path)
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
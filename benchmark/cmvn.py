@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""I/O benchmark of CMVN statistics computation
+
+Generate random raw features in a binary ark/scp, then compute the
+CMVN statistics and the deltas either in two passes over the raw
+features (statistics then deltas, as done by Features) or in a
+single one (features.cmvn accumulated by features.delta). Report
+the time and the number of bytes read and written by the process,
+from /proc/self/io.
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import abkhazia.utils as utils
+import abkhazia.kaldi.ark as ark
+from abkhazia.features.cmvn import CmvnStats
+from abkhazia.features.delta import scp_add_deltas
+
+
+def _io():
+    """Return the (read, written) bytes by the current process"""
+    with open('/proc/self/io', 'r') as fio:
+        counters = dict(line.strip().split(': ') for line in fio)
+    return int(counters['rchar']), int(counters['wchar'])
+
+
+def two_passes(scp, utt2spk, directory):
+    cmvn = CmvnStats(utt2spk)
+    cmvn.accumulate_scp(scp)
+    scp_add_deltas(scp, os.path.join(directory, 'delta.ark'),
+                   os.path.join(directory, 'delta.scp'))
+    cmvn.write(os.path.join(directory, 'cmvn.ark'),
+               os.path.join(directory, 'cmvn.scp'))
+
+
+def one_pass(scp, utt2spk, directory):
+    cmvn = CmvnStats(utt2spk)
+    scp_add_deltas(scp, os.path.join(directory, 'delta.ark'),
+                   os.path.join(directory, 'delta.scp'), cmvn=cmvn)
+    cmvn.write(os.path.join(directory, 'cmvn.ark'),
+               os.path.join(directory, 'cmvn.scp'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nutts', type=int, default=2000,
+        help='number of utterances, default is %(default)s')
+    parser.add_argument(
+        '-s', '--nspeakers', type=int, default=50,
+        help='number of speakers, default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        utt2spk = {'s{:03d}_u{:06d}'.format(i % args.nspeakers, i):
+                   's{:03d}'.format(i % args.nspeakers)
+                   for i in range(args.nutts)}
+        scp = os.path.join(tmpdir, 'raw.scp')
+        ark.write_ark(
+            os.path.join(tmpdir, 'raw.ark'),
+            ((utt, np.random.random((np.random.randint(250, 750), 13)))
+             for utt in sorted(utt2spk)),
+            scpfile=scp)
+        print('raw features: {:.1f} MB'.format(
+            os.path.getsize(os.path.join(tmpdir, 'raw.ark')) / 2**20))
+
+        for name, function in (('two passes', two_passes),
+                               ('one pass', one_pass)):
+            r0, w0 = _io()
+            t0 = time.time()
+            function(scp, utt2spk, tmpdir)
+            t = time.time() - t0
+            r1, w1 = _io()
+            print('{}: {:.2f}s, {:.1f} MB read, {:.1f} MB written'.format(
+                name, t, (r1 - r0) / 2**20, (w1 - w0) / 2**20))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
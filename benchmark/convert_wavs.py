@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of wav normalization: in process versus sox
+
+Generate a LibriSpeech-like tree of <speaker>/<chapter>/<utt>.wav
+files, a part of them being already 16 kHz mono (only linked), the
+others being 44.1 kHz stereo (resampled), and report the number of
+files processed per second by utils.wav.wav2wav with and without its
+native fast path.
+
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+import abkhazia.utils as utils
+
+
+def make_tree(directory, nfiles, duration, compliant):
+    """Write `nfiles` random wavs in `directory`, return their paths"""
+    wavs = []
+    for n in range(nfiles):
+        wav = os.path.join(
+            directory, str(n % 10), str(n % 3), '{}.wav'.format(n))
+        if not os.path.isdir(os.path.dirname(wav)):
+            os.makedirs(os.path.dirname(wav))
+
+        rate, nbc = (16000, 1) if n < compliant * nfiles else (44100, 2)
+        data = np.random.randint(
+            -2**15, 2**15, size=int(duration * rate) * nbc, dtype=np.int16)
+        with contextlib.closing(wave.open(wav, 'w')) as fout:
+            fout.setparams((nbc, 2, rate, 0, 'NONE', ''))
+            fout.writeframes(data.tobytes())
+        wavs.append(wav)
+    return wavs
+
+
+def bench(wavs, output_dir, native):
+    utils.remove(output_dir, safe=True)
+    os.makedirs(output_dir)
+
+    t0 = time.time()
+    for n, wav in enumerate(wavs):
+        utils.wav.wav2wav(
+            wav, os.path.join(output_dir, '{}.wav'.format(n)),
+            copy=False, native=native)
+    return len(wavs) / (time.time() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nfiles', type=int, default=500,
+        help='number of wav files, default is %(default)s')
+    parser.add_argument(
+        '-d', '--duration', type=float, default=10,
+        help='duration of each file in seconds, default is %(default)s')
+    parser.add_argument(
+        '-c', '--compliant', type=float, default=0.5,
+        help='proportion of files already in 16 kHz mono, '
+        'default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        wavs = make_tree(
+            os.path.join(tmpdir, 'corpus'),
+            args.nfiles, args.duration, args.compliant)
+        output_dir = os.path.join(tmpdir, 'wavs')
+
+        print('in process: {:.1f} files/s'.format(
+            bench(wavs, output_dir, native=True)))
+        if shutil.which('sox'):
+            print('sox: {:.1f} files/s'.format(
+                bench(wavs, output_dir, native=False)))
+        else:
+            print('sox: not found')
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of delta features computation
+
+Generate random raw features in a binary ark/scp and compute deltas
+on them with:
+
+- the former two passes Kaldi pipeline (add-deltas to a temporary
+  ark, then copy-feats to the final ark/scp),
+
+- a single add-deltas writing the final ark/scp,
+
+- the numpy implementation from abkhazia.features.delta.
+
+For each one report the throughput in frames per second and the
+number of bytes written to disk. The Kaldi pipelines are run only if
+Kaldi is configured in abkhazia.
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import abkhazia.utils as utils
+import abkhazia.kaldi.ark as ark
+from abkhazia.features.delta import scp_add_deltas
+
+
+def _size(*files):
+    return sum(os.path.getsize(f) for f in files if os.path.isfile(f))
+
+
+def legacy(scp, order, directory):
+    tmp = os.path.join(directory, 'tmp.ark')
+    out = os.path.join(directory, 'legacy.ark')
+    utils.jobs.run(
+        'add-deltas --delta-order={} scp:{} ark:{}'.format(order, scp, tmp),
+        env=ark.kaldi_path(), stdout=lambda _: None)
+    utils.jobs.run(
+        'copy-feats ark:{} ark,scp:{},{}'.format(tmp, out, out + '.scp'),
+        env=ark.kaldi_path(), stdout=lambda _: None)
+    return _size(tmp, out, out + '.scp')
+
+
+def fused(scp, order, directory):
+    out = os.path.join(directory, 'fused.ark')
+    utils.jobs.run(
+        'add-deltas --delta-order={} scp:{} ark,scp:{},{}'.format(
+            order, scp, out, out + '.scp'),
+        env=ark.kaldi_path(), stdout=lambda _: None)
+    return _size(out, out + '.scp')
+
+
+def numpy(scp, order, directory):
+    out = os.path.join(directory, 'numpy.ark')
+    scp_add_deltas(scp, out, out + '.scp', order=order)
+    return _size(out, out + '.scp')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nutts', type=int, default=2000,
+        help='number of utterances, default is %(default)s')
+    parser.add_argument(
+        '-f', '--nframes', type=int, default=500,
+        help='mean number of frames per utterance, default is %(default)s')
+    parser.add_argument(
+        '-d', '--ndims', type=int, default=13,
+        help='dimension of raw features, default is %(default)s')
+    parser.add_argument(
+        '-o', '--order', type=int, default=2,
+        help='delta order, default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        scp = os.path.join(tmpdir, 'raw.scp')
+        lengths = np.random.randint(
+            args.nframes // 2, 3 * args.nframes // 2, size=args.nutts)
+        ark.write_ark(
+            os.path.join(tmpdir, 'raw.ark'),
+            (('utt{:06d}'.format(i), np.random.random((n, args.ndims)))
+             for i, n in enumerate(lengths)),
+            scpfile=scp)
+        print('raw features: {} utterances, {} frames, {:.1f} MB'.format(
+            args.nutts, lengths.sum(), _size(
+                os.path.join(tmpdir, 'raw.ark')) / 2**20))
+
+        benchs = [('numpy', numpy)]
+        try:
+            ark.kaldi_path()
+            benchs = [('kaldi 2 passes', legacy),
+                      ('kaldi 1 pass', fused)] + benchs
+        except AssertionError:
+            print('kaldi not found, skipping kaldi benchmarks')
+
+        for name, function in benchs:
+            t0 = time.time()
+            written = function(scp, args.order, tmpdir)
+            t = time.time() - t0
+            print('{}: {:.0f} frames/s, {:.1f} MB written'.format(
+                name, lengths.sum() / t, written / 2**20))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Time of the G.fst generation of FlatLanguageModel
+
+Compare the former path (saving the flat unigram in ARPA format,
+loading it back, restricting its vocabulary to words.txt and
+compiling it with arpa2fst | fstarcsort) with the in-process FST
+writer, for phone-loop and word-level vocabularies. The arpa2fst
+compilation is timed only when Kaldi is installed, the former times
+are lower bounds otherwise.
+
+"""
+
+import argparse
+import math
+import os
+import shutil
+import tempfile
+import time
+
+import abkhazia.utils as utils
+from abkhazia.kaldi import kaldi_path
+from abkhazia.language import fst
+from abkhazia.language.arpa import ARPALanguageModel
+from abkhazia.language.compact import CompactLanguageModel
+
+
+def flat_lm(ntokens):
+    tokens = ['w{}'.format(i) for i in range(ntokens)] + [
+        '<s>', '</s>', '<unk>']
+    prob = math.log10(1.0 / len(tokens))
+    return ARPALanguageModel({1: {(t,): (prob, None) for t in tokens}})
+
+
+def write_words(lm, filename):
+    """Write a words.txt with all the words of `lm` but one"""
+    words = sorted(w for (w,) in lm.ngrams[1])[1:]
+    with utils.open_utf8(filename, 'w') as fout:
+        for i, w in enumerate(['<eps>'] + words + ['#0']):
+            fout.write(u'{} {}\n'.format(w, i))
+
+
+def former(lm, words_txt, tmpdir, has_kaldi):
+    g_arpa = os.path.join(tmpdir, 'G.arpa.gz')
+    lm.save(g_arpa, compress=True)
+
+    words = set(w.split()[0] for w in utils.open_utf8(words_txt, 'r'))
+    compact = CompactLanguageModel.load(g_arpa)
+    oovs = compact.vocabulary() - words
+    compact.restrict_vocabulary(words, misplaced_markers=True)
+    compact.prune_lowprobs()
+    out_lm = os.path.join(tmpdir, 'out_lm.txt')
+    compact.save(out_lm)
+
+    if has_kaldi:
+        utils.jobs.run(
+            'bash -c "arpa2fst --disambig-symbol=#0 '
+            '--read-symbol-table={} {} - | fstarcsort --sort_type=ilabel '
+            '> {}"'.format(words_txt, out_lm, os.path.join(tmpdir, 'G.fst')),
+            stdout=lambda _: None, env=kaldi_path())
+    return oovs
+
+
+def current(lm, words_txt, tmpdir):
+    lm.save(os.path.join(tmpdir, 'G.arpa.gz'), compress=True)
+
+    symbols = {}
+    for line in utils.open_utf8(words_txt, 'r'):
+        word, label = line.split()
+        symbols[word] = int(label)
+    return fst.write_unigram(os.path.join(tmpdir, 'G.fst'), lm, symbols)
+
+
+def timeit(function, *args):
+    t0 = time.time()
+    function(*args)
+    return time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[50, 5000, 100000],
+        help='vocabulary sizes, default is %(default)s')
+    args = parser.parse_args()
+
+    try:
+        has_kaldi = bool(shutil.which('arpa2fst', path=kaldi_path()['PATH']))
+    except Exception:  # Kaldi is not installed
+        has_kaldi = False
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('{:>8} {:>12} {:>12}'.format(
+            'tokens', 'former (s)', 'current (s)'))
+        for size in args.sizes:
+            lm = flat_lm(size)
+            words_txt = os.path.join(tmpdir, 'words.txt')
+            write_words(lm, words_txt)
+
+            print('{:>8} {:>12.4f} {:>12.4f}'.format(
+                size, timeit(former, lm, words_txt, tmpdir, has_kaldi),
+                timeit(current, lm, words_txt, tmpdir)))
+        if not has_kaldi:
+            print('Kaldi not found, arpa2fst is not timed')
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
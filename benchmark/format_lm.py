@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Time of the ARPA to G.fst conversion of LanguageModel._format_lm
+
+Build 3-gram and 4-gram ARPA models from a synthetic text and compare
+the former ARPA filtering (gunzip and per-line regular expressions to
+a text copy, then loading and pruning it) with the current single
+pass over the loaded model, as well as the cost of the cache key.
+
+When the Kaldi arpa2fst program is available, time the former
+arpa2fst | fstprint | eps2disambig.pl | s2eps.pl | fstcompile pipeline
+against the direct arpa2fst compilation.
+
+"""
+
+import argparse
+import gzip
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import abkhazia.utils as utils
+from abkhazia.kaldi import kaldi_path
+from abkhazia.language import ngram
+from abkhazia.language.arpa import ARPALanguageModel
+from lm_text import synthetic_text
+
+
+def synthetic_arpa(lm_text, order, filename):
+    """Write an ARPA model of relative frequencies from `lm_text`
+
+    The model is not normalized, this is irrelevant for timing. Add
+    some n-grams with misplaced sentence markers to be filtered.
+
+    """
+    counts = ngram.count_ngrams(ngram.sentences(lm_text), order)
+    ngrams = {}
+    for n in range(1, order + 1):
+        total = float(sum(counts[n].values()))
+        ngrams[n] = {
+            k: (round(math.log10(c / total), 6), None if n == order else -0.1)
+            for k, c in counts[n].items()}
+    for n in range(2, order + 1):
+        for k in list(ngrams[n])[:100]:
+            ngrams[n][('</s>', '<s>') + k[2:]] = (-5, None)
+    ARPALanguageModel(ngrams).save(filename, compress=True)
+    return ngrams
+
+
+def legacy_filter(arpa_lm, words, tmpdir):
+    lm_txt = os.path.join(tmpdir, 'lm.txt')
+    with utils.open_utf8(lm_txt, 'w') as fp:
+        for line in gzip.open(arpa_lm, 'rb'):
+            line = line.decode()
+            if not (re.search('<s> <s>', line) or
+                    re.search('</s> <s>', line) or
+                    re.search('</s> </s>', line)):
+                fp.write(line)
+
+    # utils/find_arpa_oovs.pl reads the unigrams section only
+    oovs = set()
+    with utils.open_utf8(lm_txt, 'r') as fin:
+        for line in fin:
+            if line.startswith('\\1-grams:'):
+                break
+        for line in fin:
+            if line.startswith('\\2-grams:'):
+                break
+            line = line.split()
+            if len(line) > 1 and line[1] not in words:
+                oovs.add(line[1])
+
+    lm = ARPALanguageModel.load(lm_txt)
+    lm.prune_vocabulary(words)
+    lm.save(os.path.join(tmpdir, 'lm.pruned'))
+    return oovs
+
+
+def current_filter(arpa_lm, words, tmpdir):
+    lm = ARPALanguageModel.load(arpa_lm)
+    oovs = lm.vocabulary() - words
+    lm.prune_vocabulary(words, misplaced_markers=True)
+    lm.save(os.path.join(tmpdir, 'lm.pruned'))
+    return oovs
+
+
+def timeit(function, *args):
+    t0 = time.time()
+    function(*args)
+    return time.time() - t0
+
+
+def kaldi_compile(words_txt, tmpdir):
+    """Return the times of the former and current arpa2fst pipelines"""
+    lm = os.path.join(tmpdir, 'lm.pruned')
+    legacy = (
+        'bash -c "arpa2fst {0} | fstprint | '
+        'utils/eps2disambig.pl | utils/s2eps.pl | '
+        'fstcompile --isymbols={1} --osymbols={1} '
+        '--keep_isymbols=false --keep_osymbols=false | '
+        'fstrmepsilon | fstarcsort --sort_type=ilabel > {2}"'.format(
+            lm, words_txt, os.path.join(tmpdir, 'G1.fst')))
+    current = (
+        'bash -c "arpa2fst --disambig-symbol=#0 --read-symbol-table={1} '
+        '{0} - | fstarcsort --sort_type=ilabel > {2}"'.format(
+            lm, words_txt, os.path.join(tmpdir, 'G2.fst')))
+
+    cwd = os.path.join(
+        utils.config.get('kaldi', 'kaldi-directory'), 'egs', 'wsj', 's5')
+
+    def run(command):
+        utils.jobs.run(command, stdout=lambda _: None,
+                       env=kaldi_path(), cwd=cwd)
+
+    return timeit(run, legacy), timeit(run, current)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nwords', type=int, default=1000000,
+        help='number of words in the synthetic text, '
+        'default is %(default)s')
+    args = parser.parse_args()
+
+    try:
+        has_kaldi = shutil.which('arpa2fst', path=kaldi_path()['PATH'])
+    except Exception:  # Kaldi is not installed
+        has_kaldi = False
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lm_text = os.path.join(tmpdir, 'lm_text.txt')
+        synthetic_text(lm_text, args.nwords)
+
+        print('{:<7} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10}'.format(
+            'order', 'ngrams', 'legacy', 'current', 'hash',
+            'fst legacy', 'fst current'))
+        for order in (3, 4):
+            arpa_lm = os.path.join(tmpdir, 'G.arpa.gz')
+            ngrams = synthetic_arpa(lm_text, order, arpa_lm)
+
+            # a lexicon missing 10% of the words
+            vocab = sorted(w for (w,) in ngrams[1])
+            words = set(vocab[:int(0.9 * len(vocab))]) | {'<s>', '</s>'}
+            words_txt = os.path.join(tmpdir, 'words.txt')
+            with utils.open_utf8(words_txt, 'w') as fout:
+                for i, w in enumerate(['<eps>'] + sorted(words) + ['#0']):
+                    fout.write(u'{} {}\n'.format(w, i))
+
+            legacy = timeit(legacy_filter, arpa_lm, words, tmpdir)
+            current = timeit(current_filter, arpa_lm, words, tmpdir)
+            hashing = timeit(
+                utils.cache.hash_files, arpa_lm, words_txt)
+            fst = (kaldi_compile(words_txt, tmpdir) if has_kaldi
+                   else (float('nan'), float('nan')))
+
+            print('{:<7} {:>9} {:>9.2f} {:>9.2f} {:>9.3f} {:>10.2f} '
+                  '{:>10.2f}'.format(
+                      order, sum(len(v) for v in ngrams.values()),
+                      legacy, current, hashing, *fst))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
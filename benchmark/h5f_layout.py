@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the h5features files written by kaldi.scp_to_h5f
+
+Generate random features in a binary ark/scp, convert them to
+h5features with several chunk sizes, compressions and group layouts,
+and report for each one the file size, the writing time, the time to
+read the whole file and the time to read random utterances.
+
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import h5features as h5f
+import numpy as np
+
+import abkhazia.utils as utils
+import abkhazia.kaldi.ark as ark
+
+
+CONFIGS = [
+    ('default', {}),
+    ('chunk 0.1MB', {'chunk_size': 0.1}),
+    ('chunk 10MB', {'chunk_size': 10}),
+    ('lzf', {'compression': 'lzf'}),
+    ('gzip', {'compression': 'gzip'}),
+    ('speakers', {'speakers': True}),
+    ('speakers lzf', {'speakers': True, 'compression': 'lzf'})]
+
+
+def bench(scp, h5file, utt2spk, nrandom, speakers=False, **kwargs):
+    utils.remove(h5file, safe=True)
+
+    t0 = time.time()
+    ark.scp_to_h5f(scp, h5file, utt2spk=utt2spk if speakers else None,
+                   **kwargs)
+    twrite = time.time() - t0
+
+    groups = (['features/' + s for s in sorted(set(utt2spk.values()))]
+              if speakers else ['features'])
+
+    t0 = time.time()
+    for group in groups:
+        h5f.Reader(h5file, group).read()
+    tread = time.time() - t0
+
+    # open the readers once, as a loader would do
+    readers = {g: h5f.Reader(h5file, g) for g in groups}
+    utts = random.sample(sorted(utt2spk.keys()), nrandom)
+    t0 = time.time()
+    for utt in utts:
+        group = 'features/' + utt2spk[utt] if speakers else 'features'
+        readers[group].read(from_item=utt, to_item=utt)
+    trandom = (time.time() - t0) / nrandom
+
+    return os.path.getsize(h5file), twrite, tread, trandom
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nutts', type=int, default=2000,
+        help='number of utterances, default is %(default)s')
+    parser.add_argument(
+        '-s', '--nspeakers', type=int, default=40,
+        help='number of speakers, default is %(default)s')
+    parser.add_argument(
+        '-r', '--nrandom', type=int, default=100,
+        help='number of random utterances to read, default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # mfcc-like features with smooth trajectories, so they are
+        # compressible as real ones
+        utt2spk = {'s{:03d}_u{:06d}'.format(i % args.nspeakers, i):
+                   's{:03d}'.format(i % args.nspeakers)
+                   for i in range(args.nutts)}
+        scp = os.path.join(tmpdir, 'feats.scp')
+        ark.write_ark(
+            os.path.join(tmpdir, 'feats.ark'),
+            ((utt, np.cumsum(np.random.normal(
+                size=(random.randint(200, 800), 39)), axis=0).round(2))
+             for utt in sorted(utt2spk)),
+            scpfile=scp)
+
+        h5file = os.path.join(tmpdir, 'feats.h5f')
+        print('{:<14} {:>10} {:>10} {:>10} {:>12}'.format(
+            'config', 'size (MB)', 'write (s)', 'read (s)', 'random (ms)'))
+        for name, kwargs in CONFIGS:
+            size, twrite, tread, trandom = bench(
+                scp, h5file, utt2spk, args.nrandom, **kwargs)
+            print('{:<14} {:>10.1f} {:>10.2f} {:>10.2f} {:>12.2f}'.format(
+                name, size / 2**20, twrite, tread, trandom * 1000))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of utils.list_files_with_extension
+
+Generate a LibriSpeech-like tree of <speaker>/<chapter>/<utt>.flac
+files (plus one .trans.txt per chapter) and report the time to list
+the flacs then the transcriptions (as the LibriSpeech preparator
+does) with the former regex and os.walk based implementation and
+with the scandir one, serial, parallel and cached.
+
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+
+import abkhazia.utils as utils
+
+
+def make_tree(directory, nfiles, per_chapter=100, per_speaker=5):
+    """Create `nfiles` empty flacs in `directory`"""
+    for n in range(nfiles):
+        chapter = n // per_chapter
+        d = os.path.join(
+            directory, str(chapter // per_speaker), str(chapter))
+        if n % per_chapter == 0:
+            os.makedirs(d)
+            open(os.path.join(d, '{}.trans.txt'.format(chapter)), 'w').close()
+        open(os.path.join(d, '{}.flac'.format(n)), 'w').close()
+
+
+def legacy_list(directory, extension):
+    expr = r'(.*)' + extension + '$'
+    matched = []
+    for path, _, files in os.walk(directory):
+        matched += [os.path.join(path, f)
+                    for f in files if re.match(expr, f)]
+    return sorted(os.path.realpath(os.path.abspath(m)) for m in matched)
+
+
+def bench(function, directory):
+    t0 = time.time()
+    function(directory, '.flac')
+    function(directory, '.trans.txt')
+    return time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nfiles', type=int, default=500000,
+        help='number of files in the tree, default is %(default)s')
+    parser.add_argument(
+        '-j', '--njobs', type=int, default=8,
+        help='number of threads for the parallel walk, '
+        'default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        make_tree(tmpdir, args.nfiles)
+
+        print('os.walk + regex: {:.2f}s'.format(bench(legacy_list, tmpdir)))
+        for name, kwargs in (
+                ('scandir', {}),
+                ('scandir {} threads'.format(args.njobs),
+                 {'njobs': args.njobs}),
+                ('scandir {} threads cached'.format(args.njobs),
+                 {'njobs': args.njobs, 'cache': True})):
+            print('{}: {:.2f}s'.format(name, bench(
+                lambda d, e: utils.list_files_with_extension(
+                    d, e, abspath=True, **kwargs), tmpdir)))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Throughput and peak memory of the language model stage
+
+Generate a synthetic corpus (Zipf distributed words with random
+pronunciations) and ARPA models of the requested orders estimated on
+its text, then time the sub-steps of:
+
+- LanguageModel (create, prepare_lang, compute_lm with each n-gram
+  backend, format_lm and export) and FlatLanguageModel,
+
+- ARPALanguageModel load, save (text and gzip) and prune_vocabulary,
+
+- read_int2phone on a synthetic phones.txt.
+
+When Kaldi or IRSTLM are not installed (or with --stub), stub
+scripts stand in for prepare_lang.sh, run.pl, build-lm.sh,
+compile-lm, arpa2fst, fstarcsort and fstisstochastic: build-lm.sh
+copies the synthetic ARPA model and the FST tools copy their input,
+so that only the abkhazia side of the steps is measured.
+
+The peak memory is the peak RSS of the benchmark process during each
+step (reset between steps on Linux), the Kaldi and IRSTLM programs
+are not accounted. The results are written in JSON for regression
+tracking.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import stat
+import tempfile
+import time
+
+import numpy as np
+
+import abkhazia.utils as utils
+from abkhazia.corpus import Corpus
+from abkhazia.kaldi import Abkhazia2Kaldi, kaldi_path
+from abkhazia.language import LanguageModel, FlatLanguageModel, ngram
+from abkhazia.language.arpa import ARPALanguageModel
+from abkhazia.language.language_model import read_int2phone
+from format_lm import synthetic_arpa
+from lm_text import synthetic_text, peak_rss
+
+
+STUBS = {
+    'egs/wsj/s5/utils/prepare_lang.sh': '''\
+dict=${@: -4:1}
+lang=${@: -1}
+mkdir -p ${@: -2:1} $lang/phones
+(echo '<eps>'; awk '{print $1}' $dict/lexicon.txt | sort -u;
+ echo '#0'; echo '<s>'; echo '</s>') | awk '{print $1, NR-1}' \\
+    > $lang/words.txt
+cat $dict/silence_phones.txt $dict/nonsilence_phones.txt \\
+    | awk '{print $1, NR}' > $lang/phones.txt
+touch $lang/L.fst $lang/L_disambig.fst $lang/topo
+''',
+    'egs/wsj/s5/utils/run.pl': '''\
+log=$1
+shift
+bash -c "$*" > $log 2>&1
+''',
+    'tools/irstlm/bin/build-lm.sh': '''\
+while [ $# -gt 0 ]; do
+    case $1 in
+        -n) order=$2;;
+        -o) output=$2;;
+    esac
+    shift
+done
+cp {arpa_dir}/G.$order.arpa.gz $output
+''',
+    'tools/irstlm/bin/compile-lm': 'gunzip -c $1\n',
+    'src/lmbin/arpa2fst': 'cat ${@: -2:1}\n',
+    'tools/openfst/bin/fstarcsort': 'cat\n',
+    'src/fstbin/fstisstochastic': 'echo 0 0\n'}
+"""The stub scripts, relative to the stub Kaldi directory"""
+
+
+def setup_stubs(root, arpa_dir):
+    """Install the stub Kaldi and IRSTLM in `root`"""
+    for name, script in STUBS.items():
+        path = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fout:
+            fout.write('#!/bin/bash\n' + script.replace(
+                '{arpa_dir}', arpa_dir))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+    # the files checked or linked by abkhazia
+    os.makedirs(os.path.join(root, 'egs', 'wsj', 's5', 'steps'))
+    os.makedirs(os.path.join(root, 'tools', 'openfst', 'lib'))
+    open(os.path.join(
+        root, 'tools', 'openfst', 'lib', 'libfstscript.so.1'), 'w').close()
+
+    utils.config.set('kaldi', 'kaldi-directory', root)
+
+    # path.sh is written by ./configure from the Kaldi directory
+    def write_path_script(script):
+        with open(script, 'w') as fout:
+            fout.write('export KALDI_ROOT={}\n'.format(root))
+    Abkhazia2Kaldi._write_path_script = staticmethod(write_path_script)
+
+
+def has_kaldi():
+    """Return True if Kaldi and IRSTLM are installed"""
+    try:
+        path = kaldi_path()['PATH']
+    except Exception:  # Kaldi is not configured
+        return False
+    return all(shutil.which(p, path=path) for p in (
+        'build-lm.sh', 'compile-lm', 'arpa2fst', 'fstisstochastic'))
+
+
+def synthetic_corpus(lm_text, nphones=40, seed=0):
+    """Return a Corpus with the utterances in `lm_text`
+
+    The words have random pronunciations of 2 to 8 phones, utterances
+    have no wav files but explicit timestamps.
+
+    """
+    rng = np.random.RandomState(seed)
+    corpus = Corpus()
+    corpus.phones = {'p{}'.format(i): 'p{}'.format(i)
+                     for i in range(nphones)}
+    corpus.silences = ['SIL', 'SPN']
+    phones = sorted(corpus.phones)
+
+    for utt, words in (
+            line.split(' ', 1)
+            for line in utils.open_utf8(lm_text, 'r').read().splitlines()):
+        corpus.text[utt] = words
+        corpus.utt2spk[utt] = 'spk{}'.format(int(utt[3:]) // 100)
+        corpus.segments[utt] = ('{}.wav'.format(utt), 0, 1)
+        for word in words.split():
+            if word not in corpus.lexicon:
+                corpus.lexicon[word] = ' '.join(
+                    rng.choice(phones, size=rng.randint(2, 9)))
+    corpus.lexicon['<unk>'] = 'SPN'
+    corpus.wavs = set(w for w, _, _ in corpus.segments.values())
+    return corpus
+
+
+def synthetic_phones(filename, nphones):
+    """Write a phones.txt with word position dependent phones"""
+    with utils.open_utf8(filename, 'w') as fout:
+        fout.write(u'<eps> 0\nSIL 1\n')
+        for i in range(nphones):
+            for j, pos in enumerate(('_B', '_E', '_I', '_S')):
+                fout.write(u'p{}{} {}\n'.format(i, pos, 2 + 4 * i + j))
+
+
+def nngrams(lm):
+    """Return the number of n-grams in an ARPALanguageModel"""
+    return sum(len(v) for v in lm.ngrams.values())
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the process, do nothing if not on Linux"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fout:
+            fout.write('5')
+    except IOError:
+        pass
+
+
+class Suite(object):
+    """Run the benchmarks and collect their results"""
+    def __init__(self):
+        self.results = []
+        print('{:<18} {:<30} {:>9} {:>9} {:>16}'.format(
+            'benchmark', 'step', 'time (s)', 'rss (MB)', 'throughput'))
+
+    def measure(self, benchmark, step, function, *args, **kwargs):
+        """Return function(*args), record its time and peak memory
+
+        `size` and `unit` in `kwargs` give the throughput of the step
+        (number of processed units per second), the other keywords
+        are recorded as parameters.
+
+        """
+        size, unit = kwargs.pop('size', None), kwargs.pop('unit', None)
+        reset_peak_rss()
+        t0 = time.time()
+        result = function(*args)
+        duration = time.time() - t0
+
+        throughput = size / duration if size and duration else None
+        self.results.append(dict(
+            benchmark=benchmark, step=step, time=duration,
+            peak_rss=peak_rss(), size=size, unit=unit,
+            throughput=throughput, **kwargs))
+        print('{:<18} {:<30} {:>9.3f} {:>9} {:>16}'.format(
+            benchmark, step, duration, peak_rss(),
+            '{:.0f} {}/s'.format(throughput, unit) if throughput else '-'))
+        return result
+
+
+def bench_language_model(suite, corpus, tmpdir, order, backend):
+    name = '{}-gram {}'.format(order, backend)
+    nwords = sum(len(t.split()) for t in corpus.text.values())
+    lm = LanguageModel(
+        corpus, os.path.join(tmpdir, 'lm'), order=order,
+        ngram_backend=backend, use_cache=False)
+    g_arpa = os.path.join(lm.a2k._local_path(), 'G.arpa.gz')
+    g_fst = os.path.join(lm.a2k._local_path(), 'G.fst')
+    try:
+        suite.measure('LanguageModel', name + ' create', lm.create,
+                      size=len(corpus.utts()), unit='utt',
+                      order=order, backend=backend)
+        suite.measure('LanguageModel', name + ' prepare_lang',
+                      lm._prepare_lang, size=len(corpus.lexicon),
+                      unit='word', order=order, backend=backend)
+        suite.measure('LanguageModel', name + ' compute_lm',
+                      lm._compute_lm, g_arpa, size=nwords, unit='word',
+                      order=order, backend=backend)
+        ngrams = nngrams(ARPALanguageModel.load(g_arpa))
+        suite.measure('LanguageModel', name + ' format_lm', lm._format_lm,
+                      g_arpa, g_fst, size=ngrams, unit='ngram',
+                      order=order, backend=backend)
+        suite.measure('LanguageModel', name + ' export', lm.export,
+                      order=order, backend=backend)
+    finally:
+        del lm
+        utils.remove(os.path.join(tmpdir, 'lm'), safe=True)
+
+
+def bench_flat_language_model(suite, corpus, tmpdir):
+    lm = FlatLanguageModel(corpus, os.path.join(tmpdir, 'flat'))
+    lm.use_cache = False
+    try:
+        suite.measure('FlatLanguageModel', 'create', lm.create,
+                      size=len(corpus.utts()), unit='utt')
+        suite.measure('FlatLanguageModel', 'run', lm.run,
+                      size=len(corpus.lexicon), unit='word')
+        suite.measure('FlatLanguageModel', 'export', lm.export)
+    finally:
+        del lm
+        utils.remove(os.path.join(tmpdir, 'flat'), safe=True)
+
+
+def bench_arpa(suite, arpa_lm, tmpdir, order):
+    size = nngrams(ARPALanguageModel.load(arpa_lm))
+    lm = suite.measure('ARPALanguageModel', '{}-gram load'.format(order),
+                       ARPALanguageModel.load, arpa_lm, size=size,
+                       unit='ngram', order=order)
+
+    for compress, suffix in ((False, ''), (True, '.gz')):
+        output = os.path.join(tmpdir, 'lm.arpa' + suffix)
+        suite.measure(
+            'ARPALanguageModel', '{}-gram save{}'.format(order, suffix),
+            lm.save, output, compress, size=size, unit='ngram',
+            order=order)
+        utils.remove(output)
+
+    # a lexicon missing 10% of the words
+    vocab = sorted(lm.vocabulary())
+    words = set(vocab[:int(0.9 * len(vocab))]) | {'<s>', '</s>'}
+    suite.measure('ARPALanguageModel',
+                  '{}-gram prune_vocabulary'.format(order),
+                  lm.prune_vocabulary, words, True,
+                  size=size, unit='ngram', order=order)
+
+
+def bench_int2phone(suite, tmpdir, nphones, repeat):
+    lang_dir = os.path.join(tmpdir, 'int2phone')
+    os.makedirs(lang_dir)
+    synthetic_phones(os.path.join(lang_dir, 'phones.txt'), nphones)
+
+    def run():
+        for _ in range(repeat):
+            read_int2phone(lang_dir)
+
+    suite.measure('read_int2phone', '{} phones x {}'.format(
+        4 * nphones + 2, repeat), run, size=(4 * nphones + 2) * repeat,
+        unit='phone', nphones=nphones)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nwords', type=int, default=1000000,
+        help='number of words in the synthetic corpus, '
+        'default is %(default)s')
+    parser.add_argument(
+        '--orders', type=int, nargs='+', default=[2, 3],
+        help='orders of the ARPA models, default is %(default)s')
+    parser.add_argument(
+        '--nphones', type=int, default=1000,
+        help='number of phones in phones.txt for read_int2phone, '
+        'default is %(default)s')
+    parser.add_argument(
+        '--repeat', type=int, default=100,
+        help='number of read_int2phone calls, default is %(default)s')
+    parser.add_argument(
+        '--stub', action='store_true',
+        help='use the stub Kaldi and IRSTLM even if they are installed')
+    parser.add_argument(
+        '-o', '--output', default='lm_suite.json',
+        help='JSON file to write the results, default is %(default)s')
+    args = parser.parse_args()
+
+    stub = args.stub or not has_kaldi()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lm_text = os.path.join(tmpdir, 'lm_text.txt')
+        synthetic_text(lm_text, args.nwords)
+        corpus = synthetic_corpus(lm_text)
+
+        arpa_dir = os.path.join(tmpdir, 'arpa')
+        os.makedirs(arpa_dir)
+        for order in args.orders:
+            synthetic_arpa(lm_text, order, os.path.join(
+                arpa_dir, 'G.{}.arpa.gz'.format(order)))
+
+        if stub:
+            setup_stubs(os.path.join(tmpdir, 'kaldi'), arpa_dir)
+        print('{} words, {} utterances, {} kaldi'.format(
+            args.nwords, len(corpus.utts()), 'stub' if stub else 'real'))
+
+        suite = Suite()
+        for order in args.orders:
+            for backend in ('irstlm', 'python'):
+                if backend == 'python' and order > ngram.MAX_ORDER:
+                    continue
+                bench_language_model(suite, corpus, tmpdir, order, backend)
+        bench_flat_language_model(suite, corpus, tmpdir)
+        for order in args.orders:
+            bench_arpa(suite, os.path.join(
+                arpa_dir, 'G.{}.arpa.gz'.format(order)), tmpdir, order)
+        bench_int2phone(suite, tmpdir, args.nphones, args.repeat)
+
+        with open(args.output, 'w') as fout:
+            json.dump({
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'stub': stub,
+                'parameters': vars(args),
+                'results': suite.results}, fout, indent=2)
+        print('wrote {}'.format(args.output))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
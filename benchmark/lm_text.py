@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Peak memory and wall time of the LM training text preparation
+
+Write a synthetic lm_text.txt (Zipf distributed words, as in natural
+text) and prepare it for IRSTLM build-lm.sh with the former in-memory
+approach (readlines, text_ready.txt then sentence markers) and the
+streaming one (abkhazia.language.ngram.write_sentences). Optionally
+time the in-process Kneser-Ney estimation as well. Each variant runs
+in a fresh process so that its peak RSS is measured alone.
+
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+import abkhazia.utils as utils
+from abkhazia.language import ngram
+
+
+def synthetic_text(filename, nwords, vocab=20000, seed=0):
+    """Write `nwords` in utterances of 5 to 30 words to `filename`"""
+    rng = np.random.RandomState(seed)
+    words = np.array(['w{}'.format(i) for i in range(vocab)])
+    written, nutts = 0, 0
+    with utils.open_utf8(filename, 'w') as fout:
+        while written < nwords:
+            # draw utterances by chunks of about 1M words
+            lengths = rng.randint(5, 31, size=60000)
+            tokens = words[np.minimum(
+                rng.zipf(1.2, size=lengths.sum()), vocab) - 1]
+            for utt in np.split(tokens, np.cumsum(lengths)[:-1]):
+                fout.write(u'utt{} {}\n'.format(nutts, ' '.join(utt)))
+                nutts += 1
+                written += len(utt)
+                if written >= nwords:
+                    break
+    return written
+
+
+def baseline(lm_text, tmpdir):
+    """Do nothing, the RSS of the interpreter and imported modules"""
+    pass
+
+
+def legacy(lm_text, tmpdir):
+    """The former LanguageModel._compute_lm text preparation"""
+    lm_lines = utils.open_utf8(lm_text, 'r').readlines()
+    text_ready = os.path.join(tmpdir, 'text_ready.txt')
+    with utils.open_utf8(text_ready, 'w') as ready:
+        ready.write('\n'.join(
+            [' '.join(line.split()[1:]) for line in lm_lines]))
+    del lm_lines
+
+    # add-start-end.sh is a sed script, streaming from text_ready
+    with utils.open_utf8(os.path.join(tmpdir, 'text_se.txt'), 'w') as fout:
+        for line in utils.open_utf8(text_ready, 'r'):
+            fout.write(u'<s> {} </s>\n'.format(line.strip()))
+
+
+def streaming(lm_text, tmpdir):
+    ngram.write_sentences(lm_text, os.path.join(tmpdir, 'text_se.gz'))
+
+
+def streaming_text(lm_text, tmpdir):
+    ngram.write_sentences(lm_text, os.path.join(tmpdir, 'text_se.txt'))
+
+
+def kneser_ney(lm_text, tmpdir, order):
+    counts = ngram.count_ngrams(ngram.sentences(lm_text), order)
+    ngram.kneser_ney(counts, order).save(
+        os.path.join(tmpdir, 'G.arpa.gz'), compress=True)
+
+
+def peak_rss():
+    """Return the peak RSS of the current process (MB)"""
+    # ru_maxrss survives the exec of a process spawned from a large
+    # parent, VmHWM does not
+    try:
+        with open('/proc/self/status', 'r') as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def _measure(function, args, queue):
+    t0 = time.time()
+    function(*args)
+    queue.put((time.time() - t0, peak_rss()))
+
+
+def measure(function, *args):
+    """Run function(*args) in a new process, return (time, peak RSS)"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(function, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nwords', type=int, default=50000000,
+        help='number of words in the synthetic text, '
+        'default is %(default)s')
+    parser.add_argument(
+        '-o', '--order', type=int, default=0,
+        help='order of the in-process Kneser-Ney model to estimate, '
+        'default is %(default)s (disabled)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lm_text = os.path.join(tmpdir, 'lm_text.txt')
+        t0 = time.time()
+        nwords = synthetic_text(lm_text, args.nwords)
+        print('wrote {} words ({} MB) in {:.1f} s'.format(
+            nwords, os.path.getsize(lm_text) // 2**20, time.time() - t0))
+
+        variants = [('baseline', baseline, (lm_text, tmpdir)),
+                    ('legacy', legacy, (lm_text, tmpdir)),
+                    ('streaming (gz)', streaming, (lm_text, tmpdir)),
+                    ('streaming (txt)', streaming_text, (lm_text, tmpdir))]
+        if args.order:
+            variants.append((
+                'kneser-ney {}-gram'.format(args.order),
+                kneser_ney, (lm_text, tmpdir, args.order)))
+
+        print('{:<20} {:>10} {:>10}'.format('variant', 'time (s)', 'rss (MB)'))
+        for name, function, fargs in variants:
+            duration, rss = measure(function, *fargs)
+            print('{:<20} {:>10.1f} {:>10}'.format(name, duration, rss))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
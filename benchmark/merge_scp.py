@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the feats.scp merge done in Features.export
+
+Generate per-job raw_*.scp files as written by Kaldi and merge them
+into a single feats.scp, with the former implementation (each file
+read in memory and concatenated) and with features.merge_scp (in
+order and interleaved inputs, with and without ark relocation).
+Report the time and the peak memory allocated by each one.
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import abkhazia.utils as utils
+from abkhazia.features.features import merge_scp
+
+
+def make_scps(directory, nutts, njobs, interleaved):
+    scps = [os.path.join(directory, 'raw_mfcc.{}.scp'.format(j + 1))
+            for j in range(njobs)]
+    files = [open(scp, 'w') for scp in scps]
+    per_job = -(-nutts // njobs)
+    for n in range(nutts):
+        j = n % njobs if interleaved else n // per_job
+        files[j].write('utt{:08d} /features/raw_mfcc.{}.ark:{}\n'.format(
+            n, j + 1, 20 * n))
+    for f in files:
+        f.close()
+    return scps
+
+
+def legacy(inputs, output, arks):
+    with open(output, 'w') as outfile:
+        for infile in inputs:
+            outfile.write(open(infile, 'r').read())
+
+
+def bench(function, inputs, output, arks=None):
+    # tracemalloc slows down the function, so run it twice to
+    # measure time and memory separately
+    t0 = time.time()
+    function(inputs, output, arks)
+    t = time.time() - t0
+
+    tracemalloc.start()
+    function(inputs, output, arks)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return t, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nutts', type=int, default=1000000,
+        help='number of utterances, default is %(default)s')
+    parser.add_argument(
+        '-j', '--njobs', type=int, default=20,
+        help='number of per-job scp files, default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        output = os.path.join(tmpdir, 'feats.scp')
+        for interleaved in (False, True):
+            scps = make_scps(tmpdir, args.nutts, args.njobs, interleaved)
+            arks = {'/features/raw_mfcc.1.ark': '/export/raw_mfcc.1.ark'}
+            benchs = [('merge_scp', merge_scp, None),
+                      ('merge_scp relocated', merge_scp, arks)]
+            if not interleaved:
+                benchs = [('legacy', legacy, None)] + benchs
+
+            print('{} utterances in {} {} scp files'.format(
+                args.nutts, args.njobs,
+                'interleaved' if interleaved else 'ordered'))
+            for name, function, _arks in benchs:
+                t, peak = bench(function, scps, output, _arks)
+                print('  {}: {:.2f}s, peak memory {:.1f} MB'.format(
+                    name, t, peak / 2**20))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
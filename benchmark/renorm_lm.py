@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Time and memory of the vocabulary restriction of an ARPA model
+
+Estimate a Kneser-Ney trigram on a synthetic text and restrict its
+vocabulary to 90% of its words, as done by
+LanguageModel._change_lm_vocab. Compare the former Python part of
+the restriction (ARPALanguageModel load, prune and save, SRILM ngram
+renormalizing the saved model when available) with the in-process
+CompactLanguageModel restriction and renormalization. Each variant
+runs in a fresh process to measure its peak RSS.
+
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import abkhazia.utils as utils
+from abkhazia.language import ngram
+from abkhazia.language.arpa import ARPALanguageModel
+from abkhazia.language.compact import CompactLanguageModel
+from lm_text import synthetic_text, measure
+
+
+def former(arpa_lm, words, tmpdir, srilm):
+    lm = ARPALanguageModel.load(arpa_lm)
+    lm.prune_vocabulary(words, misplaced_markers=True)
+    pruned = os.path.join(tmpdir, 'pruned.arpa')
+    lm.save(pruned)
+    del lm
+
+    if srilm:
+        subprocess.check_call(
+            'ngram -lm {} -vocab /dev/null -renorm -write-lm {} '
+            '-prune-lowprobs -unk -order 3'.format(
+                pruned, os.path.join(tmpdir, 'out_lm.txt')),
+            shell=True, stderr=subprocess.DEVNULL)
+
+
+def compact(arpa_lm, words, tmpdir):
+    lm = CompactLanguageModel.load(arpa_lm)
+    lm.restrict_vocabulary(words)
+    lm.prune_lowprobs()
+    lm.save(os.path.join(tmpdir, 'out_lm.txt'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nwords', type=int, default=2000000,
+        help='number of words in the synthetic text, '
+        'default is %(default)s')
+    args = parser.parse_args()
+
+    srilm = shutil.which('ngram') is not None
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lm_text = os.path.join(tmpdir, 'lm_text.txt')
+        synthetic_text(lm_text, args.nwords)
+
+        t0 = time.time()
+        arpa_lm = os.path.join(tmpdir, 'G.arpa.gz')
+        lm = ngram.kneser_ney(ngram.count_ngrams(ngram.sentences(lm_text), 3))
+        lm.save(arpa_lm, compress=True)
+        vocab = sorted(w for (w,) in lm.ngrams[1])
+        words = set(vocab[:int(0.9 * len(vocab))]) | {'<s>', '</s>'}
+        print('trigram of {} n-grams estimated in {:.1f} s'.format(
+            sum(len(v) for v in lm.ngrams.values()), time.time() - t0))
+        del lm
+
+        print('{:<20} {:>10} {:>10}'.format('variant', 'time (s)', 'rss (MB)'))
+        for name, function, fargs in (
+                ('former' + (' + srilm' if srilm else ' (no srilm)'),
+                 former, (arpa_lm, words, tmpdir, srilm)),
+                ('compact', compact, (arpa_lm, words, tmpdir))):
+            duration, rss = measure(function, *fargs)
+            print('{:<20} {:>10.1f} {:>10}'.format(name, duration, rss))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
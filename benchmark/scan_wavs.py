@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of wav headers scanning: wave module versus read_header
+
+Generate a tree of small wav files and report the number of headers
+read per second by the former implementation of utils.wav.scan (one
+wave.open per file, joblib multiprocessing) and by
+utils.wav.scan_headers (a single pread per file, threads).
+
+"""
+
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+import wave
+
+import joblib
+import numpy as np
+
+import abkhazia.utils as utils
+
+
+def make_tree(directory, nfiles, duration):
+    """Write `nfiles` random 16 kHz mono wavs, return their paths"""
+    data = np.random.randint(
+        -2**15, 2**15, size=int(duration * 16000), dtype=np.int16).tobytes()
+
+    wavs = []
+    for n in range(nfiles):
+        wav = os.path.join(directory, str(n % 100), '{}.wav'.format(n))
+        if not os.path.isdir(os.path.dirname(wav)):
+            os.makedirs(os.path.dirname(wav))
+
+        with contextlib.closing(wave.open(wav, 'w')) as fout:
+            fout.setparams((1, 2, 16000, 0, 'NONE', ''))
+            fout.writeframes(data)
+        wavs.append(wav)
+    return wavs
+
+
+def _legacy_scan_one(wav):
+    with contextlib.closing(wave.open(wav, 'r')) as fwav:
+        return fwav.getparams()
+
+
+def legacy_scan(wavs, njobs):
+    return dict(zip(wavs, joblib.Parallel(n_jobs=njobs)(
+        joblib.delayed(_legacy_scan_one)(w) for w in wavs)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nfiles', type=int, default=20000,
+        help='number of wav files, default is %(default)s')
+    parser.add_argument(
+        '-d', '--duration', type=float, default=0.5,
+        help='duration of each file in seconds, default is %(default)s')
+    parser.add_argument(
+        '-j', '--njobs', type=int, default=4,
+        help='number of parallel jobs, default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        wavs = make_tree(tmpdir, args.nfiles, args.duration)
+
+        t0 = time.time()
+        legacy_scan(wavs, args.njobs)
+        print('wave module: {:.1f} files/s'.format(
+            len(wavs) / (time.time() - t0)))
+
+        t0 = time.time()
+        utils.wav.scan_headers(wavs, njobs=args.njobs)
+        print('read_header: {:.1f} files/s'.format(
+            len(wavs) / (time.time() - t0)))
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Per-job imbalance of the Kaldi and duration-balanced data splits
+
+Draw speakers with very unequal numbers and lengths of utterances (as
+in Buckeye or CHILDES), or load them from an abkhazia corpus, and
+report the ratio between the longest and the mean job durations for
+the Kaldi split (contiguous speakers, balanced utterance counts) and
+the balanced one. As jobs run in parallel, this ratio bounds the
+wall time lost to straggler jobs.
+
+"""
+
+import argparse
+
+import numpy as np
+
+from abkhazia.kaldi.split_data import partition, kaldi_partition, imbalance
+
+
+def synthetic_speakers(nspeakers, seed=0):
+    """Return (spk2dur, spk2count) for random speakers"""
+    rng = np.random.RandomState(seed)
+    spk2dur, spk2count = {}, {}
+    for s in range(nspeakers):
+        spk = 's{:03d}'.format(s)
+        spk2count[spk] = int(rng.lognormal(4, 1)) + 1
+        spk2dur[spk] = float(
+            rng.lognormal(0.5 + rng.uniform(0, 2), 0.5,
+                          size=spk2count[spk]).sum())
+    return spk2dur, spk2count
+
+
+def corpus_speakers(corpus_dir):
+    """Return (spk2dur, spk2count) from an abkhazia corpus"""
+    from abkhazia.corpus import Corpus
+    corpus = Corpus.load(corpus_dir)
+    spk2dur, spk2count = {}, {}
+    for utt, dur in corpus.utt2duration().items():
+        spk = corpus.utt2spk[utt]
+        spk2dur[spk] = spk2dur.get(spk, 0) + dur
+        spk2count[spk] = spk2count.get(spk, 0) + 1
+    return spk2dur, spk2count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-c', '--corpus', metavar='<corpus-dir>',
+        help='an abkhazia corpus, default is to draw random speakers')
+    parser.add_argument(
+        '-s', '--nspeakers', type=int, default=40,
+        help='number of random speakers, default is %(default)s')
+    args = parser.parse_args()
+
+    spk2dur, spk2count = (corpus_speakers(args.corpus) if args.corpus
+                          else synthetic_speakers(args.nspeakers))
+
+    print('{:>6} {:>8} {:>9}'.format('njobs', 'kaldi', 'balanced'))
+    for njobs in (2, 4, 8, 16, 32):
+        if njobs > len(spk2dur):
+            break
+        print('{:>6} {:>8.2f} {:>9.2f}'.format(
+            njobs,
+            imbalance(spk2dur, kaldi_partition(spk2count, njobs)),
+            imbalance(spk2dur, partition(spk2dur, njobs))))
+
+
+if __name__ == '__main__':
+    main()
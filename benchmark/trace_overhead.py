@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the tracing overhead
+
+Report the cost of a span when tracing is disabled and enabled, and
+the overhead of tracing on a workload made of short subprocesses
+wrapped in spans, as done by AbstractRecipe._run_command (the
+shortest instrumented operation in practice, Kaldi commands usually
+lasting much longer).
+
+"""
+
+import argparse
+import time
+
+import abkhazia.utils as utils
+from abkhazia.utils import trace
+
+
+def span_cost(nspans):
+    """Return the time of an empty span (s)"""
+    t0 = time.time()
+    for _ in range(nspans):
+        with trace.span('span', category='bench', step='bench'):
+            pass
+    return (time.time() - t0) / nspans
+
+
+def workload(ncommands):
+    """Run `ncommands` short commands in spans, return the time (s)"""
+    t0 = time.time()
+    for _ in range(ncommands):
+        with trace.span('true', category='kaldi', step='bench'):
+            utils.jobs.run('true', stdout=lambda _: None)
+    return time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nspans', type=int, default=100000,
+        help='number of empty spans, default is %(default)s')
+    parser.add_argument(
+        '-c', '--ncommands', type=int, default=200,
+        help='number of commands in the workload, default is %(default)s')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='number of repetitions of the workload, the best time is '
+        'reported, default is %(default)s')
+    args = parser.parse_args()
+
+    trace.disable()
+    print('span disabled: {:.2f} us'.format(1e6 * span_cost(args.nspans)))
+    trace.enable()
+    print('span enabled: {:.2f} us'.format(1e6 * span_cost(args.nspans)))
+
+    # alternate the runs to be fair with the machine load variations
+    disabled, enabled = [], []
+    for _ in range(args.repeat):
+        trace.disable()
+        disabled.append(workload(args.ncommands))
+        trace.enable()
+        enabled.append(workload(args.ncommands))
+
+    overhead = (min(enabled) - min(disabled)) / min(disabled)
+    print('workload of {} commands: {:.3f} s untraced, {:.3f} s traced, '
+          'overhead {:.2f}%'.format(
+              args.ncommands, min(disabled), min(enabled), 100 * overhead))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of wav trimming: sox versus utils.wav.remove_intervals
+
+Generate a random wav file and remove thousands of intervals from it,
+either with a single sox call (as done by CorpusTrimmer before) or in
+process.
+
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+import abkhazia.utils as utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-d', '--duration', type=float, default=3600,
+        help='duration of the wav file in seconds, default is %(default)s')
+    parser.add_argument(
+        '-n', '--ncuts', type=int, default=5000,
+        help='number of intervals to remove, default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        wav_in = os.path.join(tmpdir, 'in.wav')
+        data = np.random.randint(
+            -2**15, 2**15, size=int(args.duration * 16000), dtype=np.int16)
+        with contextlib.closing(wave.open(wav_in, 'w')) as fout:
+            fout.setparams((1, 2, 16000, data.shape[0], 'NONE', ''))
+            fout.writeframes(data.tobytes())
+
+        times = np.sort(np.random.uniform(0, args.duration, 2 * args.ncuts))
+        intervals = list(zip(times[::2], times[1::2]))
+        print('removing {} intervals from a {}s wav'.format(
+            args.ncuts, args.duration))
+
+        t0 = time.time()
+        utils.wav.remove_intervals(
+            wav_in, os.path.join(tmpdir, 'out.wav'), intervals)
+        print('in process: {:.3f}s'.format(time.time() - t0))
+
+        if shutil.which('sox'):
+            t0 = time.time()
+            subprocess.check_call(
+                ['sox', wav_in, os.path.join(tmpdir, 'sox.wav'),
+                 'trim', '0'] + ['={}'.format(t) for t in times])
+            print('sox: {:.3f}s'.format(time.time() - t0))
+        else:
+            print('sox: not found')
+    finally:
+        utils.remove(tmpdir, safe=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+#!/bin/bash
+#
+# Write srilm.arpa, the reference output of SRILM used by
+# test/test_compact.py. The vocabulary of lm.arpa is restricted to
+# words.txt as formerly done in LanguageModel._change_lm_vocab. The
+# SRILM ngram program must be in the PATH.
+
+set -e
+cd "$(dirname "$0")"
+
+pruned=$(mktemp)
+trap "rm -f $pruned" EXIT
+
+python -c "
+from abkhazia.language.arpa import ARPALanguageModel
+lm = ARPALanguageModel.load('lm.arpa')
+lm.prune_vocabulary(
+    set(l.split()[0] for l in open('words.txt')), misplaced_markers=True)
+lm.save('$pruned')"
+
+ngram -lm $pruned -vocab /dev/null -renorm -write-lm srilm.arpa \
+      -prune-lowprobs -unk -order 3
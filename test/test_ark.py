@@ -15,6 +15,7 @@
 """Test of the abkhazia.kaldi.io module"""
 
 import os
+import struct
 
 import h5features as h5f
 import numpy as np
@@ -80,3 +81,147 @@ def test_h5f_twice(tmpdir, data):
     # test writing in an existing group
     with pytest.raises(AssertionError):
         io.ark_to_h5f([ark], h5file, 'test')
+
+
+def test_write_ark_read_scp(tmpdir, data):
+    ark = os.path.join(str(tmpdir), 'feats.ark')
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    assert io.write_ark(ark, sorted(data.items()), scpfile=scp) == 2
+    assert io.scp_ark_files(scp) == [ark]
+
+    # read back through the scp and the whole ark, precision is float32
+    data2 = dict(io.read_scp(scp))
+    data3 = io.ark_to_dict(ark)
+    assert data.keys() == data2.keys() == data3.keys()
+    for k in data.keys():
+        assert np.allclose(data[k], data2[k], rtol=0, atol=1e-7)
+        assert np.array_equal(data2[k], data3[k])
+
+
+def _compressed_ark(arkfile, token, header, body):
+    with open(arkfile, 'wb') as fark:
+        fark.write(b'utt \0B' + token + b' ' + header + body)
+
+
+@pytest.mark.parametrize('token', [b'CM', b'CM2', b'CM3'])
+def test_read_compressed(tmpdir, token):
+    # a 3x2 matrix with values [[0, 64], [100, 192], [200, 255]]
+    expected = np.asarray([[0, 64], [100, 192], [200, 255]])
+    ark = os.path.join(str(tmpdir), 'feats.ark')
+
+    if token == b'CM':
+        # quantiles chosen such as bytes are decoded to themselves
+        header = struct.pack('<ffii', 0, 65535, 3, 2)
+        body = struct.pack('<8H', *([0, 64, 192, 255] * 2)) + \
+            expected.T.astype(np.uint8).tobytes()
+    elif token == b'CM2':
+        header = struct.pack('<ffii', 0, 65535, 3, 2)
+        body = expected.astype('<u2').tobytes()
+    else:
+        header = struct.pack('<ffii', 0, 255, 3, 2)
+        body = expected.astype(np.uint8).tobytes()
+
+    _compressed_ark(ark, token, header, body)
+    data = io.ark_to_dict(ark)
+    assert list(data.keys()) == ['utt']
+    assert np.allclose(data['utt'], expected, atol=1e-3)
+
+
+def _planted_scp(tmpdir, data):
+    """Write 10 utterances in 2 arks, return the scp and its entries"""
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    with open(scp, 'w') as fscp:
+        for n in range(2):
+            ark = os.path.join(str(tmpdir), 'feats.{}.ark'.format(n))
+            tmp = ark + '.scp'
+            io.write_ark(
+                ark, (('utt{}{}'.format(n, i), data['test'] * i)
+                      for i in range(5)), scpfile=tmp)
+            fscp.write(open(tmp, 'r').read())
+    return scp, open(scp, 'r').readlines()
+
+
+def test_check_scp_valid(tmpdir, data):
+    scp, _ = _planted_scp(tmpdir, data)
+    check = io.check_scp(scp, njobs=2)
+    assert (check.nutts, check.nchecked, check.dims) == (10, 10, {5})
+    assert (check.nnan, check.ninf, check.errors) == (0, 0, [])
+
+    check = io.check_scp(scp, sample=3, seed=0)
+    assert (check.nutts, check.nchecked, check.errors) == (10, 3, [])
+
+
+@pytest.mark.parametrize('corruption', [
+    'nan', 'inf', 'offset', 'overlap', 'truncated', 'missing', 'dim'])
+def test_check_scp_corrupted(tmpdir, data, corruption):
+    scp, lines = _planted_scp(tmpdir, data)
+    utt, path = lines[7].strip().split(' ')
+    ark, offset = path.rsplit(':', 1)
+    offset = int(offset)
+
+    if corruption in ('nan', 'inf'):
+        # write a float in the data of utt12 (15 bytes of header)
+        with open(ark, 'r+b') as fark:
+            fark.seek(offset + 15 + 4 * 12)
+            fark.write(struct.pack('<f', float(corruption)))
+    elif corruption == 'offset':
+        lines[7] = '{} {}:{}\n'.format(utt, ark, offset + 3)
+    elif corruption == 'overlap':
+        lines[7] = '{} {}\n'.format(utt, lines[6].strip().split(' ')[1])
+    elif corruption == 'truncated':
+        with open(ark, 'r+b') as fark:
+            fark.truncate(os.path.getsize(ark) - 10)
+        utt = lines[-1].split(' ')[0]
+    elif corruption == 'missing':
+        io.utils.remove(ark)
+    elif corruption == 'dim':
+        io.write_ark(ark, [(utt, data['test'][:, :3])])
+        lines = lines[:5] + ['{} {}:{}\n'.format(utt, ark, len(utt) + 1)]
+
+    with open(scp, 'w') as fscp:
+        fscp.write(''.join(lines))
+
+    check = io.check_scp(scp, njobs=2)
+    if corruption == 'nan':
+        assert check.nnan == 1 and check.ninf == 0 and not check.errors
+    elif corruption == 'inf':
+        assert check.nnan == 0 and check.ninf == 1 and not check.errors
+    elif corruption == 'dim':
+        assert check.dims == {3, 5} and not check.errors
+    elif corruption == 'missing':
+        assert len(check.errors) == 5
+    elif corruption == 'overlap':
+        assert [e[0] for e in check.errors] == [lines[6].split(' ')[0]]
+    else:
+        assert [e[0] for e in check.errors] == [utt]
+
+
+@pytest.mark.parametrize('chunk_size, compression, speakers', [
+    ('auto', None, False), (0.01, None, False), ('auto', 'lzf', False),
+    (0.01, 4, False), ('auto', None, True), (0.01, 'gzip', True)])
+def test_h5f_layout(tmpdir, chunk_size, compression, speakers):
+    data = {'s{}_u{}'.format(i % 3, i): np.random.random((20 + i, 5))
+            for i in range(12)}
+    utt2spk = {utt: utt.split('_')[0] for utt in data}
+
+    ark = os.path.join(str(tmpdir), 'feats.ark')
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    io.write_ark(ark, sorted(data.items()), scpfile=scp)
+
+    h5file = os.path.join(str(tmpdir), 'feats.h5f')
+    io.scp_to_h5f(scp, h5file, chunk_size=chunk_size,
+                  compression=compression,
+                  utt2spk=utt2spk if speakers else None)
+
+    if speakers:
+        read = {}
+        for spk in ('s0', 's1', 's2'):
+            spk_data = h5f.Reader(h5file, 'features/' + spk).read()
+            assert all(utt2spk[u] == spk for u in spk_data.items())
+            read.update(spk_data.dict_features())
+    else:
+        read = h5f.Reader(h5file, 'features').read().dict_features()
+
+    assert sorted(read.keys()) == sorted(data.keys())
+    for utt, feats in data.items():
+        assert np.array_equal(read[utt], feats.astype(np.float32))
@@ -0,0 +1,76 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.language.arpa module"""
+
+import gzip
+
+import pytest
+
+from abkhazia.language import arpa
+from abkhazia.language.arpa import ARPALanguageModel
+
+
+NGRAMS = {
+    1: {('<s>',): (-99, -0.5), ('</s>',): (-0.8, None),
+        ('a',): (-0.5, -0.3), ('b',): (-0.6, -0.2), ('c',): (-1.0, -0.1)},
+    2: {('<s>', 'a'): (-0.2, None), ('a', 'b'): (-0.3, None),
+        ('b', '</s>'): (-0.1, None), ('c', 'a'): (-0.4, None),
+        ('<s>', '<s>'): (-2.0, None), ('</s>', '<s>'): (-2.0, None),
+        ('</s>', '</s>'): (-2.0, None)}}
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_save_load(tmpdir, compress):
+    path = str(tmpdir.join('lm.arpa' + ('.gz' if compress else '')))
+    ARPALanguageModel(NGRAMS).save(path, compress=compress)
+    lm = ARPALanguageModel.load(path)
+    assert lm.order == 2
+    assert lm.ngrams == NGRAMS
+
+
+@pytest.mark.parametrize('compresslevel, njobs', [
+    (1, 1), (9, 1), (6, 2), (6, 4)])
+def test_save_compressed(tmpdir, monkeypatch, compresslevel, njobs):
+    # many small chunks, to have several gzip members
+    monkeypatch.setattr(arpa, 'CHUNK_SIZE', 64)
+    text = str(tmpdir.join('lm.arpa'))
+    compressed = str(tmpdir.join('lm.arpa.gz'))
+
+    lm = ARPALanguageModel(NGRAMS)
+    lm.save(text)
+    lm.save(compressed, compress=True,
+            compresslevel=compresslevel, njobs=njobs)
+
+    with gzip.open(compressed, 'rt') as fin:
+        assert fin.read() == open(text).read()
+    assert ARPALanguageModel.load(compressed).ngrams == NGRAMS
+
+    # a member per chunk
+    nmembers = open(compressed, 'rb').read().count(b'\x1f\x8b\x08')
+    assert nmembers == (1 if njobs == 1 else len(list(lm._chunks())))
+
+
+def test_prune_vocabulary():
+    lm = ARPALanguageModel({n: dict(v) for n, v in NGRAMS.items()})
+    assert lm.vocabulary() == {'<s>', '</s>', 'a', 'b', 'c'}
+
+    lm.prune_vocabulary({'<s>', '</s>', 'a', 'b'})
+    assert ('c',) not in lm.ngrams[1]
+    assert ('c', 'a') not in lm.ngrams[2]
+    assert ('</s>', '<s>') in lm.ngrams[2]
+
+    lm.prune_vocabulary(lm.vocabulary(), misplaced_markers=True)
+    assert sorted(lm.ngrams[2]) == [('<s>', 'a'), ('a', 'b'), ('b', '</s>')]
+    assert len(lm.ngrams[1]) == 4
@@ -0,0 +1,112 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.cache module"""
+
+import os
+import time
+
+import abkhazia.utils as utils
+from abkhazia.utils.cache import FileCache, hash_files
+
+
+def test_hash_files(tmpdir):
+    a, b = tmpdir.join('a'), tmpdir.join('b')
+    a.write('content')
+    b.write('content')
+    assert hash_files(str(a)) == hash_files(str(b))
+    assert hash_files(str(a)) != hash_files(str(a), extra=[3])
+    assert hash_files(str(a), extra=[3]) != hash_files(str(a), extra=[4])
+
+    # the boundaries between files are hashed
+    c, empty = tmpdir.join('c'), tmpdir.join('empty')
+    c.write('contentcontent')
+    empty.write('')
+    assert hash_files(str(a), str(b)) != hash_files(str(c), str(empty))
+
+    b.write('changed')
+    assert hash_files(str(a)) != hash_files(str(b))
+
+
+def test_file(tmpdir):
+    cache = FileCache('test', directory=str(tmpdir.join('cache')))
+    assert os.path.isdir(str(tmpdir.join('cache', 'test')))
+
+    source = tmpdir.join('G.fst')
+    source.write('fst')
+    key = hash_files(str(source))
+
+    target = str(tmpdir.join('target.fst'))
+    assert not cache.get(key, target)
+    assert not os.path.exists(target)
+
+    cache.put(key, str(source))
+    assert cache.get(key, target)
+    assert open(target).read() == 'fst'
+
+    # putting twice is not an error
+    cache.put(key, str(source))
+    assert os.listdir(cache.directory) == [key]
+
+
+def test_directory(tmpdir):
+    cache = FileCache('test', directory=str(tmpdir))
+    source = tmpdir.mkdir('lang')
+    source.join('words.txt').write('a 1\n')
+    source.mkdir('phones').join('silence.txt').write('SIL\n')
+
+    cache.put('key', str(source))
+    cache.put('key', str(source))
+    target = str(tmpdir.join('target'))
+    assert cache.get('key', target)
+    assert sorted(os.listdir(target)) == ['phones', 'words.txt']
+    assert open(os.path.join(target, 'phones', 'silence.txt')).read() == \
+        'SIL\n'
+
+
+def test_evict(tmpdir):
+    # a cache of 1 MB receiving 3 entries of 400 kB
+    cache = FileCache('test', directory=str(tmpdir), max_size=1)
+    source = tmpdir.join('source')
+    source.write('x' * 400 * 1024)
+
+    for key in ('a', 'b'):
+        cache.put(key, str(source))
+        time.sleep(0.01)
+
+    # 'a' is used, 'b' is the least recently used entry
+    assert cache.get('a', str(tmpdir.join('target')))
+    time.sleep(0.01)
+    cache.put('c', str(source))
+    assert sorted(os.listdir(cache.directory)) == ['a', 'c']
+
+
+def test_default_directory(tmpdir, monkeypatch):
+    monkeypatch.setitem(
+        utils.config['abkhazia'], 'tmp-directory', str(tmpdir))
+    cache = FileCache('test')
+    assert cache.directory == os.path.join(
+        utils.config.get('abkhazia', 'tmp-directory'),
+        'abkhazia-cache', 'test')
+
+
+def test_default_max_size(tmpdir, monkeypatch):
+    monkeypatch.delitem(
+        utils.config['abkhazia'], 'cache-max-size', raising=False)
+    assert FileCache('test', directory=str(tmpdir)).max_size == \
+        utils.cache.DEFAULT_MAX_SIZE
+
+    monkeypatch.setitem(utils.config['abkhazia'], 'cache-max-size', '10')
+    assert FileCache('test', directory=str(tmpdir)).max_size == 10
+    assert FileCache('test', directory=str(tmpdir), max_size=0).max_size == 0
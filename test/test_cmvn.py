@@ -0,0 +1,116 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.features.cmvn module"""
+
+import os
+
+import numpy as np
+import pytest
+
+import abkhazia.kaldi.ark as ark
+from abkhazia.features.cmvn import CmvnStats
+from abkhazia.features.delta import scp_add_deltas
+
+
+# features as a Kaldi text ark
+FEATS = '''a1  [
+  1 2
+  3 4 ]
+a2  [
+  0 -1 ]
+b1  [
+  2 2
+  2 2
+  2 2 ]
+b2  [
+  0.5 -0.25 ]
+'''
+
+UTT2SPK = {'a1': 'a', 'a2': 'a', 'b1': 'b', 'b2': 'b'}
+
+# the expected output of `compute-cmvn-stats --spk2utt=ark:spk2utt
+# ark:feats.ark ark,t:-` for the features above: per speaker, sums of
+# the features and number of frames, sums of the squared features
+CMVN = '''a  [
+  4 5 3
+  10 21 0 ]
+b  [
+  6.5 5.75 4
+  12.25 12.0625 0 ]
+'''
+
+
+@pytest.fixture
+def scp(tmpdir):
+    txt = os.path.join(str(tmpdir), 'feats.txt')
+    with open(txt, 'w') as fout:
+        fout.write(FEATS)
+
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    ark.write_ark(
+        os.path.join(str(tmpdir), 'feats.ark'),
+        sorted(ark.ark_to_dict(txt).items()), scpfile=scp)
+    return scp
+
+
+@pytest.fixture
+def expected(tmpdir):
+    txt = os.path.join(str(tmpdir), 'cmvn.txt')
+    with open(txt, 'w') as fout:
+        fout.write(CMVN)
+    return ark.ark_to_dict(txt)
+
+
+def _check(tmpdir, cmvn, expected):
+    cmvn_scp = os.path.join(str(tmpdir), 'cmvn.scp')
+    assert cmvn.write(
+        os.path.join(str(tmpdir), 'cmvn.ark'), cmvn_scp) == len(expected)
+
+    stats = dict(ark.read_scp(cmvn_scp))
+    assert sorted(stats.keys()) == sorted(expected.keys())
+    for spk, value in expected.items():
+        assert stats[spk].dtype == np.float64
+        assert np.allclose(stats[spk], value, rtol=0, atol=1e-12)
+
+
+def test_cmvn_stats(tmpdir, scp, expected):
+    cmvn = CmvnStats(UTT2SPK)
+    cmvn.accumulate_scp(scp)
+    _check(tmpdir, cmvn, expected)
+
+
+def test_cmvn_stats_update(tmpdir, scp, expected):
+    # accumulate one utterance per job and merge the results
+    cmvn = CmvnStats()
+    for utt, feats in ark.read_scp(scp):
+        job = CmvnStats(UTT2SPK)
+        job.accumulate(utt, feats)
+        cmvn.update(job)
+    _check(tmpdir, cmvn, expected)
+
+
+def test_cmvn_stats_per_utterance(scp):
+    cmvn = CmvnStats()
+    cmvn.accumulate_scp(scp)
+    assert sorted(cmvn.stats.keys()) == ['a1', 'a2', 'b1', 'b2']
+    assert np.array_equal(cmvn.stats['a2'], [[0, -1, 1], [0, 1, 0]])
+
+
+def test_cmvn_fused_with_deltas(tmpdir, scp, expected):
+    cmvn = CmvnStats(UTT2SPK)
+    scp_add_deltas(
+        scp, os.path.join(str(tmpdir), 'delta.ark'),
+        os.path.join(str(tmpdir), 'delta.scp'), order=2, cmvn=cmvn)
+    _check(tmpdir, cmvn, expected)
@@ -0,0 +1,205 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.language.compact module"""
+
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from abkhazia.language.arpa import ARPALanguageModel
+from abkhazia.language.compact import CompactLanguageModel
+
+
+# an interpolated Kneser-Ney trigram with misplaced sentence markers
+# and a lexicon missing 'mat' and 'food', see data/srilm
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'srilm')
+LM = os.path.join(DATA, 'lm.arpa')
+WORDS = set(line.split()[0] for line in open(os.path.join(DATA, 'words.txt')))
+
+
+def _entries(lm):
+    """Return the n-grams of `lm` as a dict of dicts"""
+    if isinstance(lm, ARPALanguageModel):
+        return {n: {k: (p, b or 0) for k, (p, b) in lm.ngrams[n].items()}
+                for n in lm.ngrams}
+    entries = {}
+    for n in range(1, lm.order + 1):
+        cols = lm.columns(n)
+        entries[n] = {
+            tuple(lm.vocab[w] for w in c): (p, b) for c, p, b in zip(
+                cols, lm.prob[n], lm.bow[n])}
+    return entries
+
+
+def _assert_close(entries1, entries2, tol=1e-5):
+    assert sorted(entries1) == sorted(entries2)
+    for n in entries1:
+        assert sorted(entries1[n]) == sorted(entries2[n])
+        for k, v in entries1[n].items():
+            assert v == pytest.approx(entries2[n][k], abs=tol), k
+
+
+def _mass(lm, context):
+    """Return the sum of p(w|context) over the vocabulary of `lm`"""
+    words = np.array(sorted(set(lm.word[1])), dtype=np.int32)
+    context = np.tile(
+        np.array([lm.vocab.index(w) for w in context], dtype=np.int32),
+        (len(words), 1))
+    return (10 ** lm.logprob(context, words)).sum()
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_load_save(tmpdir, compress):
+    lm = CompactLanguageModel.load(LM)
+    assert lm.order == 3
+    assert [lm.size(n) for n in (1, 2, 3)] == [13, 32, 43]
+    _assert_close(_entries(lm), _entries(ARPALanguageModel.load(LM)))
+
+    path = str(tmpdir.join('lm.arpa' + ('.gz' if compress else '')))
+    lm.save(path)
+    _assert_close(_entries(CompactLanguageModel.load(path)), _entries(lm))
+
+
+def test_load_missing_context(tmpdir):
+    path = str(tmpdir.join('lm.arpa'))
+    ARPALanguageModel({
+        1: {('a',): (-0.3, -0.2), ('b',): (-0.3, 0)},
+        2: {('a', 'b'): (-0.1, -0.5)},
+        3: {('b', 'a', 'b'): (-0.1, 0)},
+        4: {('a', 'a', 'a', 'b'): (-0.1, None)}}).save(path)
+
+    # as in SRILM the missing contexts are inserted with their backoff
+    # probability and a null backoff weight
+    entries = _entries(CompactLanguageModel.load(path))
+    _assert_close(entries, {
+        1: {('a',): (-0.3, -0.2), ('b',): (-0.3, 0)},
+        2: {('a', 'b'): (-0.1, -0.5), ('b', 'a'): (-0.3, 0),
+            ('a', 'a'): (-0.5, 0)},
+        3: {('b', 'a', 'b'): (-0.1, 0), ('a', 'a', 'a'): (-0.5, 0)},
+        4: {('a', 'a', 'a', 'b'): (-0.1, 0)}})
+
+    # the extended model is consistent
+    lm = CompactLanguageModel.load(path)
+    lm.save(path)
+    _assert_close(_entries(CompactLanguageModel.load(path)), entries)
+
+
+def test_logprob():
+    lm = CompactLanguageModel.load(LM)
+    arpa = ARPALanguageModel.load(LM).ngrams
+    ids = {w: i for i, w in enumerate(lm.vocab)}
+
+    def logprob(*ngram):
+        return lm.logprob(
+            np.array([[ids[w] for w in ngram[:-1]]], dtype=np.int32),
+            np.array([ids[ngram[-1]]], dtype=np.int32))[0]
+
+    # explicit probabilities
+    assert logprob('the', 'cat') == arpa[2][('the', 'cat')][0]
+    assert logprob('<s>', 'the', 'cat') == arpa[3][('<s>', 'the', 'cat')][0]
+
+    # backoff to 'sat a' then to the unigram
+    assert ('sat', 'a') not in arpa[2]
+    assert logprob('cat', 'sat', 'a') == pytest.approx(
+        arpa[2][('cat', 'sat')][1] + arpa[1][('sat',)][1] +
+        arpa[1][('a',)][0])
+
+    # only the last 2 words of the context are used
+    assert logprob('the', 'cat', 'sat', 'a') == logprob('cat', 'sat', 'a')
+
+
+def test_restrict_vocabulary():
+    lm = CompactLanguageModel.load(LM)
+    assert lm.vocabulary() == WORDS - {'<eps>', '<unk>', '#0'} | {
+        'mat', 'food'}
+    lm.restrict_vocabulary(WORDS)
+    assert 'mat' not in lm.vocabulary()
+
+    # same n-grams as the ARPALanguageModel implementation
+    arpa = ARPALanguageModel.load(LM)
+    arpa.prune_vocabulary(WORDS, misplaced_markers=True)
+    _assert_close(_entries(lm), _entries(arpa))
+
+
+def test_renormalize():
+    # the backoff weights of a normalized model are unchanged
+    lm = CompactLanguageModel.load(LM)
+    lm.restrict_vocabulary(lm.vocabulary())
+    bows = {n: lm.bow[n].copy() for n in (1, 2)}
+    lm.renormalize()
+    for n in (1, 2):
+        assert np.abs(bows[n] - lm.bow[n]).max() < 1e-6
+
+    # after restriction the distributions, including the unigrams,
+    # are normalized again
+    lm.restrict_vocabulary(WORDS)
+    assert _mass(lm, ()) < 0.9
+    lm.renormalize()
+    for context in ((), ('the',), ('<s>',), ('a',), ('<s>', 'the'),
+                    ('the', 'cat'), ('sat', 'on')):
+        assert _mass(lm, context) == pytest.approx(1, abs=1e-6)
+
+
+def test_prune_lowprobs():
+    lm = CompactLanguageModel.load(LM)
+    lm.restrict_vocabulary(WORDS)
+    lm.prune_lowprobs()
+    assert _mass(lm, ()) == pytest.approx(1, abs=1e-6)
+
+    for n in (2, 3):
+        cols = lm.columns(n)
+        backoff = lm.bow[n - 1][lm.ctx[n]] + lm.logprob(
+            cols[:, 1:-1], cols[:, -1])
+        low = lm.prob[n] < backoff
+        if n == 2:  # only contexts of trigrams may be kept
+            assert not (low & (np.bincount(
+                lm.ctx[3], minlength=lm.size(2)) == 0)).any()
+        else:
+            assert not low.any()
+
+        for c in set(map(tuple, cols[:, :-1])):
+            assert _mass(lm, [lm.vocab[w] for w in c]) == \
+                pytest.approx(1, abs=1e-6)
+
+
+def test_srilm_reference():
+    # the reference must be committed, not skipped when missing
+    reference = os.path.join(DATA, 'srilm.arpa')
+    assert os.path.isfile(reference), \
+        'SRILM reference not generated, see data/srilm/make_fixtures.sh'
+
+    lm = CompactLanguageModel.load(LM)
+    lm.restrict_vocabulary(WORDS)
+    lm.prune_lowprobs()
+    _assert_close(
+        _entries(lm), _entries(ARPALanguageModel.load(reference)), tol=1e-4)
+
+
+@pytest.mark.skipif(
+    shutil.which('ngram') is None, reason='SRILM ngram not in PATH')
+def test_srilm(tmpdir):
+    # the reference generated by the installed SRILM
+    shutil.copytree(DATA, str(tmpdir.join('srilm')))
+    subprocess.check_call(str(tmpdir.join('srilm', 'make_fixtures.sh')))
+
+    lm = CompactLanguageModel.load(LM)
+    lm.restrict_vocabulary(WORDS)
+    lm.prune_lowprobs()
+    _assert_close(
+        _entries(lm), _entries(ARPALanguageModel.load(
+            str(tmpdir.join('srilm', 'srilm.arpa')))), tol=1e-4)
@@ -41,7 +41,7 @@ def wrapper_test_decode(name, options, corpus, lm, feats, am, tmpdir,
     for k, v in options.items():
         decoder.decode_opts[k].value = v
     if skip_scoring:
-        decoder.score_opts['skip-scoring'] = True
+        decoder.score_opts['skip-scoring'].value = True
     decoder.compute()
 
     # check if we have no error in log
@@ -0,0 +1,75 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.features.delta module"""
+
+import os
+
+import numpy as np
+import pytest
+
+import abkhazia.kaldi.ark as ark
+from abkhazia.features.delta import delta_scales, compute_deltas, \
+    scp_add_deltas
+
+
+def test_scales():
+    scales = delta_scales(2)
+    assert np.array_equal(scales[0], [1])
+    assert np.allclose(scales[1], [-0.2, -0.1, 0, 0.1, 0.2])
+    # values from kaldi add-deltas --print-args
+    assert np.allclose(
+        scales[2],
+        [0.04, 0.04, 0.01, -0.04, -0.1, -0.04, 0.01, 0.04, 0.04])
+
+
+@pytest.mark.parametrize('order', [0, 1, 2, 3])
+def test_shape(order):
+    feats = np.random.random((50, 13))
+    deltas = compute_deltas(feats, order=order)
+    assert deltas.shape == (50, 13 * (order + 1))
+    assert deltas.dtype == np.float32
+    assert np.allclose(deltas[:, :13], feats)
+
+
+def test_values():
+    # constant features have null deltas
+    assert np.allclose(compute_deltas(np.ones((20, 3)))[:, 3:], 0, atol=1e-6)
+
+    # the first order delta of a ramp is its slope, far from edges
+    ramp = 3 * np.arange(20, dtype=float)[:, None]
+    deltas = compute_deltas(ramp, order=2)
+    assert np.allclose(deltas[2:-2, 1], 3)
+    assert np.allclose(deltas[4:-4, 2], 0, atol=1e-5)
+
+    # edges are replicated frames
+    assert np.isclose(deltas[0, 1], 1.5)
+
+
+def test_scp_add_deltas(tmpdir):
+    data = {'utt{}'.format(i): np.random.random((30 + i, 4))
+            for i in range(5)}
+    raw_ark = os.path.join(str(tmpdir), 'raw.ark')
+    raw_scp = os.path.join(str(tmpdir), 'raw.scp')
+    ark.write_ark(raw_ark, sorted(data.items()), scpfile=raw_scp)
+
+    delta_ark = os.path.join(str(tmpdir), 'delta.ark')
+    delta_scp = os.path.join(str(tmpdir), 'delta.scp')
+    assert scp_add_deltas(raw_scp, delta_ark, delta_scp, order=2) == 5
+
+    deltas = dict(ark.read_scp(delta_scp))
+    assert sorted(deltas.keys()) == sorted(data.keys())
+    for utt, feats in data.items():
+        assert np.allclose(
+            deltas[utt], compute_deltas(feats.astype(np.float32)))
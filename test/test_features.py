@@ -86,3 +86,30 @@ def test_features(pitch, ftype, corpus, tmpdir):
     assert len(times.keys()) == len(subcorpus.utts())
     for t, c in zip(times.keys(), subcorpus.utts()):
         assert t == c
+
+
+@pytest.mark.parametrize('shuffle, relocate', [
+    (False, False), (False, True), (True, False), (True, True)])
+def test_merge_scp(tmpdir, shuffle, relocate):
+    # 4 scp files of 100 utterances each, either in consecutive or
+    # interleaved ranges of keys
+    keys = ['utt{:04d}'.format(i) for i in range(400)]
+    scps = []
+    for n in range(4):
+        scps.append(str(tmpdir.join('raw_{}.scp'.format(n))))
+        with open(scps[-1], 'w') as fscp:
+            for key in (keys[n::4] if shuffle else keys[100*n:100*(n+1)]):
+                fscp.write('{} /arks/raw_{}.ark:{}\n'.format(key, n, len(key)))
+    open(str(tmpdir.join('raw_empty.scp')), 'w').close()
+    scps.append(str(tmpdir.join('raw_empty.scp')))
+
+    output = str(tmpdir.join('feats.scp'))
+    arks = {'/arks/raw_1.ark': '/new/raw_1.ark'} if relocate else None
+    features.features.merge_scp(reversed(scps), output, arks=arks)
+
+    lines = open(output, 'r').readlines()
+    assert [line.split(' ')[0] for line in lines] == keys
+    assert sum('/new/raw_1.ark:7' in line for line in lines) == (
+        100 if relocate else 0)
+    assert sum('/arks/raw_1.ark:7' in line for line in lines) == (
+        0 if relocate else 100)
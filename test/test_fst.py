@@ -0,0 +1,87 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.language.fst module"""
+
+import math
+import shutil
+import subprocess
+
+import pytest
+
+from abkhazia.language import fst
+from abkhazia.language.arpa import ARPALanguageModel
+
+
+def _flat(tokens):
+    prob = math.log10(1.0 / len(tokens))
+    return ARPALanguageModel({1: {(t,): (prob, None) for t in tokens}})
+
+
+def test_write_read(tmpdir):
+    path = str(tmpdir.join('G.fst'))
+    states = [(fst.INF, [(1, 1, 0.5, 1), (2, 2, 0.0, 0)]),
+              (0.25, [(3, 4, 1.0, 0)])]
+    fst.write_vector_fst(path, states)
+
+    start, read, props = fst.read_vector_fst(path)
+    assert start == 0
+    assert read == states
+    assert props & fst.NOT_ACCEPTOR
+    assert props & fst.I_LABEL_SORTED
+    assert props & fst.NO_EPSILONS
+    assert props & fst.WEIGHTED
+
+
+def test_read_bad_magic(tmpdir):
+    path = tmpdir.join('G.fst')
+    path.write('not an fst')
+    with pytest.raises(IOError):
+        fst.read_vector_fst(str(path))
+
+
+def test_write_unigram(tmpdir):
+    tokens = ['<s>', '</s>', '<unk>', 'c', 'b', 'a', 'oov']
+    symbols = {w: i for i, w in enumerate(
+        ['<eps>', '<unk>', 'a', 'b', 'c', '#0', '<s>', '</s>'])}
+    path = str(tmpdir.join('G.fst'))
+    assert fst.write_unigram(path, _flat(tokens), symbols) == ['oov']
+
+    start, states, props = fst.read_vector_fst(path)
+    weight = math.log(len(tokens))
+    assert start == 0 and len(states) == 1
+    assert states[0][0] == pytest.approx(weight)
+    assert [a[0] for a in states[0][1]] == [1, 2, 3, 4]
+    for ilabel, olabel, w, nextstate in states[0][1]:
+        assert ilabel == olabel and nextstate == 0
+        assert w == pytest.approx(weight)
+    assert props & fst.ACCEPTOR and props & fst.I_DETERMINISTIC
+
+
+def test_write_unigram_order(tmpdir):
+    lm = ARPALanguageModel({1: {('a',): (-1, -0.5)},
+                            2: {('a', 'a'): (-1, None)}})
+    with pytest.raises(IOError):
+        fst.write_unigram(str(tmpdir.join('G.fst')), lm, {'a': 1})
+
+
+@pytest.mark.skipif(not shutil.which('fstprint'), reason='needs OpenFst')
+def test_openfst(tmpdir):
+    path = str(tmpdir.join('G.fst'))
+    fst.write_unigram(
+        path, _flat(['<s>', '</s>', 'a', 'b']),
+        {'<eps>': 0, 'a': 1, 'b': 2, '<s>': 3, '</s>': 4})
+    lines = subprocess.check_output(['fstprint', path]).decode().split('\n')
+    assert lines[0].split()[:4] == ['0', '0', '1', '1']
+    assert lines[2].split()[0] == '0'
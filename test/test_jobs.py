@@ -0,0 +1,180 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.jobs module"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+import abkhazia.utils as utils
+
+
+def _hungry(memory, duration, output):
+    """A command allocating `memory` MB for `duration` s
+
+    It writes its start and end times to `output`
+
+    """
+    code = (
+        'import time; t0 = time.time(); '
+        'data = bytearray({} * 1024**2); time.sleep({}); '
+        'open("{}", "w").write("%f %f" % (t0, time.time()))'.format(
+            memory, duration, output))
+    return '{} -c \'{}\''.format(sys.executable, code)
+
+
+def _max_overlap(outputs):
+    """Return the maximal number of commands running at once"""
+    events = []
+    for output in outputs:
+        start, end = (float(t) for t in open(output, 'r').read().split())
+        events += [(start, 1), (end, -1)]
+
+    running, overlap = 0, 0
+    for _, event in sorted(events):
+        running += event
+        overlap = max(overlap, running)
+    return overlap
+
+
+@pytest.fixture
+def limiter(tmpdir):
+    return utils.jobs.MemoryLimiter(
+        budget=250, directory=str(tmpdir.mkdir('jobs')), poll=0.05)
+
+
+def test_run_rusage():
+    rusage = utils.jobs.run(
+        'python -c "bytearray(100 * 1024**2)"', stdout=lambda _: None)
+    assert rusage.ru_maxrss // 1024 >= 100
+
+    with pytest.raises(RuntimeError):
+        utils.jobs.run('false', stdout=lambda _: None)
+
+
+def test_run_without_waitid(monkeypatch, tmpdir):
+    # os.waitid is not available on macOS
+    monkeypatch.delattr(os, 'waitid')
+    test_run_rusage()
+    test_run_max_memory(tmpdir)
+
+
+def test_run_max_memory(tmpdir):
+    output = str(tmpdir.join('output'))
+    with pytest.raises(RuntimeError) as err:
+        utils.jobs.run(
+            _hungry(200, 10, output), stdout=lambda _: None, max_memory=100)
+    assert 'exceeds 100 MB' in str(err.value)
+    assert not os.path.isfile(output)
+
+    utils.jobs.run(
+        _hungry(10, 1, output), stdout=lambda _: None, max_memory=100)
+    assert os.path.isfile(output)
+
+
+def test_throttle_cmd():
+    throttle = utils.jobs.throttle_cmd
+    assert throttle('run.pl JOB=1:4 log cmd', 2) == \
+        'run.pl --max-jobs-run 2 JOB=1:4 log cmd'
+    assert throttle('steps/align.sh --cmd "utils/run.pl" a b', 3) == \
+        'steps/align.sh --cmd "utils/run.pl --max-jobs-run 3" a b'
+    assert throttle('queue.pl -q all.q', 3) == 'queue.pl -q all.q'
+    assert throttle('run.pl --max-jobs-run 1', 3) == 'run.pl --max-jobs-run 1'
+
+
+def test_record(limiter):
+    assert limiter.peak('step') is None
+    for peak in range(10):
+        limiter.record('step', peak, size=3)
+    assert limiter.peak('step') == 9
+
+    utils.jobs.run(_hungry(100, 0, os.devnull), stdout=lambda _: None,
+                   limiter=limiter, key='hungry')
+    assert 100 <= limiter.peak('hungry') < 150
+
+
+def test_admit(limiter):
+    limiter.record('step', 100)
+    assert limiter.max_jobs('step', 4) == 2
+
+    with limiter.admit('step', njobs=4) as admitted:
+        assert admitted == 2
+        assert limiter.reserved() == 200
+        assert limiter.max_jobs('step', 4) == 1
+    assert limiter.reserved() == 0
+
+    # a job exceeding the budget is admitted when running alone
+    with limiter.admit('step', memory=1000) as admitted:
+        assert admitted == 1
+
+
+def test_stale_reservation(limiter):
+    # a reservation from a process that does not exist anymore
+    stale = os.path.join(limiter.directory, '999999999-0.res')
+    open(stale, 'w').write('999999999 200')
+    assert limiter.reserved() == 0
+    assert not os.path.exists(stale)
+
+
+def test_foreign_reservation(limiter, monkeypatch):
+    # a reservation from a running process of another user
+    def kill(pid, signal):
+        raise PermissionError(pid)
+
+    open(os.path.join(limiter.directory, '1-0.res'), 'w').write('1 200')
+    monkeypatch.setattr(os, 'kill', kill)
+    assert limiter.reserved() == 200
+
+
+def test_throttling(limiter, tmpdir):
+    # first run to observe the peak memory of the command
+    utils.jobs.run(_hungry(100, 0, os.devnull), stdout=lambda _: None,
+                   limiter=limiter, key='hungry')
+
+    # the budget allows 2 of the 6 concurrent commands at once
+    outputs = [str(tmpdir.join('{}.txt'.format(n))) for n in range(6)]
+    threads = [threading.Thread(
+        target=utils.jobs.run, args=(_hungry(100, 0.3, output),),
+        kwargs={'stdout': lambda _: None,
+                'limiter': limiter, 'key': 'hungry'})
+               for output in outputs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _max_overlap(outputs) <= 2
+    assert limiter.reserved() == 0
+
+
+def test_shared_budget(limiter, tmpdir):
+    # two limiters on the same directory, as in two processes
+    other = utils.jobs.MemoryLimiter(
+        budget=limiter.budget, directory=limiter.directory, poll=0.05)
+    limiter.record('hungry', 200)
+
+    outputs = [str(tmpdir.join('{}.txt'.format(n))) for n in range(2)]
+    threads = [threading.Thread(
+        target=utils.jobs.run, args=(_hungry(100, 0.3, output),),
+        kwargs={'stdout': lambda _: None, 'limiter': lim, 'key': 'hungry'})
+               for lim, output in zip((limiter, other), outputs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _max_overlap(outputs) == 1
@@ -20,6 +20,7 @@ import pytest
 import abkhazia.language.language_model as language_model
 import abkhazia.utils as utils
 import abkhazia.kaldi as kaldi
+from abkhazia.language.arpa import ARPALanguageModel
 from .conftest import assert_no_expr_in_log
 
 
@@ -69,3 +70,31 @@ def test_silence_probability(prob, corpus, tmpdir):
         lm.export()
         language_model.check_language_model(output_dir)
         assert_no_expr_in_log(flog, 'error')
+
+
+@pytest.mark.parametrize('options, reads_symbols', [
+    ({}, False),
+    ({'read-symbol-table': None}, False),
+    ({'read-symbol-table': None, 'disambig-symbol': None}, True)])
+def test_arpa2fst_interface(tmpdir, monkeypatch, options, reads_symbols):
+    monkeypatch.setattr(kaldi.options, 'get_options', lambda _: options)
+    assert language_model.arpa2fst_reads_symbols() == reads_symbols
+
+    # the attributes of a LanguageModel used by _compile_lm
+    lm = language_model.LanguageModel.__new__(language_model.LanguageModel)
+    lm.output_dir = str(tmpdir)
+    lm.log = utils.logger.null_logger()
+    commands = []
+    lm._run_command = lambda command, *_, **__: commands.append(command)
+
+    words_txt = str(tmpdir.join('words.txt'))
+    with open(words_txt, 'w') as fout:
+        fout.write('<eps> 0\n<s> 1\n</s> 2\na 3\n')
+    arpa = str(tmpdir.join('lm.arpa'))
+    ARPALanguageModel({1: {
+        ('<s>',): (-99, -0.3), ('</s>',): (-0.3, None),
+        ('a',): (-0.3, -0.3)}}).save(arpa)
+
+    lm._compile_lm(arpa, words_txt, str(tmpdir))
+    assert ('--read-symbol-table' in commands[0]) == reads_symbols
+    assert ('fstcompile' in commands[0]) != reads_symbols
@@ -0,0 +1,189 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the Kaldi messages classification in abkhazia.utils.logger"""
+
+import logging
+import os
+import sys
+import time
+
+import pytest
+
+import abkhazia.utils as utils
+
+
+# canned log of a Kaldi job, as written by run.pl in exp/*/log
+ALIGN_LOG = '''\
+# gmm-align-compiled --transition-scale=1.0 --beam=10 ...
+# Started at Wed Oct 12 16:33:51 CEST 2016
+#
+gmm-align-compiled --transition-scale=1.0 --beam=10 final.mdl ...
+LOG (gmm-align-compiled[5.5]:main():gmm-align-compiled.cc:105) Done 10 files
+WARNING (gmm-align-compiled[5.5]:AlignUtteranceWrapper():decoder-wrappers.cc:834) Retrying utterance s01_01 with beam 40
+WARNING (gmm-align-compiled[5.5]:AlignUtteranceWrapper():decoder-wrappers.cc:846) Did not successfully decode file s01_02
+VLOG[2] (gmm-align-compiled[5.5]:main():gmm-align-compiled.cc:110) details
+LOG (gmm-align-compiled[5.5]:main():gmm-align-compiled.cc:123) Overall log-likelihood per frame is -9.8
+# Accounting: time=1 threads=1
+# Ended (code 0) at Wed Oct 12 16:33:52 CEST 2016, elapsed time 1 seconds
+'''
+
+# canned output of a failed command, from TODO.org
+FAILED_OUTPUT = '''\
+steps/make_mfcc.sh data/features exp/make_mfcc mfcc
+ERROR (apply-cmvn:Write():kaldi-matrix.cc:1229) Failed to write matrix to stream
+WARNING (apply-cmvn:Write():util/kaldi-holder-inl.h:54) Exception caught writing Table object: ERROR (apply-cmvn:Write():kaldi-matrix.cc:1229) Failed to write matrix to stream
+ASSERTION_FAILED (compute-cmvn-stats[5.5]:main():compute-cmvn-stats.cc:90) Assertion failed: (dim > 0)
+'''
+
+
+class _Recorder(logging.Handler):
+    def __init__(self):
+        super(_Recorder, self).__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelname, record.getMessage()))
+
+
+@pytest.fixture
+def log():
+    log = logging.getLogger('test_logger')
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    recorder = _Recorder()
+    log.handlers = [recorder]
+    log.records = recorder.records
+    return log
+
+
+@pytest.mark.parametrize('line, level', [
+    (FAILED_OUTPUT.split('\n')[0], None),
+    (FAILED_OUTPUT.split('\n')[1], 'ERROR'),
+    (FAILED_OUTPUT.split('\n')[2], 'WARNING'),
+    (FAILED_OUTPUT.split('\n')[3], 'ERROR'),
+    (ALIGN_LOG.split('\n')[4], 'LOG'),
+    (ALIGN_LOG.split('\n')[7], 'VLOG'),
+    ('# Accounting: time=1 threads=1', None),
+    ('steps/align_si.sh: WARNING: 2 utterances failed', None)])
+def test_kaldi_level(line, level):
+    assert utils.logger.kaldi_level(line) == level
+
+
+def test_classify_stream(log):
+    classifier = utils.logger.KaldiLogClassifier(log)
+    for line in FAILED_OUTPUT.split('\n'):
+        classifier(line)
+
+    assert classifier.counts['ERROR'] == 2
+    assert classifier.counts['WARNING'] == 1
+    assert [r[0] for r in log.records] == [
+        'DEBUG', 'ERROR', 'WARNING', 'ERROR', 'DEBUG']
+
+
+def test_read_logs(tmpdir, log):
+    exp = tmpdir.mkdir('exp')
+    exp.mkdir('make_mfcc').mkdir('log').join('old.log').write(FAILED_OUTPUT)
+    old = str(exp.join('make_mfcc', 'log', 'old.log'))
+    os.utime(old, (time.time() - 100, time.time() - 100))
+
+    start = time.time() - 10
+    log_dir = exp.mkdir('tri').mkdir('log')
+    for n in (1, 2):
+        log_dir.join('align.{}.log'.format(n)).write(ALIGN_LOG)
+
+    # the logs out of exp and behind symlinks are ignored
+    tmpdir.mkdir('steps').mkdir('log').join('other.log').write(ALIGN_LOG)
+    exp.join('link').mksymlinkto(tmpdir.join('steps'))
+
+    counts = utils.logger.KaldiLogClassifier().counts
+    classifier = utils.logger.KaldiLogClassifier(log, counts=counts)
+    classifier.read_logs(str(tmpdir), since=start)
+
+    # old.log is ignored, only warnings and errors are read
+    assert dict(counts) == {'WARNING': 4}
+    assert log.records[0] == (
+        'WARNING', 'exp/tri/log/align.1.log: ' + ALIGN_LOG.split('\n')[5])
+
+    # without a threshold nothing is raised
+    classifier.check()
+
+    # the logs already read are not counted twice
+    classifier.read_logs(str(tmpdir))
+    assert dict(counts) == {'WARNING': 5, 'ERROR': 2}
+
+
+def test_read_logs_offsets(tmpdir, log):
+    log_file = tmpdir.mkdir('exp').mkdir('tri').mkdir('log').join('a.log')
+    log_file.write(ALIGN_LOG + FAILED_OUTPUT[:-10])
+
+    # concurrent commands share the offsets
+    offsets = {}
+    first = utils.logger.KaldiLogClassifier(log, offsets=offsets)
+    second = utils.logger.KaldiLogClassifier(log, offsets=offsets)
+    first.read_logs(str(tmpdir))
+    second.read_logs(str(tmpdir))
+    assert dict(first.counts) == {'WARNING': 3, 'ERROR': 1}
+    assert dict(second.counts) == {}
+
+    # the partial last line is read once completed
+    log_file.write(FAILED_OUTPUT[-10:], mode='a')
+    second.read_logs(str(tmpdir))
+    assert dict(second.counts) == {'ERROR': 1}
+
+
+@pytest.mark.parametrize('max_warnings, max_errors, raised', [
+    (None, None, False),
+    (1, None, False),
+    (0, None, True),
+    (None, 1, True),
+    (None, 2, False)])
+def test_thresholds(log, max_warnings, max_errors, raised):
+    classifier = utils.logger.KaldiLogClassifier(
+        log, max_warnings=max_warnings, max_errors=max_errors)
+
+    def feed():
+        for line in FAILED_OUTPUT.split('\n'):
+            classifier(line)
+
+    if raised:
+        with pytest.raises(RuntimeError):
+            feed()
+    else:
+        feed()
+
+
+def test_fail_fast(tmpdir, log):
+    # a command with a subprocess, printing an error then running
+    # for a long time
+    script = tmpdir.join('job.sh')
+    script.write(
+        'sleep 30 &\n'
+        'echo $! > {}\n'
+        'echo "ERROR (prog:main():prog.cc:1) failure"\n'
+        'sleep 30\n'.format(tmpdir.join('child.pid')))
+
+    classifier = utils.logger.KaldiLogClassifier(log, max_errors=0)
+    t0 = time.time()
+    with pytest.raises(RuntimeError) as err:
+        utils.jobs.run('bash {}'.format(script), stdout=classifier)
+    assert 'too many Kaldi ERROR' in str(err.value)
+    assert time.time() - t0 < 10
+
+    # the subprocess has been killed as well
+    time.sleep(0.2)
+    child = int(tmpdir.join('child.pid').read())
+    if sys.platform.startswith('linux'):
+        assert not os.path.exists('/proc/{}'.format(child)) or \
+            open('/proc/{}/stat'.format(child)).read().split()[2] == 'Z'
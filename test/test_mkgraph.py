@@ -0,0 +1,164 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the decoding graph cache in abkhazia.decode._mkgraph"""
+
+import os
+import stat
+
+import pytest
+
+import abkhazia.utils as utils
+from abkhazia.decode import _mkgraph
+
+
+# a stub of mkgraph.sh logging its invocations, its last arguments
+# are <lang-dir> <model-dir> <graph-dir>
+STUB_MKGRAPH = '''#!/bin/bash
+echo "$@" >> {calls}
+echo HCLG > ${{@: -1}}/HCLG.fst
+cp ${{@: -3:1}}/words.txt ${{@: -1}}
+'''
+
+# a stub of run.pl running the command in its log file
+STUB_RUN = '''#!/bin/bash
+log=$1
+shift
+"$@" > $log 2>&1
+'''
+
+MODEL = b'\0B<TransitionModel> <Topology> 1 2 3 </TransitionModel> <GMM> 0.5'
+
+
+def _script(path, content):
+    with open(path, 'w') as fout:
+        fout.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+class Decoder(object):
+    """The attributes of abkhazia.decode.Decode used by mkgraph"""
+    def __init__(self, tmpdir):
+        self.log = utils.logger.null_logger()
+        self.mkgraph_opts = _mkgraph.options()
+        self.recipe_dir = str(tmpdir.join('recipe'))
+        self.lm_dir = str(tmpdir.mkdir('lang'))
+        self.am_dir = str(tmpdir.mkdir('am'))
+        self.am_type = 'tri'
+        self.rusage_history = None
+        self.use_cache = True
+
+        os.makedirs(os.path.join(self.recipe_dir, 'utils'))
+        for f in ('L.fst', 'L_disambig.fst', 'G.fst', 'words.txt'):
+            tmpdir.join('lang', f).write(f)
+        tmpdir.join('am', 'tree').write('tree')
+        tmpdir.join('am', 'final.mdl').write_binary(MODEL)
+
+    def _run_command(self, command, verbose=True, max_memory=None):
+        utils.jobs.run(command, stdout=lambda _: None,
+                       cwd=self.recipe_dir, max_memory=max_memory)
+
+
+@pytest.fixture
+def calls(tmpdir, monkeypatch):
+    """Return the calls file of a stub of mkgraph.sh"""
+    monkeypatch.setitem(
+        utils.config['abkhazia'], 'tmp-directory', str(tmpdir))
+    monkeypatch.setitem(utils.config['kaldi'], 'highmem-cmd', 'run.pl')
+    return str(tmpdir.join('calls.txt'))
+
+
+def _decoder(tmpdir, calls):
+    decoder = Decoder(tmpdir)
+    utils_dir = os.path.join(decoder.recipe_dir, 'utils')
+    _script(os.path.join(utils_dir, 'mkgraph.sh'),
+            STUB_MKGRAPH.format(calls=calls))
+    _script(os.path.join(utils_dir, 'run.pl'), STUB_RUN)
+    return decoder
+
+
+def _ncalls(calls):
+    return len(open(calls).readlines()) if os.path.isfile(calls) else 0
+
+
+def _mkgraph_in(tmpdir, calls, name):
+    decoder = _decoder(tmpdir.mkdir(name), calls)
+    graph = _mkgraph.mkgraph(decoder)
+    assert open(os.path.join(graph, 'HCLG.fst')).read() == 'HCLG\n'
+    return decoder
+
+
+def test_transition_model_hash(tmpdir):
+    model = tmpdir.join('final.mdl')
+    model.write_binary(MODEL)
+    hash1 = _mkgraph.transition_model_hash(str(model))
+
+    # the acoustic parameters are ignored
+    model.write_binary(MODEL.replace(b'0.5', b'0.7'))
+    assert _mkgraph.transition_model_hash(str(model)) == hash1
+
+    model.write_binary(MODEL.replace(b'2 3', b'2 4'))
+    assert _mkgraph.transition_model_hash(str(model)) != hash1
+
+    # the whole file is hashed when not a Kaldi model
+    model.write_binary(b'0.5')
+    hash2 = _mkgraph.transition_model_hash(str(model))
+    model.write_binary(b'0.7')
+    assert _mkgraph.transition_model_hash(str(model)) != hash2
+
+
+def test_cache(tmpdir, calls):
+    _mkgraph_in(tmpdir, calls, 'decode1')
+    assert _ncalls(calls) == 1
+
+    # another decode on the same models reuses the graph, even if
+    # the acoustic model parameters changed
+    decoder = _decoder(tmpdir.mkdir('decode2'), calls)
+    with open(os.path.join(decoder.am_dir, 'final.mdl'), 'wb') as fout:
+        fout.write(MODEL.replace(b'0.5', b'0.7'))
+    _mkgraph.mkgraph(decoder)
+    assert _ncalls(calls) == 1
+    assert os.listdir(os.path.join(decoder.recipe_dir, 'graph'))
+
+    # a change in G.fst, the tree or the options is a cache miss
+    decoder = _decoder(tmpdir.mkdir('decode3'), calls)
+    with open(os.path.join(decoder.lm_dir, 'G.fst'), 'w') as fout:
+        fout.write('G2')
+    _mkgraph.mkgraph(decoder)
+    assert _ncalls(calls) == 2
+
+    decoder = _decoder(tmpdir.mkdir('decode4'), calls)
+    decoder.mkgraph_opts['self-loop-scale'].value = 1.0
+    _mkgraph.mkgraph(decoder)
+    assert _ncalls(calls) == 3
+
+    decoder = _decoder(tmpdir.mkdir('decode5'), calls)
+    decoder.use_cache = False
+    _mkgraph.mkgraph(decoder)
+    assert _ncalls(calls) == 4
+
+
+def test_max_memory(tmpdir, calls):
+    decoder = _decoder(tmpdir, calls)
+    assert _mkgraph._max_memory(decoder) is None
+
+    with open(os.path.join(decoder.recipe_dir, 'utils', 'mkgraph.sh'),
+              'a') as fout:
+        fout.write('python -c "x = bytearray(200 * 1024**2); '
+                   'import time; time.sleep(10)"\n')
+    decoder.mkgraph_opts['max-memory'].value = 100
+
+    with pytest.raises(RuntimeError):
+        _mkgraph.mkgraph(decoder)
+    assert not os.listdir(utils.cache.FileCache('graph').directory)
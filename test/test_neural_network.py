@@ -0,0 +1,50 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the train_pnorm_fast.sh command in abkhazia.acoustic"""
+
+import copy
+import shlex
+
+import abkhazia.utils as utils
+from abkhazia.acoustic.neural_network import NeuralNetwork
+from abkhazia.kaldi import planner
+
+
+def _command(nnet):
+    """Return the train_pnorm_fast.sh arguments built by `nnet`"""
+    commands = []
+    nnet._run_am_command = lambda command, *_: commands.append(command)
+    nnet._train_pnorm_fast()
+    args = shlex.split(commands[0])
+    return dict(zip(args[1:-4:2], args[2:-4:2]))
+
+
+def test_step_plan(tmpdir, monkeypatch):
+    monkeypatch.setitem(utils.config['kaldi'], 'train-cmd', 'run.pl')
+
+    # the attributes of a NeuralNetwork used by _train_pnorm_fast
+    nnet = NeuralNetwork.__new__(NeuralNetwork)
+    nnet.options = copy.deepcopy(NeuralNetwork.options)
+    nnet.njobs = 1
+    nnet.recipe_dir = nnet.data_dir = nnet.lang_dir = nnet.am_dir = str(
+        tmpdir)
+
+    plan = planner.StepPlan('nnet', 4, 8, 128, 1000, 'profile')
+    nnet._apply_step_plan(plan)
+    args = _command(nnet)
+    assert args['--num-jobs-nnet'] == '4'
+    assert args['--num-threads'] == '8'
+    assert args['--combine-num-threads'] == '8'
+    assert args['--minibatch-size'] == '128'
@@ -0,0 +1,111 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.language.ngram module"""
+
+import gzip
+
+import pytest
+
+from abkhazia.language import ngram
+from abkhazia.language.arpa import ARPALanguageModel
+
+
+LM_TEXT = u'''\
+s01_01 the cat sat on the mat
+s01_02 the dog sat
+s01_03
+s02_01 a cat and a dog
+s02_02 the cat ate the dog food
+'''
+
+
+@pytest.fixture
+def lm_text(tmpdir):
+    path = str(tmpdir.join('lm_text.txt'))
+    with open(path, 'w') as fout:
+        fout.write(LM_TEXT)
+    return path
+
+
+def _prob(lm, ngram_):
+    """Return p(w|h) from an ARPA model, with backoff"""
+    ngram_ = tuple(ngram_)
+    if ngram_ in lm.ngrams[len(ngram_)]:
+        return 10 ** lm.ngrams[len(ngram_)][ngram_][0]
+    bow = lm.ngrams[len(ngram_) - 1].get(ngram_[:-1], (0, None))[1]
+    return 10 ** (bow or 0) * _prob(lm, ngram_[1:])
+
+
+def test_sentences(lm_text):
+    sentences = ngram.sentences(lm_text)
+    assert next(sentences) == 'the cat sat on the mat'.split()
+    assert len(list(sentences)) == 3
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_write_sentences(lm_text, tmpdir, compress):
+    output = str(tmpdir.join('text_se' + ('.gz' if compress else '.txt')))
+    assert ngram.write_sentences(lm_text, output) == 4
+
+    lines = (gzip.open(output, 'rt') if compress else open(output)).read()
+    lines = lines.split('\n')
+    assert len(lines) == 5 and lines[-1] == ''
+    assert lines[1] == '<s> the dog sat </s>'
+
+
+def test_count_ngrams(lm_text):
+    counts = ngram.count_ngrams(ngram.sentences(lm_text), 3)
+    assert counts[1][('the',)] == 5
+    assert counts[1][('<s>',)] == 4
+    assert counts[2][('cat', 'sat')] == 1
+    assert counts[2][('dog', '</s>')] == 1
+    assert counts[3][('<s>', 'the', 'cat')] == 2
+    assert sum(counts[3].values()) == 20
+
+
+@pytest.mark.parametrize('order', [1, 2, 3])
+def test_kneser_ney(lm_text, tmpdir, order):
+    counts = ngram.count_ngrams(ngram.sentences(lm_text), order)
+    lm = ngram.kneser_ney(counts)
+    assert lm.order == order
+    assert lm.ngrams[1][('<s>',)][0] == -99
+
+    # the conditional distributions sum to one, for each context
+    vocab = [w for (w,) in lm.ngrams[1] if w != '<s>']
+    contexts = [()] + [h for n in range(1, order) for h in lm.ngrams[n]
+                       if h[-1] != '</s>']
+    for h in contexts:
+        assert sum(_prob(lm, h + (w,)) for w in vocab) == \
+            pytest.approx(1, abs=1e-5)
+
+    # the saved model is loaded back
+    path = str(tmpdir.join('lm.arpa'))
+    lm.save(path)
+    assert ARPALanguageModel.load(path).ngrams == lm.ngrams
+
+
+def test_kneser_ney_continuation(lm_text):
+    # 'sat' follows 2 distinct words, 'mat' a single one
+    lm = ngram.kneser_ney(
+        ngram.count_ngrams(ngram.sentences(lm_text), 2))
+    assert lm.ngrams[1][('sat',)][0] > lm.ngrams[1][('mat',)][0]
+    assert lm.ngrams[1][('the',)][1] is not None
+    assert lm.ngrams[2][('the', 'cat')][1] is None
+
+
+def test_kneser_ney_max_order(lm_text):
+    counts = ngram.count_ngrams(ngram.sentences(lm_text), 4)
+    with pytest.raises(IOError):
+        ngram.kneser_ney(counts)
@@ -0,0 +1,119 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.path module"""
+
+import os
+import re
+
+import pytest
+
+import abkhazia.utils as utils
+
+
+def _legacy_list(directory, extension, recursive=True):
+    """The former regex and os.walk based implementation"""
+    expr = r'(.*)' + re.escape(extension) + '$'
+    if recursive:
+        matched = []
+        for path, _, files in os.walk(directory):
+            matched += [os.path.join(path, f)
+                        for f in files if re.match(expr, f)]
+    else:
+        matched = [os.path.join(directory, f)
+                   for f in os.listdir(directory)
+                   if re.match(expr, f)]
+    return sorted(matched)
+
+
+@pytest.fixture
+def tree(tmpdir):
+    root = str(tmpdir.mkdir('tree'))
+    for n in range(30):
+        d = os.path.join(root, str(n % 4), str(n % 3))
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        for ext in ('.flac', '.trans.txt', '.txt'):
+            open(os.path.join(d, 'f{}{}'.format(n, ext)), 'w').close()
+    open(os.path.join(root, 'top.flac'), 'w').close()
+
+    # a directory named like a matching file and a link to a directory
+    os.makedirs(os.path.join(root, 'dir.flac'))
+    os.symlink(os.path.join(root, '0'), os.path.join(root, 'link'))
+    return root
+
+
+@pytest.mark.parametrize('njobs', [1, 3])
+@pytest.mark.parametrize('recursive', [True, False])
+@pytest.mark.parametrize('ext', ['.flac', '.trans.txt', '.txt'])
+def test_list_files(tree, njobs, recursive, ext):
+    assert utils.list_files_with_extension(
+        tree, ext, realpath=False, recursive=recursive, njobs=njobs) == \
+        _legacy_list(tree, ext, recursive=recursive)
+
+
+def test_list_files_realpath(tree, tmpdir):
+    # a link to the tree and a link to a file in it
+    link = os.path.join(str(tmpdir), 'link')
+    os.symlink(tree, link)
+    os.symlink(os.path.join(tree, '1', '1', 'f1.flac'),
+               os.path.join(tree, 'a_link.flac'))
+
+    expected = sorted(
+        os.path.realpath(f) for f in _legacy_list(link, '.flac'))
+    assert utils.list_files_with_extension(link, '.flac') == expected
+    assert utils.list_files_with_extension(
+        os.path.relpath(link), '.flac', abspath=True) == expected
+
+
+def test_list_files_natural_sort(tmpdir):
+    for n in (1, 2, 10, 11, 100):
+        open(os.path.join(str(tmpdir), 'raw_{}.scp'.format(n)), 'w').close()
+
+    files = utils.list_files_with_extension(
+        str(tmpdir), '.scp', natural_sort=True)
+    assert [os.path.basename(f) for f in files] == [
+        'raw_1.scp', 'raw_2.scp', 'raw_10.scp', 'raw_11.scp', 'raw_100.scp']
+
+
+def test_list_files_cache(tree):
+    flacs = utils.list_files_with_extension(tree, '.flac', cache=True)
+    assert len(flacs) == 31
+
+    # cache hit, whatever the extension
+    assert len(utils.list_files_with_extension(
+        tree, '.txt', cache=True)) == 60
+
+    # a new file invalidates the cache
+    new = os.path.join(tree, '2', '1', 'new.flac')
+    open(new, 'w').close()
+    assert new in utils.list_files_with_extension(tree, '.flac', cache=True)
+
+    # so does a removed one
+    utils.remove(new)
+    assert utils.list_files_with_extension(
+        tree, '.flac', cache=True) == flacs
+
+
+def test_list_files_cache_size(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils.path, 'WALK_CACHE_SIZE', 2)
+    utils.clear_walk_cache()
+    for n in range(3):
+        d = str(tmpdir.mkdir(str(n)))
+        utils.list_files_with_extension(d, '.flac', cache=True)
+    assert sorted(k[0] for k in utils.path._WALK_CACHE) == [
+        str(tmpdir.join('1')), str(tmpdir.join('2'))]
+
+    utils.clear_walk_cache()
+    assert not utils.path._WALK_CACHE
@@ -0,0 +1,108 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.kaldi.planner module"""
+
+import os
+
+import pytest
+
+from abkhazia.kaldi import planner
+
+
+# a workstation and a large compute node
+SMALL = planner.Machine(ncores=4, memory=8000)
+LARGE = planner.Machine(ncores=32, memory=64000)
+
+
+def test_local_machine():
+    machine = planner.local_machine()
+    assert machine.ncores >= 1
+    assert machine.memory > 0
+
+
+@pytest.mark.parametrize('machine, nspeakers, njobs', [
+    (SMALL, None, 4),
+    (SMALL, 2, 2),
+    (LARGE, None, 32),
+    (LARGE, 10, 10),
+    # memory bound: 1000 MB / 200 MB per job
+    (planner.Machine(ncores=32, memory=1000), None, 5),
+    # not enough memory for a single job, still run one
+    (planner.Machine(ncores=32, memory=100), None, 1)])
+def test_plan_features(machine, nspeakers, njobs):
+    plan = planner.plan_step('features', machine, nspeakers=nspeakers)
+    assert plan.njobs == njobs
+    assert plan.num_threads == 1
+    assert plan.minibatch_size is None
+    assert plan.source == 'default'
+
+
+@pytest.mark.parametrize('machine, njobs, num_threads, minibatch', [
+    (SMALL, 4, 1, 512),
+    (LARGE, 4, 8, 128),
+    (planner.Machine(ncores=1, memory=64000), 1, 1, 512),
+    # room for a single job, having all the cores
+    (planner.Machine(ncores=32, memory=3000), 1, 16, 128)])
+def test_plan_nnet(machine, njobs, num_threads, minibatch):
+    plan = planner.plan_step('nnet', machine)
+    assert (plan.njobs, plan.num_threads, plan.minibatch_size) == (
+        njobs, num_threads, minibatch)
+
+
+def test_plan_decode():
+    plans = planner.plan(['mkgraph', 'decode-nnet'], LARGE, nspeakers=4)
+    assert [p.step for p in plans] == ['mkgraph', 'decode-nnet']
+    assert (plans[0].njobs, plans[0].num_threads) == (1, 1)
+    assert (plans[1].njobs, plans[1].num_threads) == (4, 4)
+
+
+def test_plan_unknown_step():
+    with pytest.raises(IOError):
+        planner.plan_step('unknown', SMALL)
+
+
+def test_history(tmpdir):
+    filename = os.path.join(str(tmpdir), 'history', 'rusage.json')
+    history = planner.History(filename, size=2)
+    assert history.peak('features') is None
+
+    for peak in (3000, 1000, 1500):
+        history.record('features', peak)
+    assert history.peak('features') == 1500
+    history.save()
+
+    history = planner.History(filename)
+    assert history.peaks == {'features': [1000, 1500]}
+
+    # 1500 MB * 1.2 per job, 4 jobs fit in 8000 MB
+    plan = planner.plan_step('features', SMALL, history=history)
+    assert (plan.njobs, plan.memory, plan.source) == (4, 1800, 'history')
+
+    plan = planner.plan_step(
+        'features', SMALL._replace(memory=4000), history=history)
+    assert plan.njobs == 2
+
+    # no history for that step
+    assert planner.plan_step(
+        'align', SMALL, history=history).source == 'default'
+
+
+def test_format_plan():
+    plans = planner.plan(['mkgraph', 'nnet'], LARGE)
+    text = planner.format_plan(plans, LARGE).split('\n')
+    assert text[0] == 'machine: 32 cores, 64000 MB available'
+    assert len(text) == 4
+    assert text[2].split()[:4] == ['mkgraph', '1', '1', '-']
+    assert text[3].split()[:4] == ['nnet', '4', '8', '128']
@@ -0,0 +1,114 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the lang directory cache in abkhazia.utils.prepare_lang"""
+
+import os
+import stat
+
+import pytest
+
+import abkhazia.utils as utils
+from abkhazia.corpus import Corpus
+from abkhazia.kaldi import Abkhazia2Kaldi
+from abkhazia.utils import prepare_lang
+
+
+# a stub of prepare_lang.sh logging its invocations, its last
+# arguments are <dict-dir> <oov-word> <tmp-dir> <lang-dir>
+STUB = '''#!/bin/bash
+echo "$@" >> {calls}
+dict=${{@: -4:1}}
+lang=${{@: -1}}
+mkdir -p ${{@: -2:1}} $lang/phones
+cp $dict/lexicon.txt $lang/words.txt
+echo fst > $lang/L.fst
+echo SIL > $lang/phones/silence.txt
+'''
+
+
+@pytest.fixture
+def calls(tmpdir, monkeypatch):
+    """Install a stub of prepare_lang.sh, return its calls file"""
+    kaldi = tmpdir.mkdir('kaldi')
+    utils_dir = kaldi.mkdir('egs').mkdir('wsj').mkdir('s5').mkdir('utils')
+    kaldi.join('egs', 'wsj', 's5').mkdir('steps')
+    calls = str(tmpdir.join('calls.txt'))
+
+    script = str(utils_dir.join('prepare_lang.sh'))
+    with open(script, 'w') as fout:
+        fout.write(STUB.format(calls=calls))
+    os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+
+    monkeypatch.setitem(
+        utils.config['kaldi'], 'kaldi-directory', str(kaldi))
+    monkeypatch.setitem(
+        utils.config['abkhazia'], 'tmp-directory', str(tmpdir))
+    monkeypatch.setattr(prepare_lang, 'kaldi_path', lambda: os.environ)
+    monkeypatch.setattr(
+        Abkhazia2Kaldi, 'setup_machine_specific_scripts', lambda self: None)
+    return calls
+
+
+@pytest.fixture
+def corpus():
+    corpus = Corpus()
+    corpus.phones = {'a': 'a', 'b': 'b'}
+    corpus.silences = ['SIL']
+    corpus.lexicon = {'ab': 'a b', 'ba': 'b a'}
+    corpus.segments = {'u1': ('u1.wav', 0, 1), 'u2': ('u2.wav', 0, 1)}
+    corpus.text = {'u1': 'ab ba', 'u2': 'ba'}
+    corpus.utt2spk = {'u1': 's1', 'u2': 's1'}
+    return corpus
+
+
+def _ncalls(calls):
+    return len(open(calls).readlines()) if os.path.isfile(calls) else 0
+
+
+def test_cache(tmpdir, calls, corpus):
+    lang1, lang2 = str(tmpdir.join('lang1')), str(tmpdir.join('lang2'))
+    prepare_lang.prepare_lang(corpus, lang1)
+    assert _ncalls(calls) == 1
+
+    # the same lang is prepared in another directory from the cache
+    assert prepare_lang.prepare_lang(corpus, lang2) is None
+    assert _ncalls(calls) == 1
+    assert sorted(os.listdir(lang2)) == ['L.fst', 'phones', 'words.txt']
+    assert open(os.path.join(lang2, 'words.txt')).read() == \
+        open(os.path.join(lang1, 'words.txt')).read()
+    assert os.path.isfile(os.path.join(lang2, 'phones', 'silence.txt'))
+
+    # any change in the parameters or the lexicon is a cache miss
+    prepare_lang.prepare_lang(corpus, lang2, silence_probability=0.0)
+    assert _ncalls(calls) == 2
+    prepare_lang.prepare_lang(corpus, lang2, level='phone')
+    assert _ncalls(calls) == 3
+    corpus.lexicon['aa'] = 'a a'
+    prepare_lang.prepare_lang(corpus, lang2)
+    assert _ncalls(calls) == 4
+
+    prepare_lang.prepare_lang(corpus, lang2, use_cache=False)
+    assert _ncalls(calls) == 5
+
+
+def test_cache_merge(tmpdir, calls, corpus):
+    # the cached lang is merged in an existing directory
+    lang = tmpdir.mkdir('lang')
+    lang.join('G.fst').write('G')
+    prepare_lang.prepare_lang(corpus, str(tmpdir.join('other')))
+    prepare_lang.prepare_lang(corpus, str(lang))
+    assert _ncalls(calls) == 1
+    assert sorted(os.listdir(str(lang))) == [
+        'G.fst', 'L.fst', 'phones', 'words.txt']
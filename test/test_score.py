@@ -0,0 +1,216 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the lattice scoring in abkhazia.decode._score"""
+
+import collections
+import os
+
+import pytest
+
+import abkhazia.utils as utils
+from abkhazia.decode import _mkgraph, _score
+
+
+# on utt1 the path 'a b' has a better graph cost, the path 'c' a
+# better acoustic cost and less words
+LAT1 = '''utt1
+0 1 1 1.0,2.0,1_2
+1 2 2 0.5,10.0,3
+0 2 3 3.0,1.0,4_5
+2 0,0,
+
+'''
+
+# a Lattice (not compact) with states not in topological order and
+# a final state without weight
+LAT2 = '''utt2
+0 3 7 1 0,1
+3 1 8 0 0,1
+1 2 9 4 0,1
+2
+
+'''
+
+SYMBOLS = '<eps> 0\na 1\nb 2\nc 3\n<UNK> 4\n'
+
+REF = 'utt1 a b\nutt2 a <NOISE>\n'
+
+
+def stub_scorer(calls):
+    """A scorer returning the percentage of wrong hypotheses"""
+    def scorer(ref, hyp):
+        ref = open(ref).read().split('\n')
+        hyp = open(hyp).read().split('\n')
+        calls.append(hyp)
+        wrong = sum(r.strip() != h.strip() for r, h in zip(ref, hyp))
+        return '%WER {:.2f} [ {} / {}, 0 ins, 0 del, {} sub ]\n'.format(
+            100.0 * wrong / (len(ref) - 1), wrong, len(ref) - 1, wrong)
+    return scorer
+
+
+@pytest.fixture
+def lattices(tmpdir, monkeypatch):
+    monkeypatch.setitem(
+        utils.config['abkhazia'], 'tmp-directory', str(tmpdir))
+    tmpdir.join('lat.1.txt').write(LAT1)
+    tmpdir.join('lat.2.txt').write(LAT2)
+    tmpdir.join('words.txt').write(SYMBOLS)
+    tmpdir.join('text').write(REF)
+    return [str(tmpdir.join('lat.{}.txt'.format(i))) for i in (1, 2)]
+
+
+def test_read_lattices(lattices):
+    (utt1, lat1), = _score.read_lattices(lattices[0])
+    assert utt1 == 'utt1'
+    assert lat1[0] == 0
+    assert lat1[1] == [
+        (0, 1, 1, 1.0, 2.0), (0, 2, 3, 3.0, 1.0), (1, 2, 2, 0.5, 10.0)]
+    assert lat1[2] == {2: (0.0, 0.0)}
+
+    (utt2, lat2), = _score.read_lattices(lattices[1])
+    assert utt2 == 'utt2'
+    assert [arc[:3] for arc in lat2[1]] == [(0, 3, 1), (3, 1, 0), (1, 2, 4)]
+    assert lat2[2] == {2: (0.0, 0.0)}
+
+
+@pytest.mark.parametrize('lmwt, wip, words, cost', [
+    (10, 0, [1, 2], 2.7),
+    (1, 0, [3], 4.0),
+    (10, 1, [3], 4.1)])
+def test_best_path(lattices, lmwt, wip, words, cost):
+    _, lattice = next(_score.read_lattices(lattices[0]))
+    assert _score.best_path(lattice, lmwt, wip)[0] == words
+    assert _score.best_path(lattice, lmwt, wip)[1] == pytest.approx(cost)
+
+
+def test_best_path_no_final():
+    assert _score.best_path((0, [(0, 1, 1, 0, 0)], {}), 10) == (None, None)
+
+
+def test_score_lattices(tmpdir, lattices):
+    calls = []
+    results = _score.score_lattices(
+        lattices, str(tmpdir.join('words.txt')), str(tmpdir.join('text')),
+        str(tmpdir), [1, 10], wips=['0.0', '1.0'], njobs=2,
+        scorer=stub_scorer(calls))
+
+    assert len(calls) == 4
+    assert {w: r[0] for w, r in results.items()} == {
+        ('1', '0.0'): 50.0, ('1', '1.0'): 50.0,
+        ('10', '0.0'): 0.0, ('10', '1.0'): 50.0}
+
+    scoring = tmpdir.join('scoring')
+    assert scoring.join('10.0.0.tra').read() == 'utt1 1 2\nutt2 1 4\n'
+    assert scoring.join('10.0.0.txt').read() == 'utt1 a b\nutt2 a\n'
+    assert scoring.join('test_filt.txt').read() == 'utt1 a b\nutt2 a\n'
+    assert tmpdir.join('wer_1_1.0').read().startswith('%WER 50.00')
+    assert scoring.join('best_wer').read() == '%WER 0.00 [ 0 / 2, '\
+        '0 ins, 0 del, 0 sub ] {}\n'.format(tmpdir.join('wer_10_0.0'))
+    assert tmpdir.join('scoring_kaldi', 'best_wer').read() == \
+        scoring.join('best_wer').read()
+
+
+def test_score_cache(tmpdir, lattices, monkeypatch):
+    def _score_lattices(lmwts):
+        return _score.score_lattices(
+            lattices, str(tmpdir.join('words.txt')),
+            str(tmpdir.join('text')), str(tmpdir.join('decode')), lmwts,
+            scorer=stub_scorer([]))
+
+    _score_lattices([1, 10])
+
+    # the best paths are now read from the cache, only the new weight
+    # is computed
+    computed = []
+
+    def _best_paths(lattices, weights):
+        computed.append(weights)
+        return ({w: [] for w in weights}, {w: 0.0 for w in weights})
+
+    monkeypatch.setattr(_score, '_best_paths', _best_paths)
+    results = _score_lattices([1, 10, 12])
+    assert computed == [[('12', '0.0')], [('12', '0.0')]]
+    assert results[('10', '0.0')][0] == 0.0
+    assert os.path.isfile(
+        str(tmpdir.join('decode', 'scoring', '10.0.0.tra')))
+
+    # a new lattice is a cache miss
+    with open(lattices[1], 'a') as fout:
+        fout.write(LAT1.replace('utt1', 'utt3'))
+    computed.clear()
+    _score_lattices([1])
+    assert computed == [[('1', '0.0')], [('1', '0.0')]]
+
+
+def test_score_lattices_wer(tmpdir, lattices):
+    results = _score.score_lattices(
+        lattices, str(tmpdir.join('words.txt')), str(tmpdir.join('text')),
+        str(tmpdir), [1, 10])
+
+    assert results[('1', '0.0')][0] == pytest.approx(66.67)
+    assert tmpdir.join('wer_10_0.0').read() == (
+        '%WER 0.00 [ 0 / 3, 0 ins, 0 del, 0 sub ]\n'
+        '%SER 0.00 [ 0 / 2 ]\n'
+        'Scored 2 sentences, 0 not present in hyp.\n')
+    per_utt = tmpdir.join('scoring', 'wer_details', 'per_utt').read()
+    assert [line.split()[0] for line in per_utt.split('\n')[1:-1]] == [
+        'utt1', 'utt2']
+
+
+class Decoder(object):
+    """The attributes of abkhazia.decode.Decode used by score"""
+    def __init__(self, tmpdir):
+        self.log = utils.logger.null_logger()
+        self.score_opts = _score.options()
+        self.mkgraph_opts = _mkgraph.options()
+        self.recipe_dir = str(tmpdir)
+        self.name = 'test'
+        self.njobs = 2
+        self.use_cache = False
+        self.corpus = collections.namedtuple('Corpus', 'utt2spk')(
+            {'utt1': 'spk', 'utt2': 'spk'})
+        self.commands = []
+
+    def _run_command(self, command, verbose=True, max_memory=None):
+        # write the text lattice instead of converting lat.N.gz
+        self.commands.append(command)
+        target = command.split('ark,t:')[-1]
+        lattice = LAT1 if target.endswith('lat.1.txt') else LAT2
+        with open(target, 'w') as fout:
+            fout.write(lattice)
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_score(tmpdir, lattices, reverse):
+    tmpdir.mkdir('data').mkdir('test').join('text').write(REF)
+    decode_dir = tmpdir.mkdir('decode')
+    for i in (1, 2):
+        decode_dir.join('lat.{}.gz'.format(i)).write('')
+
+    decoder = Decoder(tmpdir)
+    decoder.mkgraph_opts['reverse'].value = reverse
+    decoder.score_opts['min-lmwt'].value = 10
+    decoder.score_opts['max-lmwt'].value = 10
+    _score.score(decoder, str(tmpdir), str(decode_dir))
+
+    assert len(decoder.commands) == 2
+    assert all(('lattice-reverse' in c) == reverse
+               for c in decoder.commands)
+    assert sorted(f.basename for f in decode_dir.listdir('wer_*')) == [
+        'wer_10_0.0', 'wer_10_0.5', 'wer_10_1.0']
+    assert decode_dir.join('scoring_kaldi', 'best_wer').check()
+
+    # the text lattices are removed
+    assert not decode_dir.join('scoring', 'lat.1.txt').check()
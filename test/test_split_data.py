@@ -0,0 +1,162 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.kaldi.split_data module"""
+
+import os
+import subprocess
+import time
+
+import pytest
+
+from abkhazia.kaldi.split_data import (
+    partition, kaldi_partition, imbalance, read_utt2dur, split_data,
+    is_split)
+
+
+# the data split of a Kaldi step, as in steps/train_mono.sh, with a
+# stub of utils/split_data.sh logging its calls
+STEP = '''
+data=$1
+nj=$2
+sdata=$data/split$nj
+[[ -d $sdata && $data/feats.scp -ot $sdata ]] || echo $data $nj >> $3
+'''
+
+
+@pytest.fixture
+def data_dir(tmpdir):
+    """A Kaldi data dir with 6 speakers
+
+    The 2 first speakers have 10 utterances of 1s, the others 2
+    utterances of 10s, there is 2 utterances per wav.
+
+    """
+    data_dir = str(tmpdir.mkdir('data'))
+    utts = []
+    for s in range(6):
+        for u in range(10 if s < 2 else 2):
+            utts.append(('spk{}-utt{:02d}'.format(s, u), 'spk{}'.format(s),
+                         'spk{}-wav{}'.format(s, u // 2), 1 if s < 2 else 10))
+
+    with open(os.path.join(data_dir, 'utt2spk'), 'w') as f1, \
+            open(os.path.join(data_dir, 'text'), 'w') as f2, \
+            open(os.path.join(data_dir, 'segments'), 'w') as f3:
+        for utt, spk, wav, dur in sorted(utts):
+            f1.write('{} {}\n'.format(utt, spk))
+            f2.write('{} some text\n'.format(utt))
+            f3.write('{} {} 1.0 {}\n'.format(utt, wav, 1.0 + dur))
+
+    with open(os.path.join(data_dir, 'spk2utt'), 'w') as fout:
+        for s in range(6):
+            spk = 'spk{}'.format(s)
+            fout.write('{} {}\n'.format(spk, ' '.join(
+                u for u, _s, _, _ in sorted(utts) if _s == spk)))
+
+    with open(os.path.join(data_dir, 'wav.scp'), 'w') as fout:
+        for wav in sorted(set(w for _, _, w, _ in utts)):
+            fout.write('{} /wavs/{}.wav\n'.format(wav, wav))
+    return data_dir
+
+
+def test_partition():
+    durations = {'a': 10, 'b': 6, 'c': 5, 'd': 4, 'e': 3, 'f': 2}
+    jobs = partition(durations, 3)
+    assert sorted(sum(jobs, [])) == sorted(durations)
+    assert jobs == [['a'], ['b', 'e', 'f'], ['c', 'd']]
+    assert imbalance(durations, jobs) == pytest.approx(11 / 10.)
+
+    # contiguous jobs of equal counts
+    counts = {k: 1 for k in durations}
+    assert kaldi_partition(counts, 3) == [['a', 'b'], ['c', 'd'], ['e', 'f']]
+    assert imbalance(durations, kaldi_partition(counts, 3)) == \
+        pytest.approx(16 / 10.)
+
+
+def test_read_utt2dur(data_dir):
+    utt2dur = read_utt2dur(data_dir)
+    assert len(utt2dur) == 28
+    assert utt2dur['spk0-utt00'] == pytest.approx(1)
+    assert utt2dur['spk5-utt01'] == pytest.approx(10)
+
+
+def test_split_data(data_dir):
+    # Kaldi puts the 4 last speakers in the last job
+    before, after = split_data(data_dir, 3)
+    assert before == pytest.approx(80 / (100 / 3.))
+    assert after == pytest.approx(40 / (100 / 3.))
+
+    split = os.path.join(data_dir, 'split3')
+    assert sorted(os.listdir(split)) == ['1', '2', '3']
+
+    spk2utt = open(os.path.join(split, '1', 'spk2utt')).read()
+    assert [l.split()[0] for l in spk2utt.split('\n') if l] == [
+        'spk2', 'spk5']
+
+    all_utts, all_wavs = [], []
+    for job in ('1', '2', '3'):
+        job_dir = os.path.join(split, job)
+        utts = [l.split()[0] for l in open(os.path.join(job_dir, 'utt2spk'))]
+        assert utts == sorted(utts)
+        assert utts == [
+            l.split()[0] for l in open(os.path.join(job_dir, 'text'))]
+
+        wavs = [l.split()[0] for l in open(os.path.join(job_dir, 'wav.scp'))]
+        assert wavs == sorted(set(
+            l.split()[1] for l in open(os.path.join(job_dir, 'segments'))))
+        all_utts += utts
+        all_wavs += wavs
+
+    assert sorted(all_utts) == sorted(read_utt2dur(data_dir).keys())
+    assert len(all_wavs) == len(set(all_wavs)) == 14
+
+
+def test_split_data_too_many_jobs(data_dir):
+    with pytest.raises(IOError):
+        split_data(data_dir, 7)
+
+
+def test_split_data_reused(data_dir, tmpdir):
+    calls = str(tmpdir.join('calls'))
+
+    def step():
+        subprocess.check_call(
+            ['bash', '-c', STEP, 'step', data_dir, '3', calls])
+        return open(calls).read() if os.path.isfile(calls) else ''
+
+    feats = os.path.join(data_dir, 'feats.scp')
+    with open(feats, 'w') as fout:
+        for utt in sorted(read_utt2dur(data_dir)):
+            fout.write('{} feats.ark:0\n'.format(utt))
+    os.utime(feats, (time.time() - 10, time.time() - 10))
+
+    # no split yet, the step splits the data
+    assert not is_split(data_dir, 3)
+    assert step() == '{} 3\n'.format(data_dir)
+    os.remove(calls)
+
+    # the step uses the balanced split
+    split_data(data_dir, 3)
+    assert is_split(data_dir, 3)
+    assert step() == ''
+
+    # the features changed after a first split, they are split again
+    split = os.path.join(data_dir, 'split3')
+    os.utime(split, (time.time() - 100, time.time() - 100))
+    assert not is_split(data_dir, 3)
+    split_data(data_dir, 3)
+    assert step() == ''
+    spk2utt = open(os.path.join(split, '1', 'spk2utt')).read()
+    assert [l.split()[0] for l in spk2utt.split('\n') if l] == [
+        'spk2', 'spk5']
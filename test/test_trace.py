@@ -0,0 +1,125 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.trace module"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import abkhazia.utils as utils
+from abkhazia.utils import trace
+
+
+@pytest.fixture
+def tracing():
+    trace.enable()
+    yield
+    trace.disable()
+
+
+@trace.traced(category='test')
+def _busy(duration):
+    t0 = time.time()
+    while time.time() - t0 < duration:
+        pass
+    return duration
+
+
+def test_disabled():
+    assert not trace.enabled()
+    with trace.span('nothing'):
+        pass
+    assert _busy(0) == 0
+    assert trace.spans() == []
+
+
+def test_spans(tracing):
+    with trace.span('outer', category='test', corpus='buckeye'):
+        _busy(0.05)
+        utils.jobs.run('sleep 0.05', stdout=lambda _: None)
+
+    spans = trace.spans()
+    assert [s.name for s in spans] == ['_busy', 'outer']
+
+    busy, outer = spans
+    assert busy.category == 'test'
+    assert outer.args == {'corpus': 'buckeye'}
+    assert outer.start <= busy.start
+    assert outer.duration >= busy.duration + 0.05
+    assert busy.utime + busy.stime > 0.02
+    assert outer.pid == os.getpid()
+    assert outer.maxrss > 0
+
+
+def test_threads(tracing):
+    # keep the threads alive together so that their ids are distinct
+    barrier = threading.Barrier(4)
+
+    def target():
+        _busy(0.01)
+        barrier.wait()
+
+    threads = [threading.Thread(target=target) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    spans = trace.spans()
+    assert len(spans) == 4
+    assert len(set(s.tid for s in spans)) == 4
+
+
+def test_export_chrome(tracing, tmpdir):
+    filename = str(tmpdir.join('trace.json'))
+    with trace.span('first', step='features'):
+        pass
+    trace.export_chrome(filename, process_name='abkhazia features')
+
+    # a second command appends to the trace
+    trace.disable()
+    trace.enable()
+    with trace.span('second'):
+        pass
+    trace.export_chrome(filename)
+
+    events = json.load(open(filename, 'r'))['traceEvents']
+    assert [e['name'] for e in events] == ['process_name', 'first', 'second']
+    assert events[0]['args'] == {'name': 'abkhazia features'}
+
+    first = events[1]
+    assert first['ph'] == 'X'
+    assert first['cat'] == 'abkhazia'
+    assert first['args']['step'] == 'features'
+    assert abs(first['ts'] / 1e6 - time.time()) < 60
+    assert events[2]['ts'] >= first['ts'] + first['dur']
+
+    trace.export_chrome(filename, append=False)
+    assert len(json.load(open(filename, 'r'))['traceEvents']) == 1
+
+
+def test_summary(tracing):
+    for _ in range(3):
+        _busy(0.001)
+    with trace.span('span', category='kaldi'):
+        time.sleep(0.02)
+
+    lines = trace.summary().split('\n')
+    assert len(lines) == 3
+    assert lines[1].split()[:3] == ['kaldi', 'span', '1']
+    assert lines[2].split()[:3] == ['test', '_busy', '3']
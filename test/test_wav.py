@@ -0,0 +1,348 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.wav module"""
+
+import contextlib
+import os
+import shutil
+import stat
+import struct
+import subprocess
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+import abkhazia.utils as utils
+from abkhazia.corpus import Corpus
+
+
+def write_wav(filename, duration=1.0, rate=16000, nbc=1, width=2):
+    """Write a random wav file and return its data as a numpy array"""
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+    data = np.random.randint(
+        np.iinfo(dtype).min, np.iinfo(dtype).max,
+        size=(int(duration * rate), nbc), dtype=dtype)
+
+    with contextlib.closing(wave.open(filename, 'w')) as fout:
+        fout.setparams((nbc, width, rate, data.shape[0], 'NONE', ''))
+        fout.writeframes(data.tobytes())
+    return data
+
+
+def read_wav(filename):
+    """Return (params, data) from a 16 bits wav file"""
+    with contextlib.closing(wave.open(filename, 'r')) as fin:
+        params = fin.getparams()
+        data = np.frombuffer(fin.readframes(params.nframes), dtype=np.int16)
+    return params, data.reshape((-1, params.nchannels))
+
+
+@pytest.mark.parametrize('intervals, expected', [
+    ([], [(0, 100)]),
+    ([(0, 1)], []),
+    ([(0.1, 0.2)], [(0, 10), (20, 100)]),
+    ([(0.5, 0.6), (0.1, 0.2)], [(0, 10), (20, 50), (60, 100)]),
+    ([(0.1, 0.3), (0.2, 0.4)], [(0, 10), (40, 100)]),
+    ([(-1, 0.1), (0.9, 2)], [(10, 90)])])
+def test_kept_frames(intervals, expected):
+    assert utils.wav.kept_frames(100, 100, intervals) == expected
+
+
+@pytest.mark.parametrize('nbc', [1, 2])
+def test_remove_intervals(tmpdir, nbc):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    data = write_wav(wav_in, duration=2, nbc=nbc)
+
+    intervals = [(1.5, 1.75), (0.25, 0.5), (0.4, 0.6)]
+    nframes = utils.wav.remove_intervals(
+        wav_in, wav_out, intervals, chunk_size=1000)
+
+    expected = np.concatenate(
+        (data[:4000], data[9600:24000], data[28000:]))
+    params, trimmed = read_wav(wav_out)
+    assert nframes == params.nframes == expected.shape[0]
+    assert params.nchannels == nbc
+    assert np.array_equal(trimmed, expected)
+
+
+@pytest.mark.skipif(shutil.which('sox') is None, reason='sox not found')
+def test_remove_intervals_sox(tmpdir):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    wav_sox = os.path.join(str(tmpdir), 'sox.wav')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    write_wav(wav_in, duration=10)
+
+    # 200 random non-overlapping intervals
+    times = np.sort(np.random.choice(
+        np.arange(0, 10, 1 / 16000.), 400, replace=False))
+    intervals = list(zip(times[::2], times[1::2]))
+
+    subprocess.check_call(
+        ['sox', wav_in, wav_sox, 'trim', '0'] +
+        ['={}'.format(t) for t in times])
+    utils.wav.remove_intervals(wav_in, wav_out, intervals)
+
+    params_sox, data_sox = read_wav(wav_sox)
+    params, data = read_wav(wav_out)
+    assert params == params_sox
+    assert np.array_equal(data, data_sox)
+
+
+def test_trim_corpus(tmpdir):
+    wav_dir = str(tmpdir.mkdir('wavs'))
+    data = {w: write_wav(os.path.join(wav_dir, w), duration=1)
+            for w in ('a.wav', 'b.wav', 'c.wav')}
+
+    corpus = Corpus()
+    corpus.wav_folder = wav_dir
+    corpus.wavs = {'a.wav', 'b.wav'}
+    not_kept = {
+        's1': [('u1', ('a.wav', 0.25, 0.5))],
+        's2': [('u2', ('b.wav', 0, 1)), ('u3', ('c.wav', 0, 0.5))]}
+
+    output_dir = str(tmpdir.mkdir('output'))
+    corpus.trim(wav_dir, output_dir, 'filter', not_kept, njobs=2)
+
+    output_wavs = os.path.join(output_dir, 'filter', 'data', 'wavs')
+    # b is empty after trimming and c is not in the corpus
+    assert os.listdir(output_wavs) == ['a.wav']
+    _, trimmed = read_wav(os.path.join(output_wavs, 'a.wav'))
+    assert np.array_equal(
+        trimmed, np.concatenate((data['a.wav'][:4000], data['a.wav'][8000:])))
+
+
+def test_pcm2wav_downmix(tmpdir):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    data = write_wav(wav_in, nbc=2)
+
+    utils.wav.pcm2wav(wav_in, wav_out)
+    params, mono = read_wav(wav_out)
+    assert (params.nchannels, params.sampwidth, params.framerate) == (
+        1, 2, 16000)
+    assert np.array_equal(
+        mono[:, 0], np.round(data.astype(float).mean(axis=1)))
+
+
+@pytest.mark.parametrize('width', [1, 4])
+def test_pcm2wav_width(tmpdir, width):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    data = write_wav(wav_in, width=width)
+
+    utils.wav.pcm2wav(wav_in, wav_out)
+    _, converted = read_wav(wav_out)
+    if width == 1:
+        expected = (data.astype(int) - 128) * 256
+    else:
+        expected = np.clip(np.round(data / 65536.), -2**15, 2**15 - 1)
+    assert np.array_equal(converted, expected)
+
+
+@pytest.mark.parametrize('rate', [8000, 22050, 44100, 48000])
+def test_pcm2wav_resample(tmpdir, rate):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+
+    # a 440 Hz sine plus a component above 8 kHz to be filtered out
+    def signal(t, high=True):
+        return 8000 * np.sin(2 * np.pi * 440 * t) + (
+            4000 * np.sin(2 * np.pi * 9000 * t)
+            if high and rate > 18000 else 0)
+
+    data = signal(np.arange(rate) / rate).astype(np.int16)
+    with contextlib.closing(wave.open(wav_in, 'w')) as fout:
+        fout.setparams((1, 2, rate, data.shape[0], 'NONE', ''))
+        fout.writeframes(data.tobytes())
+
+    utils.wav.pcm2wav(wav_in, wav_out)
+    params, resampled = read_wav(wav_out)
+    assert params.framerate == 16000
+    assert abs(params.nframes - 16000) <= 1
+
+    # ignore the borders
+    expected = signal(np.arange(params.nframes) / 16000, high=False)
+    error = np.abs(resampled[:, 0] - expected)[100:-100]
+    assert error.max() < 10
+
+
+def test_wav2wav(tmpdir):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    write_wav(wav_in)
+
+    # compliant wav, no conversion
+    wav_out = os.path.join(str(tmpdir), 'link.wav')
+    utils.wav.wav2wav(wav_in, wav_out, copy=False)
+    assert os.path.islink(wav_out)
+
+    # converted in process
+    write_wav(wav_in, rate=8000, nbc=2)
+    wav_out = os.path.join(str(tmpdir), 'out.wav')
+    utils.wav.wav2wav(wav_in, wav_out, copy=False)
+    assert not os.path.islink(wav_out)
+    params, _ = read_wav(wav_out)
+    assert (params.nchannels, params.framerate, params.nframes) == (
+        1, 16000, 16000)
+
+
+def test_scan(tmpdir):
+    wavs = []
+    for n, (rate, nbc, width) in enumerate(
+            [(16000, 1, 2), (8000, 2, 2), (44100, 1, 1), (16000, 3, 4)]):
+        wavs.append(os.path.join(str(tmpdir), '{}.wav'.format(n)))
+        write_wav(wavs[-1], duration=0.5, rate=rate, nbc=nbc, width=width)
+
+    # header followed by an extra chunk before data
+    with contextlib.closing(wave.open(wavs[0], 'r')) as fin:
+        raw = fin.readframes(fin.getnframes())
+    with open(wavs[0], 'rb') as fin:
+        header = fin.read(36)
+    extra = b'LIST' + struct.pack('<I', 5001) + b'x' * 5002
+    wavs.append(os.path.join(str(tmpdir), 'list.wav'))
+    with open(wavs[-1], 'wb') as fout:
+        fout.write(header + extra + b'data' +
+                   struct.pack('<I', len(raw)) + raw)
+
+    # invalid files
+    wavs.append(os.path.join(str(tmpdir), 'empty.wav'))
+    open(wavs[-1], 'w').close()
+    wavs.append(os.path.join(str(tmpdir), 'text.wav'))
+    with open(wavs[-1], 'w') as fout:
+        fout.write('this is not a wav file' * 10)
+
+    headers = utils.wav.scan_headers(wavs, njobs=2, batch_size=2)
+    assert list(headers.filename) == wavs
+    assert list(headers.valid) == [True] * 5 + [False] * 2
+
+    meta = utils.wav.scan(wavs)
+    for h, wav in zip(headers[:5], wavs[:5]):
+        with contextlib.closing(wave.open(wav, 'r')) as fin:
+            params = fin.getparams()
+        assert (h.nbc, h.width, h.rate, h.nframes, h.format) == (
+            params.nchannels, params.sampwidth, params.framerate,
+            params.nframes, 1)
+        assert h.duration == utils.wav.duration(wav) == meta[wav].duration
+        assert meta[wav].comptype == 'NONE'
+
+    for wav in wavs[5:]:
+        assert meta[wav].comptype == 'INVALID'
+        with pytest.raises(wave.Error):
+            utils.wav.read_header(wav)
+
+
+def test_scan_truncated(tmpdir):
+    wav = os.path.join(str(tmpdir), 'in.wav')
+    write_wav(wav, duration=1)
+    with open(wav, 'r+b') as fout:
+        fout.truncate(44 + 1000)
+    assert utils.wav.read_header(wav)[3] == 500
+
+
+# a stand-in for sox converting flac to wav: simply copy the input to
+# the output. Fails on the first call if the input contains 'flaky'.
+FAKE_SOX = """#!{python}
+import os, shutil, sys
+args = sys.argv[1:]
+wav_in, wav_out = args[4], args[7]
+flag = wav_out + '.failed'
+if 'flaky' in wav_in and not os.path.exists(flag):
+    open(flag, 'w').close()
+    sys.exit(1)
+shutil.copyfile(wav_in, wav_out)
+"""
+
+
+@pytest.fixture
+def fake_sox(tmpdir, monkeypatch):
+    bindir = str(tmpdir.mkdir('bin'))
+    sox = os.path.join(bindir, 'sox')
+    with open(sox, 'w') as fout:
+        fout.write(FAKE_SOX.format(python=sys.executable))
+    os.chmod(sox, os.stat(sox).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', bindir + os.pathsep + os.environ['PATH'])
+    return sox
+
+
+def test_convert_fingerprints(tmpdir, fake_sox):
+    inputs = [os.path.join(str(tmpdir), '{}.flac'.format(i))
+              for i in range(10)]
+    for i in inputs:
+        write_wav(i, duration=0.1)
+    output_dir = str(tmpdir.mkdir('wavs'))
+    outputs = [os.path.join(output_dir, '{}.wav'.format(i))
+               for i in range(10)]
+    fingerprints = os.path.join(output_dir, '.fingerprints')
+
+    converted = utils.wav.convert(
+        inputs, outputs, 'flac', fingerprints=fingerprints, batch_size=3)
+    assert sorted(converted.keys()) == outputs
+    assert len(utils.wav.load_fingerprints(fingerprints)) == 10
+
+    # all the outputs are up to date
+    assert utils.wav.convert(
+        inputs, outputs, 'flac', fingerprints=fingerprints) == {}
+
+    # modified input and output are converted again
+    write_wav(inputs[2], duration=0.2)
+    with open(outputs[5], 'wb') as fout:
+        fout.write(b'corrupted')
+    converted = utils.wav.convert(
+        inputs, outputs, 'flac', fingerprints=fingerprints)
+    assert sorted(converted.keys()) == [outputs[2], outputs[5]]
+    assert read_wav(outputs[5])[0].nframes == 1600
+
+
+def test_convert_retry(tmpdir, fake_sox):
+    flaky = os.path.join(str(tmpdir), 'flaky.flac')
+    write_wav(flaky, duration=0.1)
+    output = os.path.join(str(tmpdir), 'flaky.wav')
+
+    with pytest.raises(RuntimeError):
+        utils.wav.convert([flaky], [output], 'flac', retries=0)
+    assert not os.path.exists(output)
+
+    utils.remove(output + '.failed')
+    assert list(utils.wav.convert(
+        [flaky], [output], 'flac', retries=1).keys()) == [output]
+
+
+@pytest.mark.parametrize('rate', [8000, 44100])
+def test_resample_chunks(rate):
+    data = np.random.RandomState(0).uniform(-2**15, 2**15, rate // 4)
+    expected = utils.wav.resample(data, rate, 16000)
+
+    # any split of the input gives the same output
+    splits = [0, 1, 7, 1000, 1001, 1500, len(data)]
+    chunks = [data[a:b] for a, b in zip(splits, splits[1:])]
+    resampled = list(utils.wav.resample_chunks(
+        chunks, len(data), rate, 16000, chunk_size=100))
+    assert max(len(r) for r in resampled) <= 100
+    assert np.allclose(np.concatenate(resampled), expected)
+
+
+def test_pcm2wav_chunks(tmpdir):
+    wav_in = os.path.join(str(tmpdir), 'in.wav')
+    write_wav(wav_in, nbc=2, rate=22050)
+
+    outputs = []
+    for chunk_size in (100, 2**16):
+        wav_out = os.path.join(str(tmpdir), 'out{}.wav'.format(chunk_size))
+        utils.wav.pcm2wav(wav_in, wav_out, chunk_size=chunk_size)
+        outputs.append(read_wav(wav_out))
+    assert outputs[0][0] == outputs[1][0]
+    assert np.array_equal(outputs[0][1], outputs[1][1])
@@ -0,0 +1,159 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.decode._wer module"""
+
+import random
+
+import pytest
+
+import abkhazia.utils as utils
+from abkhazia.decode import _wer
+
+
+REF = '''s1-u1 the cat sat on the mat
+s1-u2 a b c d
+s2-u1 a b c
+s2-u2 hello
+s2-u3 not in hyp
+'''
+
+HYP = '''s1-u1 the cat sat on mat
+s1-u2 a x c d e
+s2-u1 c b a
+s2-u2
+'''
+
+UTT2SPK = {'s1-u1': 's1', 's1-u2': 's1',
+           's2-u1': 's2', 's2-u2': 's2', 's2-u3': 's2'}
+
+
+def _levenshtein(ref, hyp):
+    """The textbook dynamic programming distance"""
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i]
+        for j, h in enumerate(hyp, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1,
+                           prev[j - 1] + (r != h)))
+        prev = cur
+    return prev[-1]
+
+
+@pytest.mark.parametrize('ref, hyp, errors, wer', [
+    ('the cat sat on the mat', 'the cat sat on mat', (6, 0, 1, 0), 16.67),
+    ('a b c d', 'a x c d e', (4, 1, 0, 1), 50.0),
+    ('a b c', 'c b a', (3, 0, 0, 2), 66.67),
+    ('a b c', '', (3, 0, 3, 0), 100.0),
+    ('', 'a b', (0, 2, 0, 0), 100.0),
+    ('', '', (0, 0, 0, 0), 0.0),
+    ('a', 'a', (1, 0, 0, 0), 0.0),
+    ('a b', 'x a b y z', (2, 3, 0, 0), 150.0)])
+def test_edit_distance(ref, hyp, errors, wer):
+    result = _wer.edit_distance(ref.split(), hyp.split())
+    assert result == errors
+    assert _wer.wer(result) == pytest.approx(wer, abs=0.01)
+
+
+def test_edit_distance_random():
+    rng = random.Random(0)
+    for _ in range(200):
+        ref = [rng.choice('abcd') for _ in range(rng.randint(0, 12))]
+        hyp = [rng.choice('abcd') for _ in range(rng.randint(0, 12))]
+        errors = _wer.edit_distance(ref, hyp)
+        assert _wer.nerrors(errors) == _levenshtein(ref, hyp)
+        assert errors.nwords == len(ref)
+
+
+@pytest.fixture
+def texts(tmpdir, monkeypatch):
+    monkeypatch.setitem(
+        utils.config['abkhazia'], 'tmp-directory', str(tmpdir))
+    tmpdir.join('ref.txt').write(REF)
+    tmpdir.join('hyp.txt').write(HYP)
+    return str(tmpdir.join('ref.txt')), str(tmpdir.join('hyp.txt'))
+
+
+def test_report(texts):
+    # 1 + 2 + 2 + 1 errors on 14 words, 4 wrong sentences on 4
+    assert _wer.WerScorer()(*texts) == (
+        '%WER 42.86 [ 6 / 14, 1 ins, 2 del, 3 sub ]\n'
+        '%SER 100.00 [ 4 / 4 ]\n'
+        'Scored 4 sentences, 1 not present in hyp.\n')
+
+
+def test_no_reference(texts, tmpdir):
+    tmpdir.join('hyp.txt').write('unknown a b\n')
+    with pytest.raises(IOError):
+        _wer.WerScorer()(*texts)
+
+
+def test_details(texts, tmpdir):
+    scorer = _wer.WerScorer(utt2spk=UTT2SPK)
+    scorer(*texts)
+    utterances, speakers = scorer.details(texts[1])
+    assert list(utterances) == ['s1-u1', 's1-u2', 's2-u1', 's2-u2']
+    assert utterances['s2-u2'] == (1, 0, 1, 0)
+    assert speakers == {'s1': (2, (10, 1, 1, 1)), 's2': (2, (4, 0, 1, 2))}
+
+    scorer.write_details(texts[1], str(tmpdir.join('details')))
+    per_utt = tmpdir.join('details', 'per_utt').read().split('\n')
+    assert per_utt[2].split() == ['s1-u2', '4', '1', '0', '1', '50.00']
+    per_spk = tmpdir.join('details', 'per_spk').read().split('\n')
+    assert per_spk[1].split() == ['s1', '2', '10', '1', '1', '1', '30.00']
+    assert per_spk[2].split() == ['s2', '2', '4', '0', '1', '2', '75.00']
+
+    # no speakers, no per_spk
+    scorer = _wer.WerScorer()
+    scorer(*texts)
+    scorer.write_details(texts[1], str(tmpdir.join('details2')))
+    assert tmpdir.join('details2').listdir() == [
+        tmpdir.join('details2', 'per_utt')]
+
+
+def test_cache(texts, tmpdir, monkeypatch):
+    scored = []
+    edit_distance = _wer.edit_distance
+
+    def _edit_distance(ref, hyp):
+        scored.append(hyp)
+        return edit_distance(ref, hyp)
+
+    monkeypatch.setattr(_wer, 'edit_distance', _edit_distance)
+
+    scorer = _wer.WerScorer(use_cache=True)
+    report = scorer(*texts)
+    assert len(scored) == 4
+
+    # the same hypotheses are not rescored
+    assert scorer(*texts) == report
+    assert len(scored) == 4
+    scorer.save()
+
+    # in a new scorer only the changed hypothesis is rescored
+    tmpdir.join('hyp.txt').write(HYP.replace('c b a', 'a b c'))
+    del scored[:]
+    assert _wer.WerScorer(use_cache=True)(*texts).startswith(
+        '%WER 28.57 [ 4 / 14,')
+    assert scored == [['a', 'b', 'c']]
+
+    # without cache or on another reference, everything is rescored
+    del scored[:]
+    _wer.WerScorer()(*texts)
+    assert len(scored) == 4
+
+    del scored[:]
+    tmpdir.join('ref.txt').write(REF + 's3-u1 new\n')
+    _wer.WerScorer(use_cache=True)(*texts)
+    assert len(scored) == 4